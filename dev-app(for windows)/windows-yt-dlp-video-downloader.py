@@ -1,22 +1,30 @@
+import time
+START = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk, ImageSequence
-import requests
-import yt_dlp
-import threading
 import os
-import re
-from io import BytesIO
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python"))
+from ytdl_engine import CANCELLED, DONE, INTERACTIVE, DownloadEngine, JobJournal, MetadataCache, TkProgressTicker
+from ytdl_engine.bandwidth import scheduler_from_env
+from ytdl_engine.metrics import metrics_from_env
+from ytdl_engine.paths import user_cache_dir
+from ytdl_engine.progress import aggregate, format_sample
+from ytdl_engine.spinner import bake_spinner, load_frames
+from ytdl_engine.startup import StartupTimer
+from ytdl_engine.thumbnails import ThumbnailService
 
-def strip_ansi(text):
-    ansi_escape = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
-    return ansi_escape.sub('', text)
+IMPORTED = time.perf_counter()
+SPINNER_SIZE = (32, 32)
 
 
 class YTDL_GUI(tk.Tk):
     def __init__(self):
         super().__init__()
+        self.startup = StartupTimer(START)
+        self.startup.mark("imports", IMPORTED)
         self.title("Video Downloader")
         self.geometry("600x600")
         self.configure(bg="#1e1e1e")
@@ -28,13 +36,24 @@ class YTDL_GUI(tk.Tk):
         self.url = tk.StringVar()
         self.save_path = tk.StringVar(value=self.DEFAULT_SAVE_PATH)
         self.format_map = {}
+        self.session = None
+        self.selection = None
         self.selected_format = tk.StringVar()
         self.progress = tk.DoubleVar()
         self.status_text = tk.StringVar(value="Idle")
         self.thumbnail_image = None
         self.video_title = tk.StringVar(value="")
 
-        self.download_cancelled = threading.Event()
+        self.engine = DownloadEngine(workers=1, ffmpeg_path=self.ffmpeg_path,
+                                     ydl_opts={'windowsfilenames': True}, cache=MetadataCache(),
+                                     journal=JobJournal(), bandwidth=scheduler_from_env())
+        self.metrics, self.metrics_server = metrics_from_env(self.engine)
+        self.ticker = TkProgressTicker(self, self.engine.progress, self.render_progress, on_event=self.on_job_event)
+        self.engine.add_listener(self.ticker.post)
+        self.current_job = None
+        # DaemonLink to the background download service when one is running; the engine then only fetches info
+        self.daemon = None
+        self.thumbnails = ThumbnailService(size=(300, 180), network=self.engine.network)
         self.spinner_frames = []
         self.spinner_durations = []
         self.spinner_job = None
@@ -44,9 +63,38 @@ class YTDL_GUI(tk.Tk):
         self.create_footer()
         self.show_frame("stage1")
 
-        self.load_spinner("spinner.gif")
-
         self.bind('<Return>', self.enter_key_pressed)
+        self.startup.mark("window")
+        # Anything not needed for the first frame waits until the window has been drawn
+        self.after_idle(self.finish_startup)
+
+    def finish_startup(self):
+        self.startup.mark("first_paint")
+        self.load_spinner("spinner.gif")
+        self.ticker.start()
+        self.connect_daemon()
+        self.resume_interrupted()
+        self.engine.warm_up().add_done_callback(lambda f: self.after(0, self.on_engine_ready))
+
+    def connect_daemon(self):
+        # Downloads go to the background service when one answers, so closing the window doesn't stop them
+        from ytdl_engine.daemon import DaemonLink, find_daemon
+
+        client = find_daemon()
+        if client is not None:
+            self.daemon = DaemonLink(client, self.engine.progress, self.ticker.post,
+                                     on_lost=lambda: self.after(0, self.on_daemon_lost))
+
+    def on_daemon_lost(self):
+        self.daemon = None
+        if self.current_job is not None and hasattr(self.current_job, "remote_id") and not self.current_job.finished:
+            self.set_status("Background service stopped")
+
+    def on_engine_ready(self):
+        self.startup.mark("engine_ready")
+        if self.startup.enabled:
+            self.startup.report()
+            self.destroy()
 
     def set_dark_theme(self):
         style = ttk.Style(self)
@@ -169,6 +217,8 @@ class YTDL_GUI(tk.Tk):
         self.url.set("")
         self.save_path.set(self.DEFAULT_SAVE_PATH)
         self.format_map.clear()
+        self.session = None
+        self.selection = None
         self.selected_format.set("")
         self.progress.set(0)
         self.status_text.set("Idle")
@@ -176,7 +226,7 @@ class YTDL_GUI(tk.Tk):
         self.video_title.set("")
         self.thumbnail_label.config(image="", text="")
         self.format_combo['values'] = []
-        self.download_cancelled.clear()
+        self.current_job = None
         self.title("Video Downloader")
         self.fetch_status_label.config(text="")
         self.show_frame("stage1")
@@ -189,13 +239,19 @@ class YTDL_GUI(tk.Tk):
     def fetch_formats_threaded(self):
         self.fetch_status_label.config(text="Fetching video info...")
         self.animate_spinner()
-        threading.Thread(target=self.fetch_formats, daemon=True).start()
+        self.fetch_formats()
 
     def download_threaded(self):
-        threading.Thread(target=self.download, daemon=True).start()
+        self.download()
 
     def cancel_download(self):
-        self.download_cancelled.set()
+        if self.current_job and hasattr(self.current_job, "remote_id"):
+            try:
+                self.current_job.cancel()
+            except (OSError, RuntimeError):
+                pass  # The service is gone or the job already ended
+        elif self.current_job:
+            self.engine.cancel(self.current_job)
         self.status_text.set("Cancelling...")
         self.progress.set(0)
         self.show_frame("stage1")
@@ -207,113 +263,115 @@ class YTDL_GUI(tk.Tk):
             self.fetch_status_label.config(text="")
             return
 
-        ydl_opts = {'quiet': True, 'skip_download': True}
+        self.engine.fetch_info(url).add_done_callback(
+            lambda f: self.after(0, self.on_info_fetched, f))
+
+    def on_info_fetched(self, future):
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                self.show_thumbnail(info.get("thumbnail"))
-                self.video_title.set(info.get("title", ""))
-
-                formats = info.get("formats", [])
-                self.format_map.clear()
-                format_display_list = []
-
-                for f in formats:
-                    if f.get("vcodec") != "none" or f.get("acodec") != "none":
-                        f_id = f["format_id"]
-                        ext = f["ext"]
-                        res = f.get("resolution") or f.get("height") or "audio"
-                        fps = f.get("fps", "")
-                        abr = f.get("abr", "")
-                        filesize = f.get("filesize") or f.get("filesize_approx")
-                        size_mb = f"{round(filesize / 1024 / 1024, 1)}MB" if filesize else "?"
-
-                        label = f"{f_id} | {res} | {ext} | {fps}fps | {abr}kbps | {size_mb}"
-                        self.format_map[label] = f_id
-                        format_display_list.append(label)
-
-                if format_display_list:
-                    self.format_combo['values'] = format_display_list
-                    self.format_combo.current(0)
-                    self.show_frame("stage2")
-                    self.format_combo.focus_set()
+            self.session = future.result()
+            self.show_thumbnail(self.session.thumbnail, self.session.key)
+            self.video_title.set(self.session.title)
+
+            self.format_map = dict(self.session.format_map)
+            format_display_list = self.session.labels
+
+            if format_display_list:
+                self.format_combo['values'] = format_display_list
+                # Start from the automatic best pick instead of the first (worst) entry
+                self.selection = self.session.select()
+                if self.selection is not None:
+                    self.selected_format.set(self.selection.formats[0].label)
                 else:
-                    messagebox.showwarning("No Formats", "No downloadable formats found.")
-                self.fetch_status_label.config(text="")
+                    self.format_combo.current(0)
+                self.show_frame("stage2")
+                self.format_combo.focus_set()
+            else:
+                messagebox.showwarning("No Formats", "No downloadable formats found.")
+            self.fetch_status_label.config(text="")
         except Exception as e:
             self.fetch_status_label.config(text="")
             messagebox.showerror("Error", f"Failed to fetch formats:\n{e}")
 
-    def show_thumbnail(self, url):
-        try:
-            response = requests.get(url)
-            img_data = BytesIO(response.content)
-            image = Image.open(img_data)
-            image.thumbnail((300, 180))
-            self.thumbnail_image = ImageTk.PhotoImage(image)
-            self.thumbnail_label.config(image=self.thumbnail_image, text="")
-        except Exception:
+    def show_thumbnail(self, url, key=None):
+        self.thumbnails.fetch(url, key).add_done_callback(
+            lambda f: self.after(0, self.set_thumbnail, f.result()))
+
+    def set_thumbnail(self, image):
+        if image is None:
             self.thumbnail_label.config(image="", text="No thumbnail available")
+            return
+        from PIL import ImageTk
+
+        self.thumbnail_image = ImageTk.PhotoImage(image)
+        self.thumbnail_label.config(image=self.thumbnail_image, text="")
 
     def download(self):
         url = self.url.get().strip()
         format_label = self.selected_format.get()
         format_id = self.format_map.get(format_label)
-        path = self.save_path.get().strip() or "."
-
-        if not os.path.exists(self.ffmpeg_path):
-            messagebox.showerror("FFmpeg Error", f"ffmpeg not found at:\n{self.ffmpeg_path}")
-            return
+        path = os.path.abspath(self.save_path.get().strip() or ".")
 
         if not url or not format_id:
             messagebox.showwarning("Input Error", "Please select a format.")
             return
 
-        ydl_opts = {
-            'format': f'{format_id}+bestaudio/best',
-            'outtmpl': os.path.join(path, '%(title)s.%(ext)s'),
-            'quiet': True,
-            'progress_hooks': [self.hook],
-            'ffmpeg_location': self.ffmpeg_path,
-            'merge_output_format': 'mp4',
-            'windowsfilenames': True
-        }
+        format_spec = None
+        if self.selection is not None and format_label == self.selection.formats[0].label:
+            format_spec = self.selection.format_spec
+        if self.daemon is not None:
+            try:
+                self.current_job = self.daemon.submit(url, format_id, path, format_spec, priority="interactive")
+            except OSError:
+                # The service went away: download here instead
+                self.daemon = None
+            except RuntimeError as e:
+                messagebox.showerror("Download Service", f"The background service refused the download:\n{e}")
+                return
+            else:
+                self.progress.set(0)
+                self.show_frame("stage3")
+                self.set_status("Queued in the background service")
+                return
+
+        if not os.path.exists(self.ffmpeg_path):
+            messagebox.showerror("FFmpeg Error", f"ffmpeg not found at:\n{self.ffmpeg_path}")
+            return
 
         self.progress.set(0)
-        self.download_cancelled.clear()
         self.show_frame("stage3")
-        try:
-            self.set_status("Starting download...")
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            if not self.download_cancelled.is_set():
-                self.set_status("Download complete.")
-                messagebox.showinfo("Done", "Download complete!")
+        self.set_status("Starting download...")
+        self.current_job = self.engine.submit(url, format_id, path, session=self.session, format_spec=format_spec,
+                                              priority=INTERACTIVE)
+
+    def resume_interrupted(self):
+        resumed = self.engine.resume_unfinished()
+        if resumed:
+            self.current_job = resumed[0]
+            self.progress.set(0)
+            self.show_frame("stage3")
+            self.set_status("Resuming interrupted download...")
+
+    def on_job_event(self, job):
+        if job is not self.current_job:
+            return
+
+        if job.state == DONE:
+            self.set_status("Download complete.")
+            messagebox.showinfo("Done", "Download complete!")
             self.reset_ui()
-        except Exception as e:
-            if not self.download_cancelled.is_set():
-                self.set_status("Failed")
-                messagebox.showerror("Error", str(e))
+        elif job.state == CANCELLED:
+            self.reset_ui()
+        elif job.finished:
+            self.set_status("Failed")
+            messagebox.showerror("Error", str(job.error))
             self.reset_ui()
 
-    def hook(self, d):
-        if self.download_cancelled.is_set():
-            raise Exception("Download cancelled by user.")
-
-        if d['status'] == 'downloading':
-            percent = strip_ansi(d.get('_percent_str', '0.0%')).strip().replace('%', '')
-            speed = strip_ansi(d.get('_speed_str', '0.0 KiB/s'))
-            eta = d.get('_eta_str', '??')
-
-            try:
-                self.progress.set(float(percent))
-            except ValueError:
-                self.progress.set(0)
-
-            self.set_status(f"{percent}% at {speed} | ETA: {eta}")
-        elif d['status'] == 'finished':
-            self.progress.set(100)
-            self.set_status("Finalizing...")
+    def render_progress(self, snapshot):
+        sample = snapshot.get(self.current_job.id) if self.current_job else None
+        if sample is None:
+            return
+        self.progress.set(100 if sample.status == "finished" else sample.percent)
+        self.set_status(format_sample(sample))
 
     def set_status(self, msg):
         self.status_text.set(msg)
@@ -331,19 +389,26 @@ class YTDL_GUI(tk.Tk):
             self.download_threaded()
 
     def load_spinner(self, path):
+        # Frames are pre-baked at SPINNER_SIZE next to the source (spinner-32.gif) so Tk can load them
+        # directly; without that file they are resized once with PIL into the cache directory
+        width, height = SPINNER_SIZE
+        root, ext = os.path.splitext(path)
+        baked = f"{root}-{width}{ext}"
         try:
-            img = Image.open(path)
-            self.spinner_frames = []
-            self.spinner_durations = []
-            for frame in ImageSequence.Iterator(img):
-                frame = frame.convert("RGBA").resize((32, 32), Image.LANCZOS)
-                self.spinner_frames.append(ImageTk.PhotoImage(frame))
-                duration = frame.info.get("duration", 100)
-                self.spinner_durations.append(duration)
+            if not os.path.exists(baked):
+                baked = os.path.join(user_cache_dir(), f"{os.path.basename(root)}-{width}x{height}{ext}")
+                if not os.path.exists(baked) or os.path.getmtime(baked) < os.path.getmtime(path):
+                    bake_spinner(path, baked, SPINNER_SIZE)
+            frames = load_frames(self, baked)
+            self.spinner_frames = [image for image, _ in frames]
+            self.spinner_durations = [delay for _, delay in frames]
         except Exception as e:
             print(f"Spinner load error: {e}")
             self.spinner_frames = []
             self.spinner_durations = []
+            return
+        if self.frames["stage1"].winfo_manager():
+            self.animate_spinner()
 
     def animate_spinner(self, index=0):
         if not self.spinner_frames:
@@ -3,7 +3,7 @@
 
 a = Analysis(
     ['windows-yt-dlp-video-downloader.py'],
-    pathex=[],
+    pathex=['../python'],
     binaries=[],
     datas=[('ffmpeg.exe', '.')],
     hiddenimports=[],
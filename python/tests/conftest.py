@@ -0,0 +1,127 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ytdl_engine.backends import Backend  # noqa: E402
+from ytdl_engine.engine import DownloadEngine  # noqa: E402
+
+
+class FakeBackend(Backend):
+    # Finishes every job without touching the network; with a gate, each download waits for it
+
+    name = "fake"
+
+    def __init__(self, gate=None, fail=False):
+        self.gate = gate
+        self.fail = fail
+        self.started = []
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def extract(self, url):
+        return {"id": url, "title": url, "formats": []}
+
+    def download(self, job, hook):
+        with self._lock:
+            self.started.append(job)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            if self.gate is not None:
+                self.gate.wait(10)
+            if self.fail:
+                raise RuntimeError(f"{self.name} failed")
+            return []
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def make_info(video_id="abcdefghijk", expire=None):
+    # A YouTube-like info dict: progressive 360p, DASH h264/vp9 video up to 1080p, aac and opus audio
+    query = f"?expire={expire}" if expire else ""
+
+    def fmt(format_id, ext, vcodec, acodec, height=None, fps=None, tbr=None, abr=None, filesize=None):
+        return {"format_id": format_id, "ext": ext, "vcodec": vcodec, "acodec": acodec, "height": height,
+                "width": height and height * 16 // 9, "fps": fps, "tbr": tbr, "abr": abr, "filesize": filesize,
+                "protocol": "https", "url": f"https://media.example.com/{format_id}{query}"}
+
+    return {
+        "id": video_id,
+        "title": "Sample video",
+        "extractor_key": "Youtube",
+        "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+        "duration": 100,
+        "formats": [
+            fmt("139", "m4a", "none", "mp4a.40.5", tbr=48, abr=48, filesize=600_000),
+            fmt("140", "m4a", "none", "mp4a.40.2", tbr=128, abr=128, filesize=1_600_000),
+            fmt("251", "webm", "none", "opus", tbr=160, abr=160, filesize=2_000_000),
+            fmt("18", "mp4", "avc1.42001E", "mp4a.40.2", 360, 30, tbr=500, filesize=6_250_000),
+            fmt("134", "mp4", "avc1.4d401e", "none", 360, 30, tbr=400, filesize=5_000_000),
+            fmt("136", "mp4", "avc1.4d401f", "none", 720, 30, tbr=1500, filesize=18_750_000),
+            fmt("247", "webm", "vp9", "none", 720, 30, tbr=1200, filesize=15_000_000),
+            fmt("137", "mp4", "avc1.640028", "none", 1080, 30, tbr=3000, filesize=37_500_000),
+            fmt("248", "webm", "vp9", "none", 1080, 60, tbr=2500, filesize=31_250_000),
+        ],
+    }
+
+
+@pytest.fixture
+def sample_info():
+    return make_info()
+
+
+@pytest.fixture
+def media_server(tmp_path):
+    # The benchmark's range-capable static server, on a thread, serving tmp_path/media
+    from functools import partial
+    from http.server import ThreadingHTTPServer
+
+    from ytdl_engine.bench.mediaserver import RangeRequestHandler
+
+    root = tmp_path / "media"
+    root.mkdir()
+    requests = []
+
+    class Handler(RangeRequestHandler):
+        def send_head(self):
+            requests.append((self.path, self.headers.get("Range")))
+            return super().send_head()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(Handler, directory=str(root)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.root = root
+    server.requests = requests
+    server.url = lambda name: f"http://127.0.0.1:{server.server_port}/{name}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def user_dirs(tmp_path, monkeypatch):
+    # Journals, caches and stores default to the user's folders; keep them inside the test's tmp_path
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "data"))
+
+
+@pytest.fixture
+def make_engine():
+    engines = []
+
+    def make(*backends, **kwargs):
+        engine = DownloadEngine(**kwargs)
+        engine.backends = list(backends) or [FakeBackend()]
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.shutdown(cancel=True)
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+from conftest import FakeBackend, make_info
+from ytdl_engine.archive import ArchiveView, DownloadArchive, file_sha256, info_archive_id, url_archive_id
+from ytdl_engine.engine import DONE, SKIPPED
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = DownloadArchive(str(tmp_path / "archive.sqlite3"), hash_files=True)
+    yield archive
+    archive.close()
+
+
+def test_archive_ids():
+    assert url_archive_id("https://youtu.be/abcdefghijk") == "youtube abcdefghijk"
+    assert url_archive_id("https://www.youtube.com/watch?v=abcdefghijk&t=10") == "youtube abcdefghijk"
+    assert info_archive_id(make_info()) == "youtube abcdefghijk"
+    assert info_archive_id({"id": "x"}) is None
+
+
+def test_record_and_reopen(archive, tmp_path):
+    media = tmp_path / "video.mp4"
+    media.write_bytes(b"media")
+    archive.record("youtube abcdefghijk", "https://youtu.be/abcdefghijk", "Video", str(media))
+    assert "youtube abcdefghijk" in archive and len(archive) == 1
+    assert archive.has_url("https://youtu.be/abcdefghijk")
+    assert archive.find_hash(file_sha256(str(media))) == ["youtube abcdefghijk"]
+    # A bare key, as yt-dlp adds it, keeps what is known about the file
+    archive.add("youtube abcdefghijk")
+    entry = archive.get("youtube abcdefghijk")
+    assert entry["title"] == "Video" and entry["size"] == 5
+    archive.close()
+    reopened = DownloadArchive(archive.path)
+    assert reopened.has_info(make_info())
+    reopened.forget("youtube abcdefghijk")
+    assert not reopened.has_info(make_info())
+    reopened.close()
+
+
+def test_import_archive_file(archive, tmp_path):
+    text = tmp_path / "archive.txt"
+    text.write_text("youtube aaaaaaaaaaa\n\nvimeo 123\n", encoding="utf-8")
+    assert archive.import_archive_file(str(text)) == 2
+    assert "vimeo 123" in archive
+
+
+def test_import_folder(archive, tmp_path):
+    folder = tmp_path / "library"
+    folder.mkdir()
+    (folder / "Song [bbbbbbbbbbb].mp3").write_bytes(b"a")
+    (folder / "clip.mp4").write_bytes(b"b")
+    (folder / "clip.info.json").write_text(json.dumps({"id": "42", "extractor_key": "Vimeo"}), encoding="utf-8")
+    (folder / "mystery.mkv").write_bytes(b"c")
+    (folder / "notes.txt").write_bytes(b"d")
+    imported, unknown = archive.import_folder(str(folder))
+    assert imported == 2
+    assert unknown == [str(folder / "mystery.mkv")]
+    assert archive.get("youtube bbbbbbbbbbb")["title"] == "Song"
+    assert "vimeo 42" in archive
+
+
+def test_archive_view_notes_the_key(archive):
+    class Job:
+        archive_id = None
+
+    job = Job()
+    view = ArchiveView(archive, job)
+    view.add("youtube ccccccccccc")
+    assert job.archive_id == "youtube ccccccccccc" and "youtube ccccccccccc" not in archive
+
+
+def test_engine_skips_archived_urls(make_engine, archive):
+    archive.add("youtube abcdefghijk")
+    backend = FakeBackend()
+    engine = make_engine(backend, archive=archive)
+    job = engine.submit("https://www.youtube.com/watch?v=abcdefghijk")
+    job.wait(5)
+    assert job.state == SKIPPED and not backend.started
+
+
+class BrokenArchive(DownloadArchive):
+    def record(self, *args, **kwargs):
+        raise OSError("disk full")
+
+
+class ArchivingBackend(FakeBackend):
+    def download(self, job, hook):
+        job.archive_id = "youtube ddddddddddd"
+        return super().download(job, hook)
+
+
+def test_archive_errors_are_logged(make_engine, tmp_path, caplog):
+    archive = BrokenArchive(str(tmp_path / "broken.sqlite3"))
+    engine = make_engine(ArchivingBackend(), archive=archive)
+    job = engine.submit("https://example.com/video")
+    job.wait(5)
+    archive.close()
+    assert job.state == DONE
+    assert "youtube ddddddddddd" in caplog.text and "disk full" in caplog.text
@@ -0,0 +1,168 @@
+import pytest
+
+from conftest import FakeBackend, make_info
+from ytdl_engine import backends
+from ytdl_engine.backends import (EXPLORE_EVERY, MIN_SAMPLES, PYTUBE, YTDLP, Backend, BackendStats, PytubeBackend,
+                                  make_backends, parse_backends)
+from ytdl_engine.engine import DONE, Job
+from ytdl_engine.formats import FormatPolicy, single_file_spec
+
+VIDEO = "https://www.youtube.com/watch?v=abcdefghijk"
+
+
+@pytest.fixture
+def stats(tmp_path):
+    stats = BackendStats(str(tmp_path / "backends.sqlite3"))
+    yield stats
+    stats.close()
+
+
+def named(name, **kwargs):
+    backend = FakeBackend(**kwargs)
+    backend.name = name
+    return backend
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        Backend()
+
+    class ExtractOnly(Backend):
+        def extract(self, url):
+            return {}
+
+    with pytest.raises(TypeError):
+        ExtractOnly()
+
+
+def test_parse_backends():
+    assert parse_backends("Pytube, yt-dlp") == [PYTUBE, YTDLP]
+    assert parse_backends(None) == [YTDLP]
+    with pytest.raises(ValueError):
+        parse_backends("youtube-dl")
+
+
+def test_missing_backends_are_logged(monkeypatch, caplog):
+    monkeypatch.setattr(PytubeBackend, "available", lambda self: False)
+    made = make_backends([PYTUBE], run=None)
+    assert [b.name for b in made] == [YTDLP]
+    assert "pytube is not installed" in caplog.text
+
+
+@pytest.mark.parametrize("spec, single", [
+    ("bv*+ba/b", "b"),
+    ("bestvideo+bestaudio/best", "best"),
+    ("bv*[height<=?720]+ba/b[height<=?720]/bv*+ba/b", "b[height<=?720]/b"),
+    ("b[format_note*=a+b]", "b[format_note*=a+b]"),
+    ("137+140/18", "18"),
+    ("(bv+ba/b)[ext=mp4]", None),
+    ("bv+ba", None),
+])
+def test_single_file_spec(spec, single):
+    assert single_file_spec(spec) == single
+
+
+@pytest.mark.parametrize("kwargs, supported", [
+    ({"format_spec": "b"}, True),
+    ({"format_spec": "18"}, True),
+    ({"format_spec": "best[ext=mp4]"}, True),
+    ({"format_spec": "bv*+ba/b"}, False),
+    ({"policy": FormatPolicy(max_height=720)}, False),
+    ({"policy": FormatPolicy(max_height=720, allow_merge=False)}, True),
+    ({"policy": FormatPolicy(audio_only=True, allow_merge=False)}, False),
+])
+def test_pytube_supports(kwargs, supported):
+    assert PytubeBackend().supports(Job(VIDEO, **kwargs)) is supported
+    assert not PytubeBackend().supports(Job("https://vimeo.com/1", format_spec="b"))
+
+
+def test_no_merge_routes_merge_selectors_to_single_files(make_engine):
+    engine = make_engine(allow_merge=False)
+    pytube = PytubeBackend()
+    jobs = [
+        engine.submit(VIDEO, format_spec="bv*+ba/b"),
+        engine.submit(VIDEO),
+        engine.submit(VIDEO, policy=FormatPolicy(max_height=720)),
+        engine.submit(VIDEO, format_id="137"),
+    ]
+    assert [job.format_spec for job in jobs[:2]] == ["b", "best"]
+    assert jobs[2].policy.allow_merge is False and jobs[2].policy.max_height == 720
+    assert [pytube.supports(job) for job in jobs] == [True, True, True, False]
+    assert engine.submit(VIDEO, format_spec="bv+ba").format_spec == "bv+ba"
+
+
+class ProgressiveOnly(FakeBackend):
+    name = "progressive"
+
+    def supports(self, job):
+        return False
+
+    def fallback_for(self, job):
+        return True
+
+
+def test_merged_jobs_fall_back_to_single_files(make_engine, stats):
+    fallback = ProgressiveOnly()
+    primary = named("primary", fail=True)
+    engine = make_engine(fallback, primary, backend_stats=stats)
+    job = engine.submit(VIDEO)
+    job.wait(5)
+    assert job.state == DONE and job.backend == "progressive"
+    assert primary.started == [job] and fallback.started == [job]
+
+
+def test_pytube_picks_the_best_progressive_stream_for_merges():
+    pytube = PytubeBackend()
+    assert pytube.fallback_for(Job(VIDEO)) and not pytube.fallback_for(Job(VIDEO, audio_only=True))
+    assert not pytube.fallback_for(Job("https://vimeo.com/1"))
+    assert pytube._choose(Job(VIDEO), make_info()) == "18"
+    assert pytube._choose(Job(VIDEO, policy=FormatPolicy(max_height=720)), make_info()) == "18"
+
+
+def test_fallback_to_the_next_backend(make_engine, stats, caplog):
+    first = named("first", fail=True)
+    second = named("second")
+    engine = make_engine(first, second, backend_stats=stats)
+    job = engine.submit("https://example.com/video")
+    job.wait(5)
+    assert job.state == DONE and job.backend == "second"
+    assert first.started == [job] and second.started == [job]
+    assert "first failed for https://example.com/video" in caplog.text
+
+
+def test_rank_keeps_configured_order_until_measured(stats):
+    url = "https://example.com/a"
+    assert stats.rank(url, ["slow", "fast"]) == ["slow", "fast"]
+    for _ in range(MIN_SAMPLES):
+        stats.record(url, "slow", latency=5.0, rate=1e6)
+    # "fast" still needs its samples, so it goes first
+    assert stats.rank(url, ["slow", "fast"]) == ["fast", "slow"]
+    for _ in range(MIN_SAMPLES):
+        stats.record(url, "fast", latency=0.5, rate=10e6)
+    assert stats.rank(url, ["slow", "fast"]) == ["fast", "slow"]
+    assert stats.rank("https://other.example/a", ["slow", "fast"]) == ["slow", "fast"]
+
+
+def test_rank_explores_and_demotes_failures(stats, monkeypatch):
+    url = "https://example.com/a"
+    for _ in range(MIN_SAMPLES):
+        stats.record(url, "slow", latency=5.0, rate=1e6)
+        stats.record(url, "fast", latency=0.5, rate=10e6)
+    orders = [stats.rank(url, ["slow", "fast"]) for _ in range(EXPLORE_EVERY)]
+    assert orders.count(["slow", "fast"]) == 1 and orders[-1] == ["slow", "fast"]
+    stats.failure(url, "fast")
+    assert stats.rank(url, ["slow", "fast"]) == ["slow", "fast"]
+    monkeypatch.setattr(backends.time, "time", lambda: stats.scores[("example.com", "fast")].failed
+                        + backends.FAILURE_COOLDOWN)
+    assert stats.rank(url, ["slow", "fast"]) == ["fast", "slow"]
+
+
+def test_stats_persist(tmp_path):
+    path = str(tmp_path / "backends.sqlite3")
+    stats = BackendStats(path)
+    stats.record("https://example.com/a", "fast", latency=1.0, rate=2e6)
+    stats.close()
+    stats = BackendStats(path)
+    assert stats.rank("https://example.com/b", ["fast"]) == ["fast"]
+    assert stats.stats()["example.com"]["fast"] == {"latency": 1.0, "rate": 2e6, "samples": 1, "failures": 0}
+    stats.close()
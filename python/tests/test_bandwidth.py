@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from ytdl_engine.bandwidth import (BACKGROUND, INTERACTIVE, MIN_FLOW_RATE, NORMAL, BandwidthScheduler, parse_priority,
+                                   parse_rate, parse_schedule, scheduler_from_env)
+from conftest import FakeBackend
+
+
+@pytest.mark.parametrize("text, rate", [
+    (None, None), ("off", None), ("unlimited", None), ("", None), (5000, 5000), ("2M", 2 * 1024 ** 2),
+    ("500k/s", 500 * 1024),
+])
+def test_parse_rate(text, rate):
+    assert parse_rate(text) == rate
+
+
+def test_parse_priority():
+    assert parse_priority("Interactive") == INTERACTIVE
+    assert parse_priority(BACKGROUND) == BACKGROUND
+    with pytest.raises(ValueError):
+        parse_priority("urgent")
+
+
+def test_parse_schedule():
+    assert parse_schedule("08:00-18:00=1M, 22:00-06:00=off") == [(480, 1080, 1024 ** 2), (1320, 360, None)]
+    assert parse_schedule("") == []
+    for bad in ("08:00=1M", "25:00-26:00=1M", "8-9=1M"):
+        with pytest.raises(ValueError):
+            parse_schedule(bad)
+
+
+def test_schedule_windows_wrap_midnight():
+    scheduler = BandwidthScheduler("4M", parse_schedule("08:00-18:00=1M,22:00-06:00=off"))
+
+    def at(hour):
+        return time.mktime((2026, 1, 15, hour, 30, 0, 0, 0, -1))
+
+    assert scheduler.rate_now(at(9)) == 1024 ** 2
+    assert scheduler.rate_now(at(20)) == 4 * 1024 ** 2
+    assert scheduler.rate_now(at(23)) is None
+    assert scheduler.rate_now(at(3)) is None
+
+
+def test_unlimited_sets_no_targets():
+    scheduler = BandwidthScheduler()
+    flow = scheduler.register("a")
+    scheduler.consume(flow, 10 ** 9)
+    assert flow.target is None and not scheduler.limited
+
+
+def test_higher_priority_takes_the_rate():
+    scheduler = BandwidthScheduler(1_000_000)
+    background = scheduler.register("bg", BACKGROUND)
+    interactive = scheduler.register("ui", INTERACTIVE)
+    jobs = scheduler.stats()["jobs"]
+    assert jobs["bg"]["target"] == MIN_FLOW_RATE
+    assert jobs["ui"]["target"] == 1_000_000 - MIN_FLOW_RATE
+    scheduler.unregister(interactive)
+    # Held back by its bucket, so it wants whatever is free
+    background.throttled_at = time.monotonic()
+    scheduler.stats()
+    assert background.target == 1_000_000
+
+
+def test_weights_split_a_priority():
+    scheduler = BandwidthScheduler(1_000_000)
+    heavy = scheduler.register("heavy", NORMAL, weight=3)
+    light = scheduler.register("light", NORMAL, weight=1)
+    scheduler.stats()
+    assert heavy.target - MIN_FLOW_RATE == pytest.approx(3 * (light.target - MIN_FLOW_RATE))
+    assert heavy.target + light.target == pytest.approx(1_000_000)
+
+
+def test_consume_throttles():
+    scheduler = BandwidthScheduler(1_000_000)
+    flow = scheduler.register("a")
+    start = time.monotonic()
+    scheduler.consume(flow, 200_000)
+    assert time.monotonic() - start >= 0.15
+
+
+def test_cancel_ends_throttling():
+    scheduler = BandwidthScheduler(1000)
+    cancel = threading.Event()
+    flow = scheduler.register("a", cancel_event=cancel)
+    threading.Timer(0.1, cancel.set).start()
+    start = time.monotonic()
+    scheduler.consume(flow, 10 ** 6)
+    assert time.monotonic() - start < 2
+
+
+def test_interactive_job_starts_ahead_of_queued_background_jobs(make_engine):
+    gate = threading.Event()
+    backend = FakeBackend(gate)
+    engine = make_engine(backend, workers=1)
+    first = engine.submit("https://example.com/first")
+    deadline = time.monotonic() + 5
+    while not backend.started and time.monotonic() < deadline:
+        time.sleep(0.01)
+    background = [engine.submit(f"https://example.com/bg{i}", priority=BACKGROUND) for i in range(3)]
+    normal = engine.submit("https://example.com/normal")
+    interactive = engine.submit("https://example.com/ui", priority=INTERACTIVE)
+    gate.set()
+    engine.wait_all(5)
+    assert backend.started == [first, interactive, normal] + background
+
+
+def test_bad_environment_limits_are_logged(monkeypatch, caplog):
+    monkeypatch.setenv("YTDL_RATE_LIMIT", "fast")
+    assert not scheduler_from_env().limited
+    assert "Bandwidth limit disabled" in caplog.text
@@ -0,0 +1,44 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from ytdl_engine.bench.suite import compare, flatten, summarize
+
+
+def fetch(url, range_header=None):
+    request = urllib.request.Request(url, headers={"Range": range_header} if range_header else {})
+    with urllib.request.urlopen(request) as response:
+        return response.status, response.headers, response.read()
+
+
+def test_media_server_ranges(media_server):
+    data = bytes(range(256)) * 40
+    (media_server.root / "clip.mp4").write_bytes(data)
+    url = media_server.url("clip.mp4")
+    status, headers, body = fetch(url)
+    assert (status, body, headers["Accept-Ranges"], headers["Content-Type"]) == (200, data, "bytes", "video/mp4")
+    status, headers, body = fetch(url, "bytes=100-199")
+    assert (status, body, headers["Content-Range"]) == (206, data[100:200], f"bytes 100-199/{len(data)}")
+    assert fetch(url, "bytes=10000-")[2] == data[10000:]
+    assert fetch(url, "bytes=-16")[2] == data[-16:]
+    assert fetch(url, "bytes=0-99999")[2] == data
+    with pytest.raises(urllib.error.HTTPError) as e:
+        fetch(url, f"bytes={len(data)}-")
+    assert e.value.code == 416
+    with pytest.raises(urllib.error.HTTPError) as e:
+        fetch(media_server.url("missing.mp4"))
+    assert e.value.code == 404
+
+
+def test_summaries_and_comparison():
+    assert summarize([]) is None
+    assert summarize([3, 1, 2]) == {"median": 2, "min": 1, "max": 3, "runs": 3}
+    baseline = {"environment": {"cpu_count": 4}, "downloads": {"progressive": {"median": 2.0, "runs": 3}},
+                "peak_rss_bytes": 100, "flag": True}
+    current = {"environment": {"cpu_count": 8}, "downloads": {"progressive": {"median": 1.0, "runs": 5}},
+               "peak_rss_bytes": 0}
+    assert flatten(baseline) == {"environment.cpu_count": 4, "downloads.progressive.median": 2.0,
+                                 "downloads.progressive.runs": 3, "peak_rss_bytes": 100}
+    assert compare(baseline, current) == [("downloads.progressive.median", 2.0, 1.0, -0.5),
+                                          ("peak_rss_bytes", 100, 0, -1.0)]
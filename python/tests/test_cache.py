@@ -0,0 +1,63 @@
+import time
+
+from conftest import make_info
+from ytdl_engine.cache import EXPIRY_MARGIN, MetadataCache, normalize_url, stream_expiry
+
+
+def test_normalize_url():
+    assert normalize_url("https://youtu.be/abcdefghijk") == "youtube:abcdefghijk"
+    assert normalize_url("https://www.youtube.com/watch?list=x&v=abcdefghijk") == "youtube:abcdefghijk"
+    assert normalize_url("HTTPS://Example.COM/v?b=2&a=1#t") == "https://example.com/v?a=1&b=2"
+
+
+def test_stream_expiry_is_the_earliest_signed_url():
+    info = make_info(expire=2000)
+    info["formats"][0]["url"] += "0"
+    assert stream_expiry(info) == 2000
+    assert stream_expiry(make_info()) is None
+
+
+def test_put_get_and_invalidate(tmp_path):
+    cache = MetadataCache(str(tmp_path / "meta.sqlite3"))
+    url = "https://example.com/v"
+    assert cache.get(url) is None
+    cache.put(url, {"id": "v", "formats": []})
+    info, fresh = cache.get(url)
+    assert info["id"] == "v" and fresh
+    cache.invalidate(url)
+    assert cache.get(url) is None
+    cache.close()
+
+
+def test_ttl_is_capped_by_signed_url_expiry(tmp_path):
+    cache = MetadataCache(str(tmp_path / "meta.sqlite3"))
+    url = "https://www.youtube.com/watch?v=abcdefghijk"
+    cache.put(url, make_info(expire=int(time.time()) + EXPIRY_MARGIN - 10))
+    assert cache.get(url)[1] is False
+    cache.put(url, make_info(expire=int(time.time()) + 3600))
+    assert cache.get(url)[1] is True
+    cache.close()
+
+
+def test_entries_past_max_stale_are_dropped(tmp_path):
+    cache = MetadataCache(str(tmp_path / "meta.sqlite3"), ttl=0, max_stale=0.05)
+    cache.put("https://example.com/v", {"id": "v"})
+    time.sleep(0.1)
+    assert cache.get("https://example.com/v") is None
+    cache.close()
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path):
+    cache = MetadataCache(str(tmp_path / "meta.sqlite3"), max_bytes=250)
+    blob = "x" * 80
+    for name in ("a", "b"):
+        cache.put(f"https://example.com/{name}", {"id": name, "pad": blob})
+        time.sleep(0.01)
+    # Touch "a" so "b" is the least recently used when "c" needs room
+    cache.get("https://example.com/a")
+    time.sleep(0.01)
+    cache.put("https://example.com/c", {"id": "c", "pad": blob})
+    assert cache.get("https://example.com/b") is None
+    assert cache.get("https://example.com/a") is not None
+    assert cache.total_bytes() <= 250
+    cache.close()
@@ -0,0 +1,113 @@
+import pytest
+
+from ytdl_engine.concurrency import COOLDOWN_SECONDS, HOLD_SECONDS, AimdLimit, ConcurrencyController
+from ytdl_engine.errors import throttle_message, throttle_status
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP Error {status}: Too Many Requests")
+        self.status = status
+
+
+@pytest.fixture
+def controller(tmp_path):
+    made = []
+
+    def make(**kwargs):
+        made.append(ConcurrencyController(str(tmp_path / "concurrency.sqlite3"), **kwargs))
+        return made[-1]
+
+    yield make
+    for c in made:
+        c.close()
+
+
+def test_throttle_status():
+    assert throttle_status(HTTPError(429)) == 429
+    try:
+        try:
+            raise HTTPError(403)
+        except HTTPError:
+            raise RuntimeError("download failed")
+    except RuntimeError as e:
+        assert throttle_status(e) == 403
+    assert throttle_status(HTTPError(404)) is None
+    assert throttle_message("[download] Got error: HTTP Error 429: Too Many Requests. Retrying") == 429
+    assert throttle_message("Got error: timed out. Retrying") is None
+
+
+def test_probe_kept_when_throughput_grows():
+    limit = AimdLimit(2, maximum=8)
+    assert not limit.observe(100, now=0)
+    assert limit.observe(100, now=1) and limit.limit == 3
+    limit.observe(150, now=2)
+    # 50% more than before the probe: keep it and probe again
+    assert limit.observe(150, now=3) and limit.limit == 4
+
+
+def test_probe_reverted_when_throughput_flat():
+    limit = AimdLimit(2, maximum=8)
+    limit.observe(100, now=0)
+    limit.observe(100, now=1)
+    limit.observe(105, now=2)
+    assert limit.observe(105, now=3) and limit.limit == 2
+    assert not limit.observe(1000, now=4) and not limit.observe(1000, now=5)
+    limit.observe(100, now=3 + HOLD_SECONDS)
+    assert limit.observe(100, now=4 + HOLD_SECONDS) and limit.limit == 3
+
+
+def test_no_probe_below_the_limit():
+    limit = AimdLimit(2, maximum=8)
+    limit.observe(100, saturated=False, now=0)
+    assert not limit.observe(100, saturated=False, now=1)
+    assert limit.limit == 2
+
+
+def test_backoff_halves_once_per_event():
+    limit = AimdLimit(8, maximum=8)
+    assert limit.backoff(now=100) and limit.limit == 4
+    assert not limit.backoff(now=101) and limit.limit == 4
+    assert limit.backoff(now=110) and limit.limit == 2
+    assert limit.backoff(now=120) and limit.limit == 1
+    assert not limit.backoff(now=130) and limit.limit == 1
+    # No probing during the cooldown
+    assert not limit.observe(100, now=131) and not limit.observe(100, now=132)
+    limit.observe(100, now=130 + COOLDOWN_SECONDS)
+    assert limit.observe(100, now=131 + COOLDOWN_SECONDS) and limit.limit == 2
+
+
+def test_job_slots_per_host(controller):
+    c = controller(jobs=2)
+    assert c.try_acquire("https://www.youtube.com/watch?v=a")
+    assert c.try_acquire("https://m.youtube.com/watch?v=b")
+    assert not c.try_acquire("https://youtube.com/watch?v=c")
+    assert c.try_acquire("https://vimeo.com/1")
+    assert c.release("https://youtube.com/watch?v=a") == 1
+    assert c.try_acquire("https://youtube.com/watch?v=c")
+
+
+def test_throttled_backs_off_and_is_remembered(controller):
+    c = controller(jobs=4, fragments=8)
+    c.throttled("https://youtube.com/watch?v=a", jobs=False)
+    assert c.stats()["youtube.com"]["fragments"] == 4
+    assert c.stats()["youtube.com"]["jobs"] == 4
+    c.hosts["youtube.com"].jobs.backed_off = 0
+    c.hosts["youtube.com"].fragments.backed_off = 0
+    c.throttled("https://youtube.com/watch?v=a")
+    c.close()
+    c = controller(jobs=4, fragments=8)
+    assert c.fragments("https://youtube.com/watch?v=b") == 2
+    assert c.stats()["youtube.com"]["jobs"] == 2
+    c.forget("https://youtube.com/")
+    assert c.fragments("https://youtube.com/watch?v=b") == 8
+
+
+def test_latency_jump_backs_off(controller):
+    c = controller(jobs=4)
+    url = "https://example.com/a"
+    for _ in range(5):
+        c.report_latency(url, 0.2)
+    assert c.stats()["example.com"]["jobs"] == 4
+    c.report_latency(url, 5.0)
+    assert c.stats()["example.com"]["jobs"] == 2
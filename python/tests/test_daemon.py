@@ -0,0 +1,126 @@
+import asyncio
+import json
+import os
+import queue
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import FakeBackend
+from ytdl_engine.daemon import DaemonClient, DaemonLink, DownloadDaemon, find_daemon
+from ytdl_engine.engine import DONE
+from ytdl_engine.progress import ProgressBus
+
+
+@pytest.fixture
+def daemon(make_engine, tmp_path):
+    root = tmp_path / "downloads"
+    root.mkdir()
+    engine = make_engine(FakeBackend(), workers=1)
+    server = DownloadDaemon(engine, port=0, token="secret", root=str(root))
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result(5)
+    yield server
+    asyncio.run_coroutine_threadsafe(server.stop(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+
+def post(daemon, path, data, headers=None):
+    request = urllib.request.Request(f"http://127.0.0.1:{daemon.port}{path}", data=json.dumps(data).encode(),
+                                     method="POST")
+    for name, value in {"Authorization": "Bearer secret", "Content-Type": "application/json",
+                        **(headers or {})}.items():
+        if value is not None:
+            request.add_header(name, value)
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_submit_saves_below_root(daemon):
+    client = DaemonClient(f"http://127.0.0.1:{daemon.port}", token="secret")
+    job = client.submit("https://example.com/a", save_path="music")
+    assert job["save_path"] == os.path.join(daemon.root, "music")
+    assert client.submit("https://example.com/b")["save_path"] == daemon.root
+
+
+def test_token_required(daemon):
+    status, _ = post(daemon, "/jobs", {"url": "https://example.com/a"}, {"Authorization": None})
+    assert status == 401
+
+
+def test_cross_origin_requests_rejected(daemon):
+    status, body = post(daemon, "/jobs", {"url": "https://example.com/a"}, {"Origin": "https://evil.example"})
+    assert status == 403
+    assert "origin" in body["error"].lower()
+
+
+def test_post_requires_json_content_type(daemon):
+    status, _ = post(daemon, "/jobs", {"url": "https://example.com/a"}, {"Content-Type": "text/plain"})
+    assert status == 415
+    status, _ = post(daemon, "/jobs", {"url": "https://example.com/a"},
+                     {"Content-Type": "application/json; charset=utf-8"})
+    assert status == 201
+
+
+def test_ffmpeg_path_not_accepted(daemon):
+    status, body = post(daemon, "/jobs", {"url": "https://example.com/a", "ffmpeg_path": "/tmp/evil"})
+    assert status == 400
+    assert "--ffmpeg" in body["error"]
+    assert not daemon.engine.jobs
+
+
+@pytest.mark.parametrize("save_path", ["..", "/etc", "music/../../elsewhere"])
+def test_save_path_outside_root_rejected(daemon, save_path):
+    status, _ = post(daemon, "/jobs", {"url": "https://example.com/a", "save_path": save_path})
+    assert status == 403
+    assert not daemon.engine.jobs
+
+
+def test_save_path_symlink_out_of_root_rejected(daemon, tmp_path):
+    os.symlink(tmp_path, os.path.join(daemon.root, "escape"))
+    status, _ = post(daemon, "/jobs", {"url": "https://example.com/a", "save_path": "escape"})
+    assert status == 403
+
+
+@pytest.mark.parametrize("limit", [0, -1, "5", 1.5, True])
+def test_playlist_limit_must_be_positive_int(daemon, limit):
+    status, body = post(daemon, "/playlists", {"url": "https://example.com/list", "limit": limit})
+    assert status == 400
+    assert "limit" in body["error"]
+    assert not daemon.playlists
+
+
+def test_find_daemon(daemon):
+    assert find_daemon(f"http://127.0.0.1:{daemon.port}", token="secret") is not None
+    assert find_daemon(f"http://127.0.0.1:{daemon.port}", token="wrong") is None
+    # Bound but not listening: the connection is refused
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        assert find_daemon(f"http://127.0.0.1:{s.getsockname()[1]}") is None
+
+
+def test_link_reports_remote_jobs_like_local_ones(daemon):
+    events = queue.SimpleQueue()
+    bus = ProgressBus()
+    client = find_daemon(f"http://127.0.0.1:{daemon.port}", token="secret")
+    link = DaemonLink(client, bus, events.put)
+    job = link.submit("https://example.com/a", save_path="music", priority="interactive")
+    assert job.id == f"daemon:{job.remote_id}"
+    seen = events.get(timeout=5)
+    while not seen.finished:
+        seen = events.get(timeout=5)
+    assert seen is job and job.state == DONE
+    assert job.save_path == os.path.join(daemon.root, "music")
+    assert link.active_jobs() == [] and job.id not in bus.latest()
+    # The engine in the daemon did the work, not one in this process
+    assert [j.journal_id for j in daemon.engine.jobs] == [job.journal_id]
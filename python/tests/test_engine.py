@@ -0,0 +1,56 @@
+import logging
+import threading
+
+from conftest import FakeBackend
+from ytdl_engine.engine import CANCELLED, DONE, FAILED, QUEUED
+
+
+def test_jobs_finish_on_a_bounded_pool(make_engine, tmp_path):
+    gate = threading.Event()
+    backend = FakeBackend(gate)
+    engine = make_engine(backend, workers=2)
+    jobs = [engine.submit(f"https://example.com/{i}", save_path=str(tmp_path)) for i in range(5)]
+    threading.Timer(0.2, gate.set).start()
+    engine.wait_all(10)
+    assert [job.state for job in jobs] == [DONE] * 5
+    assert backend.peak == 2
+
+
+def test_failed_download_keeps_the_error(make_engine, tmp_path):
+    engine = make_engine(FakeBackend(fail=True))
+    job = engine.submit("https://example.com/v", save_path=str(tmp_path))
+    assert job.wait(10)
+    assert job.state == FAILED
+    assert "failed" in str(job.error)
+
+
+def test_cancel_before_start(make_engine, tmp_path):
+    gate = threading.Event()
+    engine = make_engine(FakeBackend(gate), workers=1)
+    first = engine.submit("https://example.com/1", save_path=str(tmp_path))
+    second = engine.submit("https://example.com/2", save_path=str(tmp_path))
+    assert second.state == QUEUED
+    engine.cancel(second)
+    gate.set()
+    engine.wait_all(10)
+    assert first.state == DONE
+    assert second.state == CANCELLED
+
+
+def test_listener_errors_are_logged_with_traceback(make_engine, tmp_path, caplog):
+    seen = []
+
+    def broken(job):
+        raise ValueError("listener broke")
+
+    engine = make_engine()
+    engine.add_listener(broken)
+    engine.add_listener(seen.append)
+    with caplog.at_level(logging.ERROR, logger="ytdl_engine.engine"):
+        job = engine.submit("https://example.com/v", save_path=str(tmp_path))
+        assert job.wait(10)
+    assert job.state == DONE
+    # Later listeners still hear about the job
+    assert seen and seen[-1].state == DONE
+    errors = [r for r in caplog.records if r.name == "ytdl_engine.engine"]
+    assert errors and errors[0].exc_info[0] is ValueError
@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+from ytdl_engine.formats import FormatPolicy, codec_family, parse_formats, parse_size, select_formats
+
+
+@pytest.fixture
+def formats(sample_info):
+    return parse_formats(sample_info)
+
+
+@pytest.mark.parametrize("codec, family", [
+    (None, "unknown"), ("none", None), ("", None), ("avc1.640028", "h264"), ("vp09.00.40.08", "vp9"),
+    ("mp4a.40.2", "aac"), ("opus", "opus"), ("theora", "theora"),
+])
+def test_codec_family(codec, family):
+    assert codec_family(codec) == family
+
+
+@pytest.mark.parametrize("text, size", [
+    (None, None), (1234, 1234), ("1234", 1234), ("250k", 250 * 1024), ("700M", 700 * 1024 ** 2),
+    ("1.5G", int(1.5 * 1024 ** 3)), (" 2 MiB ", 2 * 1024 ** 2), ("3gb", 3 * 1024 ** 3),
+])
+def test_parse_size(text, size):
+    assert parse_size(text) == size
+
+
+def test_parse_size_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_policy_from_dict():
+    policy = FormatPolicy.from_dict({"max_height": 720, "video_codecs": "avc1,vp9", "max_filesize": "10M"})
+    assert policy.video_codecs == ("h264", "vp9")
+    assert policy.max_filesize == 10 * 1024 ** 2
+    assert FormatPolicy.from_dict(policy.to_dict()).to_dict() == policy.to_dict()
+    with pytest.raises(ValueError):
+        FormatPolicy.from_dict({"max_heigth": 720})
+
+
+@pytest.mark.parametrize("policy, spec", [
+    (FormatPolicy(), "bv*+ba/b"),
+    (FormatPolicy(max_height=720), "bv*[height<=?720]+ba/b[height<=?720]/bv*+ba/b"),
+    (FormatPolicy(max_height=720, allow_merge=False), "b[height<=?720]/b"),
+    (FormatPolicy(allow_merge=False), "b"),
+    (FormatPolicy(audio_only=True), "ba/b"),
+    (FormatPolicy(audio_only=True, max_bitrate=128), "ba[abr<=?128]/ba/b"),
+])
+def test_format_spec(policy, spec):
+    assert policy.format_spec() == spec
+
+
+@pytest.mark.parametrize("policy, spec, within", [
+    # Highest resolution, then frame rate; the highest bitrate audio
+    (FormatPolicy(), "248+251", True),
+    (FormatPolicy(max_height=720, video_codecs=["h264"], audio_codecs=["aac"]), "136+140", True),
+    (FormatPolicy(max_fps=30, video_codecs=["vp9"]), "137+251", True),
+    # Only the progressive file fits the budget
+    (FormatPolicy(max_filesize="10M"), "18", True),
+    (FormatPolicy(max_bitrate=1500, audio_codecs=["aac"]), "247+140", True),
+    (FormatPolicy(allow_merge=False), "18", True),
+    # Nothing fits: the smallest pairing, and the lowest resolution over the height limit
+    (FormatPolicy(max_filesize=1_000_000), "134+139", False),
+    (FormatPolicy(max_height=240), "18", False),
+    (FormatPolicy(audio_only=True), "251", True),
+    (FormatPolicy(audio_only=True, audio_codecs=["aac"]), "140", True),
+    (FormatPolicy(audio_only=True, max_bitrate=100), "139", True),
+])
+def test_select_formats(formats, policy, spec, within):
+    selection = select_formats(formats, policy)
+    assert selection.format_spec == spec
+    assert selection.within_policy is within
+
+
+def test_select_formats_ignores_input_order(formats):
+    policy = FormatPolicy(max_filesize="20M")
+    expected = select_formats(formats, policy).format_spec
+    rng = random.Random(1)
+    for _ in range(10):
+        rng.shuffle(formats)
+        assert select_formats(formats, policy).format_spec == expected
+
+
+def test_select_formats_audio_only_without_audio_streams(formats):
+    videos = [f for f in formats if f.has_video]
+    assert select_formats(videos, FormatPolicy(audio_only=True)).format_spec == "18"
+    assert select_formats([], FormatPolicy()) is None
+
+
+def test_estimated_sizes(sample_info):
+    for f in sample_info["formats"]:
+        del f["filesize"]
+    sample_info["formats"][0]["filesize_approx"] = 500_000
+    by_id = {f.format_id: f for f in parse_formats(sample_info)}
+    assert by_id["139"].filesize == 500_000 and by_id["139"].size_estimated
+    # From the bitrate: 128 kbit/s for 100 s
+    assert by_id["140"].filesize == 1_600_000 and by_id["140"].size_estimated
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from conftest import FakeBackend
+from ytdl_engine.engine import DONE
+from ytdl_engine.integrity import (CHANGED, MISMATCH, MISSING, OK, SIDECAR_SUFFIX, Manifest, StreamHasher,
+                                   TailHasher, hash_file, verify)
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.sqlite3"), fast=True, sidecars=True)
+    yield manifest
+    manifest.close()
+
+
+def test_tail_hasher_follows_a_growing_file(tmp_path):
+    part = tmp_path / "video.mp4.part"
+    final = tmp_path / "video.mp4"
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    hasher = TailHasher(str(final), fast=True)
+    with open(part, "wb") as fh:
+        for i in range(0, len(data), 700_000):
+            fh.write(data[i:i + 700_000])
+            fh.flush()
+            hasher.update(str(part))
+    os.replace(part, final)
+    hasher.seal(str(final))
+    digest = hasher.digest(str(final))
+    assert digest.sha256 == hashlib.sha256(data).hexdigest()
+    assert digest.fast_hash == hash_file(str(final), fast=True).fast_hash
+    assert digest.streamed and digest.size == len(data)
+
+
+def test_tail_hasher_limit_and_restart(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"a" * 100)
+    hasher = TailHasher(str(path))
+    hasher.update(str(path), limit=40)
+    assert hasher.offset == 40
+    # The downloader started over with a different file
+    path.write_bytes(b"b" * 10)
+    hasher.seal(str(path))
+    assert hasher.digest(str(path)).sha256 == hashlib.sha256(b"b" * 10).hexdigest()
+
+
+def test_digest_rejects_a_rewritten_file(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"first")
+    hasher = StreamHasher()
+    hasher.feed(b"first")
+    hasher.seal(str(path))
+    assert hasher.digest(str(path)).sha256 == hashlib.sha256(b"first").hexdigest()
+    path.write_bytes(b"fixed up")
+    assert hasher.digest(str(path)) is None
+
+
+def test_manifest_uses_the_streamed_digest(manifest, tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"content")
+    hasher = StreamHasher(fast=True)
+    hasher.feed(b"content")
+    hasher.seal(str(path))
+    digest = manifest.record_file(str(path), hasher, "https://example.com/v", "Video")
+    assert digest is not None and digest.streamed
+    row = manifest.get(str(path))
+    assert row["sha256"] == hashlib.sha256(b"content").hexdigest() and row["streamed"] == 1
+    assert row["title"] == "Video"
+    sidecar = (tmp_path / ("video.mp4" + SIDECAR_SUFFIX)).read_text(encoding="utf-8")
+    assert sidecar == f"{row['sha256']}  video.mp4\n"
+
+
+def test_manifest_reads_files_without_a_digest(manifest, tmp_path, caplog):
+    path = tmp_path / "merged.mkv"
+    path.write_bytes(b"merged")
+    with caplog.at_level("INFO", logger="ytdl_engine.integrity"):
+        digest = manifest.record_file(str(path), TailHasher(str(path)))
+    assert not digest.streamed
+    assert digest.sha256 == hashlib.sha256(b"merged").hexdigest()
+    assert "Reading" in caplog.text and str(path) in caplog.text
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_verify(manifest, tmp_path, fast):
+    files = {}
+    for name in ("ok", "mismatch", "changed", "missing"):
+        files[name] = tmp_path / "library" / f"{name}.mp4"
+        files[name].parent.mkdir(exist_ok=True)
+        files[name].write_bytes(b"0123456789")
+        manifest.record_file(str(files[name]))
+    files["mismatch"].write_bytes(b"9876543210")
+    files["changed"].write_bytes(b"short")
+    files["missing"].unlink()
+    results = {os.path.basename(row["path"]): status for row, status in verify(manifest, fast=fast, workers=2)}
+    assert results == {"ok.mp4": OK, "mismatch.mp4": MISMATCH, "changed.mp4": CHANGED, "missing.mp4": MISSING}
+    assert manifest.get(str(files["mismatch"]))["status"] == MISMATCH
+    assert [row["path"] for row in manifest.entries([str(files["ok"])])] == [str(files["ok"])]
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None or os.name != "posix", reason="needs ffmpeg and pipes")
+def test_fmp4_stream_mux_is_hashed_while_written(media_server, tmp_path):
+    import yt_dlp
+
+    from ytdl_engine.downloaders import StreamMuxFD
+
+    def make(name, *args):
+        subprocess.run(["ffmpeg", "-v", "error", "-y", *args, "-movflags", "frag_keyframe+empty_moov",
+                        str(media_server.root / name)], check=True)
+
+    make("v.mp4", "-f", "lavfi", "-i", "testsrc=duration=2:size=160x120:rate=10", "-c:v", "libx264")
+    make("a.m4a", "-f", "lavfi", "-i", "sine=duration=2", "-c:a", "aac")
+    streams = [
+        {"format_id": "v", "ext": "mp4", "container": "mp4_dash", "protocol": "http", "vcodec": "avc1",
+         "acodec": "none", "url": media_server.url("v.mp4"), "http_headers": {}},
+        {"format_id": "a", "ext": "m4a", "container": "m4a_dash", "protocol": "http", "vcodec": "none",
+         "acodec": "mp4a.40.2", "url": media_server.url("a.m4a"), "http_headers": {}},
+    ]
+    finished = []
+    params = {"quiet": True, "stream_mux": "fmp4", "stream_hasher": lambda: StreamHasher(fast=True)}
+    output = str(tmp_path / "muxed.mp4")
+    with yt_dlp.YoutubeDL(params) as ydl:
+        fd = StreamMuxFD(ydl, ydl.params)
+        fd.add_progress_hook(lambda d: d["status"] == "finished" and finished.append(d))
+        fd.download(output, {"id": "x", "ext": "mp4", "__mux_streams": streams})
+    digest = finished[0]["hasher"].digest(output)
+    assert digest.sha256 == hash_file(output).sha256 and digest.streamed
+
+
+def make_parts(tmp_path):
+    def make(name, *args):
+        subprocess.run(["ffmpeg", "-v", "error", "-y", *args, str(tmp_path / name)], check=True)
+
+    make("v.mp4", "-f", "lavfi", "-i", "testsrc=duration=2:size=160x120:rate=10", "-c:v", "libx264")
+    make("a.m4a", "-f", "lavfi", "-i", "sine=duration=2", "-c:a", "aac")
+    return [
+        {"format_id": "v", "ext": "mp4", "protocol": "https", "vcodec": "avc1", "acodec": "none",
+         "filepath": str(tmp_path / "v.mp4")},
+        {"format_id": "a", "ext": "m4a", "protocol": "https", "vcodec": "none", "acodec": "mp4a.40.2",
+         "filepath": str(tmp_path / "a.m4a")},
+    ]
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+@pytest.mark.parametrize("stream_mux", ["fmp4", None])
+def test_merges_are_hashed_while_written(tmp_path, stream_mux):
+    import yt_dlp
+
+    from ytdl_engine.downloaders import HashingMergerPP
+
+    formats = make_parts(tmp_path)
+    hashers = []
+
+    def stream_hasher():
+        hashers.append(StreamHasher())
+        return hashers[-1]
+
+    output = str(tmp_path / "merged.mp4")
+    info = {"id": "x", "ext": "mp4", "filepath": output, "requested_formats": formats,
+            "__files_to_merge": [f["filepath"] for f in formats]}
+    with yt_dlp.YoutubeDL({"quiet": True, "stream_mux": stream_mux, "stream_hasher": stream_hasher}) as ydl:
+        HashingMergerPP(ydl).run(info)
+    assert os.path.getsize(output) > 0 and not os.path.exists(tmp_path / "merged.temp.mp4")
+    if stream_mux == "fmp4":
+        digest = hashers[0].digest(output)
+        assert digest.sha256 == hash_file(output).sha256 and digest.streamed
+    else:
+        # ffmpeg seeks back in plain MP4 output, so it is read back for the manifest
+        assert hashers == []
+
+
+def test_deferred_merges_use_the_hashing_merger(tmp_path):
+    from yt_dlp.postprocessor.ffmpeg import FFmpegMergerPP
+
+    from ytdl_engine.downloaders import HashingMergerPP, StagedYoutubeDL
+
+    with StagedYoutubeDL({"quiet": True}) as ydl:
+        ydl.post_process(str(tmp_path / "merged.mp4"), {"id": "x", "__postprocessors": [FFmpegMergerPP(ydl)]})
+    [(_, info, _)] = ydl.deferred
+    assert [type(pp) for pp in info["__postprocessors"]] == [HashingMergerPP]
+
+
+class OutputBackend(FakeBackend):
+    def download(self, job, hook):
+        job.filename = os.path.join(job.save_path, "video.mp4")
+        with open(job.filename, "wb") as fh:
+            fh.write(b"video")
+        return super().download(job, hook)
+
+
+class BrokenManifest(Manifest):
+    def record_file(self, *args, **kwargs):
+        raise OSError("read-only")
+
+
+def test_manifest_errors_are_logged(make_engine, tmp_path, caplog):
+    manifest = BrokenManifest(str(tmp_path / "broken.sqlite3"))
+    engine = make_engine(OutputBackend(), manifest=manifest)
+    job = engine.submit("https://example.com/video", save_path=str(tmp_path))
+    job.wait(5)
+    manifest.close()
+    assert job.state == DONE
+    assert "read-only" in caplog.text and job.sha256 is None
@@ -0,0 +1,181 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from ytdl_engine.bandwidth import BACKGROUND, INTERACTIVE
+from ytdl_engine.formats import FormatPolicy
+from conftest import FakeBackend
+from ytdl_engine.jobstore import QUEUED, RUNNING, JobStore
+from ytdl_engine.workers import StoreWorker
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "jobstore.sqlite3")
+
+
+@pytest.fixture
+def open_store(store_path):
+    stores = []
+
+    def make(**kwargs):
+        stores.append(JobStore(store_path, **kwargs))
+        return stores[-1]
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+def test_claim_by_priority_then_age(open_store):
+    store = open_store()
+    background = store.enqueue("https://example.com/bg", priority=BACKGROUND)
+    first = store.enqueue("https://example.com/1")
+    second = store.enqueue("https://example.com/2", policy=FormatPolicy(max_height=720))
+    urgent = store.enqueue("https://example.com/ui", priority=INTERACTIVE)
+    claimed = store.claim("w1", limit=3)
+    assert [job["id"] for job in claimed] == [urgent, first, second]
+    assert claimed[2]["policy"] == {"max_height": 720, "allow_merge": True, "audio_only": False}
+    assert all(job["state"] == RUNNING and job["attempts"] == 1 for job in claimed)
+    assert store.get(background)["state"] == QUEUED
+    assert store.workers() == {"w1": 3}
+
+
+def test_concurrent_claims_never_share_a_job(open_store):
+    ids = [open_store().enqueue(f"https://example.com/{i}") for i in range(40)]
+    claimed = {}
+
+    def worker(name):
+        store = open_store()
+        while True:
+            jobs = store.claim(name, limit=2)
+            if not jobs:
+                return
+            claimed.setdefault(name, []).extend(job["id"] for job in jobs)
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    everything = [job_id for jobs in claimed.values() for job_id in jobs]
+    assert sorted(everything) == sorted(ids)
+
+
+def test_heartbeat_renews_and_reports_cancels(open_store):
+    store = open_store(lease=0.2)
+    job_id = store.enqueue("https://example.com/a")
+    other = store.enqueue("https://example.com/b")
+    store.claim("w1", limit=2)
+    for _ in range(3):
+        time.sleep(0.1)
+        assert store.heartbeat("w1", {job_id: ("downloading", 10, 100), other: ("downloading", 0, None)}) == set()
+    assert store.requeue_expired() == 0
+    assert store.get(job_id)["downloaded_bytes"] == 10
+    store.cancel(other)
+    assert store.heartbeat("w1", {job_id: ("downloading", 20, 100), other: ("downloading", 0, None)}) == {other}
+    assert store.complete(other, "w1", "cancelled")
+
+
+def test_expired_lease_goes_to_another_worker(open_store):
+    store = open_store(lease=0.05)
+    job_id = store.enqueue("https://example.com/a")
+    store.claim("w1")
+    time.sleep(0.1)
+    claimed = open_store(lease=60).claim("w2")
+    assert [job["id"] for job in claimed] == [job_id] and claimed[0]["attempts"] == 2
+    # The first worker comes back: the job isn't its any more
+    assert store.heartbeat("w1", {job_id: ("downloading", 0, None)}) == {job_id}
+    assert not store.complete(job_id, "w1", "done")
+    assert store.complete(job_id, "w2", "done", output="/tmp/a.mp4", downloaded=5)
+    assert store.get(job_id)["output"] == "/tmp/a.mp4"
+
+
+def test_jobs_fail_after_max_attempts(open_store):
+    store = open_store(lease=0.01)
+    job_id = store.enqueue("https://example.com/a", max_attempts=2)
+    for _ in range(2):
+        assert store.claim("w1")
+        time.sleep(0.03)
+    assert store.claim("w1") == []
+    job = store.get(job_id)
+    assert job["state"] == "failed" and job["error"] == "Worker lost 2 times"
+    assert store.retry(job_id)
+    assert store.claim("w1")[0]["attempts"] == 1
+
+
+def test_release_does_not_count_as_an_attempt(open_store):
+    store = open_store()
+    job_id = store.enqueue("https://example.com/a")
+    store.claim("w1")
+    store.release(job_id, "w1")
+    assert store.get(job_id)["state"] == QUEUED and store.get(job_id)["attempts"] == 0
+    assert store.pending() == 1
+
+
+def test_cancel_queued_and_prune(open_store):
+    store = open_store()
+    job_id = store.enqueue("https://example.com/a")
+    store.cancel(job_id)
+    assert store.counts() == {"cancelled": 1}
+    store.prune(older_than=3600)
+    assert store.get(job_id) is not None
+    store.prune(older_than=-1)
+    assert store.get(job_id) is None
+
+
+def test_shared_mode(open_store):
+    store = open_store(shared=True)
+    store.enqueue("https://example.com/a")
+    assert store._db.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    assert len(open_store(shared=True).claim("w1")) == 1
+
+
+def test_older_stores_gain_the_new_columns(store_path):
+    db = sqlite3.connect(store_path)
+    db.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, url TEXT NOT NULL, format_spec TEXT, policy TEXT,"
+               " save_path TEXT, turbo INTEGER NOT NULL DEFAULT 0, priority INTEGER NOT NULL, state TEXT NOT NULL,"
+               " phase TEXT, attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, worker TEXT,"
+               " lease_until REAL, cancel_requested INTEGER NOT NULL DEFAULT 0, output TEXT,"
+               " downloaded_bytes INTEGER NOT NULL DEFAULT 0, total_bytes INTEGER, error TEXT, created REAL NOT NULL,"
+               " started REAL, updated REAL NOT NULL)")
+    db.execute("INSERT INTO jobs (id, url, priority, state, max_attempts, created, updated)"
+               " VALUES ('old', 'https://example.com/a', 0, 'queued', 3, 0, 0)")
+    db.commit()
+    db.close()
+    store = JobStore(store_path)
+    [row] = store.claim("w1")
+    assert (row["audio_only"], row["audio_format"], row["audio_quality"]) == (0, None, None)
+    store.close()
+
+
+def test_workers_run_jobs_with_their_audio_settings(open_store, make_engine, tmp_path):
+    store = open_store()
+    store.enqueue("https://example.com/a", save_path=str(tmp_path), audio_only=True, audio_format="mp3",
+                  audio_quality="192K")
+    store.enqueue("https://example.com/b", save_path=str(tmp_path))
+    backend = FakeBackend()
+    engine = make_engine(backend, audio_format="opus")
+    StoreWorker(store, engine, name="w1").run(exit_when_idle=True)
+    jobs = {job.url: job for job in backend.started}
+    a, b = jobs["https://example.com/a"], jobs["https://example.com/b"]
+    assert (a.audio_only, a.audio_format, a.audio_quality) == (True, "mp3", "192K")
+    assert (b.audio_only, b.audio_format) == (False, "opus")
+    assert store.counts() == {"done": 2}
+
+
+def test_heartbeat_stops_jobs_removed_from_the_store(open_store, make_engine, tmp_path):
+    store = open_store()
+    job_id = store.enqueue("https://example.com/a", save_path=str(tmp_path))
+    gate = threading.Event()
+    engine = make_engine(FakeBackend(gate))
+    worker = StoreWorker(store, engine, name="w1")
+    worker._start(store.claim("w1")[0])
+    store._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+    job = worker.running[job_id]
+    worker._heartbeat()
+    gate.set()
+    job.wait(5)
+    assert job.state == "cancelled"
@@ -0,0 +1,182 @@
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+
+from conftest import FakeBackend
+from ytdl_engine.bandwidth import BACKGROUND, INTERACTIVE, NORMAL
+from ytdl_engine.engine import DONE, Job
+from ytdl_engine.formats import FormatPolicy
+from ytdl_engine.journal import PROGRESS_INTERVAL, JobJournal
+from ytdl_engine.session import VideoSession
+
+
+def test_record_update_and_unfinished(tmp_path):
+    journal = JobJournal(str(tmp_path / "journal.sqlite3"))
+    job = Job("https://example.com/v", "137", str(tmp_path), turbo=True)
+    journal.record(job)
+    row = journal.get(job.journal_id)
+    assert row["format_spec"] == "137+bestaudio/best" and row["turbo"] == 1 and row["state"] == "queued"
+    job.state = "running"
+    job.downloaded_bytes = 10
+    journal.update_state(job)
+    assert [r["id"] for r in journal.unfinished()] == [job.journal_id]
+    job.state = DONE
+    journal.update_state(job)
+    assert journal.unfinished() == []
+    journal.close()
+
+
+def test_records_audio_policy_and_priority(tmp_path):
+    journal = JobJournal(str(tmp_path / "journal.sqlite3"))
+    policy = FormatPolicy(audio_only=True, audio_codecs=["opus"])
+    job = Job("https://example.com/v", policy=policy, priority=INTERACTIVE, audio_format="mp3", audio_quality=5)
+    journal.record(job)
+    row = journal.get(job.journal_id)
+    assert row["audio_only"] == 1 and row["priority"] == INTERACTIVE
+    assert FormatPolicy.from_dict(row["policy"]).to_dict() == policy.to_dict()
+    assert (row["audio_format"], row["audio_quality"]) == ("mp3", "5")
+    plain = Job("https://example.com/w")
+    journal.record(plain)
+    row = journal.get(plain.journal_id)
+    assert (row["audio_only"], row["policy"], row["audio_format"], row["priority"]) == (0, None, None, NORMAL)
+    journal.close()
+
+
+def test_old_journals_gain_the_new_columns(tmp_path):
+    path = str(tmp_path / "journal.sqlite3")
+    db = sqlite3.connect(path)
+    # The schema before audio jobs, policies and priorities were recorded
+    db.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, url TEXT NOT NULL, format_id TEXT, format_spec TEXT,"
+               " save_path TEXT, ffmpeg_path TEXT, turbo INTEGER NOT NULL DEFAULT 0, state TEXT NOT NULL, phase TEXT,"
+               " filename TEXT, tmpfilename TEXT, downloaded_bytes INTEGER NOT NULL DEFAULT 0, total_bytes INTEGER,"
+               " error TEXT, created REAL NOT NULL, updated REAL NOT NULL)")
+    db.execute("INSERT INTO jobs (id, url, format_spec, state, created, updated)"
+               " VALUES ('old', 'https://example.com/v', 'best', 'queued', 1, 1)")
+    db.commit()
+    db.close()
+    journal = JobJournal(path)
+    [row] = journal.unfinished()
+    assert row["id"] == "old" and row["format_spec"] == "best"
+    assert (row["audio_only"], row["policy"], row["audio_format"], row["priority"]) == (0, None, None, NORMAL)
+    # Nobody owns it, so it is free to resume
+    assert [row["id"] for row in journal.claim_unfinished()] == ["old"]
+    assert journal.get("old")["owner"] == journal.owner
+    journal.record(Job("https://example.com/w", priority=BACKGROUND))
+    journal.close()
+    # Opening it again finds nothing left to add
+    JobJournal(path).close()
+
+
+def test_progress_writes_are_throttled(tmp_path):
+    journal = JobJournal(str(tmp_path / "journal.sqlite3"))
+    job = Job("https://example.com/v")
+    journal.record(job)
+    job.downloaded_bytes = 100
+    journal.update_progress(job)
+    assert journal.get(job.journal_id)["downloaded_bytes"] == 0
+    job.journal_updated -= PROGRESS_INTERVAL
+    journal.update_progress(job)
+    assert journal.get(job.journal_id)["downloaded_bytes"] == 100
+    job.downloaded_bytes = 200
+    journal.update_progress(job, force=True)
+    assert journal.get(job.journal_id)["downloaded_bytes"] == 200
+    journal.close()
+
+
+def test_prune_keeps_unfinished(tmp_path):
+    journal = JobJournal(str(tmp_path / "journal.sqlite3"))
+    done, queued = Job("https://example.com/1"), Job("https://example.com/2")
+    for job in (done, queued):
+        journal.record(job)
+    done.state = DONE
+    journal.update_state(done)
+    journal.prune(older_than=-1)
+    assert journal.get(done.journal_id) is None
+    assert journal.get(queued.journal_id) is not None
+    journal.close()
+
+
+def crash(engine):
+    # The process dies: its workers stop, and its rows name a process that no longer exists
+    engine.shutdown(wait=False)
+    pid = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    db = sqlite3.connect(engine.journal.path)
+    db.execute("UPDATE jobs SET owner = ?", (f"{socket.gethostname()}:{pid.stdout.strip()}:crashed",))
+    db.commit()
+    db.close()
+
+
+def test_live_jobs_are_not_resumed_by_another_process(make_engine, tmp_path):
+    path = str(tmp_path / "journal.sqlite3")
+    gate = threading.Event()
+    first = make_engine(FakeBackend(gate), workers=1, journal=JobJournal(path))
+    jobs = [first.submit(f"https://example.com/{i}", save_path=str(tmp_path)) for i in range(2)]
+    # Another window, CLI run or daemon on the same journal while the first is still working
+    second = make_engine(journal=JobJournal(path))
+    assert second.resume_unfinished() == []
+    assert {row["owner"] for row in second.journal.unfinished()} == {first.journal.owner}
+    gate.set()
+    first.wait_all(10)
+    assert [job.state for job in jobs] == [DONE, DONE]
+
+
+def test_jobs_are_claimed_once_their_lease_runs_out(tmp_path):
+    path = str(tmp_path / "journal.sqlite3")
+    first = JobJournal(path)
+    job = Job("https://example.com/v")
+    first.record(job)
+    assert JobJournal(path).claim_unfinished() == []
+    # Its owner stopped beating (hung, or on another machine that can't be checked)
+    later = JobJournal(path, lease=0.0)
+    assert [row["id"] for row in later.claim_unfinished()] == [job.journal_id]
+    assert later.claim_unfinished() == []
+    first.close()
+    later.close()
+
+
+def test_engine_resumes_unfinished_jobs(make_engine, tmp_path):
+    path = str(tmp_path / "journal.sqlite3")
+    gate = threading.Event()
+    first = make_engine(FakeBackend(gate), workers=1, journal=JobJournal(path))
+    running = first.submit("https://example.com/1", format_spec="18", save_path=str(tmp_path))
+    queued = first.submit("https://example.com/2", format_id="22", save_path=str(tmp_path), turbo=True)
+    # A crash: neither job gets to finish
+    crash(first)
+
+    second = make_engine(journal=JobJournal(path))
+    resumed = second.resume_unfinished()
+    assert [job.journal_id for job in resumed] == [running.journal_id, queued.journal_id]
+    assert resumed[0].format_spec == "18"
+    assert resumed[1].format_spec == "22+bestaudio/best" and resumed[1].turbo
+    second.wait_all(10)
+    assert [job.state for job in resumed] == [DONE, DONE]
+    assert second.journal.unfinished() == []
+    gate.set()
+
+
+def test_resumed_jobs_keep_audio_policy_and_priority(make_engine, tmp_path, sample_info):
+    path = str(tmp_path / "journal.sqlite3")
+    gate = threading.Event()
+    first = make_engine(FakeBackend(gate), workers=1, journal=JobJournal(path), audio_format="mp3", audio_quality=5)
+    first.submit("https://example.com/1", save_path=str(tmp_path))
+    policy = FormatPolicy(audio_only=True, max_bitrate=128)
+    by_policy = first.submit("https://example.com/2", save_path=str(tmp_path), policy=policy, priority=INTERACTIVE)
+    url = "https://example.com/3"
+    picked = first.submit(url, "140", str(tmp_path), session=VideoSession(url, sample_info), priority=BACKGROUND)
+    assert picked.audio_only and picked.format_spec == "140"
+    crash(first)
+
+    # Restarted with other audio defaults: the jobs keep the ones they were queued with
+    second = make_engine(journal=JobJournal(path), audio_format="opus")
+    resumed = {job.journal_id: job for job in second.resume_unfinished()}
+    again = resumed[by_policy.journal_id]
+    assert again.audio_only and again.policy.to_dict() == policy.to_dict()
+    assert again.format_spec == policy.format_spec() and again.priority == INTERACTIVE
+    assert (again.audio_format, again.audio_quality) == ("mp3", "5")
+    assert second.build_opts(again)["extract_audio"] == "mp3"
+    again = resumed[picked.journal_id]
+    assert again.audio_only and again.format_spec == "140" and again.priority == BACKGROUND
+    second.wait_all(10)
+    gate.set()
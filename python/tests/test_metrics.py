@@ -0,0 +1,77 @@
+import json
+import urllib.request
+
+from conftest import FakeBackend
+from ytdl_engine.engine import Job
+from ytdl_engine.metrics import JobLogger, MetricsRecorder, MetricsServer, error_class, metrics_from_env
+
+
+def test_job_logger_counts_retries():
+    job = Job("https://example.com/v")
+    seen = []
+    logger = JobLogger(job, seen.append)
+    logger.debug("[download] Got error: HTTP Error 429. Retrying (1/10)...")
+    logger.debug("[download] Destination: v.mp4")
+    assert job.retries == 1 and len(seen) == 1
+
+
+def test_job_logger_logs_warnings_and_errors(caplog, capsys):
+    logger = JobLogger(Job("https://example.com/v"))
+    logger.warning("Falling back to generic n function search")
+    logger.error("ERROR: Unable to download webpage")
+    assert [(r.levelname, r.getMessage()) for r in caplog.records] == [
+        ("WARNING", "https://example.com/v: Falling back to generic n function search"),
+        ("ERROR", "ERROR: Unable to download webpage"),
+    ]
+    assert capsys.readouterr().err == ""
+
+
+def test_bad_metrics_port_is_logged(make_engine, monkeypatch, caplog):
+    monkeypatch.setenv("YTDL_METRICS_PORT", "nope")
+    recorder, server = metrics_from_env(make_engine(FakeBackend()))
+    recorder.close()
+    assert server is None and "Metrics endpoint disabled" in caplog.text
+
+
+def test_error_class_unwraps_yt_dlp_errors():
+    class Wrapped(Exception):
+        exc_info = (None, TimeoutError("read timed out"), None)
+
+    assert error_class(None) is None
+    assert error_class(ValueError()) == "ValueError"
+    assert error_class(Wrapped()) == "TimeoutError"
+
+
+def test_phase_timings_from_marks():
+    job = Job("https://example.com/v")
+    job.marks = {"submitted": 0.0, "started": 1.0, "pre_process": 3.0, "video": 3.5, "before_dl": 4.0,
+                 "downloaded": 14.0, "finished": 20.0}
+    job.pp_seconds = {"Merger": 2.0, "MoveFiles": 0.5}
+    job.timings["merge_wait"] = 1.0
+    assert job.phase_timings() == {"queue": 1.0, "extract": 2.0, "format_selection": 0.5, "thumbnail": 0.5,
+                                   "download": 10.0, "merge": 2.0, "finalize": 3.0}
+
+
+def test_recorder_counts_finished_jobs_and_serves_them(make_engine, tmp_path):
+    engine = make_engine(FakeBackend())
+    path = tmp_path / "metrics.jsonl"
+    recorder = MetricsRecorder(engine, jsonl_path=str(path))
+    jobs = [engine.submit(f"https://example.com/{i}", save_path=str(tmp_path)) for i in range(3)]
+    engine.wait_all(10)
+    snapshot = recorder.snapshot()
+    assert snapshot["jobs"] == {"done": 3}
+    assert snapshot["phase_seconds"]["queue"]["count"] == 3
+    server = MetricsServer(recorder, port=0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+            text = response.read().decode()
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics.json") as response:
+            assert json.load(response)["jobs"] == {"done": 3}
+    finally:
+        server.close()
+    assert 'ytdl_jobs_total{state="done"} 3' in text
+    assert "# TYPE ytdl_job_phase_seconds summary" in text
+    recorder.close()
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert sorted(r["id"] for r in records if r["type"] == "job") == sorted(job.id for job in jobs)
+    assert records[-1]["type"] == "process"
@@ -0,0 +1,99 @@
+import socket
+
+import pytest
+import yt_dlp
+
+from ytdl_engine.downloaders import SharedYoutubeDL
+from ytdl_engine.network import SharedNetwork
+
+
+@pytest.fixture
+def shared():
+    made = []
+
+    def make(*args, **kwargs):
+        made.append(SharedNetwork(*args, **kwargs))
+        return made[-1]
+
+    yield make
+    for network in made:
+        network.close()
+
+
+def test_dns_cache(shared, monkeypatch):
+    network = shared(dns_ttl=60)
+    resolver = []
+
+    def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+        resolver.append(host)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port))]
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+    for _ in range(2):
+        assert network.dns.getaddrinfo("cdn.example", 443, 0, socket.SOCK_STREAM)[0][4] == ("127.0.0.1", 443)
+    assert resolver == ["cdn.example"]
+    stats = network.dns.stats()
+    assert (stats["dns_lookups"], stats["dns_cache_hits"], stats["connections"]) == (1, 1, 2)
+
+
+def test_other_lookups_are_left_alone(media_server, shared):
+    original = socket.getaddrinfo
+    network = shared()
+    (media_server.root / "a.bin").write_bytes(b"x")
+    with yt_dlp.YoutubeDL({"quiet": True}) as ydl:
+        assert ydl.urlopen(media_server.url("a.bin").replace("127.0.0.1", "localhost")).read() == b"x"
+    assert socket.getaddrinfo is original and network.dns.stats()["dns_lookups"] == 0
+
+
+def test_instances_share_connections(media_server, shared):
+    (media_server.root / "a.bin").write_bytes(b"x" * 1000)
+    network = shared(pool_size=4)
+    for _ in range(3):
+        with SharedYoutubeDL({"quiet": True, "shared_network": network}) as ydl:
+            with ydl.urlopen(media_server.url("a.bin")) as response:
+                assert response.read() == b"x" * 1000
+    stats = network.stats()
+    assert stats["openers"] == 1 and stats["requests"] == 3
+    assert stats["connections"] == 1 and stats["reused"] == 2
+    # Closing an instance leaves the shared connections open
+    assert network.opener({}).cookiejar is not None
+
+
+def test_opener_per_network_params(shared):
+    network = shared()
+    assert network.opener({"quiet": True}) is network.opener({"verbose": True})
+    assert network.opener({}) is not network.opener({"proxy": "http://127.0.0.1:9"})
+
+
+def test_pools_are_sized(shared):
+    network = shared(pool_size=32)
+    handler = network.opener({})._request_director.handlers.get("Requests")
+    if handler is None:
+        pytest.skip("requests is not installed")
+    session = handler._get_instance(cookiejar=handler.cookiejar, legacy_ssl_support=None)
+    managers = [a.poolmanager for a in session.adapters.values()]
+    assert {m.connection_pool_kw["maxsize"] for m in managers} == {32}
+    assert all(m.pool_classes_by_scheme is network.dns.pool_classes() for m in managers)
+
+
+def test_unknown_handlers_are_used_as_they_are(shared):
+    from yt_dlp.networking.common import RequestHandler
+
+    class OtherRH(RequestHandler):
+        pass
+
+    class RequestsRH(RequestHandler):
+        pass
+
+    network = shared()
+    assert network.handler_class(OtherRH) is OtherRH and network.handler_class(RequestsRH) is RequestsRH
+
+
+def test_http_session_counts_and_caches(media_server, shared):
+    (media_server.root / "a.bin").write_bytes(b"x" * 10)
+    network = shared()
+    session = network.http_session(2)
+    for _ in range(2):
+        assert session.get(media_server.url("a.bin").replace("127.0.0.1", "localhost")).content == b"x" * 10
+    stats = network.stats()
+    assert stats["requests"] == 2 and stats["dns_lookups"] == 1
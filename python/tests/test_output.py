@@ -0,0 +1,129 @@
+import os
+import threading
+from collections import namedtuple
+
+import pytest
+
+from conftest import make_info
+from ytdl_engine import output
+from ytdl_engine.engine import Job
+from ytdl_engine.output import STAGING_DIR, InsufficientSpace, OutputManager, estimate_size, reserve_blocks
+
+GiB = 1024 ** 3
+Usage = namedtuple("Usage", "total used free")
+
+
+@pytest.fixture
+def free_space(monkeypatch):
+    space = {"free": 10 * GiB}
+    monkeypatch.setattr(output.shutil, "disk_usage", lambda path: Usage(100 * GiB, 0, space["free"]))
+    return space
+
+
+def formats_by_id():
+    return {f["format_id"]: f for f in make_info()["formats"]}
+
+
+def test_estimate_size():
+    f = formats_by_id()
+    assert estimate_size(dict(f["18"], duration=100)) == int(6_250_000 * 1.1)
+    # A merge holds both streams and the merged copy
+    merged = {"duration": 100, "requested_formats": [f["137"], f["140"]]}
+    assert estimate_size(merged) == int((37_500_000 + 1_600_000) * 2 * 1.1)
+    muxed = {"duration": 100, "__mux_streams": [f["137"], f["140"]]}
+    assert estimate_size(muxed) == int((37_500_000 + 1_600_000) * 1.1)
+    # From the bitrate when no size is given, unknown without either
+    assert estimate_size({"tbr": 800, "duration": 10}) == int(800 * 10 * 125 * 1.1)
+    assert estimate_size({"format_id": "x", "duration": 10}) is None
+
+
+def test_staging_paths(tmp_path):
+    job = Job("https://example.com/a", save_path=str(tmp_path))
+    manager = OutputManager(buffer_size="1M", http_chunk_size="10M")
+    staging = manager.staging_dir(job)
+    assert staging == os.path.join(str(tmp_path), STAGING_DIR, job.journal_id)
+    opts = manager.ydl_opts(job)
+    assert opts["paths"] == {"home": str(tmp_path), "temp": staging}
+    assert opts["buffersize"] == 1024 ** 2 and opts["noresizebuffer"]
+    assert opts["http_chunk_size"] == 10 * 1024 ** 2
+    assert manager.final_path(job, os.path.join(staging, "a.mp4")) == os.path.join(str(tmp_path), "a.mp4")
+    assert manager.final_path(job, "/elsewhere/a.mp4") == "/elsewhere/a.mp4"
+    plain = OutputManager(staging=False)
+    assert plain.staging_dir(job) is None and plain.ydl_opts(job) == {}
+
+
+def test_discard_and_finish(tmp_path):
+    job = Job("https://example.com/a", save_path=str(tmp_path))
+    manager = OutputManager()
+    staging = manager.staging_dir(job)
+    os.makedirs(staging)
+    open(os.path.join(staging, "a.mp4.part"), "wb").close()
+    manager.discard(job)
+    assert not os.path.exists(staging)
+    os.makedirs(staging)
+    manager.finish(job)
+    assert not os.path.exists(os.path.join(str(tmp_path), STAGING_DIR))
+
+
+def test_admission_waits_for_running_jobs(tmp_path, free_space):
+    manager = OutputManager(min_free=GiB)
+    first = Job("https://example.com/a", save_path=str(tmp_path))
+    second = Job("https://example.com/b", save_path=str(tmp_path))
+    manager.admit(first, 6 * GiB)
+    waited = threading.Event()
+    admitted = threading.Event()
+
+    def admit_second():
+        manager.admit(second, 5 * GiB, on_wait=waited.set)
+        admitted.set()
+
+    threading.Thread(target=admit_second, daemon=True).start()
+    assert waited.wait(5) and not admitted.is_set()
+    assert second.phase == "waiting for disk space"
+    manager.release(first)
+    assert admitted.wait(5)
+
+
+def test_progress_frees_the_reservation(tmp_path, free_space):
+    manager = OutputManager(min_free=0)
+    first = Job("https://example.com/a", save_path=str(tmp_path))
+    manager.admit(first, 8 * GiB)
+    first.file_bytes["a.mp4"] = 6 * GiB
+    # Free space already reflects what the first job wrote
+    free_space["free"] = 4 * GiB
+    manager.admit(Job("https://example.com/b", save_path=str(tmp_path)), 2 * GiB)
+
+
+def test_admission_fails_when_it_can_never_fit(tmp_path, free_space):
+    manager = OutputManager(min_free=GiB)
+    with pytest.raises(InsufficientSpace) as raised:
+        manager.admit(Job("https://example.com/a", save_path=str(tmp_path)), 10 * GiB)
+    assert raised.value.needed == 10 * GiB and raised.value.free == 9 * GiB
+
+
+def test_admission_stops_waiting_on_cancel(tmp_path, free_space):
+    manager = OutputManager(min_free=0)
+    manager.admit(Job("https://example.com/a", save_path=str(tmp_path)), 8 * GiB)
+    job = Job("https://example.com/b", save_path=str(tmp_path))
+    threading.Timer(0.1, job.cancel_event.set).start()
+    manager.admit(job, 8 * GiB)
+    assert job.id not in manager.reservations
+
+
+def test_allocate_checks_unadmitted_jobs(tmp_path, free_space):
+    manager = OutputManager(min_free=0, preallocate=False)
+    job = Job("https://example.com/a", save_path=str(tmp_path))
+    path = tmp_path / "a.mp4.part"
+    path.touch()
+    free_space["free"] = 1024
+    with pytest.raises(InsufficientSpace):
+        manager.allocate(job, str(path), 4096)
+    manager.allocate(job, str(path), 512)
+
+
+def test_reserve_blocks(tmp_path):
+    path = tmp_path / "a.mp4.part"
+    path.touch()
+    if reserve_blocks(str(path), 4 * 1024 ** 2):
+        assert os.path.getsize(path) == 0
+        assert os.stat(path).st_blocks * 512 >= 4 * 1024 ** 2
@@ -0,0 +1,80 @@
+from yt_dlp.utils import sanitize_filename
+
+from ytdl_engine import playlist as playlist_module
+from ytdl_engine.bandwidth import BACKGROUND
+from ytdl_engine.engine import DONE
+from ytdl_engine.playlist import MAX_DEPTH, Playlist, _walk, expand_playlist
+
+
+class FakeYdl:
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def extract_info(self, url, download=False, process=True):
+        self.calls.append(url)
+        return self.pages.get(url)
+
+
+def video(n):
+    return {"_type": "url", "url": f"https://example.com/v{n}", "title": f"v{n}"}
+
+
+def test_walk_flattens_channel_tabs_and_nested_playlists():
+    ydl = FakeYdl({
+        "channel": {"_type": "playlist", "title": "Channel", "entries": [
+            {"_type": "playlist", "url": "tab"}, None, video(3), {"_type": "url"}]},
+        "tab": {"_type": "playlist", "title": "Videos", "entries": [video(1), video(2)]},
+    })
+    titles = []
+    entries = list(_walk(ydl, "channel", titles.append, 0))
+    assert [e["url"] for e in entries] == ["https://example.com/v1", "https://example.com/v2",
+                                          "https://example.com/v3"]
+    # Only the outermost title names the playlist
+    assert titles == ["Channel"]
+
+
+def test_walk_follows_redirects_up_to_max_depth():
+    pages = {f"r{i}": {"_type": "url", "url": f"r{i + 1}"} for i in range(MAX_DEPTH + 2)}
+    ydl = FakeYdl(pages)
+    entries = list(_walk(ydl, "r0", None, 0))
+    assert len(ydl.calls) == MAX_DEPTH + 1
+    assert entries == [pages[f"r{MAX_DEPTH}"]]
+
+
+def test_walk_entries_are_lazy():
+    def entries():
+        yield video(1)
+        raise AssertionError("read past the first entry")
+
+    ydl = FakeYdl({"list": {"_type": "playlist", "title": "L", "entries": entries()}})
+    assert next(_walk(ydl, "list", None, 0))["url"] == "https://example.com/v1"
+
+
+def test_expand_queues_entries_in_a_subfolder(make_engine, tmp_path, monkeypatch):
+    def fake_entries(url, opts=None, on_title=None):
+        on_title("My/List")
+        for n in range(5):
+            yield video(n)
+
+    monkeypatch.setattr(playlist_module, "iter_entries", fake_entries)
+    engine = make_engine()
+    playlist = expand_playlist(engine, Playlist("https://example.com/list"), save_path=str(tmp_path), limit=3)
+    assert playlist.expanded and playlist.error is None
+    assert [job.url for job in playlist.jobs] == [f"https://example.com/v{n}" for n in range(3)]
+    assert all(job.priority == BACKGROUND for job in playlist.jobs)
+    assert {job.save_path for job in playlist.jobs} == {str(tmp_path / sanitize_filename("My/List"))}
+    assert playlist.wait(10)
+    assert [job.state for job in playlist.jobs] == [DONE] * 3
+
+
+def test_expand_records_errors(make_engine, monkeypatch):
+    def failing(url, opts=None, on_title=None):
+        yield video(1)
+        raise RuntimeError("page 2 failed")
+
+    monkeypatch.setattr(playlist_module, "iter_entries", failing)
+    playlist = expand_playlist(make_engine(), Playlist("https://example.com/list"), subfolder=False)
+    assert len(playlist.jobs) == 1
+    assert str(playlist.error) == "page 2 failed"
+    assert playlist.expanded
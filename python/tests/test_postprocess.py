@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from ytdl_engine.engine import Job
+from ytdl_engine.postprocess import DeferredPostprocessMixin, PostprocessPool, audio_transcodes, default_workers
+
+
+class Base:
+    def __init__(self, params=None):
+        self.params = params or {}
+        self.ran = []
+
+    def post_process(self, filename, info, files_to_move=None):
+        self.ran.append(filename)
+        return info
+
+
+class Deferring(DeferredPostprocessMixin, Base):
+    pass
+
+
+def test_mixin_defers_only_when_there_is_work():
+    ydl = Deferring()
+    ydl.post_process("plain.mp4", {"__postprocessors": []})
+    assert ydl.ran == ["plain.mp4"] and ydl.deferred == []
+    info = {"__postprocessors": ["merger"], "title": "t"}
+    returned = ydl.post_process("merged.mp4", info, {"a": "b"})
+    assert ydl.ran == ["plain.mp4"]
+    assert returned["filepath"] == "merged.mp4"
+    filename, recorded, files_to_move = ydl.deferred[0]
+    assert filename == "merged.mp4" and recorded["title"] == "t" and files_to_move == {"a": "b"}
+
+
+def test_pool_is_bounded_and_counts(monkeypatch):
+    from ytdl_engine import postprocess
+
+    gate = threading.Event()
+    running = []
+    peak = []
+
+    def fake_run(params, deferred):
+        running.append(1)
+        peak.append(len(running))
+        gate.wait(5)
+        running.pop()
+        if deferred == "bad":
+            raise RuntimeError("ffmpeg failed")
+        return "/out/final.mp4"
+
+    monkeypatch.setattr(postprocess, "run_deferred", fake_run)
+    pool = PostprocessPool(2)
+    results = {}
+    done = threading.Semaphore(0)
+
+    def callback(job, error):
+        results[job.url] = error
+        done.release()
+
+    jobs = [Job(f"https://example.com/{i}") for i in range(4)]
+    for i, job in enumerate(jobs):
+        pool.submit(job, {}, "bad" if i == 3 else [], callback)
+    assert pool.stats()["queued"] >= 1
+    gate.set()
+    for _ in jobs:
+        assert done.acquire(timeout=5)
+    pool.shutdown()
+    stats = pool.stats()
+    assert max(peak) == 2
+    assert (stats["completed"], stats["failed"], stats["queued"], stats["busy"]) == (3, 1, 0, 0)
+    assert str(results["https://example.com/3"]) == "ffmpeg failed"
+    assert jobs[0].output == "/out/final.mp4"
+    assert "merge_wait" in jobs[0].timings and "postprocess" in jobs[0].timings
+
+
+def test_default_workers_leave_cores_for_downloads():
+    assert default_workers() >= 1
+
+
+@pytest.mark.parametrize("acodec, codec, transcodes", [
+    ("opus", "best", False), ("mp4a.40.2", "m4a", False), ("mp4a.40.2", "aac", False), ("opus", "opus", False),
+    ("opus", "mp3", True), ("mp4a.40.2", "opus", True), (None, "flac", True),
+])
+def test_audio_transcodes(acodec, codec, transcodes):
+    assert audio_transcodes({"acodec": acodec}, codec) is transcodes
@@ -0,0 +1,114 @@
+import threading
+
+import pytest
+
+from ytdl_engine import prefetch
+from ytdl_engine.errors import rate_limit_delay
+from ytdl_engine.prefetch import BatchPrefetcher, host_key
+
+
+class HTTPError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP Error {status}")
+        self.status = status
+        self.headers = headers or {}
+
+
+class Wrapped(Exception):
+    # Like yt-dlp's DownloadError: the real failure sits in exc_info
+    def __init__(self, cause):
+        super().__init__(str(cause))
+        self.exc_info = (type(cause), cause, None)
+
+
+@pytest.fixture
+def prefetcher():
+    made = []
+
+    def make(**kwargs):
+        made.append(BatchPrefetcher(**kwargs))
+        return made[-1]
+
+    yield make
+    for p in made:
+        p.shutdown()
+
+
+def test_host_key_shares_subdomains():
+    assert host_key("https://www.youtube.com/watch?v=x") == "youtube.com"
+    assert host_key("https://m.YouTube.com/watch?v=x") == "youtube.com"
+    assert host_key("https://music.youtube.com/") == "music.youtube.com"
+
+
+def test_rate_limit_delay():
+    assert rate_limit_delay(ValueError("boom")) is None
+    assert rate_limit_delay(HTTPError(403)) is None
+    assert rate_limit_delay(HTTPError(429)) == 0.0
+    assert rate_limit_delay(Wrapped(HTTPError(429, {"Retry-After": "7"}))) == 7.0
+
+
+def test_per_host_limit(monkeypatch, prefetcher):
+    gate = threading.Event()
+    lock = threading.Lock()
+    running = {}
+    peak = {}
+
+    def open_session(url, opts, cache, force_refresh):
+        host = host_key(url)
+        with lock:
+            running[host] = running.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), running[host])
+        gate.wait(5)
+        with lock:
+            running[host] -= 1
+        return url
+
+    monkeypatch.setattr(prefetch, "open_session", open_session)
+    p = prefetcher(workers=8, per_host=2)
+    urls = [f"https://a.example/{i}" for i in range(6)] + [f"https://b.example/{i}" for i in range(2)]
+    batch = p.prefetch(urls + urls[:1])
+    assert len(batch.urls) == 8
+    threading.Timer(0.2, gate.set).start()
+    assert batch.wait(5)
+    assert peak == {"a.example": 2, "b.example": 2}
+    assert all(result.ok for result in batch.results.values())
+
+
+def test_rate_limited_url_is_retried(monkeypatch, prefetcher):
+    calls = []
+
+    def open_session(url, opts, cache, force_refresh):
+        calls.append(url)
+        if len(calls) == 1:
+            raise Wrapped(HTTPError(429))
+        return "session"
+
+    monkeypatch.setattr(prefetch, "open_session", open_session)
+    monkeypatch.setattr(prefetch, "BACKOFF_BASE", 0.01)
+    batch = prefetcher().prefetch(["https://a.example/1"])
+    result = next(iter(batch))
+    assert result.ok and result.attempts == 2
+    assert calls == ["https://a.example/1"] * 2
+
+
+def test_gives_up_after_retries(monkeypatch, prefetcher):
+    def open_session(url, opts, cache, force_refresh):
+        raise HTTPError(429)
+
+    monkeypatch.setattr(prefetch, "open_session", open_session)
+    monkeypatch.setattr(prefetch, "BACKOFF_BASE", 0.01)
+    batch = prefetcher(retries=1).prefetch(["https://a.example/1"])
+    result = next(iter(batch))
+    assert not result.ok and result.attempts == 2
+    assert isinstance(result.error, HTTPError)
+
+
+def test_callback_errors_are_logged(monkeypatch, prefetcher, caplog):
+    monkeypatch.setattr(prefetch, "open_session", lambda *args: "session")
+
+    def callback(result):
+        raise RuntimeError("callback broke")
+
+    batch = prefetcher().prefetch(["https://a.example/1"], callback=callback)
+    assert batch.wait(5)
+    assert "callback broke" in caplog.text
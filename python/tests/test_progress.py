@@ -0,0 +1,70 @@
+from ytdl_engine.progress import ProgressBus, ProgressSample, TkProgressTicker, aggregate, format_eta, format_sample
+
+
+class FakeWidget:
+    # Records after() calls instead of running a Tk event loop
+    def __init__(self):
+        self.scheduled = []
+        self.cancelled = []
+
+    def after(self, ms, fn):
+        self.scheduled.append((ms, fn))
+        return len(self.scheduled)
+
+    def after_cancel(self, handle):
+        self.cancelled.append(handle)
+
+
+def test_bus_keeps_only_the_latest_sample():
+    bus = ProgressBus()
+    bus.publish(1, ProgressSample("downloading", 10, 100, 5.0, 18))
+    bus.publish(1, ProgressSample("downloading", 50, 100, 5.0, 10))
+    bus.publish(2, ProgressSample("downloading", 1, None, None, None))
+    snapshot = bus.latest()
+    assert snapshot[1].downloaded_bytes == 50 and snapshot[1].percent == 50.0
+    bus.discard(2)
+    assert list(bus.latest()) == [1]
+    # Snapshots are copies
+    snapshot.clear()
+    assert bus.latest()
+
+
+def test_aggregate():
+    samples = [ProgressSample("downloading", 10, 100, 2.0, 45, 4.0),
+               ProgressSample("finished", 200, 200, 3.0, 0, None)]
+    total = aggregate(samples)
+    assert (total.downloaded_bytes, total.total_bytes, total.speed, total.eta) == (210, 300, 5.0, 45)
+    assert total.status == "downloading"
+    # Only downloading samples count towards the target, and only when all of them are limited
+    assert total.target_rate == 4.0
+    assert aggregate([ProgressSample("downloading", 1, None, None, None)]).total_bytes is None
+    assert aggregate([]) is None
+
+
+def test_formatting():
+    assert format_eta(None) == "??"
+    assert format_eta(75) == "01:15"
+    assert format_eta(3725) == "1:02:05"
+    sample = ProgressSample("downloading", 512, 1024, 1024.0, 1, 2048.0)
+    assert format_sample(sample) == "50.0% at 1.0KiB/s of 2.0KiB/s | ETA: 00:01"
+    assert format_sample(sample._replace(status="finished")) == "Finalizing..."
+
+
+def test_ticker_renders_changes_and_delivers_events():
+    widget = FakeWidget()
+    bus = ProgressBus()
+    rendered = []
+    events = []
+    ticker = TkProgressTicker(widget, bus, rendered.append, events.append, hz=20)
+    ticker.start()
+    ticker.start()
+    assert len(widget.scheduled) == 1 and widget.scheduled[0][0] == 50
+    bus.publish(1, ProgressSample("downloading", 1, 2, None, None))
+    ticker.post("job changed")
+    widget.scheduled[-1][1]()
+    assert rendered == [bus.latest()] and events == ["job changed"]
+    # Nothing new: no render, but the tick is scheduled again
+    widget.scheduled[-1][1]()
+    assert len(rendered) == 1 and len(widget.scheduled) == 3
+    ticker.stop()
+    assert widget.cancelled == [3]
@@ -0,0 +1,88 @@
+import os
+
+from ytdl_engine.segmented import (
+    MAX_RANGE, MIN_RANGE, TARGET_RANGE_SECONDS, RangeScheduler, load_segments, merge_ranges, preallocate,
+    save_segments, turbo_opts,
+)
+
+
+def test_merge_ranges_joins_adjacent_and_overlapping():
+    assert merge_ranges([(10, 19), (0, 9), (30, 39), (35, 50)]) == [[0, 19], [30, 50]]
+    assert merge_ranges([]) == []
+
+
+def drain(scheduler, rate=None):
+    claimed = []
+    while True:
+        r = scheduler.claim(rate)
+        if r is None:
+            return claimed
+        claimed.append(r)
+
+
+def test_scheduler_covers_every_byte_once():
+    total = 5 * 1024 * 1024 + 7
+    claimed = drain(RangeScheduler(total, initial_range=MIN_RANGE))
+    assert merge_ranges(claimed) == [[0, total - 1]]
+    assert sum(end - start + 1 for start, end in claimed) == total
+
+
+def test_scheduler_skips_ranges_already_done():
+    total = 4 * 1024 * 1024
+    done = [(0, 1024 * 1024 - 1), (2 * 1024 * 1024, 3 * 1024 * 1024 - 1)]
+    claimed = drain(RangeScheduler(total, done))
+    assert merge_ranges(claimed) == [[1024 * 1024, 2 * 1024 * 1024 - 1], [3 * 1024 * 1024, total - 1]]
+    assert RangeScheduler(total, [(0, total - 1)]).claim() is None
+
+
+def test_range_size_follows_throughput():
+    scheduler = RangeScheduler(64 * 1024 * 1024)
+    start, end = scheduler.claim(rate=1024 * 1024)
+    assert end - start + 1 == int(1024 * 1024 * TARGET_RANGE_SECONDS)
+    start, end = scheduler.claim(rate=1)
+    assert end - start + 1 == MIN_RANGE
+    start, end = scheduler.claim(rate=10 ** 12)
+    assert end - start + 1 == MAX_RANGE
+
+
+def test_failed_range_is_retried_first():
+    scheduler = RangeScheduler(4 * 1024 * 1024, initial_range=MIN_RANGE)
+    first = scheduler.claim()
+    scheduler.claim()
+    scheduler.give_back(*first)
+    assert scheduler.claim() == first
+
+
+def test_segments_sidecar_round_trip(tmp_path):
+    path = str(tmp_path / "video.part.segments")
+    save_segments(path, 100, [(50, 59), (0, 9), (10, 19)])
+    assert load_segments(path, 100) == [(0, 19), (50, 59)]
+    # A different size means a different file: start over
+    assert load_segments(path, 200) is None
+    assert load_segments(str(tmp_path / "missing"), 100) is None
+
+
+def test_preallocate_sets_size(tmp_path):
+    path = str(tmp_path / "video.part")
+    preallocate(path, 1024 * 1024)
+    assert os.path.getsize(path) == 1024 * 1024
+
+
+def test_turbo_opts():
+    assert turbo_opts(8) == {"concurrent_fragment_downloads": 8}
+    assert turbo_opts(0) == {"concurrent_fragment_downloads": 1}
+
+
+def test_turbo_download_over_ranges(media_server, tmp_path):
+    from ytdl_engine.downloaders import TurboYoutubeDL
+
+    data = os.urandom(6 * 1024 * 1024 + 123)
+    (media_server.root / "big.mp4").write_bytes(data)
+    out = tmp_path / "out"
+    params = {"quiet": True, "noprogress": True, "outtmpl": str(out / "%(id)s.%(ext)s")}
+    with TurboYoutubeDL(params, connections=4) as ydl:
+        ydl.process_ie_result({"id": "big", "title": "big", "url": media_server.url("big.mp4"), "ext": "mp4"})
+    assert (out / "big.mp4").read_bytes() == data
+    assert sorted(os.listdir(out)) == ["big.mp4"]
+    ranges = [r for path, r in media_server.requests if r and r != "bytes=0-0"]
+    assert len(ranges) > 1
@@ -0,0 +1,42 @@
+import pytest
+
+from conftest import make_info
+from ytdl_engine import session as session_module
+from ytdl_engine.cache import MetadataCache
+from ytdl_engine.session import VideoSession, describe_formats, open_session
+
+URL = "https://www.youtube.com/watch?v=abcdefghijk"
+
+
+def test_session_parses_formats_once(sample_info):
+    session = VideoSession(URL, sample_info)
+    assert session.title == "Sample video"
+    assert session.key == "Youtube-abcdefghijk"
+    assert [f.format_id for f in session.format_records] == [f["format_id"] for f in sample_info["formats"]]
+    assert session.labels == [label for label, _ in describe_formats(sample_info)]
+    assert session.format_map[session.labels[0]] == "139"
+
+
+def test_open_session_uses_the_cache_instead_of_extracting(tmp_path, monkeypatch, sample_info):
+    calls = []
+    monkeypatch.setattr(session_module, "extract_info", lambda url, opts=None: calls.append(url) or sample_info)
+    cache = MetadataCache(str(tmp_path / "meta.sqlite3"))
+    first = open_session(URL, cache=cache)
+    second = open_session(URL, cache=cache)
+    assert calls == [URL]
+    assert second.fresh and second.info["id"] == first.info["id"]
+    assert second.extract_seconds is not None
+    open_session(URL, cache=cache, force_refresh=True)
+    assert calls == [URL, URL]
+    cache.close()
+
+
+def test_expired_cache_entry_is_not_fresh(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_module, "extract_info", lambda url, opts=None: pytest.fail("extracted"))
+    cache = MetadataCache(str(tmp_path / "meta.sqlite3"))
+    # Signed stream URLs that already expired
+    cache.put(URL, make_info(expire=1))
+    session = open_session(URL, cache=cache)
+    assert not session.fresh
+    assert session.format_records
+    cache.close()
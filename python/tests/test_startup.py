@@ -0,0 +1,43 @@
+import io
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from PIL import Image
+
+from ytdl_engine.startup import StartupTimer, measure_requested
+
+
+def test_package_import_leaves_heavy_modules_unloaded():
+    code = ("import sys, ytdl_engine, ytdl_engine.engine, ytdl_engine.cli; "
+            "print(sorted(m for m in ('yt_dlp', 'requests', 'PIL') if m in sys.modules))")
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+    assert out.stdout.strip() == "[]"
+
+
+def test_startup_timer_keeps_first_mark(monkeypatch):
+    monkeypatch.delenv("YTDL_MEASURE_STARTUP", raising=False)
+    assert measure_requested(["app", "--measure-startup"])
+    assert not measure_requested(["app"])
+    timer = StartupTimer(10.0, enabled=True)
+    assert timer.mark("imports", at=10.25) == 250.0
+    assert timer.mark("imports", at=11.0) == 250.0
+    out = io.StringIO()
+    timer.report(out)
+    assert json.loads(out.getvalue())["startup_ms"] == {"imports": 250.0}
+
+
+def test_baked_spinner_keeps_frame_delays(tmp_path):
+    spinner = pytest.importorskip("ytdl_engine.spinner")
+    source = str(tmp_path / "source.gif")
+    frames = [Image.new("RGBA", (64, 64), color) for color in ("red", "green", "blue")]
+    frames[0].save(source, "GIF", save_all=True, append_images=frames[1:], duration=[40, 80, 120], loop=0)
+    target = spinner.bake_spinner(source, str(tmp_path / "baked" / "spinner-32.gif"))
+    assert spinner.gif_delays(target) == [40, 80, 120]
+    with Image.open(target) as baked:
+        assert baked.size == (32, 32) and baked.n_frames == 3
+    with pytest.raises(ValueError):
+        spinner.gif_delays(__file__)
@@ -0,0 +1,80 @@
+import os
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from ytdl_engine.bench.mediaserver import RangeRequestHandler
+from ytdl_engine.streammux import FRAGMENTED_MOVFLAGS, can_stream_mux, mux_command
+
+VIDEO = {"format_id": "248", "ext": "webm", "container": "webm_dash", "protocol": "https",
+         "url": "https://media.example.com/v", "vcodec": "vp9", "acodec": "none"}
+AUDIO = {"format_id": "140", "ext": "m4a", "container": "m4a_dash", "protocol": "https",
+         "url": "https://media.example.com/a", "vcodec": "none", "acodec": "mp4a.40.2"}
+
+
+def merged(*formats, **extra):
+    return {"ext": "mkv", "requested_formats": list(formats), **extra}
+
+
+@pytest.mark.skipif(os.name != "posix", reason="stream muxing needs pass_fds")
+def test_can_stream_mux():
+    params = {"stream_mux": True}
+    assert can_stream_mux(merged(VIDEO, AUDIO), params)
+    assert not can_stream_mux(merged(VIDEO, AUDIO), {})
+    assert not can_stream_mux(merged(VIDEO), params)
+    assert not can_stream_mux(merged(VIDEO, AUDIO, ext="flv"), params)
+    assert not can_stream_mux(merged(VIDEO, AUDIO, section_start=10), params)
+    # Progressive MP4 may keep its index at the end
+    assert not can_stream_mux(merged(VIDEO, dict(AUDIO, container=None, ext="mp4")), params)
+    assert not can_stream_mux(merged(VIDEO, dict(AUDIO, protocol="m3u8_native")), params)
+    dash = dict(AUDIO, protocol="http_dash_segments", url=None, fragments=[{"path": "seg1"}])
+    assert can_stream_mux(merged(VIDEO, dash), params)
+    assert not can_stream_mux(merged(VIDEO, dict(AUDIO, has_drm=True)), params)
+
+
+def test_mux_command():
+    cmd = mux_command("ffmpeg", [5, 7], [VIDEO, AUDIO], "mp4", "out.mp4", fragmented=True)
+    assert cmd[cmd.index("-i") + 1] == "pipe:5"
+    assert " ".join(cmd).endswith(f"-map 0:v:0? -map 1:a:0? -c copy -movflags {FRAGMENTED_MOVFLAGS} -f mp4 out.mp4")
+    cmd = mux_command("ffmpeg", [5, 7], [VIDEO, AUDIO], "mkv", "out.mkv", fragmented=True)
+    assert "-movflags" not in cmd and cmd[-3:] == ["-f", "matroska", "out.mkv"]
+
+
+class DroppingHandler(RangeRequestHandler):
+    # Every response breaks off after `limit` bytes, as a flaky connection would
+    limit = 64 * 1024
+
+    def copyfile(self, source, outputfile):
+        outputfile.write(source.read(min(self.limit, self.remaining)))
+        self.close_connection = True
+
+
+@pytest.fixture
+def flaky_server(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(DroppingHandler, directory=str(tmp_path)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_retries_reset_after_progress(flaky_server, tmp_path, monkeypatch):
+    import yt_dlp
+
+    from ytdl_engine import downloaders
+    from ytdl_engine.downloaders import StreamMuxFD
+
+    monkeypatch.setattr(downloaders.time, "sleep", lambda seconds: None)
+    data = os.urandom(5 * DroppingHandler.limit + 100)
+    (tmp_path / "stream.webm").write_bytes(data)
+    url = f"http://127.0.0.1:{flaky_server.server_port}/stream.webm"
+    # Reads smaller than what each response delivers, so every connection makes some progress
+    params = {"quiet": True, "retries": 1, "buffersize": 16 * 1024, "noresizebuffer": True}
+    with yt_dlp.YoutubeDL(params) as ydl:
+        fd = StreamMuxFD(ydl, ydl.params)
+        # Six drops in all, but never two in a row without progress
+        blocks = fd._http_blocks(url, {}, None, 0, [None], threading.Event())
+        assert b"".join(blocks) == data
@@ -0,0 +1,75 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from ytdl_engine.thumbnails import ThumbnailService
+
+
+def encode(size, fmt):
+    buf = BytesIO()
+    Image.new("RGB", size, "red").save(buf, fmt)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def server():
+    # Tests lower PIL's pixel limit rather than serve a really huge image as the bomb
+    bodies = {"/ok.jpg": encode((640, 360), "JPEG"), "/garbage.jpg": b"not an image",
+              "/bomb.png": encode((100, 100), "PNG")}
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            body = bodies.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}", hits
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = ThumbnailService(size=(160, 90), cache_dir=str(tmp_path / "thumbs"))
+    yield service
+    service.close()
+
+
+def test_fetch_resizes_and_caches(server, service, tmp_path):
+    base, hits = server
+    image = service.get(base + "/ok.jpg")
+    assert image.size == (160, 90)
+    assert service.get(base + "/ok.jpg") is image
+    assert hits == ["/ok.jpg"]
+    # A new service finds the resized copy on disk
+    again = ThumbnailService(size=(160, 90), cache_dir=str(tmp_path / "thumbs"))
+    assert again.get(base + "/ok.jpg").size == (160, 90)
+    again.close()
+    assert hits == ["/ok.jpg"]
+
+
+@pytest.mark.parametrize("path", ["/garbage.jpg", "/missing.jpg"])
+def test_bad_thumbnails_resolve_to_none(server, service, path):
+    base, _ = server
+    assert service.get(base + path) is None
+
+
+def test_decompression_bomb_resolves_to_none(server, service, monkeypatch):
+    base, _ = server
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    assert service.fetch(base + "/bomb.png").result(10) is None
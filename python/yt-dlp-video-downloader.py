@@ -1,34 +1,108 @@
+import time
+START = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk
-import requests
-import yt_dlp
-import threading
 import os
-import re
-from io import BytesIO
 
-def strip_ansi(text):
-    ansi_escape = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
-    return ansi_escape.sub('', text)
+from ytdl_engine import (BACKGROUND, CANCELLED, DONE, INTERACTIVE, DownloadEngine, FormatPolicy, JobJournal, MetadataCache,
+                         TkProgressTicker)
+from ytdl_engine.bandwidth import scheduler_from_env
+from ytdl_engine.metrics import metrics_from_env
+from ytdl_engine.progress import aggregate, format_sample
+from ytdl_engine.startup import StartupTimer
+from ytdl_engine.thumbnails import ThumbnailService
+
+IMPORTED = time.perf_counter()
+
+MAX_QUALITY = {"Best": None, "2160p": 2160, "1440p": 1440, "1080p": 1080, "720p": 720, "480p": 480, "360p": 360}
 
 class YTDL_GUI(tk.Tk):
     def __init__(self):
         super().__init__()
+        self.startup = StartupTimer(START)
+        self.startup.mark("imports", IMPORTED)
         self.title("Video Downloader")
         self.geometry("900x700")
         self.configure(bg="#1e1e1e")
 
+        self.ffmpeg_path = r"D:\Software Dependency (Installer)\ffmpeg-2025-03-31-git-35c091f4b7-essentials_build\bin"  # Replace this path with your actual ffmpeg location
+
         self.url = tk.StringVar()
         self.save_path = tk.StringVar(value=os.getcwd())
         self.format_map = {}
+        self.session = None
         self.selected_format = tk.StringVar()
+        self.max_quality = tk.StringVar(value="Best")
+        self.selection = None
         self.progress = tk.DoubleVar()
         self.status_text = tk.StringVar(value="Idle")
+        self.force_refresh = tk.BooleanVar(value=False)
+        self.turbo = tk.BooleanVar(value=False)
         self.thumbnail_image = None
+        self.batch_window = None
+        # DaemonLink to the background download service when one is running; the engine then only fetches info
+        self.daemon = None
+
+        self.engine = DownloadEngine(workers=3, cache=MetadataCache(), journal=JobJournal(), bandwidth=scheduler_from_env())
+        self.metrics, self.metrics_server = metrics_from_env(self.engine)
+        self.ticker = TkProgressTicker(self, self.engine.progress, self.render_progress, on_event=self.on_job_event)
+        self.engine.add_listener(self.ticker.post)
+        self.thumbnails = ThumbnailService(size=(360, 202), network=self.engine.network)
 
         self.create_widgets()
         self.set_dark_theme()
+        self.startup.mark("window")
+        # Anything not needed for the first frame waits until the window has been drawn
+        self.after_idle(self.finish_startup)
+
+    def finish_startup(self):
+        self.startup.mark("first_paint")
+        self.ticker.start()
+        self.connect_daemon()
+        if self.engine.resume_unfinished():
+            self.set_status("Resuming interrupted downloads...")
+        self.engine.warm_up().add_done_callback(lambda f: self.after(0, self.on_engine_ready))
+
+    def connect_daemon(self):
+        # Downloads go to the background service when one answers, so closing the window doesn't stop them
+        from ytdl_engine.daemon import DaemonLink, find_daemon
+
+        client = find_daemon()
+        if client is not None:
+            self.daemon = DaemonLink(client, self.engine.progress, self.ticker.post,
+                                     on_lost=lambda: self.after(0, self.on_daemon_lost))
+            self.set_status("Downloads run in the background service")
+
+    def on_daemon_lost(self):
+        self.daemon = None
+        self.set_status("Background service stopped; new downloads run in this window")
+
+    def send_to_daemon(self, method, *args, **kwargs):
+        # Calls the DaemonLink's submit/submit_playlist; False when there is no service (any more) and the
+        # download should run here
+        if self.daemon is None:
+            return False
+        try:
+            getattr(self.daemon, method)(*args, **kwargs)
+        except OSError:
+            self.daemon = None
+            return False
+        except RuntimeError as e:
+            messagebox.showerror("Download Service", f"The background service refused the download:\n{e}")
+        return True
+
+    def active_jobs(self):
+        jobs = self.engine.active_jobs()
+        if self.daemon is not None:
+            jobs += self.daemon.active_jobs()
+        return jobs
+
+    def on_engine_ready(self):
+        self.startup.mark("engine_ready")
+        if self.startup.enabled:
+            self.startup.report()
+            self.destroy()
 
     def set_dark_theme(self):
         style = ttk.Style(self)
@@ -48,6 +122,12 @@ class YTDL_GUI(tk.Tk):
 
         tk.Button(self, text="Fetch Available Formats", command=self.fetch_formats_threaded, font=("Segoe UI", 10),
                   bg="#3b82f6", fg="white", activebackground="#2563eb").pack(**pad)
+        tk.Button(self, text="Fetch Formats for Many Links...", command=self.open_batch, font=("Segoe UI", 10),
+                  bg="#3b82f6", fg="white", activebackground="#2563eb").pack(**pad)
+        tk.Button(self, text="Download Whole Playlist / Channel", command=self.download_playlist, font=("Segoe UI", 10),
+                  bg="#3b82f6", fg="white", activebackground="#2563eb").pack(**pad)
+        tk.Checkbutton(self, text="Ignore cached info", variable=self.force_refresh, bg="#1e1e1e", fg="white",
+                       selectcolor="#2d2d2d", activebackground="#1e1e1e").pack()
 
         self.thumbnail_label = tk.Label(self, bg="#1e1e1e")
         self.thumbnail_label.pack(pady=(10, 5))
@@ -56,10 +136,19 @@ class YTDL_GUI(tk.Tk):
         self.download_btn = tk.Button(self, text="Download Selected Format", command=self.download_threaded,
                                       font=("Segoe UI", 10), bg="#10b981", fg="white", activebackground="#059669")
         self.download_btn.pack(pady=10)
+        tk.Checkbutton(self, text="Turbo mode (parallel connections)", variable=self.turbo, bg="#1e1e1e", fg="white",
+                       selectcolor="#2d2d2d", activebackground="#1e1e1e").pack()
 
         tk.Label(self, text="Select Format:", bg="#1e1e1e", fg="white", font=("Segoe UI", 10)).pack(**pad)
         self.format_combo = ttk.Combobox(self, textvariable=self.selected_format, state="readonly", width=90)
         self.format_combo.pack(**pad)
+        quality_frame = tk.Frame(self, bg="#1e1e1e")
+        quality_frame.pack()
+        tk.Label(quality_frame, text="Auto-select up to:", bg="#1e1e1e", fg="white").pack(side=tk.LEFT, padx=5)
+        quality_combo = ttk.Combobox(quality_frame, textvariable=self.max_quality, values=list(MAX_QUALITY),
+                                     state="readonly", width=8)
+        quality_combo.pack(side=tk.LEFT)
+        quality_combo.bind("<<ComboboxSelected>>", lambda e: self.session and self.show_session(self.session))
 
         tk.Label(self, text="Save to Folder:", bg="#1e1e1e", fg="white", font=("Segoe UI", 10)).pack(**pad)
         path_frame = tk.Frame(self, bg="#1e1e1e")
@@ -84,117 +173,235 @@ class YTDL_GUI(tk.Tk):
             messagebox.showwarning("Input Error", "Please enter a video URL.")
             return
 
-        ydl_opts = {'quiet': True, 'skip_download': True}
+        self.engine.fetch_info(url, self.force_refresh.get()).add_done_callback(
+            lambda f: self.after(0, self.on_info_fetched, f))
+
+    def on_info_fetched(self, future):
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                self.show_thumbnail(info.get("thumbnail"))
-
-                formats = info.get("formats", [])
-                self.format_map.clear()
-                format_display_list = []
-
-                for f in formats:
-                    if f.get("vcodec") != "none" or f.get("acodec") != "none":
-                        f_id = f["format_id"]
-                        ext = f["ext"]
-                        res = f.get("resolution") or f.get("height") or "audio"
-                        fps = f.get("fps", "")
-                        abr = f.get("abr", "")
-                        filesize = f.get("filesize") or f.get("filesize_approx")
-                        size_mb = f"{round(filesize/1024/1024, 1)}MB" if filesize else "?"
-
-                        label = f"{f_id} | {res} | {ext} | {fps}fps | {abr}kbps | {size_mb}"
-                        self.format_map[label] = f_id
-                        format_display_list.append(label)
-
-                if format_display_list:
-                    self.format_combo['values'] = format_display_list
-                    self.format_combo.current(0)
-                    messagebox.showinfo("Formats Found", "Available formats loaded.")
-                else:
-                    messagebox.showwarning("No Formats", "No downloadable formats found.")
+            if self.show_session(future.result()):
+                messagebox.showinfo("Formats Found", "Available formats loaded.")
+            else:
+                messagebox.showwarning("No Formats", "No downloadable formats found.")
 
         except Exception as e:
             messagebox.showerror("Error", f"Failed to fetch formats:\n{e}")
 
-    def show_thumbnail(self, url):
-        try:
-            response = requests.get(url)
-            img_data = BytesIO(response.content)
-            image = Image.open(img_data)
-            image.thumbnail((360, 202))  # Smaller thumbnail
-            self.thumbnail_image = ImageTk.PhotoImage(image)
-            self.thumbnail_label.config(image=self.thumbnail_image)
-            self.update_idletasks()
-        except Exception:
+    def show_session(self, session):
+        self.session = session
+        self.url.set(session.url)
+        self.show_thumbnail(session.thumbnail, session.key)
+
+        self.format_map = dict(session.format_map)
+        self.format_combo['values'] = session.labels
+        # Preselect what the policy picks; the list stays open for choosing by hand
+        self.selection = session.select(self.policy())
+        if self.selection is not None:
+            self.selected_format.set(self.selection.formats[0].label)
+        elif session.labels:
+            self.format_combo.current(0)
+        else:
+            self.selected_format.set("")
+        return bool(session.labels)
+
+    def policy(self):
+        return FormatPolicy(max_height=MAX_QUALITY.get(self.max_quality.get()))
+
+    def open_batch(self):
+        if self.batch_window is None or not self.batch_window.winfo_exists():
+            self.batch_window = BatchWindow(self)
+        self.batch_window.lift()
+
+    def show_thumbnail(self, url, key=None):
+        self.thumbnails.fetch(url, key).add_done_callback(
+            lambda f: self.after(0, self.set_thumbnail, f.result()))
+
+    def set_thumbnail(self, image):
+        if image is None:
             self.thumbnail_label.config(image="", text="No thumbnail available")
+            return
+        from PIL import ImageTk
+
+        self.thumbnail_image = ImageTk.PhotoImage(image)
+        self.thumbnail_label.config(image=self.thumbnail_image)
+        self.update_idletasks()
 
     def download(self):
         url = self.url.get().strip()
         format_label = self.selected_format.get()
         format_id = self.format_map.get(format_label)
-        path = self.save_path.get().strip() or "."
+        path = os.path.abspath(self.save_path.get().strip() or ".")
 
-        ffmpeg_path = r"D:\Software Dependency (Installer)\ffmpeg-2025-03-31-git-35c091f4b7-essentials_build\bin"  # Replace this path with your actual ffmpeg location
+        if not url or not format_id:
+            messagebox.showwarning("Input Error", "Please select a format.")
+            return
 
-        if not os.path.exists(ffmpeg_path):
-            messagebox.showerror("FFmpeg Error", f"ffmpeg not found at:\n{ffmpeg_path}")
+        format_spec = None
+        if self.selection is not None and format_label == self.selection.formats[0].label:
+            # The automatic pick may pair the video with a specific audio stream
+            format_spec = self.selection.format_spec
+
+        self.progress.set(0)
+        if self.send_to_daemon("submit", url, format_id, path, format_spec, self.turbo.get(), priority="interactive"):
+            self.set_status("Queued in the background service")
             return
 
-        if not url or not format_id:
-            messagebox.showwarning("Input Error", "Please select a format.")
+        if not os.path.exists(self.ffmpeg_path):
+            messagebox.showerror("FFmpeg Error", f"ffmpeg not found at:\n{self.ffmpeg_path}")
             return
 
-        ydl_opts = {
-            'format': f'{format_id}+bestaudio/best',
-            'outtmpl': os.path.join(path, '%(title)s.%(ext)s'),
-            'quiet': True,
-            'progress_hooks': [self.hook],
-            'ffmpeg_location': ffmpeg_path,
-            'merge_output_format': 'mp4',
-        }
+        self.set_status("Starting download...")
+        self.engine.turbo = self.turbo.get()
+        # The download the user is watching gets bandwidth first; playlists and batches run in the background
+        self.engine.submit(url, format_id, path, self.ffmpeg_path, session=self.session, format_spec=format_spec,
+                           priority=INTERACTIVE)
 
-        try:
-            self.set_status("Starting download...")
-            self.progress.set(0)
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            self.set_status("Download complete.")
-            messagebox.showinfo("Done", "Download complete!")
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            self.set_status("Failed")
+    def download_playlist(self):
+        url = self.url.get().strip()
+        path = os.path.abspath(self.save_path.get().strip() or ".")
 
-    def hook(self, d):
-        if d['status'] == 'downloading':
-            percent_raw = d.get('_percent_str', '0.0%')
-            speed_raw = d.get('_speed_str', '0.0 KiB/s')
-            eta = d.get('_eta_str', '??')
+        if not url:
+            messagebox.showwarning("Input Error", "Please enter a playlist or channel URL.")
+            return
+
+        self.progress.set(0)
+        if self.send_to_daemon("submit_playlist", url, save_path=path, policy=self.policy().to_dict()):
+            self.set_status("Playlist queued in the background service")
+            return
 
-            percent_clean = strip_ansi(percent_raw).strip().replace('%', '')
-            speed_clean = strip_ansi(speed_raw)
+        if not os.path.exists(self.ffmpeg_path):
+            messagebox.showerror("FFmpeg Error", f"ffmpeg not found at:\n{self.ffmpeg_path}")
+            return
 
-            try:
-                self.progress.set(float(percent_clean))
-            except ValueError:
-                self.progress.set(0)
+        self.set_status("Listing playlist...")
+        self.engine.turbo = self.turbo.get()
+        self.engine.submit_playlist(url, save_path=path, ffmpeg_path=self.ffmpeg_path, policy=self.policy())
 
-            self.set_status(f"{percent_clean}% at {speed_clean} | ETA: {eta}")
+    def on_job_event(self, job):
+        if not job.finished:
+            return
+        # While a batch is still running, report per-job results in the status line only
+        if self.active_jobs():
+            self.set_status(f"{job.state.capitalize()}: {job.url}")
+        elif job.state == DONE:
+            self.set_status("Download complete.")
+            messagebox.showinfo("Done", "Download complete!")
+        elif job.state == CANCELLED:
+            self.set_status("Cancelled")
+        else:
+            messagebox.showerror("Error", str(job.error))
+            self.set_status("Failed")
 
-        elif d['status'] == 'finished':
-            self.progress.set(100)
-            self.set_status("Finalizing...")
+    def render_progress(self, snapshot):
+        sample = aggregate(snapshot.values())
+        if sample is None:
+            return
+        self.progress.set(100 if sample.status == "finished" else sample.percent)
+        prefix = f"{len(snapshot)} jobs | " if len(snapshot) > 1 else ""
+        self.set_status(prefix + format_sample(sample))
 
     def set_status(self, msg):
         self.status_text.set(msg)
         self.title(f"Video Downloader - {msg}")
 
     def fetch_formats_threaded(self):
-        threading.Thread(target=self.fetch_formats).start()
+        self.fetch_formats()
 
     def download_threaded(self):
-        threading.Thread(target=self.download).start()
+        self.download()
+
+class BatchWindow(tk.Toplevel):
+    # Paste many links, resolve them all in parallel and pick from a table that fills in as results arrive.
+    # Selecting a row loads that video into the main window's format list.
+    def __init__(self, app):
+        super().__init__(app, bg="#1e1e1e")
+        self.app = app
+        self.batch = None
+        self.sessions = {}
+        self.title("Fetch Formats for Many Links")
+        self.geometry("900x520")
+
+        tk.Label(self, text="One link per line:", bg="#1e1e1e", fg="white", font=("Segoe UI", 10)).pack(padx=10, pady=(10, 0), anchor="w")
+        self.links = tk.Text(self, height=7, bg="#2d2d2d", fg="white", insertbackground="white")
+        self.links.pack(fill=tk.X, padx=10, pady=6)
+
+        buttons = tk.Frame(self, bg="#1e1e1e")
+        buttons.pack(fill=tk.X, padx=10)
+        tk.Button(buttons, text="Fetch All", command=self.fetch_all, bg="#3b82f6", fg="white", activebackground="#2563eb").pack(side=tk.LEFT)
+        tk.Button(buttons, text="Stop", command=self.stop, bg="#333333", fg="white").pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="Download All (auto pick)", command=self.download_all, bg="#10b981", fg="white", activebackground="#059669").pack(side=tk.RIGHT)
+        self.summary = tk.StringVar(value="")
+        tk.Label(buttons, textvariable=self.summary, bg="#1e1e1e", fg="white").pack(side=tk.LEFT, padx=10)
+
+        columns = ("status", "title", "formats", "pick")
+        self.table = ttk.Treeview(self, columns=columns, show="headings", selectmode="browse")
+        for column, heading, width in zip(columns, ("Status", "Title / URL", "Formats", "Auto pick"), (90, 420, 70, 280)):
+            self.table.heading(column, text=heading)
+            self.table.column(column, width=width, stretch=column == "title")
+        self.table.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.table.bind("<<TreeviewSelect>>", self.on_select)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+    def fetch_all(self):
+        urls = [line.strip() for line in self.links.get("1.0", tk.END).splitlines() if line.strip()]
+        if not urls:
+            return
+        self.stop()
+        self.sessions = {}
+        self.table.delete(*self.table.get_children())
+        self.batch = batch = self.app.engine.prefetch(urls, lambda r: self.after(0, lambda: self.on_result(batch, r)),
+                                                      self.app.force_refresh.get())
+        for url in self.batch.urls:
+            self.table.insert("", tk.END, iid=url, values=("waiting", url, "", ""))
+        self.update_summary()
+
+    def on_result(self, batch, result):
+        # Late results from a batch that was stopped or replaced are ignored
+        if batch is not self.batch or not self.winfo_exists():
+            return
+        if result.ok:
+            session = result.session
+            self.sessions[result.url] = session
+            selection = session.select(self.app.policy())
+            self.table.item(result.url, values=("ready", session.title or result.url, len(session.labels),
+                                                " + ".join(f.label for f in selection.formats) if selection else "none"))
+        else:
+            self.table.item(result.url, values=("failed", result.url, "", str(result.error)[:200]))
+        self.update_summary()
+
+    def update_summary(self):
+        if self.batch is not None:
+            done = len(self.batch.results)
+            self.summary.set(f"{done}/{len(self.batch.urls)} resolved, {len(self.sessions)} ready")
+
+    def on_select(self, event=None):
+        selected = self.table.selection()
+        session = self.sessions.get(selected[0]) if selected else None
+        if session is not None:
+            self.app.show_session(session)
+
+    def download_all(self):
+        path = os.path.abspath(self.app.save_path.get().strip() or ".")
+        policy = self.app.policy()
+        # What the background service doesn't take runs here
+        local = [session for session in self.sessions.values()
+                 if not self.app.send_to_daemon("submit", session.url, save_path=path, turbo=self.app.turbo.get(),
+                                                policy=policy.to_dict(), priority="background")]
+        if local and not os.path.exists(self.app.ffmpeg_path):
+            messagebox.showerror("FFmpeg Error", f"ffmpeg not found at:\n{self.app.ffmpeg_path}", parent=self)
+            return
+        self.app.engine.turbo = self.app.turbo.get()
+        for session in local:
+            self.app.engine.submit(session.url, None, path, self.app.ffmpeg_path, session=session, policy=policy,
+                                   priority=BACKGROUND)
+        self.app.set_status(f"Queued {len(self.sessions)} downloads")
+
+    def stop(self):
+        if self.batch is not None:
+            self.batch.cancel()
+
+    def close(self):
+        self.stop()
+        self.destroy()
 
 if __name__ == "__main__":
     app = YTDL_GUI()
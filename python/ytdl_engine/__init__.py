@@ -0,0 +1,72 @@
+from .engine import (
+    CANCELLED,
+    DONE,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    SKIPPED,
+    DownloadCancelled,
+    DownloadEngine,
+    Job,
+)
+from .archive import DownloadArchive
+from .backends import Backend, BackendStats
+from .bandwidth import BACKGROUND, INTERACTIVE, NORMAL, BandwidthScheduler
+from .cache import MetadataCache, normalize_url
+from .concurrency import ConcurrencyController
+from .formats import Format, FormatPolicy, Selection, parse_formats, rank_formats, select_formats
+from .integrity import Manifest
+from .jobstore import JobStore
+from .journal import JobJournal
+from .network import SharedNetwork
+from .output import InsufficientSpace, OutputManager
+from .playlist import Playlist, iter_entries
+from .prefetch import BatchPrefetcher, PrefetchBatch, PrefetchResult
+from .progress import ProgressBus, ProgressSample, TkProgressTicker
+from .session import VideoSession, describe_formats, extract_info, open_session
+
+__all__ = [
+    "BACKGROUND",
+    "CANCELLED",
+    "DONE",
+    "FAILED",
+    "INTERACTIVE",
+    "NORMAL",
+    "QUEUED",
+    "RUNNING",
+    "SKIPPED",
+    "Backend",
+    "BackendStats",
+    "BandwidthScheduler",
+    "BatchPrefetcher",
+    "ConcurrencyController",
+    "DownloadArchive",
+    "DownloadCancelled",
+    "DownloadEngine",
+    "Format",
+    "FormatPolicy",
+    "InsufficientSpace",
+    "Job",
+    "JobJournal",
+    "JobStore",
+    "Manifest",
+    "MetadataCache",
+    "OutputManager",
+    "Playlist",
+    "PrefetchBatch",
+    "PrefetchResult",
+    "ProgressBus",
+    "ProgressSample",
+    "Selection",
+    "SharedNetwork",
+    "TkProgressTicker",
+    "VideoSession",
+    "describe_formats",
+    "extract_info",
+    "iter_entries",
+    "normalize_url",
+    "open_session",
+    "parse_formats",
+    "rank_formats",
+    "select_formats",
+]
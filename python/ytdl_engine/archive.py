@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from .cache import _YOUTUBE_ID
+from .paths import user_data_dir
+
+MEDIA_EXTS = {"mp4", "mkv", "webm", "mov", "m4a", "mp3", "opus", "ogg", "flac", "wav", "aac", "avi", "flv"}
+# yt-dlp's default output template ends in "[<id>]"; 11 characters is a YouTube video id
+_BRACKETED_ID = re.compile(r"\[([0-9A-Za-z_-]{11})\]$")
+HASH_BLOCK = 1024 * 1024
+
+_COLUMNS = ("key", "url", "title", "filename", "size", "sha256", "added")
+# A bare key (e.g. from an imported text archive) never overwrites what is already known about the file
+_UPSERT = (
+    "INSERT INTO entries (key, url, title, filename, size, sha256, added) VALUES (?, ?, ?, ?, ?, ?, ?)"
+    " ON CONFLICT(key) DO UPDATE SET url = COALESCE(excluded.url, url), title = COALESCE(excluded.title, title),"
+    " filename = COALESCE(excluded.filename, filename), size = COALESCE(excluded.size, size),"
+    " sha256 = COALESCE(excluded.sha256, sha256)")
+
+_extractor_classes = None
+
+
+def make_archive_id(extractor, video_id):
+    # Same keys as yt-dlp's --download-archive files, so those can be imported as they are
+    return f"{extractor.lower()} {video_id}"
+
+
+def info_archive_id(info):
+    # From an extracted info dict or a flat playlist entry
+    extractor = info.get("extractor_key") or info.get("ie_key")
+    video_id = info.get("id")
+    if not extractor or not video_id:
+        return None
+    return make_archive_id(extractor, video_id)
+
+
+def url_archive_id(url):
+    # The key for URLs whose extractor can tell the id without a request, else None
+    m = _YOUTUBE_ID.search(url)
+    if m:
+        return make_archive_id("Youtube", m.group(1))
+    global _extractor_classes
+    if _extractor_classes is None:
+        from yt_dlp.extractor import gen_extractor_classes
+
+        _extractor_classes = gen_extractor_classes()
+    for ie in _extractor_classes:
+        if ie.suitable(url):
+            temp_id = ie.get_temp_id(url)
+            return make_archive_id(ie.ie_key(), temp_id) if temp_id else None
+    return None
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DownloadArchive:
+    # Everything downloaded so far, keyed by extractor and video id ("youtube dQw4w9WgXcQ"). All keys are
+    # held in a set, so membership is O(1) even for hundreds of thousands of entries; SQLite keeps them
+    # with the file, its size and optionally its SHA-256. Also usable as yt-dlp's `download_archive`.
+
+    def __init__(self, path=None, hash_files=False):
+        self.path = path or os.path.join(user_data_dir(), "archive.sqlite3")
+        self.hash_files = hash_files
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " url TEXT,"
+            " title TEXT,"
+            " filename TEXT,"
+            " size INTEGER,"
+            " sha256 TEXT,"
+            " added REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_sha256 ON entries (sha256)")
+        self._db.commit()
+        self._keys = {row[0] for row in self._db.execute("SELECT key FROM entries")}
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        self.record(key)
+
+    def has_url(self, url):
+        key = url_archive_id(url)
+        return key is not None and key in self._keys
+
+    def has_info(self, info):
+        key = info_archive_id(info)
+        return key is not None and key in self._keys
+
+    def record(self, key, url=None, title=None, filename=None, size=None, sha256=None):
+        if filename and size is None and os.path.isfile(filename):
+            size = os.path.getsize(filename)
+        if filename and sha256 is None and self.hash_files and os.path.isfile(filename):
+            sha256 = file_sha256(filename)
+        self._add_many([(key, url, title, filename, size, sha256)])
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM entries WHERE key = ?", (key,)).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def find_hash(self, sha256):
+        # Keys whose file had exactly this content
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT key FROM entries WHERE sha256 = ?", (sha256,))]
+
+    def forget(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._db.commit()
+            self._keys.discard(key)
+
+    def import_archive_file(self, path):
+        # A yt-dlp --download-archive text file: one "extractor id" per line
+        with open(path, encoding="utf-8") as fh:
+            keys = [line.strip() for line in fh if line.strip()]
+        self._add_many([(key, None, None, None, None, None) for key in keys])
+        return len(keys)
+
+    def import_folder(self, folder, hash_files=None):
+        # Records media files under `folder` whose video is identifiable: by a yt-dlp .info.json next to
+        # the file, or an "[id]" at the end of the name. Returns (imported, unidentified file paths).
+        hash_files = self.hash_files if hash_files is None else hash_files
+        rows = []
+        unknown = []
+        for root, _, files in os.walk(folder):
+            names = set(files)
+            for name in sorted(files):
+                stem, ext = os.path.splitext(name)
+                if ext[1:].lower() not in MEDIA_EXTS:
+                    continue
+                path = os.path.join(root, name)
+                key, url, title = _identify(root, stem, names)
+                if key is None:
+                    unknown.append(path)
+                    continue
+                sha256 = file_sha256(path) if hash_files else None
+                rows.append((key, url, title, path, os.path.getsize(path), sha256))
+        self._add_many(rows)
+        return len(rows), unknown
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _add_many(self, rows):
+        now = time.time()
+        with self._lock:
+            self._db.executemany(_UPSERT, [row + (now,) for row in rows])
+            self._db.commit()
+            self._keys.update(row[0] for row in rows)
+
+
+def _identify(folder, stem, names):
+    info_name = stem + ".info.json"
+    if info_name in names:
+        try:
+            with open(os.path.join(folder, info_name), encoding="utf-8") as fh:
+                info = json.load(fh)
+        except (OSError, ValueError):
+            info = None
+        if isinstance(info, dict):
+            key = info_archive_id(info)
+            if key is not None:
+                return key, info.get("webpage_url"), info.get("title")
+    m = _BRACKETED_ID.search(stem)
+    if m:
+        return make_archive_id("Youtube", m.group(1)), None, stem[:m.start()].strip()
+    return None, None, None
+
+
+class ArchiveView:
+    # yt-dlp's `download_archive` for one job. Lookups go to the shared archive; the key yt-dlp would
+    # record is only noted on the job, which the engine records once post-processing succeeded too.
+
+    def __init__(self, archive, job):
+        self.archive = archive
+        self.job = job
+
+    def __contains__(self, key):
+        if key in self.archive:
+            self.job.archive_id = key
+            return True
+        return False
+
+    def __len__(self):
+        return len(self.archive)
+
+    def add(self, key):
+        self.job.archive_id = key
@@ -0,0 +1,327 @@
+import abc
+import importlib.util
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .archive import info_archive_id
+from .cache import _YOUTUBE_ID
+from .formats import FormatPolicy, parse_formats, select_formats
+from .paths import user_data_dir
+from .prefetch import host_key
+from .session import extract_info
+
+YTDLP = "yt-dlp"
+PYTUBE = "pytube"
+# Format selectors that ask for one file with both tracks, which pytube's progressive streams are
+PROGRESSIVE_SPECS = ("b", "best", "b[ext=mp4]", "best[ext=mp4]")
+# A backend needs this many good runs on a site before its numbers are trusted over the configured order
+MIN_SAMPLES = 3
+# Every Nth job of a site goes to the runner-up, so its numbers don't go stale
+EXPLORE_EVERY = 20
+# A backend that failed where another then succeeded goes to the back of the line for this long
+FAILURE_COOLDOWN = 3600.0
+# Download size that start-up latency and throughput are weighed against
+REFERENCE_BYTES = 50 * 1024 * 1024
+SMOOTHING = 0.3
+
+logger = logging.getLogger(__name__)
+
+
+class BackendError(Exception):
+    pass
+
+
+class Backend(abc.ABC):
+    # What the engine needs from an extraction/download library. extract() returns a yt-dlp style info
+    # dict, so parse_formats() and format policies work the same for every backend; download() reports
+    # through `hook` with yt-dlp style progress dicts and returns any post-processing it deferred.
+    name = None
+
+    def available(self):
+        return True
+
+    def supports(self, job):
+        # Cheap check before extraction: can this backend deliver what the job asks for
+        return True
+
+    def fallback_for(self, job):
+        # Whether it can deliver something short of what the job asks for (e.g. a lower-quality single file);
+        # such a backend is only tried once every one that supports the job has failed
+        return False
+
+    @abc.abstractmethod
+    def extract(self, url):
+        pass
+
+    def formats(self, url):
+        return parse_formats(self.extract(url))
+
+    @abc.abstractmethod
+    def download(self, job, hook):
+        pass
+
+
+class YtDlpBackend(Backend):
+    # The engine's own pipeline; `run(job)` is DownloadEngine._download, which reports through the hooks
+    # in the job's yt-dlp options rather than `hook`
+    name = YTDLP
+
+    def __init__(self, run=None, opts=None):
+        self.run = run
+        self.opts = opts
+
+    def extract(self, url):
+        return extract_info(url, self.opts)
+
+    def download(self, job, hook):
+        return self.run(job)
+
+
+class PytubeBackend(Backend):
+    # Single-file (progressive) YouTube downloads through pytube: no format negotiation, no merge, and a
+    # quicker start than yt-dlp's full extraction for simple jobs. Jobs that want a merge only come here as
+    # the last resort once every other backend failed, and get the best progressive stream instead.
+    name = PYTUBE
+
+    def available(self):
+        return importlib.util.find_spec("pytube") is not None
+
+    def supports(self, job):
+        # No audio extraction here: pytube only delivers the stream as it is
+        if not _YOUTUBE_ID.search(job.url) or job.audio_only:
+            return False
+        if job.policy is not None:
+            return not job.policy.allow_merge
+        return job.format_spec in PROGRESSIVE_SPECS or job.format_spec.isdigit()
+
+    def fallback_for(self, job):
+        return bool(_YOUTUBE_ID.search(job.url)) and not job.audio_only
+
+    def extract(self, url):
+        return self._info(self._open(url))
+
+    def download(self, job, hook):
+        state = {"began": time.time()}
+        yt = self._open(job.url, lambda stream, chunk, remaining: self._progress(hook, state, stream, remaining))
+        info = self._info(yt)
+        if not self.supports(job):
+            logger.warning("pytube has no merged formats; downloading the best single-file stream of %s", job.url)
+        stream = yt.streams.get_by_itag(int(self._choose(job, info)))
+        if stream is None or not stream.is_progressive:
+            raise BackendError(f"No progressive stream for format {job.format_spec!r}")
+        job.archive_id = job.archive_id or info_archive_id(info)
+        state["info"] = dict(info, **next(f for f in info["formats"] if f["format_id"] == str(stream.itag)))
+        state["info"]["__final_file"] = True
+        # pytube writes straight to the name it is given, which is therefore also what a cancel removes; with
+        # a staging folder that is where it goes, and the finished file is moved out like yt-dlp's
+        folder = job.staging_dir or job.save_path
+        state["filename"] = os.path.join(folder, stream.default_filename)
+        state["total"] = stream.filesize
+        filename = stream.download(output_path=folder)
+        hook({
+            "status": "finished",
+            "downloaded_bytes": state["total"],
+            "total_bytes": state["total"],
+            "filename": filename,
+            "elapsed": time.time() - state["began"],
+            "info_dict": state["info"],
+        })
+        if job.staging_dir:
+            os.makedirs(job.save_path, exist_ok=True)
+            os.replace(filename, os.path.join(job.save_path, os.path.basename(filename)))
+        return []
+
+    def _open(self, url, on_progress=None):
+        from pytube import YouTube
+
+        return YouTube(url, on_progress_callback=on_progress)
+
+    def _choose(self, job, info):
+        # The itag to download, picked by the same rules yt-dlp jobs use; a merge policy or selector gets the
+        # best progressive stream within its limits
+        formats = [f for f in parse_formats(info) if f.has_video and f.has_audio]
+        if job.format_spec.isdigit() and job.policy is None:
+            return job.format_spec
+        policy = FormatPolicy(allow_merge=False)
+        if job.policy is not None:
+            policy = FormatPolicy.from_dict(dict(job.policy.to_dict(), allow_merge=False))
+        if job.format_spec.endswith("[ext=mp4]"):
+            formats = [f for f in formats if f.ext == "mp4"]
+        selection = select_formats(formats, policy)
+        if selection is None:
+            raise BackendError("No progressive stream")
+        return selection.video.format_id
+
+    def _info(self, yt):
+        formats = []
+        for s in yt.streams:
+            # Only the size the stream data announced; Stream.filesize would send a HEAD request per stream
+            size = getattr(s, "_filesize", 0) or None
+            formats.append({
+                "format_id": str(s.itag),
+                "url": s.url,
+                "ext": s.subtype,
+                "height": int(s.resolution[:-1]) if s.includes_video_track and s.resolution else None,
+                "fps": s.fps if s.includes_video_track else None,
+                "vcodec": s.video_codec if s.includes_video_track else "none",
+                "acodec": s.audio_codec if s.includes_audio_track else "none",
+                "abr": float(s.abr[:-4]) if s.includes_audio_track and s.abr else None,
+                "tbr": s.bitrate / 1000 if s.bitrate else None,
+                "filesize": size,
+                "protocol": "https",
+            })
+        return {
+            "id": yt.video_id,
+            "title": yt.title,
+            "extractor_key": "Youtube",
+            "webpage_url": yt.watch_url,
+            "duration": yt.length,
+            "thumbnail": yt.thumbnail_url,
+            "uploader": yt.author,
+            "formats": formats,
+        }
+
+    def _progress(self, hook, state, stream, remaining):
+        total = state.get("total") or stream.filesize
+        downloaded = total - remaining
+        elapsed = max(0.001, time.time() - state["began"])
+        speed = downloaded / elapsed
+        hook({
+            "status": "downloading",
+            "downloaded_bytes": downloaded,
+            "total_bytes": total,
+            "filename": state["filename"],
+            "tmpfilename": state["filename"],
+            "speed": speed,
+            "eta": remaining / speed if speed else None,
+            "elapsed": elapsed,
+            "info_dict": state["info"],
+        })
+
+
+BACKENDS = {YTDLP: YtDlpBackend, PYTUBE: PytubeBackend}
+
+
+def make_backends(names, run, opts=None):
+    # Backend instances for `names`; libraries that aren't installed are left out
+    backends = []
+    for name in names or (YTDLP,):
+        backend = YtDlpBackend(run, opts) if name == YTDLP else BACKENDS[name]()
+        if backend.available():
+            backends.append(backend)
+        else:
+            logger.warning("Backend %s is not installed and will not be used.", name)
+    return backends or [YtDlpBackend(run, opts)]
+
+
+def parse_backends(text):
+    # "pytube,yt-dlp" -> ["pytube", "yt-dlp"]; the order is the preference until speeds are measured
+    names = [name.strip().lower() for name in (text or YTDLP).split(",") if name.strip()]
+    unknown = [name for name in names if name not in BACKENDS]
+    if unknown:
+        raise ValueError(f"Unknown backend {unknown[0]!r}, expected one of {', '.join(BACKENDS)}")
+    return names
+
+
+class _Score:
+    def __init__(self, latency=None, rate=None, samples=0, failures=0, failed=0.0):
+        self.latency = latency
+        self.rate = rate
+        self.samples = samples
+        self.failures = failures
+        self.failed = failed
+
+    def expected_seconds(self):
+        # Time to start plus time to move a typical download; unknown throughput counts as none
+        if self.latency is None:
+            return float("inf")
+        return self.latency + (REFERENCE_BYTES / self.rate if self.rate else float("inf"))
+
+
+class BackendStats:
+    # Per site and backend: smoothed time from job start to first byte (extraction included) and download
+    # throughput, plus failures that another backend then got past. Kept in SQLite so routing carries over.
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(user_data_dir(), "backends.sqlite3")
+        self.scores = {}
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS backends ("
+            " host TEXT NOT NULL,"
+            " backend TEXT NOT NULL,"
+            " latency REAL,"
+            " rate REAL,"
+            " samples INTEGER NOT NULL,"
+            " failures INTEGER NOT NULL,"
+            " failed REAL NOT NULL,"
+            " PRIMARY KEY (host, backend))")
+        self._db.commit()
+
+    def rank(self, url, names):
+        # `names` reordered quickest first. Backends short of MIN_SAMPLES keep the configured order ahead of
+        # measured ones, so each gets measured; recently failed ones go last.
+        with self._lock:
+            host = host_key(url)
+            now = time.time()
+            scores = {name: self._score(host, name) for name in names}
+            fresh = [n for n in names if now - scores[n].failed >= FAILURE_COOLDOWN]
+            failed = [n for n in names if n not in fresh]
+            unmeasured = [n for n in fresh if scores[n].samples < MIN_SAMPLES]
+            measured = sorted((n for n in fresh if n not in unmeasured), key=lambda n: scores[n].expected_seconds())
+            order = unmeasured + measured
+            count = self.jobs[host] = self.jobs.get(host, 0) + 1
+            if not unmeasured and len(order) > 1 and count % EXPLORE_EVERY == 0:
+                order[0], order[1] = order[1], order[0]
+            return order + failed
+
+    def record(self, url, name, latency, rate=None):
+        with self._lock:
+            host = host_key(url)
+            score = self._score(host, name)
+            score.latency = latency if score.latency is None else score.latency + SMOOTHING * (latency - score.latency)
+            if rate:
+                score.rate = rate if score.rate is None else score.rate + SMOOTHING * (rate - score.rate)
+            score.samples += 1
+            self._save(host, name, score)
+
+    def failure(self, url, name):
+        with self._lock:
+            host = host_key(url)
+            score = self._score(host, name)
+            score.failures += 1
+            score.failed = time.time()
+            self._save(host, name, score)
+
+    def stats(self):
+        # {host: {backend: figures}} for the sites seen since start-up
+        result = {}
+        with self._lock:
+            for (host, name), s in self.scores.items():
+                result.setdefault(host, {})[name] = {"latency": s.latency, "rate": s.rate, "samples": s.samples,
+                                                     "failures": s.failures}
+        return result
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _score(self, host, name):
+        score = self.scores.get((host, name))
+        if score is None:
+            row = self._db.execute("SELECT latency, rate, samples, failures, failed FROM backends"
+                                   " WHERE host = ? AND backend = ?", (host, name)).fetchone()
+            score = self.scores[(host, name)] = _Score(*row) if row else _Score()
+        return score
+
+    def _save(self, host, name, score):
+        self._db.execute("INSERT OR REPLACE INTO backends (host, backend, latency, rate, samples, failures, failed)"
+                         " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (host, name, score.latency, score.rate, score.samples, score.failures, score.failed))
+        self._db.commit()
@@ -0,0 +1,236 @@
+import logging
+import os
+import threading
+import time
+
+from .formats import parse_size
+
+logger = logging.getLogger(__name__)
+
+# Job priorities: a class only gets the bandwidth the classes above it leave unused
+BACKGROUND = 0
+NORMAL = 1
+INTERACTIVE = 2
+
+# How often shares are recomputed from what each job actually moved
+ALLOCATE_INTERVAL = 0.5
+# Bucket depth in seconds of a job's share; bounds the burst after an idle spell
+BURST_SECONDS = 0.5
+# Longest single sleep, so cancels and schedule changes are noticed promptly
+MAX_WAIT = 0.5
+# Even a fully preempted job keeps this trickle, so its server connection doesn't time out
+MIN_FLOW_RATE = 16 * 1024
+# A job idle for this long no longer counts as competing for bandwidth
+IDLE_SECONDS = 2.0
+# Read size for yt-dlp's HTTP downloader while a limit is set; its default grows to 4 MiB per read,
+# which would turn throttling into second-long stalls
+THROTTLE_BLOCK = 64 * 1024
+
+
+PRIORITIES = {"background": BACKGROUND, "normal": NORMAL, "interactive": INTERACTIVE}
+
+
+def parse_priority(value):
+    if isinstance(value, int):
+        return value
+    try:
+        return PRIORITIES[str(value).strip().lower()]
+    except KeyError:
+        raise ValueError(f"Unknown priority {value!r}, expected one of {', '.join(PRIORITIES)}") from None
+
+
+def parse_rate(text):
+    # "2M" -> 2097152 bytes/s; "off", "unlimited" or "" -> None
+    if text is None or isinstance(text, (int, float)):
+        return text
+    text = str(text).strip().lower()
+    if text in ("", "off", "none", "unlimited", "inf"):
+        return None
+    return parse_size(text[:-2] if text.endswith("/s") else text)
+
+
+def parse_schedule(text):
+    # "08:00-18:00=1M,22:00-06:00=off" -> [(start_minute, end_minute, rate)]; windows may wrap midnight
+    profile = []
+    for part in (text or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            window, rate = part.split("=", 1)
+            start, end = (_minute(t) for t in window.split("-", 1))
+        except ValueError:
+            raise ValueError(f"Invalid schedule entry {part!r}, expected HH:MM-HH:MM=RATE") from None
+        profile.append((start, end, parse_rate(rate)))
+    return profile
+
+
+def _minute(text):
+    hours, minutes = text.strip().split(":")
+    value = int(hours) * 60 + int(minutes)
+    if not 0 <= value <= 24 * 60:
+        raise ValueError(text)
+    return value
+
+
+class Flow:
+    # One job's view of the scheduler. Shared by every thread downloading for that job (fragments, ranges).
+
+    def __init__(self, key, priority=NORMAL, weight=1.0, cancel_event=None):
+        self.key = key
+        self.priority = priority
+        self.weight = max(0.01, float(weight))
+        self.cancel_event = cancel_event or threading.Event()
+        self.bytes = 0
+        self.target = None
+        self.achieved = 0.0
+        self.tokens = 0.0
+        self.refilled = time.monotonic()
+        self.window_bytes = 0
+        self.throttled_at = 0.0
+        self.active_at = time.monotonic()
+
+    def __repr__(self):
+        return f"<Flow {self.key} prio={self.priority} target={self.target} achieved={self.achieved:.0f}>"
+
+
+class BandwidthScheduler:
+    # Shares one download rate between all running jobs. Every job gets its own token bucket; every
+    # ALLOCATE_INTERVAL the global rate is split again by priority class (highest first) and, within a
+    # class, by weight, with jobs that used less than their share giving the rest back (max-min fairness).
+    # Unused bandwidth therefore flows to lower priorities, while an interactive job that can use
+    # everything takes it from background ones. The rate comes from `rate` or, when a time-of-day
+    # `profile` window matches, from that window; None means unlimited.
+
+    def __init__(self, rate=None, profile=None):
+        self.rate = parse_rate(rate)
+        self.profile = list(profile or [])
+        self.flows = {}
+        self._lock = threading.Lock()
+        self._allocated = time.monotonic()
+        self._reallocate = True
+
+    def set_limits(self, rate=None, profile=None):
+        # Takes effect on the next allocation pass, for running jobs too
+        with self._lock:
+            self.rate = parse_rate(rate)
+            self.profile = list(profile or [])
+            self._reallocate = True
+
+    @property
+    def limited(self):
+        return self.rate is not None or bool(self.profile)
+
+    def rate_now(self, now=None):
+        if self.profile:
+            t = time.localtime(now)
+            minute = t.tm_hour * 60 + t.tm_min
+            for start, end, rate in self.profile:
+                if start <= end and start <= minute < end or start > end and (minute >= start or minute < end):
+                    return rate
+        return self.rate
+
+    def register(self, key, priority=NORMAL, weight=1.0, cancel_event=None):
+        flow = Flow(key, priority, weight, cancel_event)
+        with self._lock:
+            self.flows[key] = flow
+            self._reallocate = True
+        return flow
+
+    def unregister(self, flow):
+        with self._lock:
+            if self.flows.get(flow.key) is flow:
+                del self.flows[flow.key]
+                self._reallocate = True
+
+    def consume(self, flow, nbytes):
+        # Called after `nbytes` arrived for `flow`; sleeps the calling download thread while the job is
+        # over its share, which backs the TCP connection off the same way yt-dlp's own ratelimit does
+        if nbytes <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            flow.bytes += nbytes
+            flow.window_bytes += nbytes
+            flow.active_at = now
+            self._maybe_allocate(now)
+            if flow.target is None:
+                return
+            self._refill(flow, now)
+            flow.tokens -= nbytes
+        while not flow.cancel_event.is_set():
+            with self._lock:
+                now = time.monotonic()
+                self._maybe_allocate(now)
+                if flow.target is None:
+                    return
+                self._refill(flow, now)
+                if flow.tokens >= 0:
+                    return
+                flow.throttled_at = now
+                wait = -flow.tokens / flow.target if flow.target > 0 else MAX_WAIT
+            flow.cancel_event.wait(min(wait, MAX_WAIT))
+
+    def stats(self):
+        with self._lock:
+            self._maybe_allocate(time.monotonic())
+            return {
+                "rate": self.rate_now(),
+                "achieved": sum(f.achieved for f in self.flows.values()),
+                "jobs": {key: {"priority": f.priority, "weight": f.weight, "target": f.target,
+                               "achieved": f.achieved} for key, f in self.flows.items()},
+            }
+
+    def _refill(self, flow, now):
+        elapsed = now - flow.refilled
+        flow.refilled = now
+        flow.tokens = min(flow.target * BURST_SECONDS, flow.tokens + flow.target * elapsed)
+
+    def _maybe_allocate(self, now):
+        elapsed = now - self._allocated
+        if elapsed < ALLOCATE_INTERVAL and not self._reallocate:
+            return
+        self._reallocate = False
+        # A job starting or ending forces an early pass; rates are only re-measured over a full window
+        if elapsed >= ALLOCATE_INTERVAL:
+            self._allocated = now
+            for flow in self.flows.values():
+                rate = flow.window_bytes / elapsed
+                flow.achieved = rate if not flow.achieved else 0.5 * (rate + flow.achieved)
+                flow.window_bytes = 0
+        rate = self.rate_now()
+        if rate is None:
+            for flow in self.flows.values():
+                flow.target = None
+            return
+        active = [f for f in self.flows.values() if now - f.active_at < IDLE_SECONDS]
+        for flow in self.flows.values():
+            if flow not in active:
+                flow.target = MIN_FLOW_RATE if rate else 0.0
+        if not active:
+            return
+        floor = min(MIN_FLOW_RATE, rate / len(active))
+        remaining = rate - floor * len(active)
+        for priority in sorted({f.priority for f in active}, reverse=True):
+            group = [f for f in active if f.priority == priority]
+            # Jobs held back by their bucket want more than they got; the others want what they moved
+            demand = {f.key: float("inf") if now - f.throttled_at < ALLOCATE_INTERVAL * 2 or f.target is None
+                      else f.achieved * 1.25 for f in group}
+            weight = sum(f.weight for f in group)
+            for flow in sorted(group, key=lambda f: (demand[f.key] / f.weight, f.key)):
+                share = remaining * flow.weight / weight if weight else 0.0
+                give = min(share, max(0.0, demand[flow.key] - floor))
+                flow.target = floor + give
+                remaining -= give
+                weight -= flow.weight
+
+
+def scheduler_from_env():
+    # Opt-in for the GUIs: YTDL_RATE_LIMIT caps all downloads together (e.g. "4M" bytes/s) and
+    # YTDL_RATE_SCHEDULE sets time-of-day windows (e.g. "08:00-18:00=1M,22:00-06:00=off")
+    try:
+        return BandwidthScheduler(os.environ.get("YTDL_RATE_LIMIT"),
+                                  parse_schedule(os.environ.get("YTDL_RATE_SCHEDULE")))
+    except ValueError as e:
+        logger.warning("Bandwidth limit disabled: %s", e)
+        return BandwidthScheduler()
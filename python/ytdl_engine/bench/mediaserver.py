@@ -0,0 +1,188 @@
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from ..paths import user_cache_dir
+
+# Bump when the generated media changes so cached assets get rebuilt
+ASSET_VERSION = 1
+COPY_BLOCK = 256 * 1024
+
+CONTENT_TYPES = {
+    ".mpd": "application/dash+xml",
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".m4s": "video/iso.segment",
+    ".ts": "video/mp2t",
+    ".mp4": "video/mp4",
+    ".jpg": "image/jpeg",
+}
+
+ASSETS = {
+    "progressive": "progressive.mp4",
+    "dash": "dash/manifest.mpd",
+    "hls": "hls/index.m3u8",
+    "thumbnail": "thumb.jpg",
+}
+
+
+def find_ffmpeg(ffmpeg_path=None):
+    if ffmpeg_path and os.path.isdir(ffmpeg_path):
+        ffmpeg_path = os.path.join(ffmpeg_path, "ffmpeg.exe" if os.name == "nt" else "ffmpeg")
+    if ffmpeg_path:
+        return ffmpeg_path if os.path.isfile(ffmpeg_path) else None
+    return shutil.which("ffmpeg")
+
+
+def build_assets(ffmpeg, root=None, clip_seconds=10, progressive_mb=64):
+    # Synthetic test media, generated once per parameter set: an H.264/AAC clip with 2 s GOPs, a progressive
+    # MP4 made by looping it, DASH (separate video/audio) and HLS (muxed fMP4) renditions of it, and a thumbnail
+    root = root or user_cache_dir("bench", f"v{ASSET_VERSION}-{clip_seconds}s-{progressive_mb}mb")
+    marker = os.path.join(root, ".complete")
+    if os.path.exists(marker):
+        return root
+
+    def run(*args):
+        subprocess.run([ffmpeg, "-v", "error", "-y", *args], check=True, cwd=root)
+
+    os.makedirs(os.path.join(root, "dash"), exist_ok=True)
+    os.makedirs(os.path.join(root, "hls"), exist_ok=True)
+    run("-f", "lavfi", "-i", f"testsrc2=size=640x360:rate=25:duration={clip_seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={clip_seconds}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-g", "50", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "128k", "-shortest", "clip.mp4")
+    loops = max(1, -(-progressive_mb * 1024 * 1024 // os.path.getsize(os.path.join(root, "clip.mp4"))))
+    run("-stream_loop", str(loops - 1), "-i", "clip.mp4", "-c", "copy", "-movflags", "+faststart",
+        ASSETS["progressive"])
+    run("-i", "clip.mp4", "-map", "0:v", "-map", "0:a", "-c", "copy", "-f", "dash", "-seg_duration", "2",
+        "-use_template", "1", "-use_timeline", "0", ASSETS["dash"])
+    run("-i", "clip.mp4", "-c", "copy", "-f", "hls", "-hls_time", "2", "-hls_playlist_type", "vod",
+        "-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", "init.mp4",
+        "-hls_segment_filename", "hls/seg%03d.m4s", ASSETS["hls"])
+    run("-ss", "1", "-i", "clip.mp4", "-frames:v", "1", "-vf", "scale=1280:720", ASSETS["thumbnail"])
+    with open(marker, "w", encoding="utf-8") as fh:
+        fh.write(str(time.time()))
+    return root
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    # Static files with single byte-range support, which the turbo downloader and yt-dlp's resume rely on
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def guess_type(self, path):
+        return CONTENT_TYPES.get(os.path.splitext(path)[1].lower()) or super().guess_type(path)
+
+    def send_head(self):
+        self.remaining = None
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404, "File not found")
+            return None
+        size = os.path.getsize(path)
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", "").strip())
+        fh = open(path, "rb")
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start, end = max(0, size - int(match.group(2))), size - 1
+            if start >= size or start > end:
+                fh.close()
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            fh.seek(start)
+            self.remaining = end - start + 1
+        else:
+            self.send_response(200)
+            self.remaining = size
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(self.remaining))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        return fh
+
+    def copyfile(self, source, outputfile):
+        remaining = self.remaining
+        while remaining:
+            block = source.read(min(COPY_BLOCK, remaining))
+            if not block:
+                break
+            outputfile.write(block)
+            remaining -= len(block)
+
+
+def serve(root, port=0, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), partial(RangeRequestHandler, directory=root))
+    server.daemon_threads = True
+    print(f"PORT {server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class MediaServer:
+    # Runs serve() in a child process so the server's CPU and memory don't count against the client
+
+    def __init__(self, root):
+        self.root = root
+        self.port = None
+        self._proc = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        package_parent = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(p for p in (package_parent, env.get("PYTHONPATH")) if p)
+        self._proc = subprocess.Popen([sys.executable, "-m", "ytdl_engine.bench.mediaserver", self.root],
+                                      stdout=subprocess.PIPE, env=env, text=True)
+        line = self._proc.stdout.readline()
+        if not line.startswith("PORT "):
+            self.stop()
+            raise RuntimeError("Benchmark media server failed to start")
+        self.port = int(line.split()[1])
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.port}/{ASSETS.get(name, name)}"
+
+    def stop(self):
+        if self._proc is None:
+            return
+        self._proc.terminate()
+        try:
+            self._proc.wait(5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+        self._proc.stdout.close()
+        self._proc = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a folder over HTTP with byte-range support.")
+    parser.add_argument("root")
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+    serve(args.root, args.port)
@@ -0,0 +1,316 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from ..cache import MetadataCache
+from ..engine import DONE, DownloadEngine
+from ..thumbnails import ThumbnailService
+from .mediaserver import MediaServer, build_assets, find_ffmpeg
+
+# Never touch the network beyond the local server, even when proxy variables are set
+OFFLINE_OPTS = {"proxy": "", "socket_timeout": 15}
+
+DOWNLOAD_CASES = [
+    # name, asset, format spec, turbo
+    ("progressive", "progressive", "best", False),
+    ("progressive_turbo", "progressive", "best", True),
+    ("hls", "hls", "best", False),
+    ("hls_turbo", "hls", "best", True),
+    ("dash_merge", "dash", "bestvideo+bestaudio/best", False),
+]
+
+
+class HookTimingEngine(DownloadEngine):
+    # Times the engine's progress hook, i.e. the bookkeeping done for every chunk yt-dlp reports
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._hook_lock = threading.Lock()
+        self.reset_hook_stats()
+
+    def reset_hook_stats(self):
+        with self._hook_lock:
+            self.hook_calls = 0
+            self.hook_seconds = 0.0
+
+    def _hook(self, job, d):
+        began = time.perf_counter()
+        try:
+            super()._hook(job, d)
+        finally:
+            elapsed = time.perf_counter() - began
+            with self._hook_lock:
+                self.hook_calls += 1
+                self.hook_seconds += elapsed
+
+
+def peak_rss():
+    # Peak resident set size of this process in bytes. Child figures are left out: a forked child
+    # starts out charged with the parent's RSS, so they say little about ffmpeg itself.
+    try:
+        import resource
+    except ImportError:
+        return _windows_peak_rss()
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _windows_peak_rss():
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+    except (OSError, AttributeError):
+        return None
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "median": statistics.median(values),
+        "min": min(values),
+        "max": max(values),
+        "runs": len(values),
+    }
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def environment():
+    try:
+        from yt_dlp.version import __version__ as yt_dlp_version
+    except ImportError:
+        yt_dlp_version = None
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "yt_dlp": yt_dlp_version,
+    }
+
+
+def bench_metadata(engine, server, repeat, workdir):
+    # Same path as the GUIs' fetch_formats(): engine.fetch_info() -> generic extractor -> VideoSession
+    results = {}
+    cache = MetadataCache(os.path.join(workdir, "metadata.sqlite"))
+    engine.cache = cache
+    try:
+        for name in ("progressive", "dash", "hls"):
+            url = server.url(name)
+            cold = []
+            for _ in range(repeat):
+                began = time.perf_counter()
+                session = engine.fetch_info(url, force_refresh=True).result()
+                cold.append(time.perf_counter() - began)
+            cached = []
+            for _ in range(repeat):
+                began = time.perf_counter()
+                engine.fetch_info(url).result()
+                cached.append(time.perf_counter() - began)
+            results[name] = {
+                "extract_s": summarize(cold),
+                "cached_s": summarize(cached),
+                "formats": len(session.formats),
+            }
+    finally:
+        engine.cache = None
+        cache.close()
+    return results
+
+
+def bench_downloads(engine, server, repeat, workdir, ffmpeg, cases=None):
+    # Same path as the GUIs' download(): engine.submit() -> yt-dlp (turbo FD when enabled) -> merge pool
+    results = {}
+    for name, asset, format_spec, turbo in DOWNLOAD_CASES:
+        if cases and name not in cases:
+            continue
+        runs = []
+        error = None
+        for i in range(repeat):
+            out_dir = os.path.join(workdir, f"{name}-{i}")
+            os.makedirs(out_dir)
+            engine.reset_hook_stats()
+            began = time.perf_counter()
+            job = engine.submit(server.url(asset), save_path=out_dir, ffmpeg_path=ffmpeg,
+                                format_spec=format_spec, turbo=turbo)
+            job.wait()
+            wall = time.perf_counter() - began
+            if job.state != DONE:
+                error = f"{type(job.error).__name__}: {job.error}" if job.error else job.state
+                break
+            size = sum(os.path.getsize(os.path.join(out_dir, f)) for f in os.listdir(out_dir))
+            download_s = job.timings.get("download") or wall
+            runs.append({
+                "wall_s": wall,
+                "download_s": download_s,
+                "merge_s": job.timings.get("merge"),
+                "bytes": size,
+                "throughput_mbps": size / download_s / (1024 * 1024) if download_s else None,
+                "hook_calls": engine.hook_calls,
+                "hook_us_per_call": engine.hook_seconds / engine.hook_calls * 1e6 if engine.hook_calls else None,
+            })
+            shutil.rmtree(out_dir, ignore_errors=True)
+        result = {"error": error}
+        if runs:
+            result.update({
+                "bytes": runs[0]["bytes"],
+                "wall_s": summarize([r["wall_s"] for r in runs]),
+                "download_s": summarize([r["download_s"] for r in runs]),
+                "throughput_mbps": summarize([r["throughput_mbps"] for r in runs if r["throughput_mbps"]]),
+                "merge_s": summarize([r["merge_s"] for r in runs if r["merge_s"] is not None]),
+                "hook_calls": runs[0]["hook_calls"],
+                "hook_us_per_call": summarize([r["hook_us_per_call"] for r in runs if r["hook_us_per_call"]]),
+            })
+        results[name] = result
+    return results
+
+
+def bench_thumbnails(server, repeat, workdir):
+    url = server.url("thumbnail")
+    cache_dir = os.path.join(workdir, "thumbnails")
+    cold, disk, memory = [], [], []
+    for i in range(repeat):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        service = ThumbnailService(cache_dir=cache_dir, workers=1)
+        began = time.perf_counter()
+        service.get(url, f"bench-{i}")
+        cold.append(time.perf_counter() - began)
+        began = time.perf_counter()
+        service.get(url, f"bench-{i}")
+        memory.append(time.perf_counter() - began)
+        service.close()
+        # A new service has an empty memory cache, so this one is served from the resized JPEG on disk
+        service = ThumbnailService(cache_dir=cache_dir, workers=1)
+        began = time.perf_counter()
+        service.get(url, f"bench-{i}")
+        disk.append(time.perf_counter() - began)
+        service.close()
+    return {"cold_s": summarize(cold), "disk_s": summarize(disk), "memory_s": summarize(memory)}
+
+
+def run_suite(repeat=3, ffmpeg=None, progressive_mb=64, cases=None, keep_workdir=False):
+    ffmpeg = find_ffmpeg(ffmpeg)
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg is required to build the benchmark media and to merge DASH downloads")
+    began = time.perf_counter()
+    root = build_assets(ffmpeg, progressive_mb=progressive_mb)
+    assets_s = time.perf_counter() - began
+
+    workdir = tempfile.mkdtemp(prefix="ytdl-bench-")
+    engine = HookTimingEngine(workers=1, ffmpeg_path=ffmpeg, ydl_opts=OFFLINE_OPTS, postprocess_workers=1)
+    try:
+        with MediaServer(root) as server:
+            began = time.perf_counter()
+            engine.warm_up().result()
+            results = {
+                "environment": environment(),
+                "config": {"repeat": repeat, "progressive_mb": progressive_mb, "assets": root},
+                "setup": {"assets_s": assets_s, "engine_warm_up_s": time.perf_counter() - began},
+                "metadata": bench_metadata(engine, server, repeat, workdir),
+                "downloads": bench_downloads(engine, server, repeat, workdir, ffmpeg, cases),
+                "thumbnails": bench_thumbnails(server, repeat, workdir),
+            }
+    finally:
+        engine.shutdown()
+        if not keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    results["peak_rss_bytes"] = peak_rss()
+    return results
+
+
+def flatten(data, prefix=""):
+    items = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            items.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[name] = value
+    return items
+
+
+def compare(baseline, current):
+    # (metric, baseline, current, relative change) for every numeric value present in both runs
+    old, new = flatten(baseline), flatten(current)
+    rows = []
+    for key in sorted(old.keys() & new.keys()):
+        if key.startswith(("environment.", "config.")) or key.endswith(".runs"):
+            continue
+        change = (new[key] - old[key]) / old[key] if old[key] else None
+        rows.append((key, old[key], new[key], change))
+    return rows
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ytdl_engine.bench",
+                                     description="Offline benchmarks against a local media server.")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="runs per measurement (default: 3)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="JSON file to write (default: bench-results/<commit>-<time>.json)")
+    parser.add_argument("--compare", metavar="BASELINE", default=None,
+                        help="earlier results JSON to print changes against")
+    parser.add_argument("--case", action="append", dest="cases",
+                        choices=[case[0] for case in DOWNLOAD_CASES], help="only run these download cases")
+    parser.add_argument("--progressive-mb", type=int, default=64, help="size of the progressive MP4 (default: 64)")
+    parser.add_argument("--ffmpeg", default=None, help="path to ffmpeg binary or its folder")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary download folder")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        results = run_suite(max(1, args.repeat), args.ffmpeg, args.progressive_mb, args.cases, args.keep)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    output = args.output
+    if output is None:
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        output = os.path.join("bench-results", f"{results['environment']['commit'] or 'nogit'}-{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2, sort_keys=True)
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    print(f"\nSaved to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        for key, old, new, change in compare(baseline, results):
+            delta = f"{change:+.1%}" if change is not None else "n/a"
+            print(f"{key:60} {old:>14.6g} {new:>14.6g} {delta:>9}")
+
+    failed = [name for name, r in results["downloads"].items() if r.get("error")]
+    return 1 if failed else 0
@@ -0,0 +1,129 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+from .paths import user_cache_dir
+
+DEFAULT_TTL = 6 * 3600
+DEFAULT_MAX_STALE = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+EXPIRY_MARGIN = 300
+
+_YOUTUBE_ID = re.compile(
+    r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)([0-9A-Za-z_-]{11})')
+_EXPIRY_PARAMS = ("expire", "expires", "Expires", "exp")
+
+
+def normalize_url(url):
+    url = url.strip()
+    m = _YOUTUBE_ID.search(url)
+    if m:
+        return f"youtube:{m.group(1)}"
+    parts = urlsplit(url)
+    query = "&".join(sorted(q for q in parts.query.split("&") if q))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+
+
+def stream_expiry(info):
+    # Earliest expiry timestamp advertised by the signed stream URLs, if any
+    earliest = None
+    for f in info.get("formats") or []:
+        url = f.get("url") or ""
+        if "?" not in url:
+            continue
+        params = parse_qs(urlsplit(url).query)
+        for name in _EXPIRY_PARAMS:
+            value = params.get(name)
+            if value and value[0].isdigit():
+                ts = int(value[0])
+                if earliest is None or ts < earliest:
+                    earliest = ts
+                break
+    return earliest
+
+
+class MetadataCache:
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_stale=DEFAULT_MAX_STALE, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path or os.path.join(user_cache_dir(), "metadata.sqlite3")
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " url TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " expires REAL NOT NULL,"
+            " last_access REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+        self._db.commit()
+
+    def get(self, url):
+        # Returns (info, fresh) or None; stale entries are still usable for the format list
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT data, created, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            data, created, expires = row
+            if now - created > self.max_stale:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return json.loads(data), now < expires
+
+    def put(self, url, info):
+        key = normalize_url(url)
+        data = json.dumps(info, separators=(",", ":"), default=str)
+        now = time.time()
+        expires = now + self.ttl
+        signed = stream_expiry(info)
+        if signed is not None:
+            expires = min(expires, signed - EXPIRY_MARGIN)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, url, data, size, created, expires, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, url, data, len(data), now, expires, now))
+            self._evict()
+            self._db.commit()
+
+    def invalidate(self, url):
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (normalize_url(url),))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+            self._db.commit()
+
+    def total_bytes(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
@@ -0,0 +1,379 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+from .archive import DownloadArchive
+from .backends import BackendStats, parse_backends
+from .engine import DONE, SKIPPED, DownloadEngine
+from .journal import JobJournal
+from .bandwidth import PRIORITIES, BandwidthScheduler, parse_priority, parse_schedule
+from .cache import MetadataCache
+from .concurrency import DEFAULT_MAX_JOBS, ConcurrencyController
+from .formats import FormatPolicy
+from .integrity import OK, Manifest, verify
+from .jobstore import JobStore
+from .metrics import MetricsRecorder, MetricsServer
+from .network import DNS_TTL, SharedNetwork
+from .output import DEFAULT_MIN_FREE, OutputManager
+from .postprocess import AUDIO_FORMATS
+from .prefetch import DEFAULT_PER_HOST, DEFAULT_WORKERS, BatchPrefetcher
+from .segmented import DEFAULT_CONNECTIONS, DEFAULT_FRAGMENTS
+
+
+def read_url_list(path):
+    urls = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                urls.append(line)
+    return urls
+
+
+def build_policy(args):
+    # None unless a policy option was given; an explicit --format/--format-spec wins over it
+    fields = {
+        "max_height": args.max_height,
+        "max_fps": args.max_fps,
+        "video_codecs": args.video_codecs,
+        "audio_codecs": args.audio_codecs,
+        "max_filesize": args.max_size,
+        "max_bitrate": args.max_bitrate,
+        "audio_only": args.audio_only or None,
+    }
+    fields = {k: v for k, v in fields.items() if v is not None}
+    if not fields or args.format_id or args.format_spec:
+        return None
+    return FormatPolicy.from_dict(fields)
+
+
+def list_formats(urls, per_host, policy=None, dns_ttl=DNS_TTL):
+    network = SharedNetwork(DEFAULT_WORKERS, dns_ttl)
+    prefetcher = BatchPrefetcher({"shared_network": network}, cache=MetadataCache(), per_host=per_host)
+    batch = prefetcher.prefetch(urls)
+    failed = 0
+    try:
+        for result in batch:
+            if not result.ok:
+                failed += 1
+                print(f"== {result.url}\n   failed after {result.attempts} attempt(s): {result.error}", flush=True)
+                continue
+            session = result.session
+            print(f"== {session.title or result.url} ({result.url}, {result.seconds:.1f}s)")
+            selection = session.select(policy)
+            picked = {f.format_id for f in selection.formats} if selection is not None else set()
+            for f in session.format_records:
+                print(f" {'*' if f.format_id in picked else ' '} {f.label}")
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        batch.cancel()
+    finally:
+        prefetcher.shutdown(wait=False)
+    print(f"{len(batch.results) - failed}/{len(batch.urls)} URLs resolved.")
+    print_network(network.stats())
+    network.close()
+    return 1 if failed or batch.pending else 0
+
+
+def print_network(stats):
+    print(f"HTTP: {stats['requests']} requests over {stats['connections']} new connections "
+          f"({stats['reuse_ratio'] * 100:.0f}% reused) | DNS: {stats['dns_cache_hits']} cached, "
+          f"{stats['dns_lookups']} resolved")
+
+
+def open_archive(args):
+    if args.archive is None:
+        return None
+    return DownloadArchive(args.archive or None, hash_files=args.archive_hash)
+
+
+def open_manifest(args):
+    if args.manifest is None:
+        return None
+    return Manifest(args.manifest or None, fast=args.fast_hash, sidecars=args.sidecar)
+
+
+def verify_files(args):
+    # Re-hashes recorded files on every core; exit status 1 when any is missing or no longer matches
+    manifest = Manifest(args.manifest or None)
+    counts = {}
+    verified = 0
+    began = time.time()
+    try:
+        for row, status in verify(manifest, args.verify, args.verify_workers, args.fast_hash):
+            counts[status] = counts.get(status, 0) + 1
+            if status == OK:
+                verified += row["size"]
+            else:
+                print(f"{status.upper()}: {row['path']}", flush=True)
+    except KeyboardInterrupt:
+        print("Interrupted.")
+    finally:
+        manifest.close()
+    elapsed = max(0.001, time.time() - began)
+    summary = ", ".join(f"{n} {status}" for status, n in sorted(counts.items())) or "no files"
+    print(f"{summary} ({verified / 1024 / 1024:.0f} MiB in {elapsed:.1f}s, "
+          f"{verified / 1024 / 1024 / elapsed:.0f} MiB/s)")
+    return 0 if set(counts) <= {OK} else 1
+
+
+def build_output(args):
+    return OutputManager(staging=not args.no_staging, min_free=args.min_free, preallocate=not args.no_preallocate,
+                         buffer_size=args.buffer_size, http_chunk_size=args.http_chunk_size)
+
+
+def enqueue(args, urls, policy):
+    store = JobStore(args.store or None, args.shared_store)
+    format_spec = args.format_spec or (f"{args.format_id}+bestaudio/best" if args.format_id else None)
+    for url in urls:
+        store.enqueue(url, format_spec, policy, os.path.abspath(args.output), args.turbo,
+                      parse_priority(args.priority), audio_only=args.audio_only, audio_format=args.audio_format,
+                      audio_quality=args.audio_quality)
+    print(f"{len(urls)} job(s) queued in {store.path}; run python -m ytdl_engine.workers to download them.")
+    store.close()
+    return 0
+
+
+def import_archive(args):
+    archive = DownloadArchive(args.archive or None, hash_files=args.archive_hash)
+    for path in args.import_archive:
+        if os.path.isdir(path):
+            imported, unknown = archive.import_folder(path)
+            print(f"{path}: {imported} file(s) imported, {len(unknown)} without a recognizable video id")
+        else:
+            print(f"{path}: {archive.import_archive_file(path)} entries imported")
+    print(f"Archive {archive.path} holds {len(archive)} entries.")
+    archive.close()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ytdl_engine", description="Download every URL listed in a file.")
+    parser.add_argument("url_file", nargs="?", help="text file with one URL per line ('-' for stdin)")
+    parser.add_argument("-j", "--jobs", type=int, default=3,
+                        help="number of concurrent downloads (default: 3); with --adaptive, where new sites start")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="learn per site how many jobs and fragments to run from throughput and 403/429 errors")
+    parser.add_argument("--max-jobs", type=int, default=DEFAULT_MAX_JOBS,
+                        help=f"upper bound for --adaptive (default: {DEFAULT_MAX_JOBS})")
+    parser.add_argument("-o", "--output", default=os.getcwd(), help="folder to save into")
+    parser.add_argument("-f", "--format", dest="format_id", default=None,
+                        help="format id to download (merged with bestaudio); default is best available")
+    parser.add_argument("--format-spec", default=None,
+                        help="raw yt-dlp format selector applied to every job (overrides --format)")
+    parser.add_argument("--max-height", type=int, default=None,
+                        help="pick the best format up to this height automatically (e.g. 1080)")
+    parser.add_argument("--max-fps", type=int, default=None, help="skip formats above this frame rate")
+    parser.add_argument("--codec", dest="video_codecs", default=None,
+                        help="preferred video codecs, best first (e.g. h264,vp9,av1)")
+    parser.add_argument("--audio-codec", dest="audio_codecs", default=None,
+                        help="preferred audio codecs, best first (e.g. aac,opus)")
+    parser.add_argument("--max-size", default=None, help="size budget per download, e.g. 500M or 2G")
+    parser.add_argument("--max-bitrate", type=float, default=None,
+                        help="bandwidth budget in kbit/s for the combined audio and video streams")
+    parser.add_argument("--audio-only", action="store_true",
+                        help="download only the best audio stream (by --audio-codec preference and bitrate) and "
+                             "save it as an audio file with tags and cover art")
+    parser.add_argument("--audio-format", choices=AUDIO_FORMATS, default="best",
+                        help="codec of audio-only downloads; 'best' keeps the downloaded one and only remuxes it "
+                             "(default: best)")
+    parser.add_argument("--audio-quality", default=None,
+                        help="when --audio-format re-encodes: VBR quality 0 (best) to 10, or a bitrate like 192K")
+    parser.add_argument("--bulk", action="store_true",
+                        help="treat URLs as playlists/channels and queue their entries as they are listed")
+    parser.add_argument("--limit-rate", default=None,
+                        help="total download rate for all jobs together, e.g. 4M (bytes/s)")
+    parser.add_argument("--schedule", default=None,
+                        help="time-of-day rate windows overriding --limit-rate, e.g. '08:00-18:00=1M,22:00-06:00=off'")
+    parser.add_argument("--priority", choices=list(PRIORITIES), default="normal",
+                        help="bandwidth priority of these jobs against others in the same process (default: normal)")
+    parser.add_argument("--archive", nargs="?", const="", default=None, metavar="PATH",
+                        help="skip videos already in the download archive and add new ones to it "
+                             "(default archive in the user data folder)")
+    parser.add_argument("--archive-hash", action="store_true",
+                        help="store a SHA-256 of every file added to the archive")
+    parser.add_argument("--import-archive", nargs="+", default=None, metavar="PATH",
+                        help="add existing download folders or yt-dlp archive .txt files to the archive, then exit")
+    parser.add_argument("--manifest", nargs="?", const="", default=None, metavar="PATH",
+                        help="record the SHA-256 and size of every finished file, hashed while it downloads "
+                             "(default manifest in the user data folder)")
+    parser.add_argument("--fast-hash", action="store_true",
+                        help="also record a fast non-cryptographic hash for quick verification")
+    parser.add_argument("--sidecar", action="store_true",
+                        help="with --manifest, also write a sha256sum-style .sha256 file next to each download")
+    parser.add_argument("--verify", nargs="*", default=None, metavar="PATH",
+                        help="re-check files in the manifest (or those under PATH) against their hashes, then exit; "
+                             "with --fast-hash, compares the fast hash where one was recorded")
+    parser.add_argument("--verify-workers", type=int, default=None,
+                        help="files hashed at once by --verify (default: CPU cores)")
+    parser.add_argument("--merge-workers", type=int, default=None,
+                        help="concurrent ffmpeg merge/post-processing jobs (default: half the CPU cores)")
+    parser.add_argument("--convert-workers", type=int, default=None,
+                        help="concurrent audio re-encodes for --audio-format (default: CPU cores)")
+    parser.add_argument("--store", nargs="?", const="", default=None, metavar="PATH",
+                        help="queue the URLs in a job store for worker processes (python -m ytdl_engine.workers) "
+                             "instead of downloading them here (default store in the user data folder)")
+    parser.add_argument("--shared-store", action="store_true",
+                        help="the job store is on a network volume used by several machines (no WAL)")
+    parser.add_argument("--resume", action="store_true",
+                        help="also resume jobs left unfinished by an earlier run or crash")
+    parser.add_argument("--no-journal", action="store_true", help="do not record jobs for crash recovery")
+    parser.add_argument("--backends", default="yt-dlp",
+                        help="download libraries to use, in order of preference (e.g. 'pytube,yt-dlp'); with more "
+                             "than one, each job goes to the one measured quickest on its site and falls back to "
+                             "the others on failure; pytube only has single-file streams, so jobs that merge reach it "
+                             "last and get its best progressive stream")
+    parser.add_argument("--allow-merge", dest="allow_merge", action="store_true", default=True,
+                        help="download separate video and audio streams and merge them (the default)")
+    parser.add_argument("--no-merge", dest="allow_merge", action="store_false",
+                        help="single files only: merge selectors fall back to their single-file alternative "
+                             "(e.g. 'bv*+ba/b' -> 'b'), which pytube can serve; explicit --format ids are kept")
+    parser.add_argument("--ffmpeg", default=None, help="path to ffmpeg binary or its folder")
+    parser.add_argument("--turbo", action="store_true",
+                        help="parallel fragment downloads and multi-connection ranges for single files")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS,
+                        help=f"connections per file in turbo mode (default: {DEFAULT_CONNECTIONS})")
+    parser.add_argument("--fragments", type=int, default=DEFAULT_FRAGMENTS,
+                        help=f"concurrent DASH/HLS fragments in turbo mode (default: {DEFAULT_FRAGMENTS})")
+    parser.add_argument("--stream-mux", nargs="?", const="mp4", choices=("mp4", "fmp4"), default=None,
+                        help="mux DASH video and audio through ffmpeg while they download instead of merging "
+                             "afterwards; 'fmp4' writes fragmented MP4 (POSIX only)")
+    parser.add_argument("--no-staging", action="store_true",
+                        help="download straight into the output folder instead of a hidden staging folder there")
+    parser.add_argument("--min-free", default=DEFAULT_MIN_FREE,
+                        help="free space to leave on the output disk, e.g. 2G; downloads that would cut into it "
+                             "wait for running ones or fail (default: 512M)")
+    parser.add_argument("--no-preallocate", action="store_true",
+                        help="don't reserve each file's disk space when its download starts")
+    parser.add_argument("--buffer-size", default=None,
+                        help="fixed read/write block size, e.g. 256K (default: yt-dlp adapts it)")
+    parser.add_argument("--http-chunk-size", default=None,
+                        help="download HTTP files in ranged requests of this size, e.g. 10M, for servers that "
+                             "throttle long responses")
+    parser.add_argument("--dns-ttl", type=float, default=DNS_TTL,
+                        help=f"seconds to reuse resolved host addresses, 0 to disable (default: {DNS_TTL:.0f})")
+    parser.add_argument("--list-formats", action="store_true",
+                        help="fetch every URL's formats in parallel and print them as they arrive; no downloads")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST,
+                        help=f"concurrent extractions per site with --list-formats (default: {DEFAULT_PER_HOST})")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics while running")
+    parser.add_argument("--metrics-jsonl", default=None,
+                        help="append one JSON line per finished job (plus periodic process gauges) to this file")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.import_archive:
+        return import_archive(args)
+    if args.verify is not None:
+        return verify_files(args)
+    if args.url_file is None and not args.resume:
+        parser.error("a URL file is required unless --resume is given")
+    if args.url_file == "-":
+        urls = [line.strip() for line in sys.stdin if line.strip() and not line.startswith("#")]
+    elif args.url_file:
+        urls = read_url_list(args.url_file)
+    else:
+        urls = []
+    if not urls and not args.resume:
+        print("No URLs to download.")
+        return 1
+    try:
+        policy = build_policy(args)
+        bandwidth = BandwidthScheduler(args.limit_rate, parse_schedule(args.schedule))
+        backends = parse_backends(args.backends)
+        output = build_output(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.list_formats:
+        return list_formats(urls, args.per_host, policy, args.dns_ttl)
+    if args.store is not None:
+        if args.bulk:
+            parser.error("--bulk can't be combined with --store")
+        if args.archive is not None or args.manifest is not None:
+            # Each worker process opens them itself
+            parser.error("with --store, pass --archive and --manifest to python -m ytdl_engine.workers instead")
+        return enqueue(args, urls, policy)
+
+    print_lock = threading.Lock()
+
+    def on_event(job):
+        with print_lock:
+            msg = f"[{job.id}] {job.state}: {job.url}"
+            if job.error:
+                msg += f" ({job.error})"
+            print(msg, flush=True)
+
+    journal = None if args.no_journal else JobJournal()
+    workers = args.jobs
+    concurrency = None
+    if args.adaptive:
+        workers = max(args.jobs, args.max_jobs)
+        concurrency = ConcurrencyController(jobs=args.jobs, max_jobs=workers, fragments=args.fragments)
+    engine = DownloadEngine(workers=workers, ffmpeg_path=args.ffmpeg, turbo=args.turbo,
+                            connections=args.connections, fragments=args.fragments, journal=journal,
+                            postprocess_workers=args.merge_workers, bandwidth=bandwidth, concurrency=concurrency,
+                            stream_mux=args.stream_mux, archive=open_archive(args),
+                            manifest=open_manifest(args), backends=backends,
+                            backend_stats=BackendStats() if len(backends) > 1 else None, output=output,
+                            dns_ttl=args.dns_ttl, audio_format=args.audio_format, audio_quality=args.audio_quality,
+                            conversion_workers=args.convert_workers, allow_merge=args.allow_merge)
+    engine.add_listener(on_event)
+    metrics = None
+    metrics_server = None
+    if args.metrics_port is not None or args.metrics_jsonl:
+        metrics = MetricsRecorder(engine, jsonl_path=args.metrics_jsonl, interval=10)
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(metrics, args.metrics_port)
+        print(f"Metrics on http://127.0.0.1:{metrics_server.port}/metrics")
+    if args.resume:
+        engine.resume_unfinished()
+    if args.bulk:
+        playlists = [engine.submit_playlist(url, args.format_spec, args.output, policy=policy,
+                                            priority=parse_priority(args.priority)) for url in urls]
+    else:
+        playlists = []
+        for url in urls:
+            engine.submit(url, args.format_id, args.output, format_spec=args.format_spec, policy=policy,
+                          priority=parse_priority(args.priority))
+    try:
+        for playlist in playlists:
+            playlist.done_event.wait()
+            if playlist.error:
+                print(f"Failed to list {playlist.url}: {playlist.error}")
+        engine.wait_all()
+    except KeyboardInterrupt:
+        print("Cancelling...")
+        for playlist in playlists:
+            playlist.cancel()
+        engine.cancel_all()
+        engine.wait_all()
+    finally:
+        engine.shutdown(wait=False)
+        if metrics_server is not None:
+            metrics_server.close()
+        if metrics is not None:
+            metrics.close()
+
+    jobs = list(engine.jobs)
+    failed = [j for j in jobs if j.state not in (DONE, SKIPPED)]
+    skipped = sum(1 for j in jobs if j.state == SKIPPED) + sum(p.skipped for p in playlists)
+    print(f"{len(jobs) - len(failed)}/{len(jobs)} downloads complete.")
+    if skipped:
+        print(f"{skipped} skipped as already in the archive.")
+    download_seconds = sum(j.timings.get("download", 0) for j in jobs)
+    merge = engine.postprocessor.stats()
+    print(f"Download time {download_seconds:.1f}s | merge time {merge['merge_seconds']:.1f}s over "
+          f"{merge['completed'] + merge['failed']} merges, {merge['workers']} workers, "
+          f"{merge['utilization'] * 100:.0f}% utilized")
+    conversions = engine.conversions.stats()
+    if conversions["completed"] or conversions["failed"]:
+        print(f"Audio conversion time {conversions['merge_seconds']:.1f}s over "
+              f"{conversions['completed'] + conversions['failed']} files, {conversions['workers']} workers")
+    print_network(engine.network.stats())
+    return 1 if failed or any(p.error for p in playlists) else 0
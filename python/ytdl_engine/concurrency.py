@@ -0,0 +1,236 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from .paths import user_data_dir
+from .prefetch import host_key
+from .segmented import DEFAULT_FRAGMENTS
+
+DEFAULT_JOBS = 2
+DEFAULT_MAX_JOBS = 8
+DEFAULT_MAX_FRAGMENTS = 16
+# Seconds of summed job speeds per throughput sample
+SAMPLE_INTERVAL = 3.0
+# Samples averaged at a limit before it is judged
+SETTLE_SAMPLES = 2
+# One more slot has to buy at least this much extra throughput to be kept
+GROWTH = 0.10
+# After a probe didn't pay off, stay put this long before trying again
+HOLD_SECONDS = 60.0
+# After a backoff, no probing for this long; further backoffs within BACKOFF_GAP count as the same event
+COOLDOWN_SECONDS = 30.0
+BACKOFF_GAP = 5.0
+DECREASE = 0.5
+# Time to first byte beyond this multiple of the host's usual one counts as the server queueing us
+LATENCY_FACTOR = 3.0
+MIN_LATENCY = 0.5
+# Learned limits older than this are ignored; sites change their throttling
+MAX_AGE = 14 * 24 * 3600
+
+
+class AimdLimit:
+    # Additive increase, multiplicative decrease. Throughput is averaged over a few samples at the
+    # current limit; if the limit is in use, one slot is added and kept only when throughput grew by
+    # GROWTH. Throttling halves the limit.
+
+    def __init__(self, limit, minimum=1, maximum=DEFAULT_MAX_JOBS):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = max(self.minimum, min(self.maximum, int(limit)))
+        self.rate = 0.0
+        self.samples = 0
+        # Throughput before the last increase, while that increase is on probation
+        self.probing = None
+        self.hold_until = 0.0
+        self.backed_off = 0.0
+
+    def __repr__(self):
+        return f"<AimdLimit {self.limit} [{self.minimum}-{self.maximum}] rate={self.rate:.0f}>"
+
+    def observe(self, rate, saturated=True, now=None):
+        # Returns True when the limit changed
+        now = time.monotonic() if now is None else now
+        if now < self.hold_until:
+            return False
+        self.samples += 1
+        self.rate += (rate - self.rate) / self.samples
+        if self.samples < SETTLE_SAMPLES:
+            return False
+        if self.probing is not None:
+            baseline, self.probing = self.probing, None
+            if self.rate < baseline * (1 + GROWTH):
+                self._set(self.limit - 1)
+                self.hold_until = now + HOLD_SECONDS
+                return True
+        if saturated and self.limit < self.maximum:
+            self.probing = self.rate
+            self._set(self.limit + 1)
+            return True
+        return False
+
+    def backoff(self, now=None):
+        now = time.monotonic() if now is None else now
+        if now - self.backed_off < BACKOFF_GAP:
+            return False
+        self.backed_off = now
+        self.probing = None
+        self.hold_until = now + COOLDOWN_SECONDS
+        previous = self.limit
+        self._set(math.floor(self.limit * DECREASE))
+        return self.limit != previous
+
+    def _set(self, limit):
+        self.limit = max(self.minimum, min(self.maximum, limit))
+        self.rate = 0.0
+        self.samples = 0
+
+
+class _Host:
+    def __init__(self, jobs, fragments):
+        self.jobs = jobs
+        self.fragments = fragments
+        self.running = 0
+        self.speeds = {}
+        self.sampled = time.monotonic()
+        self.latency = None
+
+
+class ConcurrencyController:
+    # Learns per site how many jobs to run at once and how many fragments/connections each job opens.
+    # Both follow AIMD: jobs from the summed hook speeds of the site's running jobs, fragments from each
+    # finished job's throughput. 403/429 responses and a jump in time to first byte back off; what was
+    # learned is kept in a small SQLite file so the next run starts there.
+
+    def __init__(self, path=None, jobs=DEFAULT_JOBS, max_jobs=DEFAULT_MAX_JOBS, fragments=DEFAULT_FRAGMENTS,
+                 max_fragments=DEFAULT_MAX_FRAGMENTS):
+        self.path = path or os.path.join(user_data_dir(), "concurrency.sqlite3")
+        self.initial_jobs = jobs
+        self.max_jobs = max(1, max_jobs)
+        self.initial_fragments = fragments
+        self.max_fragments = max(1, max_fragments)
+        self.hosts = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS limits ("
+            " host TEXT PRIMARY KEY,"
+            " jobs INTEGER NOT NULL,"
+            " fragments INTEGER NOT NULL,"
+            " latency REAL,"
+            " updated REAL NOT NULL)")
+        self._db.commit()
+
+    def try_acquire(self, url):
+        # Takes a job slot for the URL's site; False when the site is at its limit
+        with self._lock:
+            host = self._host(host_key(url))
+            if host.running >= host.jobs.limit:
+                return False
+            host.running += 1
+            return True
+
+    def release(self, url, key=None):
+        # Returns how many more jobs the site can start now
+        with self._lock:
+            host = self._host(host_key(url))
+            host.running = max(0, host.running - 1)
+            host.speeds.pop(key, None)
+            return max(0, host.jobs.limit - host.running)
+
+    def fragments(self, url):
+        with self._lock:
+            return self._host(host_key(url)).fragments.limit
+
+    def report_speed(self, url, key, speed):
+        # Fed from the progress hook. Returns True when the site's job limit grew.
+        if speed is None:
+            return False
+        with self._lock:
+            name = host_key(url)
+            host = self._host(name)
+            now = time.monotonic()
+            host.speeds[key] = speed
+            if now - host.sampled < SAMPLE_INTERVAL:
+                return False
+            host.sampled = now
+            previous = host.jobs.limit
+            # A limit that isn't reached says nothing about whether more jobs would help
+            if host.jobs.observe(sum(host.speeds.values()), host.running >= host.jobs.limit, now):
+                self._save(name, host)
+            return host.jobs.limit > previous
+
+    def report_job(self, url, rate):
+        # Average download rate of a finished job, which ran with fragments(url) connections
+        if not rate:
+            return
+        with self._lock:
+            name = host_key(url)
+            host = self._host(name)
+            if host.fragments.observe(rate):
+                self._save(name, host)
+
+    def report_latency(self, url, seconds):
+        with self._lock:
+            name = host_key(url)
+            host = self._host(name)
+            if host.latency is not None and seconds > max(MIN_LATENCY, host.latency * LATENCY_FACTOR):
+                if host.jobs.backoff():
+                    self._save(name, host)
+                return
+            host.latency = seconds if host.latency is None else host.latency + 0.2 * (seconds - host.latency)
+
+    def throttled(self, url, jobs=True):
+        # A 403/429: fewer fragments per job, and with jobs=True (a 429, or a job that failed) fewer jobs
+        with self._lock:
+            name = host_key(url)
+            host = self._host(name)
+            changed = host.fragments.backoff()
+            if jobs:
+                changed = host.jobs.backoff() or changed
+            if changed:
+                self._save(name, host)
+
+    def stats(self):
+        with self._lock:
+            return {name: {"jobs": h.jobs.limit, "running": h.running, "fragments": h.fragments.limit,
+                           "throughput": sum(h.speeds.values()), "latency": h.latency}
+                    for name, h in self.hosts.items()}
+
+    def forget(self, url=None):
+        # Drops what was learned for one site, or for all of them
+        with self._lock:
+            if url is None:
+                self.hosts.clear()
+                self._db.execute("DELETE FROM limits")
+            else:
+                name = host_key(url)
+                self.hosts.pop(name, None)
+                self._db.execute("DELETE FROM limits WHERE host = ?", (name,))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _host(self, name):
+        host = self.hosts.get(name)
+        if host is not None:
+            return host
+        jobs, fragments, latency = self.initial_jobs, self.initial_fragments, None
+        row = self._db.execute("SELECT jobs, fragments, latency, updated FROM limits WHERE host = ?",
+                               (name,)).fetchone()
+        if row is not None and time.time() - row[3] < MAX_AGE:
+            jobs, fragments, latency = row[:3]
+        host = _Host(AimdLimit(jobs, 1, self.max_jobs), AimdLimit(fragments, 1, self.max_fragments))
+        host.latency = latency
+        self.hosts[name] = host
+        return host
+
+    def _save(self, name, host):
+        self._db.execute("INSERT OR REPLACE INTO limits (host, jobs, fragments, latency, updated)"
+                         " VALUES (?, ?, ?, ?, ?)",
+                         (name, host.jobs.limit, host.fragments.limit, host.latency, time.time()))
+        self._db.commit()
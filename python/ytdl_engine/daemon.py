@@ -0,0 +1,808 @@
+import argparse
+import asyncio
+import hmac
+import itertools
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import parse_qs, urlsplit
+
+from .archive import DownloadArchive
+from .backends import BackendStats, parse_backends
+from .bandwidth import BACKGROUND, NORMAL, BandwidthScheduler, parse_priority, parse_rate, parse_schedule
+from .cache import MetadataCache
+from .concurrency import DEFAULT_MAX_JOBS, ConcurrencyController
+from .engine import FINAL_STATES, DownloadEngine
+from .formats import Format, FormatPolicy
+from .integrity import Manifest
+from .journal import JobJournal
+from .metrics import MetricsRecorder
+from .network import DNS_TTL
+from .output import DEFAULT_MIN_FREE, OutputManager
+from .postprocess import AUDIO_FORMATS
+from .progress import ProgressSample
+from .segmented import DEFAULT_CONNECTIONS, DEFAULT_FRAGMENTS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+# Events buffered per SSE client; a client that falls further behind loses the oldest ones
+CLIENT_QUEUE_SIZE = 1000
+PROGRESS_HZ = 2
+KEEPALIVE_SECONDS = 15
+# How long find_daemon waits for an answer; a daemon on localhost replies at once, a missing one refuses at once
+PROBE_TIMEOUT = 1.0
+CLIENT_TIMEOUT = 30
+
+REASONS = {200: "OK", 201: "Created", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
+           404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 415: "Unsupported Media Type",
+           500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def job_to_dict(job):
+    return {
+        "id": job.id,
+        "journal_id": job.journal_id,
+        "url": job.url,
+        "state": job.state,
+        "phase": job.phase,
+        "error": str(job.error) if job.error else None,
+        "format_spec": job.format_spec,
+        "policy": job.policy.to_dict() if job.policy is not None else None,
+        "save_path": job.save_path,
+        "turbo": job.turbo,
+        "priority": job.priority,
+        "weight": job.weight,
+        "title": job.title,
+        "filename": job.filename,
+        "output": job.output,
+        "archive_id": job.archive_id,
+        "sha256": job.sha256,
+        "backend": job.backend,
+        "downloaded_bytes": job.downloaded_bytes,
+        "total_bytes": job.total_bytes,
+        "percent": round(job.percent, 2),
+        "speed": job.speed,
+        "eta": job.eta,
+        "timings": {k: v for k, v in job.timings.items() if isinstance(v, (int, float))},
+    }
+
+
+def playlist_to_dict(playlist_id, playlist):
+    return {"id": int(playlist_id), "url": playlist.url, "title": playlist.title,
+            "done": playlist.done_event.is_set(), "error": str(playlist.error) if playlist.error else None,
+            "jobs": [job.id for job in list(playlist.jobs)], "skipped": playlist.skipped}
+
+
+def format_to_dict(f):
+    return {name: getattr(f, name) for name in Format.__slots__}
+
+
+def sample_to_dict(job_id, sample):
+    return {"id": job_id, "status": sample.status, "downloaded_bytes": sample.downloaded_bytes,
+            "total_bytes": sample.total_bytes, "percent": round(sample.percent, 2), "speed": sample.speed,
+            "eta": sample.eta, "target_rate": sample.target_rate}
+
+
+class DownloadDaemon:
+    # Localhost REST front for a DownloadEngine. The engine keeps doing the work on its own threads; the
+    # event loop only parses requests and fans job events and progress out to SSE subscribers.
+    # Browsers can reach localhost too, so requests carrying an Origin header are refused and every POST must
+    # be application/json (which a page can't send cross-site without a preflight). Jobs save below `root`
+    # only, and always run the daemon's own ffmpeg.
+    #
+    #   GET    /health                     liveness and queue figures
+    #   GET    /jobs                       all jobs (?state=running to filter)
+    #   POST   /jobs                       {"url", "format_id"|"format_spec"|"policy", "save_path" (in root), "turbo",
+    #                                        "priority": "background"|"normal"|"interactive", "weight"}
+    #   GET    /jobs/<id>                  one job, by numeric id or journal id
+    #   DELETE /jobs/<id>                  cancel (POST /jobs/<id>/cancel works too)
+    #   POST   /playlists                  {"url", "format_spec"|"policy", "save_path", "limit"}
+    #   GET    /playlists/<id>             expansion status and the ids of the jobs queued so far
+    #   POST   /info                       {"url", "policy"}: title, formats and the policy's pick, via the cache
+    #   GET    /events                     SSE stream of "job" and "progress" events (?job=<id>)
+    #   GET    /bandwidth                  global rate and each job's target vs achieved rate
+    #   POST   /bandwidth                  {"rate": "4M"|null, "schedule": "08:00-18:00=1M,..."}
+    #   GET    /concurrency                job and fragment limits learned per site (with --adaptive)
+    #   GET    /backends                   configured backends and their latency/throughput per site
+    #   GET    /network                    HTTP requests vs new connections, DNS cache hits
+    #   GET    /metrics                    Prometheus text, when a MetricsRecorder is attached
+
+    def __init__(self, engine, host="127.0.0.1", port=DEFAULT_PORT, token=None, metrics=None,
+                 progress_hz=PROGRESS_HZ, root=None):
+        self.engine = engine
+        # Folder every job's save_path must resolve into; relative save paths start here
+        self.root = os.path.realpath(root or ".")
+        self.host = host
+        self.port = port
+        self.token = token
+        self.metrics = metrics
+        self.progress_hz = progress_hz
+        self.playlists = {}
+        self._playlist_ids = itertools.count(1)
+        self._subscribers = set()
+        self._loop = None
+        self._server = None
+        self._tasks = []
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self.engine.add_listener(self._on_job_event)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._tasks.append(asyncio.create_task(self._pump_progress()))
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        self.engine.remove_listener(self._on_job_event)
+        for task in self._tasks:
+            task.cancel()
+        for queue in list(self._subscribers):
+            self._offer(queue, None)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def find_job(self, key):
+        for job in list(self.engine.jobs):
+            if str(job.id) == key or job.journal_id == key:
+                return job
+        return None
+
+    # -- events
+
+    def _on_job_event(self, job):
+        # Engine worker thread: snapshot now, deliver on the loop
+        data = job_to_dict(job)
+        self._loop.call_soon_threadsafe(self._broadcast, "job", data)
+
+    def _broadcast(self, event, data):
+        for queue in list(self._subscribers):
+            self._offer(queue, (event, data))
+
+    def _offer(self, queue, item):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(item)
+
+    async def _pump_progress(self):
+        # Same latest-value polling as the Tk ticker: one event per changed job per tick, however fast the chunks
+        last = {}
+        while True:
+            await asyncio.sleep(1 / self.progress_hz)
+            if not self._subscribers:
+                last = {}
+                continue
+            snapshot = self.engine.progress.latest()
+            for job_id, sample in snapshot.items():
+                if last.get(job_id) is not sample:
+                    self._broadcast("progress", sample_to_dict(job_id, sample))
+            last = snapshot
+
+    # -- HTTP
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                method, target, headers, body = await self._read_request(reader)
+                self._check_auth(headers)
+                self._check_origin(method, headers)
+                await self._route(method, target, body, writer)
+            except HttpError as e:
+                await self._send_json(writer, e.status, {"error": str(e)})
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                await self._send_json(writer, 400, {"error": "Malformed request"})
+            except Exception as e:
+                await self._send_json(writer, 500, {"error": f"{type(e).__name__}: {e}"})
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            raise asyncio.IncompleteReadError(b"", None)
+        method, target, _ = request_line.split(" ", 2)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, headers, body
+
+    def _check_auth(self, headers):
+        if not self.token:
+            return
+        given = headers.get("authorization", "")
+        if not hmac.compare_digest(given.encode(), f"Bearer {self.token}".encode()):
+            raise HttpError(401, "Missing or wrong bearer token")
+
+    def _check_origin(self, method, headers):
+        if "origin" in headers:
+            raise HttpError(403, "Cross-origin requests are not accepted")
+        content_type = headers.get("content-type", "").split(";", 1)[0].strip().lower()
+        if method == "POST" and content_type != "application/json":
+            raise HttpError(415, "POST bodies must be application/json")
+
+    async def _route(self, method, target, body, writer):
+        parts = urlsplit(target)
+        path = parts.path.rstrip("/") or "/"
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        segments = path.strip("/").split("/")
+
+        if path == "/health" and method == "GET":
+            return await self._send_json(writer, 200, {
+                "status": "ok",
+                "active_jobs": len(self.engine.active_jobs()),
+                "queue_depth": self.engine.queue_depth(),
+                "merge": self.engine.postprocessor.stats(),
+            })
+        if path == "/events" and method == "GET":
+            return await self._stream_events(writer, query.get("job"))
+        if path == "/bandwidth":
+            if method == "POST":
+                self._set_bandwidth(self._json(body, require_url=False))
+            elif method != "GET":
+                raise HttpError(405, f"{method} not allowed on /bandwidth")
+            return await self._send_json(writer, 200, self.engine.bandwidth.stats())
+        if path == "/concurrency" and method == "GET":
+            if self.engine.concurrency is None:
+                raise HttpError(404, "Adaptive concurrency is not enabled")
+            return await self._send_json(writer, 200, {"hosts": self.engine.concurrency.stats()})
+        if path == "/backends" and method == "GET":
+            stats = self.engine.backend_stats.stats() if self.engine.backend_stats is not None else {}
+            return await self._send_json(writer, 200, {"backends": [b.name for b in self.engine.backends],
+                                                       "hosts": stats})
+        if path == "/network" and method == "GET":
+            return await self._send_json(writer, 200, self.engine.network.stats())
+        if path == "/metrics" and method == "GET":
+            if self.metrics is None:
+                raise HttpError(404, "Metrics are not enabled")
+            return await self._send(writer, 200, self.metrics.prometheus().encode("utf-8"),
+                                    "text/plain; version=0.0.4; charset=utf-8")
+        if path == "/jobs":
+            if method == "GET":
+                jobs = [job_to_dict(j) for j in list(self.engine.jobs)]
+                if "state" in query:
+                    jobs = [j for j in jobs if j["state"] == query["state"]]
+                return await self._send_json(writer, 200, {"jobs": jobs})
+            if method == "POST":
+                return await self._submit(self._json(body), writer)
+            raise HttpError(405, f"{method} not allowed on /jobs")
+        if segments[0] == "jobs" and len(segments) in (2, 3):
+            job = self.find_job(segments[1])
+            if job is None:
+                raise HttpError(404, f"No job {segments[1]}")
+            if len(segments) == 2 and method == "GET":
+                return await self._send_json(writer, 200, job_to_dict(job))
+            if (len(segments) == 2 and method == "DELETE") or (segments[2:] == ["cancel"] and method == "POST"):
+                self.engine.cancel(job)
+                return await self._send_json(writer, 202, job_to_dict(job))
+            raise HttpError(405, f"{method} not allowed on {path}")
+        if path == "/playlists" and method == "POST":
+            return await self._submit_playlist(self._json(body), writer)
+        if segments[0] == "playlists" and len(segments) == 2 and method == "GET":
+            playlist = self.playlists.get(int(segments[1])) if segments[1].isdigit() else None
+            if playlist is None:
+                raise HttpError(404, f"No playlist {segments[1]}")
+            return await self._send_json(writer, 200, playlist_to_dict(segments[1], playlist))
+        if path == "/info" and method == "POST":
+            return await self._info(self._json(body), writer)
+        raise HttpError(404, f"No route for {method} {path}")
+
+    def _policy(self, data):
+        # {"max_height": 1080, "video_codecs": ["h264"], "max_filesize": "500M", ...}
+        try:
+            return FormatPolicy.from_dict(data["policy"]) if data.get("policy") else None
+        except (TypeError, ValueError) as e:
+            raise HttpError(400, f"Invalid policy: {e}")
+
+    def _json(self, body, require_url=True):
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(400, "Body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HttpError(400, "A JSON object is required")
+        if require_url and not data.get("url"):
+            raise HttpError(400, "A JSON object with a 'url' is required")
+        return data
+
+    def _save_path(self, data):
+        path = os.path.realpath(os.path.join(self.root, data.get("save_path") or "."))
+        try:
+            inside = os.path.commonpath([path, self.root]) == self.root
+        except ValueError:
+            # Another drive (Windows)
+            inside = False
+        if not inside:
+            raise HttpError(403, f"save_path must be inside {self.root}")
+        return path
+
+    def _no_ffmpeg_path(self, data):
+        if data.get("ffmpeg_path") is not None:
+            raise HttpError(400, "ffmpeg_path can't be set over HTTP; start the daemon with --ffmpeg")
+
+    def _priority(self, data, default):
+        try:
+            return parse_priority(data["priority"]) if data.get("priority") is not None else default
+        except ValueError as e:
+            raise HttpError(400, str(e))
+
+    def _set_bandwidth(self, data):
+        scheduler = self.engine.bandwidth
+        try:
+            rate = parse_rate(data["rate"]) if "rate" in data else scheduler.rate
+            profile = parse_schedule(data["schedule"]) if "schedule" in data else scheduler.profile
+        except ValueError as e:
+            raise HttpError(400, str(e))
+        scheduler.set_limits(rate, profile)
+
+    async def _submit(self, data, writer):
+        self._no_ffmpeg_path(data)
+        policy = self._policy(data)
+        save_path = self._save_path(data)
+        priority = self._priority(data, NORMAL)
+        # submit() writes the journal row, so keep it off the loop
+        job = await self._loop.run_in_executor(None, lambda: self.engine.submit(
+            data["url"], data.get("format_id"), save_path, format_spec=data.get("format_spec"),
+            turbo=data.get("turbo"), policy=policy, priority=priority, weight=float(data.get("weight") or 1.0)))
+        await self._send_json(writer, 201, job_to_dict(job))
+
+    async def _submit_playlist(self, data, writer):
+        self._no_ffmpeg_path(data)
+        limit = data.get("limit")
+        if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 1):
+            raise HttpError(400, "limit must be a positive integer")
+        playlist = self.engine.submit_playlist(data["url"], data.get("format_spec"), self._save_path(data),
+                                               subfolder=data.get("subfolder", True), limit=limit,
+                                               policy=self._policy(data), priority=self._priority(data, BACKGROUND))
+        playlist_id = next(self._playlist_ids)
+        self.playlists[playlist_id] = playlist
+        await self._send_json(writer, 202, playlist_to_dict(playlist_id, playlist))
+
+    async def _info(self, data, writer):
+        policy = self._policy(data)
+        future = self.engine.fetch_info(data["url"], bool(data.get("force_refresh")))
+        try:
+            session = await asyncio.wrap_future(future)
+        except Exception as e:
+            raise HttpError(400, f"Failed to fetch formats: {e}")
+        selection = session.select(policy)
+        await self._send_json(writer, 200, {
+            "url": session.url,
+            "title": session.title,
+            "thumbnail": session.thumbnail,
+            "fresh": session.fresh,
+            "formats": [format_to_dict(f) for f in session.format_records],
+            "selected": selection.format_spec if selection is not None else None,
+        })
+
+    async def _stream_events(self, writer, job_filter):
+        queue = asyncio.Queue(CLIENT_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                         b"Connection: close\r\n\r\n")
+            # Current state first, so a client that connects mid-download doesn't start blind
+            for job in list(self.engine.jobs):
+                if not job.finished and job_filter in (None, str(job.id), job.journal_id):
+                    writer.write(self._event("job", job_to_dict(job)))
+            await writer.drain()
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    writer.write(b": keepalive\n\n")
+                    await writer.drain()
+                    continue
+                if item is None:
+                    return
+                event, data = item
+                if job_filter is not None and job_filter not in (str(data["id"]), data.get("journal_id")):
+                    continue
+                writer.write(self._event(event, data))
+                await writer.drain()
+        finally:
+            self._subscribers.discard(queue)
+
+    def _event(self, event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+    async def _send_json(self, writer, status, data):
+        await self._send(writer, status, json.dumps(data).encode("utf-8"), "application/json")
+
+    async def _send(self, writer, status, body, content_type):
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+class DaemonClient:
+    # Minimal blocking client for scripts and the GUIs
+
+    def __init__(self, base_url=f"http://127.0.0.1:{DEFAULT_PORT}", token=None, timeout=CLIENT_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def _request(self, method, path, data=None):
+        body = json.dumps(data).encode("utf-8") if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        if body is not None:
+            request.add_header("Content-Type", "application/json")
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.load(e).get("error")
+            except ValueError:
+                message = None
+            raise RuntimeError(message or str(e)) from None
+
+    def health(self):
+        return self._request("GET", "/health")
+
+    def submit(self, url, format_id=None, save_path=None, format_spec=None, turbo=None, policy=None,
+               priority=None, weight=None):
+        # policy: a dict of FormatPolicy fields; priority: "background", "normal" or "interactive"
+        return self._request("POST", "/jobs", {"url": url, "format_id": format_id, "save_path": save_path,
+                                               "format_spec": format_spec, "turbo": turbo, "policy": policy,
+                                               "priority": priority, "weight": weight})
+
+    def submit_playlist(self, url, format_spec=None, save_path=None, limit=None, policy=None):
+        return self._request("POST", "/playlists", {"url": url, "format_spec": format_spec,
+                                                    "save_path": save_path, "limit": limit, "policy": policy})
+
+    def playlist(self, playlist_id):
+        return self._request("GET", f"/playlists/{playlist_id}")
+
+    def info(self, url, force_refresh=False, policy=None):
+        return self._request("POST", "/info", {"url": url, "force_refresh": force_refresh, "policy": policy})
+
+    def bandwidth(self):
+        return self._request("GET", "/bandwidth")
+
+    def set_bandwidth(self, rate=None, schedule=None):
+        # rate None lifts the cap; schedule is left alone unless given
+        data = {"rate": rate}
+        if schedule is not None:
+            data["schedule"] = schedule
+        return self._request("POST", "/bandwidth", data)
+
+    def concurrency(self):
+        return self._request("GET", "/concurrency")["hosts"]
+
+    def backends(self):
+        return self._request("GET", "/backends")
+
+    def network(self):
+        return self._request("GET", "/network")
+
+    def jobs(self, state=None):
+        return self._request("GET", "/jobs" + (f"?state={state}" if state else ""))["jobs"]
+
+    def job(self, job_id):
+        return self._request("GET", f"/jobs/{job_id}")
+
+    def cancel(self, job_id):
+        return self._request("DELETE", f"/jobs/{job_id}")
+
+    def events(self, job_id=None, on_open=None):
+        # Yields (event, data) from the SSE stream until the daemon closes it; on_open() runs once it is connected
+        request = urllib.request.Request(self.base_url + "/events" + (f"?job={job_id}" if job_id else ""))
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        with urllib.request.urlopen(request) as response:
+            if on_open is not None:
+                on_open()
+            event = None
+            for raw in response:
+                line = raw.decode("utf-8").rstrip("\n")
+                if line.startswith("event: "):
+                    event = line[7:]
+                elif line.startswith("data: ") and event:
+                    yield event, json.loads(line[6:])
+                    event = None
+
+
+
+def find_daemon(base_url=None, token=None, timeout=PROBE_TIMEOUT):
+    # A client for the daemon at base_url ($YTDL_DAEMON_URL, else the default port on localhost), or None when
+    # nothing answers there
+    client = DaemonClient(base_url or os.environ.get("YTDL_DAEMON_URL") or f"http://127.0.0.1:{DEFAULT_PORT}",
+                          token if token is not None else os.environ.get("YTDL_DAEMON_TOKEN"), timeout)
+    try:
+        client.health()
+    except (OSError, RuntimeError, ValueError):
+        return None
+    client.timeout = CLIENT_TIMEOUT
+    return client
+
+
+class RemoteJob:
+    # A job running in the daemon, seen from a DaemonLink. Carries the Job attributes the GUIs read; its id
+    # is prefixed so it can share a ProgressBus with the local engine's jobs.
+
+    def __init__(self, client, data):
+        self.client = client
+        self.remote_id = data["id"]
+        self.id = f"daemon:{data['id']}"
+        self.update(data)
+
+    def __repr__(self):
+        return f"<RemoteJob {self.remote_id} {self.state} {self.url}>"
+
+    def update(self, data):
+        for name in ("journal_id", "url", "state", "phase", "error", "format_spec", "save_path", "title",
+                     "filename", "output", "downloaded_bytes", "total_bytes", "percent"):
+            setattr(self, name, data.get(name))
+
+    @property
+    def finished(self):
+        return self.state in FINAL_STATES
+
+    def cancel(self):
+        self.client.cancel(self.remote_id)
+
+
+class DaemonLink:
+    # Lets a GUI hand its downloads to the daemon, so closing the window doesn't stop them. Follows the event
+    # stream on a thread: progress of the jobs submitted through the link goes into `bus` under their
+    # RemoteJob ids and on_job(remote_job) runs whenever one changes state, which is what a ProgressBus and a
+    # DownloadEngine listener get from local jobs. on_lost() runs if the stream ends (the daemon stopped).
+
+    def __init__(self, client, bus, on_job, on_lost=None, timeout=PROBE_TIMEOUT):
+        self.client = client
+        self.bus = bus
+        self.on_job = on_job
+        self.on_lost = on_lost
+        self.jobs = {}
+        self.connected = True
+        # Playlist id -> jobs its expansion has queued so far, looked up when their events arrive
+        self._playlists = {}
+        self._lock = threading.Lock()
+        opened = threading.Event()
+        threading.Thread(target=self._follow, args=(opened,), name="ytdl-daemon-events", daemon=True).start()
+        # Jobs submitted before the stream is open could finish unseen
+        opened.wait(timeout)
+
+    def submit(self, url, format_id=None, save_path=None, format_spec=None, turbo=None, policy=None,
+               priority=None, weight=None):
+        # As DaemonClient.submit(); returns the RemoteJob
+        data = self.client.submit(url, format_id, save_path, format_spec, turbo, policy, priority, weight)
+        return self._track(data["id"], data)
+
+    def submit_playlist(self, url, format_spec=None, save_path=None, limit=None, policy=None):
+        data = self.client.submit_playlist(url, format_spec, save_path, limit, policy)
+        with self._lock:
+            self._playlists[data["id"]] = set()
+        return data
+
+    def active_jobs(self):
+        with self._lock:
+            return [job for job in self.jobs.values() if not job.finished]
+
+    def _track(self, remote_id, data):
+        with self._lock:
+            job = self.jobs.get(remote_id)
+            if job is None:
+                job = self.jobs[remote_id] = RemoteJob(self.client, data)
+        # Events sent between the daemon creating the job and it being tracked here were skipped
+        self._apply(job, self.client.job(remote_id))
+        return job
+
+    def _job_for(self, remote_id):
+        with self._lock:
+            job = self.jobs.get(remote_id)
+            playlists = [pid for pid, ids in self._playlists.items() if remote_id not in ids]
+        if job is not None or not playlists:
+            return job
+        for playlist_id in playlists:
+            playlist = self.client.playlist(playlist_id)
+            with self._lock:
+                self._playlists[playlist_id].update(playlist["jobs"])
+                if playlist["done"] and remote_id not in playlist["jobs"]:
+                    del self._playlists[playlist_id]
+            if remote_id in playlist["jobs"]:
+                return self._track(remote_id, self.client.job(remote_id))
+        return None
+
+    def _apply(self, job, data):
+        if data["state"] == job.state and job.finished:
+            return
+        job.update(data)
+        if job.finished:
+            self.bus.discard(job.id)
+        self.on_job(job)
+
+    def _follow(self, opened):
+        try:
+            for event, data in self.client.events(on_open=opened.set):
+                # A playlist's new jobs announce themselves with a job event before any progress
+                job = self._job_for(data["id"]) if event == "job" else self.jobs.get(data["id"])
+                if job is None:
+                    continue
+                if event == "job":
+                    self._apply(job, data)
+                elif event == "progress" and not job.finished:
+                    self.bus.publish(job.id, ProgressSample(data["status"], data["downloaded_bytes"],
+                                                            data["total_bytes"], data["speed"], data["eta"],
+                                                            data["target_rate"]))
+        except (OSError, RuntimeError, ValueError):
+            logger.warning("Lost the connection to the download daemon", exc_info=True)
+        finally:
+            opened.set()
+            self.connected = False
+            if self.on_lost is not None:
+                self.on_lost()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ytdl_engine.daemon",
+                                     description="Run the download engine as a background service with a REST API.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--token", default=None, help="require 'Authorization: Bearer TOKEN' on every request")
+    parser.add_argument("--root", default=None,
+                        help="folder jobs may save into; a job's save_path is taken relative to it and must stay "
+                             "inside (default: the current folder)")
+    parser.add_argument("-j", "--jobs", type=int, default=3,
+                        help="number of concurrent downloads (default: 3); with --adaptive, where new sites start")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="learn per site how many jobs and fragments to run from throughput and 403/429 errors")
+    parser.add_argument("--max-jobs", type=int, default=DEFAULT_MAX_JOBS,
+                        help=f"upper bound for --adaptive (default: {DEFAULT_MAX_JOBS})")
+    parser.add_argument("--backends", default="yt-dlp",
+                        help="download libraries to use, in order of preference (e.g. 'pytube,yt-dlp'); with more "
+                             "than one, each job goes to the one measured quickest on its site and falls back to "
+                             "the others on failure")
+    parser.add_argument("--allow-merge", dest="allow_merge", action="store_true", default=True,
+                        help="download separate video and audio streams and merge them (the default)")
+    parser.add_argument("--no-merge", dest="allow_merge", action="store_false",
+                        help="single files only: merge selectors fall back to their single-file alternative "
+                             "(e.g. 'bv*+ba/b' -> 'b'), which pytube can serve; explicit format ids are kept")
+    parser.add_argument("--ffmpeg", default=None, help="path to ffmpeg binary or its folder")
+    parser.add_argument("--merge-workers", type=int, default=None,
+                        help="concurrent ffmpeg merge/post-processing jobs (default: half the CPU cores)")
+    parser.add_argument("--audio-format", choices=AUDIO_FORMATS, default="best",
+                        help="codec of audio-only jobs (policy \"audio_only\"); 'best' keeps the downloaded one")
+    parser.add_argument("--audio-quality", default=None,
+                        help="when --audio-format re-encodes: VBR quality 0 (best) to 10, or a bitrate like 192K")
+    parser.add_argument("--convert-workers", type=int, default=None,
+                        help="concurrent audio re-encodes (default: CPU cores)")
+    parser.add_argument("--turbo", action="store_true", help="turbo mode for jobs that don't say otherwise")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS)
+    parser.add_argument("--fragments", type=int, default=DEFAULT_FRAGMENTS)
+    parser.add_argument("--stream-mux", nargs="?", const="mp4", choices=("mp4", "fmp4"), default=None,
+                        help="mux DASH video and audio through ffmpeg while they download instead of merging "
+                             "afterwards; 'fmp4' writes fragmented MP4 (POSIX only)")
+    parser.add_argument("--limit-rate", default=None, help="total download rate for all jobs, e.g. 4M (bytes/s)")
+    parser.add_argument("--schedule", default=None,
+                        help="time-of-day rate windows overriding --limit-rate, e.g. '08:00-18:00=1M,22:00-06:00=off'")
+    parser.add_argument("--archive", nargs="?", const="", default=None, metavar="PATH",
+                        help="skip videos already in the download archive and add new ones to it "
+                             "(default archive in the user data folder)")
+    parser.add_argument("--archive-hash", action="store_true",
+                        help="store a SHA-256 of every file added to the archive")
+    parser.add_argument("--manifest", nargs="?", const="", default=None, metavar="PATH",
+                        help="record the SHA-256 and size of every finished file, hashed while it downloads "
+                             "(default manifest in the user data folder)")
+    parser.add_argument("--fast-hash", action="store_true",
+                        help="also record a fast non-cryptographic hash for quick verification")
+    parser.add_argument("--sidecar", action="store_true",
+                        help="with --manifest, also write a sha256sum-style .sha256 file next to each download")
+    parser.add_argument("--no-staging", action="store_true",
+                        help="download straight into the save folder instead of a hidden staging folder there")
+    parser.add_argument("--min-free", default=DEFAULT_MIN_FREE,
+                        help="free space to leave on each save disk, e.g. 2G; downloads that would cut into it wait "
+                             "for running ones or fail (default: 512M)")
+    parser.add_argument("--no-preallocate", action="store_true",
+                        help="don't reserve each file's disk space when its download starts")
+    parser.add_argument("--buffer-size", default=None,
+                        help="fixed read/write block size, e.g. 256K (default: yt-dlp adapts it)")
+    parser.add_argument("--http-chunk-size", default=None,
+                        help="download HTTP files in ranged requests of this size, e.g. 10M")
+    parser.add_argument("--dns-ttl", type=float, default=DNS_TTL,
+                        help=f"seconds to reuse resolved host addresses, 0 to disable (default: {DNS_TTL:.0f})")
+    parser.add_argument("--no-resume", action="store_true", help="don't resume jobs left unfinished by a crash")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.host not in ("127.0.0.1", "localhost", "::1") and not args.token:
+        print("Refusing to listen beyond localhost without --token.", file=sys.stderr)
+        return 2
+
+    try:
+        bandwidth = BandwidthScheduler(args.limit_rate, parse_schedule(args.schedule))
+        backends = parse_backends(args.backends)
+        output = OutputManager(staging=not args.no_staging, min_free=args.min_free,
+                               preallocate=not args.no_preallocate, buffer_size=args.buffer_size,
+                               http_chunk_size=args.http_chunk_size)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    workers = args.jobs
+    concurrency = None
+    if args.adaptive:
+        workers = max(args.jobs, args.max_jobs)
+        concurrency = ConcurrencyController(jobs=args.jobs, max_jobs=workers, fragments=args.fragments)
+    archive = None
+    if args.archive is not None:
+        archive = DownloadArchive(args.archive or None, hash_files=args.archive_hash)
+    manifest = None
+    if args.manifest is not None:
+        manifest = Manifest(args.manifest or None, fast=args.fast_hash, sidecars=args.sidecar)
+    engine = DownloadEngine(workers=workers, ffmpeg_path=args.ffmpeg, cache=MetadataCache(),
+                            journal=JobJournal(), turbo=args.turbo, connections=args.connections,
+                            fragments=args.fragments, postprocess_workers=args.merge_workers, bandwidth=bandwidth,
+                            concurrency=concurrency, stream_mux=args.stream_mux, archive=archive,
+                            manifest=manifest, backends=backends,
+                            backend_stats=BackendStats() if len(backends) > 1 else None, output=output,
+                            dns_ttl=args.dns_ttl, audio_format=args.audio_format, audio_quality=args.audio_quality,
+                            conversion_workers=args.convert_workers, allow_merge=args.allow_merge)
+    metrics = MetricsRecorder(engine)
+    daemon = DownloadDaemon(engine, args.host, args.port, args.token, metrics, root=args.root)
+
+    async def run():
+        await daemon.start()
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows: Ctrl+C still raises KeyboardInterrupt
+        engine.warm_up()
+        if not args.no_resume:
+            resumed = engine.resume_unfinished()
+            if resumed:
+                print(f"Resumed {len(resumed)} unfinished job(s)", flush=True)
+        print(f"Listening on http://{args.host}:{daemon.port}", flush=True)
+        await stopping.wait()
+        await daemon.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Running jobs stay in the journal and are resumed on the next start
+        engine.shutdown(wait=False)
+        metrics.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
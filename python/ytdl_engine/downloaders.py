@@ -0,0 +1,672 @@
+# yt-dlp subclasses. Importing this module pulls in yt_dlp itself, so the engine only
+# imports it once a download actually starts (or from warm_up() in the background).
+import itertools
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import yt_dlp
+from yt_dlp.downloader.common import FileDownloader
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.networking.exceptions import HTTPError, TransportError
+from yt_dlp.postprocessor.common import PostProcessor
+from yt_dlp.postprocessor.embedthumbnail import EmbedThumbnailPP, EmbedThumbnailPPError
+from yt_dlp.postprocessor.ffmpeg import (
+    FFmpegExtractAudioPP, FFmpegMergerPP, FFmpegMetadataPP, FFmpegPostProcessor, FFmpegPostProcessorError,
+)
+from yt_dlp.utils import DownloadError, determine_protocol, parse_http_range, prepend_extension
+from yt_dlp.utils.networking import HTTPHeaderDict
+
+from .postprocess import DeferredPostprocessMixin, audio_transcodes
+from .segmented import (
+    DEFAULT_CONNECTIONS, MIN_SEGMENTED_SIZE, READ_BLOCK, REPORT_INTERVAL, SEGMENTS_SUFFIX, RangeScheduler,
+    load_segments, merge_ranges, preallocate, save_segments,
+)
+from .streammux import (
+    FRAGMENTED_MOVFLAGS, MUXERS, STREAM_MUX_PROTOCOL, can_stream_mux, mux_command, widen_pipe,
+)
+
+
+def read_block(params):
+    # A fixed 'buffersize' (with 'noresizebuffer', as yt-dlp's HttpFD reads it) also sizes our own reads
+    if params.get("noresizebuffer") and params.get("buffersize"):
+        return params["buffersize"]
+    return READ_BLOCK
+
+
+class SegmentedHttpFD(HttpFD):
+    # Downloads a single progressive HTTP file over several connections using Range requests,
+    # writing every segment in place into a preallocated .part file.
+
+    FD_NAME = "segmented"
+
+    def __init__(self, ydl, params, connections=DEFAULT_CONNECTIONS):
+        super().__init__(ydl, params)
+        self.connections = max(1, connections)
+
+    def real_download(self, filename, info_dict):
+        if self.connections < 2 or self.params.get("test") or filename == "-":
+            return super().real_download(filename, info_dict)
+
+        url = info_dict["url"]
+        headers = HTTPHeaderDict({"Accept-Encoding": "identity"}, info_dict.get("http_headers"))
+        if headers.get("Range"):
+            return super().real_download(filename, info_dict)
+
+        total = self._probe_size(url, headers)
+        if not total or total < MIN_SEGMENTED_SIZE:
+            return super().real_download(filename, info_dict)
+
+        tmpfilename = self.temp_name(filename)
+        sidecar = tmpfilename + SEGMENTS_SUFFIX
+        self.report_destination(filename)
+        done = None
+        if self.params.get("continuedl", True) and os.path.isfile(tmpfilename) \
+                and os.path.getsize(tmpfilename) == total:
+            done = load_segments(sidecar, total)
+        if done is None:
+            done = []
+            preallocate(tmpfilename, total)
+            save_segments(sidecar, total, done)
+        elif done:
+            self.report_resuming_byte(sum(e - s + 1 for s, e in done))
+
+        scheduler = RangeScheduler(total, done)
+        state = {"downloaded": sum(e - s + 1 for s, e in done), "error": None}
+        lock = threading.Lock()
+        stop = threading.Event()
+        retries = self.params.get("retries", 10)
+        throttle = self.params.get("bandwidth_throttle")
+        block_size = read_block(self.params)
+
+        def worker():
+            rate = None
+            failures = 0
+            with open(tmpfilename, "r+b") as out:
+                while not stop.is_set():
+                    segment = scheduler.claim(rate)
+                    if segment is None:
+                        return
+                    start, end = segment
+                    began = time.time()
+                    pos = start
+                    try:
+                        request = Request(url, headers=HTTPHeaderDict(headers, {"Range": f"bytes={start}-{end}"}))
+                        response = self.ydl.urlopen(request)
+                        if response.status != 206:
+                            response.close()
+                            raise TransportError(f"Server ignored range request (HTTP {response.status})")
+                        out.seek(start)
+                        while pos <= end and not stop.is_set():
+                            block = response.read(min(block_size, end - pos + 1))
+                            if not block:
+                                break
+                            out.write(block)
+                            pos += len(block)
+                            with lock:
+                                state["downloaded"] += len(block)
+                            if throttle is not None:
+                                throttle(len(block))
+                        response.close()
+                        if pos <= end:
+                            if stop.is_set():
+                                return
+                            raise TransportError(f"Connection closed at byte {pos} of range {start}-{end}")
+                        # Only ranges that are on disk get listed in the sidecar, so a crash never skips data
+                        out.flush()
+                        os.fsync(out.fileno())
+                        with lock:
+                            done[:] = [tuple(r) for r in merge_ranges(done + [(start, end)])]
+                            save_segments(sidecar, total, done)
+                    except (HTTPError, TransportError, OSError) as err:
+                        if pos > start:
+                            with lock:
+                                state["downloaded"] -= pos - start
+                        failures += 1
+                        if stop.is_set() or failures > retries:
+                            with lock:
+                                state["error"] = state["error"] or err
+                            stop.set()
+                            return
+                        scheduler.give_back(start, end)
+                        self.report_retry(err, failures, retries, fatal=False)
+                        time.sleep(min(failures, 5))
+                        continue
+                    elapsed = time.time() - began
+                    if elapsed > 0:
+                        rate = (end - start + 1) / elapsed
+
+        threads = [threading.Thread(target=worker, name=f"ytdl-segment-{i + 1}", daemon=True)
+                   for i in range(self.connections)]
+        start_time = time.time()
+        for t in threads:
+            t.start()
+
+        try:
+            while any(t.is_alive() for t in threads):
+                for t in threads:
+                    t.join(REPORT_INTERVAL / len(threads))
+                with lock:
+                    # Bytes before the first gap are final and can be hashed while the rest still arrives
+                    hashable = done[0][1] + 1 if done and done[0][0] == 0 else 0
+                self._report(filename, tmpfilename, info_dict, state["downloaded"], total, start_time, hashable)
+        except BaseException:
+            # Raised by a progress hook (e.g. user cancel); let the connections wind down
+            stop.set()
+            for t in threads:
+                t.join()
+            raise
+
+        if state["error"] is not None:
+            raise state["error"]
+
+        self.try_rename(tmpfilename, filename)
+        self.try_remove(sidecar)
+        self._hook_progress({
+            "downloaded_bytes": total,
+            "total_bytes": total,
+            "filename": filename,
+            "status": "finished",
+            "elapsed": time.time() - start_time,
+            "bandwidth_accounted": throttle is not None,
+        }, info_dict)
+        return True
+
+    def _probe_size(self, url, headers):
+        try:
+            response = self.ydl.urlopen(Request(url, headers=HTTPHeaderDict(headers, {"Range": "bytes=0-0"})))
+        except (HTTPError, TransportError):
+            return None
+        try:
+            if response.status != 206:
+                return None
+            _, _, total = parse_http_range(response.headers.get("Content-Range"))
+            return total
+        finally:
+            response.close()
+
+    def _report(self, filename, tmpfilename, info_dict, downloaded, total, start_time, hashable):
+        now = time.time()
+        speed = self.calc_speed(start_time, now, downloaded)
+        self._hook_progress({
+            "status": "downloading",
+            "downloaded_bytes": downloaded,
+            "total_bytes": total,
+            "tmpfilename": tmpfilename,
+            "filename": filename,
+            "eta": self.calc_eta(speed, total - downloaded),
+            "speed": speed,
+            "elapsed": now - start_time,
+            "bandwidth_accounted": self.params.get("bandwidth_throttle") is not None,
+            "hashable_bytes": hashable,
+        }, info_dict)
+
+
+class TurboYoutubeDL(yt_dlp.YoutubeDL):
+    # Routes plain HTTP(S) media downloads through SegmentedHttpFD; everything else uses yt-dlp's choice
+
+    def __init__(self, params=None, connections=DEFAULT_CONNECTIONS, **kwargs):
+        super().__init__(params, **kwargs)
+        self.connections = connections
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if test or subtitle or name == "-" or not info.get("url"):
+            return super().dl(name, info, subtitle, test)
+        if determine_protocol(info) not in ("http", "https") or info.get("impersonate"):
+            return super().dl(name, info, subtitle, test)
+        if self.params.get("external_downloader"):
+            return super().dl(name, info, subtitle, test)
+
+        fd = SegmentedHttpFD(self, self.params, self.connections)
+        for ph in self._progress_hooks:
+            fd.add_progress_hook(ph)
+        new_info = self._copy_infodict(info)
+        if new_info.get("http_headers") is None:
+            new_info["http_headers"] = self._calc_headers(new_info)
+        return fd.download(name, new_info, subtitle)
+
+
+class StreamMuxFD(FileDownloader):
+    # Downloads both streams of a merged format at once into pipes read by a single ffmpeg stream-copy
+    # process, so the final file is written once and there is nothing left to merge afterwards. Nothing
+    # is resumable: an interrupted job starts over. With the 'stream_hasher' param (a StreamHasher factory,
+    # not a yt-dlp option) fragmented MP4 comes out of ffmpeg's stdout and is hashed as it is written to
+    # the file; other containers need ffmpeg to seek in its output, so they are hashed afterwards.
+
+    FD_NAME = "streammux"
+
+    def real_download(self, filename, info_dict):
+        formats = info_dict["__mux_streams"]
+        ffmpeg = FFmpegPostProcessor(self.ydl).executable
+        tmpfilename = self.temp_name(filename)
+        self.report_destination(filename)
+        sizes = [f.get("filesize") or f.get("filesize_approx") for f in formats]
+        state = {"downloaded": 0, "error": None}
+        lock = threading.Lock()
+        stop = threading.Event()
+        throttle = self.params.get("bandwidth_throttle")
+        fragmented = self.params.get("stream_mux") == "fmp4"
+        hasher = None
+        if fragmented and MUXERS[info_dict["ext"]] in ("mp4", "mov") and self.params.get("stream_hasher"):
+            hasher = self.params["stream_hasher"]()
+
+        pipes = [os.pipe() for _ in formats]
+        for _, w in pipes:
+            widen_pipe(w)
+        cmd = mux_command(ffmpeg, [r for r, _ in pipes], formats, info_dict["ext"],
+                          "pipe:1" if hasher is not None else tmpfilename, fragmented)
+        stderr = tempfile.TemporaryFile()
+        try:
+            proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stderr=stderr, pass_fds=[r for r, _ in pipes],
+                                    stdout=subprocess.PIPE if hasher is not None else subprocess.DEVNULL)
+        except BaseException:
+            for fd in itertools.chain.from_iterable(pipes):
+                os.close(fd)
+            stderr.close()
+            raise
+        for r, _ in pipes:
+            os.close(r)
+
+        def feed(index, w):
+            try:
+                # Closing the write end is ffmpeg's end of input
+                with open(w, "wb", buffering=0) as out:
+                    for block in self._blocks(formats[index], index, sizes, stop):
+                        out.write(block)
+                        with lock:
+                            state["downloaded"] += len(block)
+                        if throttle is not None:
+                            throttle(len(block))
+            except Exception as err:
+                with lock:
+                    state["error"] = state["error"] or err
+                stop.set()
+
+        def drain():
+            # ffmpeg's output, written to the file and hashed in the same pass
+            try:
+                with open(tmpfilename, "wb") as out:
+                    for block in iter(lambda: proc.stdout.read(READ_BLOCK), b""):
+                        out.write(block)
+                        hasher.feed(block)
+            except Exception as err:
+                with lock:
+                    state["error"] = state["error"] or err
+                stop.set()
+                proc.kill()
+            finally:
+                proc.stdout.close()
+
+        threads = [threading.Thread(target=feed, args=(i, w), name=f"ytdl-mux-{i + 1}", daemon=True)
+                   for i, (_, w) in enumerate(pipes)]
+        writer = None
+        if hasher is not None:
+            writer = threading.Thread(target=drain, name="ytdl-mux-out", daemon=True)
+            threads.append(writer)
+        start_time = time.time()
+        for t in threads:
+            t.start()
+
+        try:
+            while any(t.is_alive() for t in threads if t is not writer):
+                for t in threads:
+                    t.join(REPORT_INTERVAL / len(threads))
+                total = sum(sizes) if all(sizes) else None
+                self._report(filename, tmpfilename, info_dict, state["downloaded"], total, start_time)
+            if state["error"] is not None:
+                proc.kill()
+            if writer is not None:
+                writer.join()
+            proc.wait()
+        except BaseException:
+            # Raised by a progress hook (e.g. user cancel)
+            stop.set()
+            proc.kill()
+            for t in threads:
+                t.join()
+            proc.wait()
+            stderr.close()
+            raise
+
+        stderr.seek(0)
+        message = stderr.read().decode("utf-8", "replace").strip()
+        stderr.close()
+        # A dead ffmpeg also breaks the pipes, so its own message explains more than the feeder's error
+        if proc.returncode and (message or state["error"] is None):
+            raise DownloadError(f"ffmpeg exited with code {proc.returncode}: {message or 'no output'}")
+        if state["error"] is not None:
+            raise state["error"]
+
+        self.try_rename(tmpfilename, filename)
+        if hasher is not None:
+            hasher.seal(filename)
+        self._hook_progress({
+            "downloaded_bytes": state["downloaded"],
+            "total_bytes": state["downloaded"],
+            "filename": filename,
+            "status": "finished",
+            "elapsed": time.time() - start_time,
+            "bandwidth_accounted": throttle is not None,
+            "hasher": hasher,
+        }, info_dict)
+        return True
+
+    def _blocks(self, f, index, sizes, stop):
+        headers = HTTPHeaderDict(f.get("http_headers"))
+        if f["protocol"] == "http_dash_segments":
+            return self._fragment_blocks(f, headers, stop)
+        chunk = self.params.get("http_chunk_size") or (f.get("downloader_options") or {}).get("http_chunk_size")
+        return self._http_blocks(f["url"], headers, chunk, index, sizes, stop)
+
+    def _http_blocks(self, url, headers, chunk, index, sizes, stop):
+        # One GET, or Range requests of `chunk` bytes where the site throttles long responses; a
+        # dropped connection resumes at the byte it stopped at
+        retries = self.params.get("retries", 10)
+        pos = 0
+        failures = 0
+        block_size = read_block(self.params)
+        while not stop.is_set():
+            end = pos + chunk - 1 if chunk else None
+            ranged = bool(chunk or pos)
+            request_headers = headers
+            if ranged:
+                request_headers = HTTPHeaderDict(headers, {"Range": f"bytes={pos}-{'' if end is None else end}"})
+            try:
+                response = self.ydl.urlopen(Request(url, headers=request_headers))
+                try:
+                    if ranged and response.status != 206:
+                        if pos:
+                            raise TransportError(f"Server ignored range request (HTTP {response.status})")
+                        chunk = None
+                    total = None
+                    if response.status == 206:
+                        _, _, total = parse_http_range(response.headers.get("Content-Range"))
+                    elif response.headers.get("Content-Length"):
+                        total = int(response.headers["Content-Length"])
+                    if total:
+                        sizes[index] = total
+                    while not stop.is_set():
+                        block = response.read(block_size)
+                        if not block:
+                            break
+                        pos += len(block)
+                        # Only failures in a row count against the retries, not every drop over a long download
+                        failures = 0
+                        yield block
+                finally:
+                    response.close()
+            except (HTTPError, TransportError) as err:
+                failures += 1
+                if stop.is_set() or failures > retries:
+                    raise
+                self.report_retry(err, failures, retries, fatal=False)
+                time.sleep(min(failures, 5))
+                continue
+            if total is None or pos >= total:
+                return
+
+    def _fragment_blocks(self, f, headers, stop):
+        # Fragments arrive in order, with up to concurrent_fragment_downloads of them fetched ahead
+        requests = []
+        for fragment in f["fragments"]:
+            url = fragment.get("url") or urljoin(f.get("fragment_base_url"), fragment["path"])
+            byte_range = fragment.get("byte_range")
+            if byte_range:
+                requests.append((url, HTTPHeaderDict(
+                    headers, {"Range": f"bytes={byte_range['start']}-{byte_range['end'] - 1}"})))
+            else:
+                requests.append((url, headers))
+        ahead = max(1, self.params.get("concurrent_fragment_downloads") or 1)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=ahead, thread_name_prefix="ytdl-mux-frag") as pool:
+            for index, (url, frag_headers) in enumerate(requests):
+                pending.append(pool.submit(self._fetch_fragment, url, frag_headers, index + 1, stop))
+                if len(pending) >= ahead:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _fetch_fragment(self, url, headers, index, stop):
+        retries = self.params.get("fragment_retries", 10)
+        for attempt in itertools.count(1):
+            try:
+                response = self.ydl.urlopen(Request(url, headers=headers))
+                try:
+                    return response.read()
+                finally:
+                    response.close()
+            except (HTTPError, TransportError) as err:
+                if stop.is_set() or attempt > retries:
+                    raise
+                self.report_retry(err, attempt, retries, index, fatal=False)
+                time.sleep(min(attempt, 5))
+
+    def _report(self, filename, tmpfilename, info_dict, downloaded, total, start_time):
+        now = time.time()
+        speed = self.calc_speed(start_time, now, downloaded)
+        self._hook_progress({
+            "status": "downloading",
+            "downloaded_bytes": downloaded,
+            "total_bytes": total,
+            "tmpfilename": tmpfilename,
+            "filename": filename,
+            "eta": self.calc_eta(speed, total - downloaded) if total else None,
+            "speed": speed,
+            "elapsed": now - start_time,
+            "bandwidth_accounted": self.params.get("bandwidth_throttle") is not None,
+            # Not read back while muxing: ffmpeg may still seek back to patch the header, and fmp4 output
+            # that can't is hashed as it is written
+            "hashable_bytes": 0,
+        }, info_dict)
+
+
+class StreamMuxMixin:
+    # With the 'stream_mux' param (not a yt-dlp option: True/"mp4" or "fmp4"), a merged format whose
+    # streams ffmpeg can read from a pipe becomes one download through StreamMuxFD instead of two files
+    # and a FFmpegMerger run
+
+    def process_info(self, info_dict):
+        if can_stream_mux(info_dict, self.params) and FFmpegPostProcessor(self).available:
+            streams = []
+            for f in info_dict.pop("requested_formats"):
+                f = dict(f)
+                if f.get("http_headers") is None:
+                    f["http_headers"] = self._calc_headers(dict(info_dict, **f))
+                streams.append(f)
+            info_dict["__mux_streams"] = streams
+            info_dict["protocol"] = STREAM_MUX_PROTOCOL
+        return super().process_info(info_dict)
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if info.get("protocol") != STREAM_MUX_PROTOCOL or subtitle or test:
+            return super().dl(name, info, subtitle, test)
+        fd = StreamMuxFD(self, self.params)
+        for ph in self._progress_hooks:
+            fd.add_progress_hook(ph)
+        return fd.download(name, info, subtitle)
+
+
+class HashingMergerPP(FFmpegMergerPP):
+    # FFmpegMerger that, like StreamMuxFD, has ffmpeg write fragmented MP4 to its stdout when there is a
+    # 'stream_hasher' and 'stream_mux' is "fmp4", so the merged file is hashed as it is written. Any other
+    # output needs ffmpeg to seek in it (moov at the end, +faststart, Matroska cues) and is merged by
+    # yt-dlp's FFmpegMerger, to be read back once for the manifest.
+
+    @PostProcessor._restrict_to(images=False)
+    def run(self, info):
+        if not self.get_param("stream_hasher") or self.get_param("stream_mux") != "fmp4" \
+                or MUXERS.get(info.get("ext")) not in ("mp4", "mov"):
+            return super().run(info)
+        self.check_version()
+        filename = info["filepath"]
+        temp_filename = prepend_extension(filename, "temp")
+        files = info["__files_to_merge"]
+        cmd = [self.executable, "-y", "-nostdin", "-hide_banner", "-loglevel", "error"]
+        for path in files:
+            cmd += ["-i", self._ffmpeg_filename_argument(path)]
+        # Same mapping as FFmpegMergerPP
+        audio_streams = 0
+        for i, fmt in enumerate(info["requested_formats"]):
+            if fmt.get("acodec") != "none":
+                cmd += ["-map", f"{i}:a:0"]
+                if fmt["protocol"].startswith("m3u8") and self.get_audio_codec(fmt["filepath"]) == "aac":
+                    cmd += [f"-bsf:a:{audio_streams}", "aac_adtstoasc"]
+                audio_streams += 1
+            if fmt.get("vcodec") != "none":
+                cmd += ["-map", f"{i}:v:0"]
+        cmd += ["-c", "copy", "-movflags", FRAGMENTED_MOVFLAGS, "-f", MUXERS[info["ext"]], "pipe:1"]
+
+        self.to_screen(f'Merging formats into "{filename}"')
+        hasher = self.get_param("stream_hasher")()
+        oldest_mtime = min(os.stat(path).st_mtime for path in files)
+        with tempfile.TemporaryFile() as stderr:
+            proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr)
+            try:
+                with proc.stdout, open(temp_filename, "wb") as out:
+                    for block in iter(lambda: proc.stdout.read(READ_BLOCK), b""):
+                        out.write(block)
+                        hasher.feed(block)
+            except BaseException:
+                proc.kill()
+                raise
+            finally:
+                proc.wait()
+            if proc.returncode:
+                stderr.seek(0)
+                message = stderr.read().decode("utf-8", "replace").strip()
+                raise FFmpegPostProcessorError(message.splitlines()[-1] if message else
+                                               f"ffmpeg exited with code {proc.returncode}")
+        self.try_utime(temp_filename, oldest_mtime, oldest_mtime)
+        os.replace(temp_filename, filename)
+        hasher.seal(filename)
+        return files, info
+
+
+class HashingMergeMixin:
+    # Swaps the FFmpegMerger yt-dlp queued for a merged format for HashingMergerPP, before the deferred
+    # post-processing records it
+
+    def post_process(self, filename, info, files_to_move=None):
+        if info.get("__postprocessors"):
+            info["__postprocessors"] = [HashingMergerPP(self) if type(pp) is FFmpegMergerPP else pp
+                                        for pp in info["__postprocessors"]]
+        return super().post_process(filename, info, files_to_move)
+
+
+class FinalFileMixin:
+    # Marks info dicts whose download is the finished file itself, as opposed to the separate video and
+    # audio files of a merged format; progress hooks see the mark in d['info_dict']['__final_file']
+
+    def process_info(self, info_dict):
+        info_dict["__final_file"] = not info_dict.get("requested_formats")
+        return super().process_info(info_dict)
+
+
+class CoverArtPP(EmbedThumbnailPP):
+    # Embeds the thumbnail where it can and otherwise leaves the file without cover art instead of failing
+    # the job (ogg, opus and flac need mutagen)
+
+    def run(self, info):
+        try:
+            return super().run(info)
+        except EmbedThumbnailPPError as e:
+            self.report_warning(f"Not embedding the thumbnail: {e}")
+            return [t["filepath"] for t in info.get("thumbnails") or () if t.get("filepath")], info
+
+
+class AudioExtractMixin:
+    # With the 'extract_audio' param (the codec to end up with, "best" to keep the downloaded one; not a
+    # yt-dlp option) the download becomes an audio file with its tags and the thumbnail as cover art.
+    # A codec the container takes as it is only gets remuxed; downloads that need re-encoding are marked
+    # '__audio_transcode' so the engine runs them on its conversion pool rather than with the merges.
+
+    def post_process(self, filename, info, files_to_move=None):
+        codec = self.params.get("extract_audio")
+        if codec:
+            info["__postprocessors"] = list(info.get("__postprocessors") or []) + [
+                FFmpegExtractAudioPP(self, preferredcodec=codec, preferredquality=self.params.get("audio_quality")),
+                FFmpegMetadataPP(self),
+                CoverArtPP(self),
+            ]
+            info["__audio_transcode"] = audio_transcodes(info, codec)
+        return super().post_process(filename, info, files_to_move)
+
+
+class SharedNetworkMixin:
+    # With the 'shared_network' param (a SharedNetwork, not a yt-dlp option), requests go through the
+    # urlopen() and cookie jar of the YoutubeDL it keeps for these networking params, so connections stay
+    # open from one instance to the next. Only public YoutubeDL attributes are swapped; the instance's own
+    # request director is never built unless yt-dlp asks for it directly, and then close() closes it.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shared_network = self.params.get("shared_network")
+        self.shared_opener = None
+        if self.shared_network is not None:
+            self.shared_opener = self.shared_network.opener(self.params)
+            # Cookies the extractors set land in the jar the shared requests send
+            self.cookiejar = self.shared_opener.cookiejar
+
+    def urlopen(self, req):
+        if self.shared_opener is None:
+            return super().urlopen(req)
+        return self.shared_network.urlopen(self.shared_opener, req)
+
+
+class SharedYoutubeDL(SharedNetworkMixin, yt_dlp.YoutubeDL):
+    pass
+
+
+class StagedYoutubeDL(SharedNetworkMixin, StreamMuxMixin, FinalFileMixin, AudioExtractMixin, HashingMergeMixin,
+                      DeferredPostprocessMixin, yt_dlp.YoutubeDL):
+    pass
+
+
+class StagedTurboYoutubeDL(SharedNetworkMixin, StreamMuxMixin, FinalFileMixin, AudioExtractMixin,
+                           HashingMergeMixin, DeferredPostprocessMixin, TurboYoutubeDL):
+    pass
+
+
+class PhaseMarkerPP(PostProcessor):
+    # Does nothing but report when yt-dlp reaches the stage it was registered for
+
+    def __init__(self, downloader, stage, callback):
+        super().__init__(downloader)
+        self.stage = stage
+        self.callback = callback
+
+    def run(self, information):
+        self.callback(self.stage)
+        return [], information
+
+
+# pre_process: extraction done; video: format selected; before_dl: subtitles/thumbnails written
+PHASE_STAGES = ("pre_process", "video", "before_dl")
+
+
+def add_phase_markers(ydl, callback):
+    for stage in PHASE_STAGES:
+        ydl.add_post_processor(PhaseMarkerPP(ydl, stage, callback), when=stage)
+
+
+class DiskAdmissionPP(PostProcessor):
+    # Hands the chosen formats to callback(info) before the download starts; the callback may block until
+    # there is room on disk, or raise to fail the job
+
+    def __init__(self, downloader, callback):
+        super().__init__(downloader)
+        self.callback = callback
+
+    def run(self, information):
+        self.callback(information)
+        return [], information
+
+
+def add_disk_admission(ydl, callback):
+    ydl.add_post_processor(DiskAdmissionPP(ydl, callback), when="before_dl")
@@ -0,0 +1,771 @@
+import copy
+import glob
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .archive import ArchiveView, info_archive_id, url_archive_id
+from .backends import make_backends
+from .bandwidth import BACKGROUND, NORMAL, THROTTLE_BLOCK, BandwidthScheduler
+from .errors import throttle_message, throttle_status
+from .formats import FormatPolicy, single_file_spec
+from .integrity import StreamHasher, TailHasher
+from .metrics import JobLogger
+from .network import DNS_TTL, SharedNetwork
+from .output import OutputManager, estimate_size
+from .playlist import Playlist, expand_playlist
+from .postprocess import PostprocessPool, default_conversion_workers
+from .prefetch import BatchPrefetcher, host_key
+from .progress import ProgressBus, ProgressSample
+from .segmented import DEFAULT_CONNECTIONS, DEFAULT_FRAGMENTS, SEGMENTS_SUFFIX, turbo_opts
+from .session import open_session
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+# Already in the download archive; nothing was transferred
+SKIPPED = "skipped"
+
+FINAL_STATES = (DONE, FAILED, CANCELLED, SKIPPED)
+# Jobs smaller than this finish too fast for their rate to say anything about fragment counts
+MIN_RATE_SAMPLE = 8 * 1024 * 1024
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, url, format_id=None, save_path=".", ffmpeg_path=None, session=None, format_spec=None,
+                 turbo=False, journal_id=None, policy=None, priority=NORMAL, weight=1.0, audio_only=False,
+                 audio_format=None, audio_quality=None):
+        self.id = next(Job._ids)
+        self.journal_id = journal_id or uuid.uuid4().hex
+        self.url = url
+        self.session = session
+        self.format_id = format_id
+        # A FormatPolicy is ranked against the video's formats when the job starts; until then its yt-dlp
+        # approximation stands in
+        self.policy = policy
+        self.selection = None
+        # Bandwidth share: higher priorities preempt lower ones, weights split bandwidth within a priority
+        self.priority = priority
+        self.weight = weight
+        self.flow = None
+        # Audio jobs keep only the sound, extracted into a tagged audio file; a hand-picked format without
+        # video is one too, rather than half of a merge
+        self.audio_only = audio_only or (policy is not None and policy.audio_only)
+        # Codec and quality an audio job ends as; None takes the engine's
+        self.audio_format = audio_format
+        self.audio_quality = audio_quality
+        if format_id and format_spec is None and session is not None:
+            picked = next((f for f in session.format_records if f.format_id == format_id), None)
+            if picked is not None and picked.has_audio and not picked.has_video:
+                self.audio_only = True
+                format_spec = format_id
+        if format_spec is None:
+            if format_id:
+                format_spec = f"{format_id}+bestaudio/best"
+            else:
+                format_spec = policy.format_spec() if policy is not None else "bestvideo+bestaudio/best"
+        self.format_spec = format_spec
+        self.save_path = save_path or "."
+        self.ffmpeg_path = ffmpeg_path
+        self.turbo = turbo
+        # Fragments/connections per file in turbo mode, when a ConcurrencyController decides it
+        self.fragments = None
+        self.state = QUEUED
+        self.phase = QUEUED
+        self.error = None
+        self.title = None
+        self.filename = None
+        self.tmpfilename = None
+        # The finished file, after any merge
+        self.output = None
+        # "extractor id" key for the download archive, once known
+        self.archive_id = None
+        # TailHasher fed from the progress hook (or a StreamHasher on ffmpeg's output), and the finished file's
+        # SHA-256 once in the manifest
+        self.hasher = None
+        self.sha256 = None
+        # Name of the backend that ran (or is running) the download
+        self.backend = None
+        self.part_files = set()
+        # Files whose blocks were reserved on disk as their download started
+        self.preallocated = set()
+        # Folder the job downloads into before its finished files move to save_path; None writes in place
+        self.staging_dir = None
+        self.journal_updated = 0.0
+        self.timings = {}
+        # Wall-clock stamps of the stages a job passes through; timings are derived from them when it ends
+        self.marks = {"submitted": time.time()}
+        self.pp_seconds = {}
+        self.pp_started = {}
+        self.retries = 0
+        # True when the job had to extract the page itself before downloading, to apply its policy
+        self.extracted_for_policy = False
+        self.file_bytes = {}
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.speed = None
+        self.eta = None
+        self.cancel_event = threading.Event()
+        self.keep_partial = False
+        self.done_event = threading.Event()
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.state} {self.url}>"
+
+    @property
+    def percent(self):
+        if not self.total_bytes:
+            return 0.0
+        return min(100.0, self.downloaded_bytes * 100.0 / self.total_bytes)
+
+    @property
+    def finished(self):
+        return self.state in FINAL_STATES
+
+    @property
+    def bytes_done(self):
+        # Bytes written across every file of the job (video and audio are downloaded separately)
+        return sum(self.file_bytes.values())
+
+    def mark(self, name):
+        self.marks[name] = time.time()
+
+    def phase_timings(self):
+        marks = self.marks
+        timings = {}
+
+        def span(name, start, end):
+            if start in marks and end in marks:
+                timings[name] = max(0.0, marks[end] - marks[start])
+
+        span("queue", "submitted", "started")
+        span("extract", "started", "pre_process")
+        if "extract" in timings and self.session is not None and self.session.extract_seconds and \
+                not self.extracted_for_policy:
+            # The page was extracted earlier, when the format list was fetched
+            timings["extract"] += self.session.extract_seconds
+        span("format_selection", "pre_process", "video")
+        span("thumbnail", "video", "before_dl")
+        span("download", "before_dl", "downloaded")
+        merge = sum(seconds for name, seconds in self.pp_seconds.items() if name != "MoveFiles")
+        if self.pp_seconds:
+            timings["merge"] = merge
+        if "downloaded" in marks and "finished" in marks:
+            waited = self.timings.get("merge_wait", 0.0)
+            timings["finalize"] = max(0.0, marks["finished"] - marks["downloaded"] - merge - waited)
+        return timings
+
+    def cancel(self, keep_partial=False):
+        # keep_partial: stop without deleting .part files, e.g. because another process will resume them
+        self.keep_partial = keep_partial
+        self.cancel_event.set()
+
+    def wait(self, timeout=None):
+        return self.done_event.wait(timeout)
+
+
+def _warm_up(opts):
+    from .downloaders import StagedYoutubeDL
+
+    with StagedYoutubeDL(dict(opts, quiet=True)):
+        pass
+
+
+class DownloadEngine:
+    def __init__(self, workers=3, ffmpeg_path=None, ydl_opts=None, metadata_workers=2, cache=None,
+                 turbo=False, connections=DEFAULT_CONNECTIONS, fragments=DEFAULT_FRAGMENTS, journal=None,
+                 postprocess_workers=None, bandwidth=None, concurrency=None, stream_mux=None, archive=None,
+                 manifest=None, backends=None, backend_stats=None, output=None, dns_ttl=DNS_TTL, audio_format="best",
+                 audio_quality=None, conversion_workers=None, allow_merge=True):
+        self.workers = max(1, int(workers))
+        self.ffmpeg_path = ffmpeg_path
+        self.cache = cache
+        self.journal = journal
+        # Turbo mode: parallel DASH/HLS fragments and multi-connection ranges for progressive files
+        self.turbo = turbo
+        self.connections = connections
+        self.fragments = fragments
+        # "mp4" or "fmp4": mux pipe-readable video+audio pairs while they download instead of merging after
+        self.stream_mux = stream_mux
+        # Optional DownloadArchive: jobs for videos already in it end as SKIPPED without downloading
+        self.archive = archive
+        # Optional Manifest: every finished file is recorded with its digests, hashed while it downloads
+        self.manifest = manifest
+        # Staging folders, free-space admission, preallocation and I/O buffer sizes
+        self.output = output or OutputManager()
+        # Extractions, downloads and thumbnail fetches share one keep-alive pool per host, sized so
+        # every worker's connections fit, and a DNS cache
+        self.network = SharedNetwork(self.workers * max(1, connections, fragments) + metadata_workers, dns_ttl)
+        self.ydl_opts = dict(ydl_opts or {})
+        self.ydl_opts.setdefault('shared_network', self.network)
+        # Download libraries by preference ("yt-dlp", "pytube"); with several, a BackendStats routes each job
+        # to the one that has been quickest on its site, and the others are its fallbacks
+        self.backends = make_backends(backends, self._download, self.ydl_opts)
+        self.backend_stats = backend_stats
+        # False: single files only, so merge selectors fall back to their single-file alternatives (which lets
+        # backends without a merger, like pytube, take those jobs too)
+        self.allow_merge = allow_merge
+        self.jobs = []
+        self.listeners = []
+        self.progress = ProgressBus()
+        # Merges/fixups run here so download workers are free for the next job meanwhile
+        self.postprocessor = PostprocessPool(postprocess_workers)
+        # Audio jobs end as this codec ("best": whatever was downloaded, only remuxed); the ones that need
+        # re-encoding queue here, one ffmpeg per core, instead of holding up the merges
+        self.audio_format = audio_format or "best"
+        self.audio_quality = audio_quality
+        self.conversions = PostprocessPool(conversion_workers or default_conversion_workers(), "ytdl-convert")
+        # Unlimited unless configured, but still measures what every job achieves
+        self.bandwidth = bandwidth or BandwidthScheduler()
+        # Optional ConcurrencyController: per-site job limits below `workers`, learned fragment counts
+        self.concurrency = concurrency
+        self._deferred = {}
+        # (-priority, seq, job): higher priorities start first, FIFO within a priority
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._closed = False
+        self._metadata_pool = ThreadPoolExecutor(max_workers=metadata_workers,
+                                                 thread_name_prefix="ytdl-meta")
+        self._prefetcher = None
+
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"ytdl-worker-{i + 1}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def add_listener(self, fn):
+        # fn(job) is called from worker threads whenever a job changes state; byte progress goes to self.progress
+        self.listeners.append(fn)
+
+    def remove_listener(self, fn):
+        if fn in self.listeners:
+            self.listeners.remove(fn)
+
+    def warm_up(self):
+        # Imports yt-dlp and builds one YoutubeDL on a metadata thread, so the first fetch or download
+        # doesn't pay for it; the GUIs call this after their first paint
+        return self._metadata_pool.submit(_warm_up, self.ydl_opts)
+
+    def fetch_info(self, url, force_refresh=False):
+        # Resolves to a VideoSession that can be handed back to submit()
+        return self._metadata_pool.submit(open_session, url, self.ydl_opts, self.cache, force_refresh)
+
+    def prefetch(self, urls, callback=None, force_refresh=False):
+        # fetch_info() for a whole batch: extractions run in parallel with per-host caps and 429 backoff,
+        # and callback(PrefetchResult) fires as each one lands. Returns a PrefetchBatch.
+        with self._lock:
+            if self._prefetcher is None:
+                self._prefetcher = BatchPrefetcher(self.ydl_opts, self.cache)
+        self._prefetcher.cache = self.cache
+        return self._prefetcher.prefetch(urls, callback, force_refresh)
+
+    def submit(self, url, format_id=None, save_path=".", ffmpeg_path=None, session=None, format_spec=None,
+               turbo=None, journal_id=None, policy=None, priority=NORMAL, weight=1.0, audio_only=False,
+               audio_format=None, audio_quality=None):
+        # policy: a FormatPolicy to pick the format automatically; ignored when format_id/format_spec is given.
+        # audio_only keeps just the sound of whatever format is picked; audio_format/audio_quality override
+        # the engine's for this job.
+        if self._closed:
+            raise RuntimeError("Engine has been shut down.")
+        if session is not None and session.url != url:
+            session = None
+        if format_id or format_spec:
+            policy = None
+        if not self.allow_merge:
+            # An explicit format id is left as asked
+            if format_spec:
+                format_spec = single_file_spec(format_spec) or format_spec
+            elif policy is not None:
+                policy = FormatPolicy.from_dict(dict(policy.to_dict(), allow_merge=False))
+            elif not format_id:
+                format_spec = "best"
+        # The engine's audio settings are fixed into the job, so the journal resumes it with the same ones
+        job = Job(url, format_id, save_path, ffmpeg_path or self.ffmpeg_path, session, format_spec,
+                  self.turbo if turbo is None else turbo, journal_id, policy, priority, weight, audio_only,
+                  audio_format or self.audio_format, self.audio_quality if audio_quality is None else audio_quality)
+        with self._lock:
+            self.jobs.append(job)
+        if self.journal is not None:
+            self.journal.record(job)
+        self._emit(job)
+        self._enqueue(job)
+        return job
+
+    def resume_unfinished(self):
+        # Re-queues jobs the journal still lists as queued/running, e.g. after a crash or the window was closed.
+        # yt-dlp continues from the existing .part files (and segment sidecars in turbo mode). Jobs another
+        # live process journaled are left to it.
+        if self.journal is None:
+            return []
+        resumed = []
+        for row in self.journal.claim_unfinished():
+            policy = FormatPolicy.from_dict(row["policy"]) if row["policy"] else None
+            # A policy job ranks the formats again, which is what it did (and the journal noted) the first time
+            format_spec = None if policy is not None else row["format_spec"]
+            resumed.append(self.submit(row["url"], row["format_id"], row["save_path"], row["ffmpeg_path"],
+                                       format_spec=format_spec, turbo=bool(row["turbo"]), journal_id=row["id"],
+                                       policy=policy, priority=row["priority"], audio_only=bool(row["audio_only"]),
+                                       audio_format=row["audio_format"], audio_quality=row["audio_quality"]))
+        return resumed
+
+    def submit_playlist(self, url, format_spec=None, save_path=".", ffmpeg_path=None, subfolder=True, limit=None,
+                        policy=None, priority=BACKGROUND):
+        # Expands a playlist/channel in the background, queueing each entry as soon as it is listed.
+        # Every entry is downloaded with the same format_spec or policy and resolves its own formats when
+        # it starts.
+        playlist = Playlist(url)
+        self._metadata_pool.submit(expand_playlist, self, playlist, format_spec, save_path, ffmpeg_path,
+                                   subfolder, limit, policy, priority)
+        return playlist
+
+    def cancel(self, job, keep_partial=False):
+        job.cancel(keep_partial)
+        if job.state == QUEUED:
+            self._finish(job, CANCELLED)
+
+    def cancel_all(self):
+        for job in list(self.jobs):
+            self.cancel(job)
+
+    def active_jobs(self):
+        with self._lock:
+            return [j for j in self.jobs if not j.finished]
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def wait_all(self, timeout=None):
+        for job in list(self.jobs):
+            job.wait(timeout)
+
+    def shutdown(self, wait=True, cancel=False):
+        self._closed = True
+        if cancel:
+            self.cancel_all()
+        for _ in self._threads:
+            # Sorts after every job, so queued jobs still run unless cancelled
+            self._queue.put((-BACKGROUND + 1, next(self._seq), None))
+        self._metadata_pool.shutdown(wait=False)
+        if self._prefetcher is not None:
+            self._prefetcher.shutdown(wait=False)
+        if wait:
+            for t in self._threads:
+                t.join()
+        self.postprocessor.shutdown(wait=wait)
+        self.conversions.shutdown(wait=wait)
+        if wait:
+            self.network.close()
+
+    def build_opts(self, job):
+        ydl_opts = {
+            'format': job.format_spec,
+            'outtmpl': os.path.join(job.save_path, '%(title)s.%(ext)s'),
+            'quiet': True,
+            'noprogress': True,
+            'progress_hooks': [lambda d: self._hook(job, d)],
+            'postprocessor_hooks': [lambda d: self._pp_hook(job, d)],
+            'logger': JobLogger(job, lambda msg: self._on_retry(job, msg)),
+            # Not a yt-dlp option: read by SegmentedHttpFD, which throttles per block instead of per report
+            'bandwidth_throttle': lambda n: job.flow is not None and self.bandwidth.consume(job.flow, n),
+            'merge_output_format': 'mp4',
+        }
+        if job.ffmpeg_path:
+            ydl_opts['ffmpeg_location'] = job.ffmpeg_path
+        if job.audio_only:
+            # Not yt-dlp options: read by AudioExtractMixin; the thumbnail becomes the cover art
+            del ydl_opts['merge_output_format']
+            audio_quality = self.audio_quality if job.audio_quality is None else job.audio_quality
+            ydl_opts.update({'extract_audio': job.audio_format or self.audio_format, 'audio_quality': audio_quality,
+                             'writethumbnail': True})
+        if job.turbo:
+            ydl_opts.update(turbo_opts(job.fragments or self.fragments))
+        if self.stream_mux:
+            ydl_opts['stream_mux'] = self.stream_mux
+        if self.manifest is not None:
+            # Not a yt-dlp option: StreamMuxFD and HashingMergerPP hash ffmpeg's output as they write it
+            ydl_opts['stream_hasher'] = lambda: self._stream_hasher(job)
+        if self.archive is not None:
+            # Lets yt-dlp skip what only turns out to be archived once the page is extracted
+            ydl_opts['download_archive'] = ArchiveView(self.archive, job)
+        ydl_opts.update(self.output.ydl_opts(job))
+        if self.bandwidth.limited:
+            buffersize = min(ydl_opts.get('buffersize') or THROTTLE_BLOCK, THROTTLE_BLOCK)
+            ydl_opts.update({'buffersize': buffersize, 'noresizebuffer': True})
+        ydl_opts.update(self.ydl_opts)
+        return ydl_opts
+
+    def _worker(self):
+        while True:
+            _, _, job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                if job.finished or not self._admit(job):
+                    continue
+                try:
+                    self._run(job)
+                finally:
+                    self._release(job)
+            finally:
+                self._queue.task_done()
+
+    def _enqueue(self, job):
+        self._queue.put((-job.priority, next(self._seq), job))
+
+    def _admit(self, job):
+        # A site at its learned job limit parks the job until one of its jobs ends, leaving this worker
+        # free for other sites
+        if self.concurrency is None:
+            return True
+        with self._lock:
+            if self.concurrency.try_acquire(job.url):
+                return True
+            self._deferred.setdefault(host_key(job.url), deque()).append(job)
+            return False
+
+    def _release(self, job):
+        if self.concurrency is None:
+            return
+        with self._lock:
+            self._wake(host_key(job.url), self.concurrency.release(job.url, job.id))
+
+    def _wake(self, host, slots):
+        # Caller holds self._lock
+        waiting = self._deferred.get(host)
+        while waiting and slots > 0:
+            job = waiting.popleft()
+            if not job.finished:
+                self._enqueue(job)
+                slots -= 1
+        if not waiting:
+            self._deferred.pop(host, None)
+
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            self._finish(job, CANCELLED)
+            return
+        if self._archived(job):
+            self._finish(job, SKIPPED)
+            return
+        job.state = RUNNING
+        job.phase = "extracting"
+        job.mark("started")
+        self._emit(job)
+        job.staging_dir = self.output.staging_dir(job)
+        job.flow = self.bandwidth.register(job.id, job.priority, job.weight, job.cancel_event)
+        if self.concurrency is not None:
+            job.fragments = self.concurrency.fragments(job.url)
+        try:
+            deferred = self._dispatch(job)
+        except Exception as e:
+            if job.cancel_event.is_set():
+                self._discard_partial(job)
+                self._finish(job, CANCELLED)
+            else:
+                if self.concurrency is not None and throttle_status(e):
+                    self.concurrency.throttled(job.url)
+                self._finish(job, FAILED, e)
+            return
+        finally:
+            self.bandwidth.unregister(job.flow)
+        # yt-dlp moves the files out of the staging folder once they are complete
+        job.output = self.output.final_path(job, deferred[-1][0] if deferred else job.filename)
+        if self.concurrency is not None and job.turbo and not job.cancel_event.is_set():
+            began = job.marks.get("before_dl")
+            if began is not None and job.bytes_done >= MIN_RATE_SAMPLE:
+                self.concurrency.report_job(job.url, job.bytes_done / max(0.001, time.time() - began))
+        if job.cancel_event.is_set():
+            self._finish(job, CANCELLED)
+        elif not job.file_bytes and self.archive is not None and job.archive_id in self.archive:
+            self._finish(job, SKIPPED)
+        elif deferred:
+            job.phase = "postprocessing"
+            if self.journal is not None:
+                self.journal.update_progress(job, force=True)
+            transcode = any(info.get('__audio_transcode') for _, info, _ in deferred)
+            pool = self.conversions if transcode else self.postprocessor
+            pool.submit(job, self.build_opts(job), deferred, self._postprocessed)
+        else:
+            self._record_manifest(job)
+            self._record_archive(job)
+            self._finish(job, DONE)
+
+    def _postprocessed(self, job, error):
+        # Once the merge has started the download is kept even if the user cancels meanwhile
+        if error is not None:
+            self._finish(job, FAILED, error)
+        else:
+            self._record_manifest(job)
+            self._record_archive(job)
+            self._finish(job, DONE)
+
+    def _archived(self, job):
+        # Checked before extraction: from the format list's info when there is one, else from the URL
+        if self.archive is None:
+            return False
+        if job.session is not None:
+            key = info_archive_id(job.session.info)
+        else:
+            key = url_archive_id(job.url)
+        if key is not None and key in self.archive:
+            job.archive_id = key
+            return True
+        return False
+
+    def _record_archive(self, job):
+        if self.archive is None or job.archive_id is None:
+            return
+        try:
+            self.archive.record(job.archive_id, job.url, job.title, job.output, sha256=job.sha256)
+        except Exception:
+            # The download itself succeeded; it just won't be skipped next time
+            logger.exception("Could not record %s in the download archive", job.archive_id)
+
+    def _record_manifest(self, job):
+        # A merged or fixed-up file no longer matches what the hook hashed and is read once here instead
+        if self.manifest is None or not job.output or not os.path.isfile(job.output):
+            return
+        try:
+            job.sha256 = self.manifest.record_file(job.output, job.hasher, job.url, job.title, job.archive_id,
+                                                   job.format_spec).sha256
+        except Exception:
+            logger.exception("Could not record %s in the manifest", job.output)
+        job.hasher = None
+
+    def make_ydl(self, job):
+        from .downloaders import StagedTurboYoutubeDL, StagedYoutubeDL, add_disk_admission, add_phase_markers
+
+        if job.turbo:
+            ydl = StagedTurboYoutubeDL(self.build_opts(job), connections=job.fragments or self.connections)
+        else:
+            ydl = StagedYoutubeDL(self.build_opts(job))
+        add_phase_markers(ydl, job.mark)
+        add_disk_admission(ydl, lambda info: self._reserve_space(job, info))
+        return ydl
+
+    def _reserve_space(self, job, info):
+        # Runs once the formats are chosen, before any byte is written
+        self.output.admit(job, estimate_size(info), lambda: self._emit(job))
+
+    def _apply_policy(self, job):
+        # Ranks the video's own format list, so the choice is exact and the same on every run. The chosen
+        # ids go to the journal, so a resumed job continues the same files.
+        if job.session is None or not job.session.fresh:
+            job.session = open_session(job.url, self.ydl_opts, self.cache, force_refresh=job.session is not None)
+            job.extracted_for_policy = True
+        job.selection = job.session.select(job.policy)
+        if job.selection is not None:
+            job.format_spec = job.selection.format_spec
+            if self.journal is not None:
+                self.journal.update_state(job)
+
+    def _dispatch(self, job):
+        # A failure only counts against a backend once another one got the same job through
+        candidates = [b for b in self.backends if b.supports(job)] or self.backends[:1]
+        if self.backend_stats is not None and len(candidates) > 1:
+            order = self.backend_stats.rank(job.url, [b.name for b in candidates])
+            candidates.sort(key=lambda b: order.index(b.name))
+        candidates += [b for b in self.backends if b not in candidates and b.fallback_for(job)]
+        failed = []
+        for backend in candidates:
+            began = time.time()
+            job.backend = backend.name
+            job.marks.pop("first_byte", None)
+            job.marks.pop("downloaded", None)
+            try:
+                deferred = backend.download(job, lambda d: self._hook(job, d))
+            except Exception as e:
+                if job.cancel_event.is_set() or backend is candidates[-1]:
+                    raise
+                logger.warning("%s failed for %s, trying the next backend: %s", backend.name, job.url, e)
+                failed.append(backend.name)
+                self._discard_partial(job)
+                job.part_files.clear()
+                job.file_bytes.clear()
+                continue
+            self._record_backend(job, began, failed)
+            return deferred
+
+    def _record_backend(self, job, began, failed):
+        if self.backend_stats is None or "first_byte" not in job.marks:
+            return
+        first_byte = job.marks["first_byte"]
+        rate = None
+        if job.bytes_done >= MIN_RATE_SAMPLE and "downloaded" in job.marks:
+            rate = job.bytes_done / max(0.001, job.marks["downloaded"] - first_byte)
+        self.backend_stats.record(job.url, job.backend, max(0.0, first_byte - began), rate)
+        for name in failed:
+            self.backend_stats.failure(job.url, name)
+
+    def _download(self, job):
+        # Returns the post-processing work yt-dlp wanted to run inline, for the merge pool
+        if job.policy is not None:
+            self._apply_policy(job)
+        with self.make_ydl(job) as ydl:
+            if job.session is None or not job.session.fresh:
+                ydl.download([job.url])
+                return ydl.deferred
+            try:
+                # Reuse the info fetched for the format list instead of extracting the page again
+                ydl.process_ie_result(copy.deepcopy(job.session.info), download=True)
+            except Exception:
+                # Stream URLs in the stored info may have expired; fall back to a fresh extraction
+                if job.cancel_event.is_set() or job.downloaded_bytes:
+                    raise
+                if self.cache is not None:
+                    self.cache.invalidate(job.url)
+                job.session = None
+                ydl.download([job.url])
+            return ydl.deferred
+
+    def _discard_partial(self, job):
+        # A user cancel means the partial data is not wanted; crashes leave it in place for resume
+        if job.keep_partial and job.cancel_event.is_set():
+            return
+        self.output.discard(job)
+        for path in job.part_files:
+            leftovers = [path, path + ".ytdl", path + SEGMENTS_SUFFIX] + glob.glob(glob.escape(path) + "-Frag*")
+            for leftover in leftovers:
+                try:
+                    if os.path.isfile(leftover):
+                        os.remove(leftover)
+                except OSError:
+                    pass
+
+    def _finish(self, job, state, error=None):
+        if job.finished:
+            return
+        job.state = state
+        job.phase = state
+        job.error = error
+        job.mark("finished")
+        job.timings.update(job.phase_timings())
+        self.output.release(job)
+        self.output.finish(job)
+        self.progress.discard(job.id)
+        self._emit(job)
+        job.done_event.set()
+
+    def _hook(self, job, d):
+        if job.cancel_event.is_set():
+            raise DownloadCancelled("Download cancelled by user.")
+
+        if d['status'] == 'downloading' and "first_byte" not in job.marks:
+            job.mark("first_byte")
+            if self.concurrency is not None and "before_dl" in job.marks:
+                self.concurrency.report_latency(job.url, job.marks["first_byte"] - job.marks["before_dl"])
+        job.downloaded_bytes = d.get('downloaded_bytes') or 0
+        job.total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
+        job.filename = d.get('filename') or job.filename
+        if job.title is None:
+            job.title = (d.get('info_dict') or {}).get('title')
+        if job.filename:
+            previous = job.file_bytes.get(job.filename, 0)
+            job.file_bytes[job.filename] = job.downloaded_bytes
+            # The segmented downloader throttles each connection itself and marks its reports
+            if job.flow is not None and not d.get('bandwidth_accounted'):
+                self.bandwidth.consume(job.flow, job.downloaded_bytes - previous)
+        job.speed = d.get('speed')
+        job.eta = d.get('eta')
+        target = job.flow.target if job.flow is not None else None
+        if target is not None:
+            # yt-dlp averages over the whole file, which lags far behind a throttled rate
+            job.speed = job.flow.achieved
+            remaining = (job.total_bytes or 0) - job.downloaded_bytes
+            job.eta = remaining / job.speed if job.speed and remaining > 0 else None
+        if d.get('tmpfilename'):
+            job.tmpfilename = d['tmpfilename']
+            job.part_files.add(d['tmpfilename'])
+            if d['status'] == 'downloading' and d['tmpfilename'] not in job.preallocated:
+                self._preallocate(job, d)
+        finished = d['status'] == 'finished'
+        if self.manifest is not None and (d.get('info_dict') or {}).get('__final_file') and d.get('filename'):
+            self._hash_progress(job, d, finished)
+        if finished:
+            job.mark("downloaded")
+        elif self.concurrency is not None and self.concurrency.report_speed(job.url, job.id, job.speed):
+            with self._lock:
+                self._wake(host_key(job.url), 1)
+        job.phase = "postprocessing" if finished else "downloading"
+        self.progress.publish(job.id, ProgressSample(d['status'], job.downloaded_bytes, job.total_bytes,
+                                                     job.speed, job.eta, target))
+        if self.journal is not None:
+            self.journal.update_progress(job, force=finished)
+
+    def _preallocate(self, job, d):
+        # Reserves the file's blocks, and checks free space for jobs admitted without a size estimate. Only
+        # an exact size: estimates would leave reserved blocks past the end of the file, and stream-mux
+        # totals are the inputs' sizes, not the muxed file's.
+        job.preallocated.add(d['tmpfilename'])
+        if d.get('total_bytes') and not (d.get('info_dict') or {}).get('__mux_streams') \
+                and os.path.isfile(d['tmpfilename']):
+            self.output.allocate(job, d['tmpfilename'], d['total_bytes'])
+
+    def _stream_hasher(self, job):
+        # The digest _record_manifest uses once the file it was sealed on is the job's output
+        job.hasher = StreamHasher(self.manifest.fast)
+        return job.hasher
+
+    def _hash_progress(self, job, d, finished):
+        # Reads back what was written since the last report, usually still from the page cache. Merged
+        # output can't be hashed this way (ffmpeg seeks back to patch headers): fmp4 output is hashed as
+        # ffmpeg writes it, anything else is read once by _record_manifest.
+        if d.get('hasher') is not None:
+            job.hasher = d['hasher']
+            return
+        if job.hasher is None or job.hasher.filename != d['filename']:
+            job.hasher = TailHasher(d['filename'], self.manifest.fast)
+        try:
+            if finished:
+                job.hasher.seal(d['filename'])
+            elif d.get('tmpfilename') and d.get('hashable_bytes') != 0:
+                job.hasher.update(d['tmpfilename'], d.get('hashable_bytes'))
+        except OSError:
+            # Renamed or not created yet; the next report, or the manifest, catches up
+            pass
+
+    def _pp_hook(self, job, d):
+        # Deferred post-processors report to the hooks of both YoutubeDL instances, so only the
+        # first "finished" after a "started" counts
+        name = d.get('postprocessor')
+        if name in ("PhaseMarker", "DiskAdmission"):
+            return
+        if d['status'] == 'started':
+            job.pp_started[name] = time.time()
+        elif d['status'] == 'finished':
+            began = job.pp_started.pop(name, None)
+            if began is not None:
+                job.pp_seconds[name] = job.pp_seconds.get(name, 0.0) + time.time() - began
+
+    def _on_retry(self, job, msg):
+        # yt-dlp retrying after a 403/429 on a fragment or range
+        status = throttle_message(msg)
+        if self.concurrency is not None and status is not None:
+            self.concurrency.throttled(job.url, jobs=status == 429)
+
+    def _emit(self, job):
+        if self.journal is not None and job.state != QUEUED:
+            self.journal.update_state(job)
+        for fn in list(self.listeners):
+            try:
+                fn(job)
+            except Exception:
+                logger.exception("Listener error for %r", job)
@@ -0,0 +1,70 @@
+import re
+import time
+from email.utils import parsedate_to_datetime
+
+# Statuses a server answers with when it is throttling us rather than refusing the request itself
+THROTTLE_STATUSES = (403, 429)
+_THROTTLE_MESSAGE = re.compile(r"HTTP Error (403|429)")
+
+
+def error_causes(error):
+    # The error itself plus whatever yt-dlp wrapped it around
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        exc_info = getattr(error, "exc_info", None)
+        if exc_info and exc_info[1] is not None and id(exc_info[1]) not in seen:
+            error = exc_info[1]
+        else:
+            error = error.__cause__ or error.__context__
+
+
+def http_status(error):
+    # The HTTP status of a yt-dlp, urllib or requests error, else None
+    return getattr(error, "status", None) or getattr(error, "code", None)
+
+
+def throttle_status(error):
+    # 403 or 429 when `error` (or what yt-dlp wrapped) is a server refusing us, else None
+    for cause in error_causes(error):
+        status = http_status(cause)
+        if status in THROTTLE_STATUSES:
+            return status
+        match = _THROTTLE_MESSAGE.search(str(cause))
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def throttle_message(msg):
+    # Same for the warnings yt-dlp logs while it retries fragments
+    match = _THROTTLE_MESSAGE.search(msg)
+    return int(match.group(1)) if match else None
+
+
+def rate_limit_delay(error):
+    # None when `error` isn't an HTTP 429, else the server's Retry-After in seconds (0 if it sent none)
+    causes = list(error_causes(error))
+    # The wrapper's message repeats the HTTP error's, so look for the error with the status (and headers) first
+    for cause in causes:
+        if http_status(cause) == 429:
+            response = getattr(cause, "response", None)
+            headers = getattr(response, "headers", None) or getattr(cause, "headers", None)
+            return _retry_after(headers.get("Retry-After") if headers is not None else None)
+    if any("HTTP Error 429" in str(cause) for cause in causes):
+        return 0.0
+    return None
+
+
+def _retry_after(value):
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0.0
@@ -0,0 +1,337 @@
+import math
+import re
+
+# Prefixes of yt-dlp codec strings, mapped to the family names policies are written in
+CODEC_FAMILIES = (
+    ("avc", "h264"), ("h264", "h264"), ("hev", "h265"), ("hvc", "h265"), ("h265", "h265"),
+    ("vp09", "vp9"), ("vp9", "vp9"), ("vp8", "vp8"), ("av01", "av1"), ("av1", "av1"),
+    ("mp4a", "aac"), ("aac", "aac"), ("opus", "opus"), ("vorbis", "vorbis"), ("mp3", "mp3"),
+    ("flac", "flac"), ("ac-3", "ac3"), ("ec-3", "eac3"), ("alac", "alac"),
+)
+SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+
+def codec_family(codec):
+    # None for "none" (no such track); yt-dlp leaves the field unset when the track is merely unknown
+    if codec is None:
+        return "unknown"
+    if not codec or codec == "none":
+        return None
+    codec = codec.lower()
+    for prefix, family in CODEC_FAMILIES:
+        if codec.startswith(prefix):
+            return family
+    return codec.split(".", 1)[0]
+
+
+def parse_size(text):
+    # "700M", "1.5G", "250k" or plain bytes -> bytes
+    if text is None or isinstance(text, (int, float)):
+        return text
+    match = re.fullmatch(r"\s*([\d.]+)\s*([kmgt]?)i?b?\s*", str(text).lower())
+    if not match:
+        raise ValueError(f"Invalid size: {text!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def _top_level(spec, sep):
+    # Splits a yt-dlp selector at `sep`, except inside [filters] and (groups)
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(spec):
+        if char in "[(":
+            depth += 1
+        elif char in "])":
+            depth -= 1
+        elif char == sep and depth == 0:
+            parts.append(spec[start:i])
+            start = i + 1
+    return parts + [spec[start:]]
+
+
+def single_file_spec(spec):
+    # The alternatives of a selector that need no merge ("bv*+ba/b" -> "b"); None when every one does.
+    # A "+" outside the [filters], even inside a (group), means a merge.
+    alternatives = [alt.strip() for alt in _top_level(spec or "", "/")]
+    return "/".join(alt for alt in alternatives if alt and "+" not in re.sub(r"\[[^\]]*\]", "", alt)) or None
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0 else None
+
+
+class Format:
+    # One entry of info["formats"], reduced to the fields selection needs. Hundreds of these are built per
+    # manifest, so no per-instance __dict__.
+    __slots__ = ("format_id", "ext", "width", "height", "fps", "vcodec", "acodec", "tbr", "abr", "filesize",
+                 "size_estimated", "protocol", "label")
+
+    def __init__(self, format_id, ext=None, width=None, height=None, fps=None, vcodec=None, acodec=None,
+                 tbr=None, abr=None, filesize=None, size_estimated=False, protocol=None, label=None):
+        self.format_id = format_id
+        self.ext = ext
+        self.width = width
+        self.height = height
+        self.fps = fps
+        # Codec families ("h264", "vp9", "aac", ...); None when the stream has no such track
+        self.vcodec = vcodec
+        self.acodec = acodec
+        # Bitrates in kbit/s
+        self.tbr = tbr
+        self.abr = abr
+        self.filesize = filesize
+        self.size_estimated = size_estimated
+        self.protocol = protocol
+        self.label = label or format_id
+
+    def __repr__(self):
+        return f"<Format {self.label}>"
+
+    @classmethod
+    def from_dict(cls, f, duration=None):
+        vcodec = codec_family(f.get("vcodec"))
+        acodec = codec_family(f.get("acodec"))
+        tbr = _number(f.get("tbr")) or (_number(f.get("vbr")) or 0) + (_number(f.get("abr")) or 0) or None
+        filesize = _number(f.get("filesize"))
+        estimated = False
+        if filesize is None:
+            filesize = _number(f.get("filesize_approx"))
+            estimated = True
+            if filesize is None and tbr and duration:
+                filesize = int(tbr * duration * 125)
+        res = f.get("resolution") or f.get("height") or "audio"
+        fps = f.get("fps", "")
+        abr = f.get("abr", "")
+        # The label only shows sizes yt-dlp reported, not ones estimated from the bitrate
+        shown = f.get("filesize") or f.get("filesize_approx")
+        size_mb = f"{round(shown / 1024 / 1024, 1)}MB" if shown else "?"
+        label = f"{f['format_id']} | {res} | {f['ext']} | {fps}fps | {abr}kbps | {size_mb}"
+        return cls(f["format_id"], f.get("ext"), _number(f.get("width")), _number(f.get("height")),
+                   _number(f.get("fps")), vcodec, acodec, tbr, _number(f.get("abr")), filesize,
+                   estimated if filesize is not None else False, f.get("protocol"), label)
+
+    @property
+    def has_video(self):
+        return self.vcodec is not None
+
+    @property
+    def has_audio(self):
+        return self.acodec is not None
+
+
+def parse_formats(info):
+    # Formats with a video or audio track, in the order yt-dlp listed them (worst to best)
+    duration = _number(info.get("duration"))
+    result = []
+    for f in info.get("formats") or []:
+        if f.get("vcodec") != "none" or f.get("acodec") != "none":
+            result.append(Format.from_dict(f, duration))
+    return result
+
+
+class FormatPolicy:
+    # What to download when nobody is there to pick from the list. Limits filter, preferences order, and
+    # budgets (bytes for the whole download, kbit/s for the combined streams) are met when sizes are known.
+    # audio_only picks the best audio-only stream by codec preference and bitrate, and nothing else.
+    __slots__ = ("max_height", "max_fps", "video_codecs", "audio_codecs", "max_filesize", "max_bitrate",
+                 "allow_merge", "audio_only")
+
+    def __init__(self, max_height=None, max_fps=None, video_codecs=(), audio_codecs=(), max_filesize=None,
+                 max_bitrate=None, allow_merge=True, audio_only=False):
+        self.max_height = max_height
+        self.max_fps = max_fps
+        self.video_codecs = tuple(codec_family(c) for c in video_codecs)
+        self.audio_codecs = tuple(codec_family(c) for c in audio_codecs)
+        self.max_filesize = parse_size(max_filesize)
+        self.max_bitrate = max_bitrate
+        self.allow_merge = allow_merge
+        self.audio_only = audio_only
+
+    def __repr__(self):
+        return f"<FormatPolicy {self.to_dict()}>"
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data or {})
+        for key in ("video_codecs", "audio_codecs"):
+            if isinstance(data.get(key), str):
+                data[key] = [c for c in data[key].split(",") if c.strip()]
+        unknown = set(data) - set(cls.__slots__)
+        if unknown:
+            raise ValueError(f"Unknown format policy fields: {', '.join(sorted(unknown))}")
+        return cls(**data)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) not in (None, ())}
+
+    def format_spec(self):
+        # The policy as a yt-dlp selector, for when no format list is at hand to rank. Codec preferences
+        # aren't expressed; unknown sizes and bitrates pass, as they do in select_formats().
+        if self.audio_only:
+            limits = f"[filesize<=?{self.max_filesize}]" if self.max_filesize else ""
+            if self.max_bitrate:
+                limits += f"[abr<=?{self.max_bitrate}]"
+            return f"ba{limits}/ba/b" if limits else "ba/b"
+        limits = ""
+        if self.max_height:
+            limits += f"[height<=?{self.max_height}]"
+        if self.max_fps:
+            limits += f"[fps<=?{self.max_fps}]"
+        if self.max_filesize:
+            limits += f"[filesize<=?{self.max_filesize}]"
+        if self.max_bitrate:
+            limits += f"[tbr<=?{self.max_bitrate}]"
+        merged = f"bv*{limits}+ba/" if self.allow_merge else ""
+        relaxed = "/bv*+ba/b" if self.allow_merge else "/b"
+        return f"{merged}b{limits}{relaxed}" if limits else f"{merged}b"
+
+
+class Selection:
+    def __init__(self, video=None, audio=None, within_policy=True):
+        self.video = video
+        self.audio = audio
+        # False when nothing met the policy and the closest fit was taken instead
+        self.within_policy = within_policy
+
+    def __repr__(self):
+        return f"<Selection {self.format_spec}{'' if self.within_policy else ' (outside policy)'}>"
+
+    @property
+    def formats(self):
+        return [f for f in (self.video, self.audio) if f is not None]
+
+    @property
+    def format_spec(self):
+        return "+".join(f.format_id for f in self.formats)
+
+    @property
+    def filesize(self):
+        return _total_size(self.video, self.audio)
+
+    @property
+    def bitrate(self):
+        return _total_bitrate(self.video, self.audio)
+
+
+def _total_size(video, audio):
+    # None when any part's size is unknown
+    total = 0
+    for f in (video, audio):
+        if f is not None:
+            if f.filesize is None:
+                return None
+            total += f.filesize
+    return total
+
+
+def _total_bitrate(video, audio):
+    total = 0
+    for f in (video, audio):
+        if f is not None:
+            rate = f.tbr or f.abr
+            if rate is None:
+                return None
+            total += rate
+    return total
+
+
+def _preference(family, preferred):
+    if not preferred:
+        return 0
+    try:
+        return preferred.index(family)
+    except ValueError:
+        return len(preferred)
+
+
+def video_key(f, policy):
+    # Ascending sort puts the best first; format_id breaks every tie so the order never depends on input order
+    return (-(f.height or 0), _preference(f.vcodec, policy.video_codecs), -(f.fps or 0), not f.has_audio,
+            -(f.tbr or 0), f.format_id)
+
+
+def audio_key(f, policy):
+    return (_preference(f.acodec, policy.audio_codecs), -(f.abr or f.tbr or 0), f.format_id)
+
+
+def rank_formats(formats, policy=None):
+    # Video-bearing formats best first under `policy`, then audio-only ones best first
+    policy = policy or FormatPolicy()
+    videos = sorted((f for f in formats if f.has_video), key=lambda f: video_key(f, policy))
+    audios = sorted((f for f in formats if not f.has_video and f.has_audio), key=lambda f: audio_key(f, policy))
+    return videos + audios
+
+
+def _fits(policy, video, audio):
+    if policy.max_filesize:
+        size = _total_size(video, audio)
+        if size is not None and size > policy.max_filesize:
+            return False
+    if policy.max_bitrate:
+        rate = _total_bitrate(video, audio)
+        if rate is not None and rate > policy.max_bitrate:
+            return False
+    return True
+
+
+def _cost(video, audio):
+    size = _total_size(video, audio)
+    rate = _total_bitrate(video, audio)
+    return (math.inf if size is None else size, math.inf if rate is None else rate)
+
+
+def _select_audio(audios, policy):
+    audios = sorted(audios, key=lambda f: audio_key(f, policy))
+    for audio in audios:
+        if _fits(policy, None, audio):
+            return Selection(audio=audio)
+    return Selection(audio=min(audios, key=lambda a: _cost(None, a) + (audio_key(a, policy),)), within_policy=False)
+
+
+def select_formats(formats, policy=None):
+    # Deterministic choice of what to download: the best ranked video (with the best ranked audio-only
+    # stream when it has no sound of its own) that satisfies the policy. When nothing does, the closest
+    # fit: the lowest resolution over the height limit, or the smallest download over a budget.
+    policy = policy or FormatPolicy()
+    if policy.audio_only:
+        audios = [f for f in formats if f.has_audio and not f.has_video]
+        if audios:
+            return _select_audio(audios, policy)
+        # Nothing to merge with either; the sound is taken from the best file that has some
+        formats = [f for f in formats if f.has_audio]
+    videos = []
+    over_limit = []
+    audios = []
+    for f in formats:
+        if not f.has_video:
+            if f.has_audio:
+                audios.append(f)
+        elif not f.has_audio and not policy.allow_merge:
+            continue
+        elif (policy.max_height and f.height and f.height > policy.max_height) or \
+                (policy.max_fps and f.fps and f.fps > policy.max_fps):
+            over_limit.append(f)
+        else:
+            videos.append(f)
+    if not videos and not over_limit:
+        return _select_audio(audios, policy) if audios else None
+    audios.sort(key=lambda f: audio_key(f, policy))
+
+    within = bool(videos)
+    if not videos:
+        lowest = min(f.height or 0 for f in over_limit)
+        videos = [f for f in over_limit if (f.height or 0) == lowest]
+    videos.sort(key=lambda f: video_key(f, policy))
+    for video in videos:
+        if video.has_audio or not audios:
+            if _fits(policy, video, None):
+                return Selection(video, within_policy=within)
+            continue
+        for audio in audios:
+            if _fits(policy, video, audio):
+                return Selection(video, audio, within)
+
+    # Over budget whatever we pick: take the cheapest pairing, preferring better ranked streams on ties
+    smallest_audio = min(audios, key=lambda a: _cost(None, a) + (audio_key(a, policy),)) if audios else None
+    pairs = [(v, None if v.has_audio else smallest_audio) for v in videos]
+    video, audio = min(pairs, key=lambda pair: _cost(*pair) + (video_key(pair[0], policy),))
+    return Selection(video, audio, False)
@@ -0,0 +1,261 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .paths import user_data_dir
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK = 1024 * 1024
+SIDECAR_SUFFIX = ".sha256"
+
+OK = "ok"
+MISMATCH = "mismatch"
+CHANGED = "changed"
+MISSING = "missing"
+
+_COLUMNS = ("path", "size", "mtime", "sha256", "fast_hash", "streamed", "url", "title", "archive_id", "format_spec",
+            "added", "verified", "status")
+
+
+class _Crc32:
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self):
+        return f"{self.value:08x}"
+
+
+def new_fast_hash():
+    # (name, hasher). xxh3 when the optional xxhash package is installed, else CRC-32 from zlib;
+    # either is many times quicker than SHA-256 for a first-pass check
+    try:
+        import xxhash
+    except ImportError:
+        return "crc32", _Crc32()
+    return "xxh3_64", xxhash.xxh3_64()
+
+
+class FileDigest:
+    def __init__(self, sha256, fast_hash=None, size=0, streamed=False):
+        self.sha256 = sha256
+        # "<algorithm>:<hex>", or None when only SHA-256 was computed
+        self.fast_hash = fast_hash
+        self.size = size
+        # True when it was computed while the file was being written, not by reading it back afterwards
+        self.streamed = streamed
+
+    def __repr__(self):
+        return f"<FileDigest {self.sha256[:12]} {self.size} bytes{' streamed' if self.streamed else ''}>"
+
+
+def _signature(path):
+    st = os.stat(path)
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class StreamHasher:
+    # Hashes the bytes handed to feed() by whoever writes the file, so nothing is read back. Only usable
+    # where we own the write path; see TailHasher for files yt-dlp or ffmpeg write themselves.
+
+    def __init__(self, fast=False):
+        self.fast = fast
+        self._reset()
+        self.signature = None
+        self.streamed = True
+
+    def _reset(self):
+        self._sha = hashlib.sha256()
+        self._fast_name, self._fast = new_fast_hash() if self.fast else (None, None)
+        self.offset = 0
+
+    def feed(self, block):
+        self._sha.update(block)
+        if self._fast is not None:
+            self._fast.update(block)
+        self.offset += len(block)
+
+    def seal(self, path):
+        # The download finished as `path`; remember exactly which file the digest belongs to
+        self.signature = _signature(path)
+
+    def digest(self, path):
+        # None unless `path` is still byte for byte the file that was hashed (a fixup may have rewritten it)
+        if self.signature is None or not os.path.isfile(path) or _signature(path) != self.signature:
+            return None
+        if self.offset != self.signature[2]:
+            return None
+        fast = f"{self._fast_name}:{self._fast.hexdigest()}" if self._fast is not None else None
+        return FileDigest(self._sha.hexdigest(), fast, self.offset, self.streamed)
+
+
+class TailHasher(StreamHasher):
+    # Hashes a file while a downloader appends to it, by reading back the bytes added since the last call.
+    # That is a second read of every byte, though usually one served from the page cache rather than the
+    # disk. The file is reopened by path each time so renames (.part -> final) and Windows file locking
+    # aren't an issue.
+
+    def __init__(self, filename, fast=False):
+        super().__init__(fast)
+        # The name the download will finish as
+        self.filename = filename
+        self.streamed = False
+
+    def update(self, path, limit=None):
+        # `limit`: how many leading bytes are final (out-of-order writers); default, the whole file
+        with open(path, "rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size < self.offset:
+                # The downloader started over (e.g. the server refused to resume)
+                self._reset()
+            end = size if limit is None else min(limit, size)
+            fh.seek(self.offset)
+            while self.offset < end:
+                block = fh.read(min(HASH_BLOCK, end - self.offset))
+                if not block:
+                    break
+                self.feed(block)
+
+    def seal(self, path):
+        self.streamed = self.offset > 0
+        self.update(path)
+        super().seal(path)
+
+
+def hash_file(path, fast=False):
+    sha = hashlib.sha256()
+    fast_name, fast_hasher = new_fast_hash() if fast else (None, None)
+    size = 0
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(HASH_BLOCK), b""):
+            sha.update(block)
+            if fast_hasher is not None:
+                fast_hasher.update(block)
+            size += len(block)
+    fast_hash = f"{fast_name}:{fast_hasher.hexdigest()}" if fast_hasher is not None else None
+    return FileDigest(sha.hexdigest(), fast_hash, size)
+
+
+def fast_hash_file(path, algorithm):
+    # Only the fast hash, for verify --fast; None when that algorithm isn't available here
+    name, hasher = new_fast_hash()
+    if name != algorithm:
+        return None
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(HASH_BLOCK), b""):
+            hasher.update(block)
+    return f"{name}:{hasher.hexdigest()}"
+
+
+class Manifest:
+    # Digests, sizes and source of every finished download, so a library can be verified later without
+    # trusting file names. Optionally also writes "<file>.sha256" sidecars in sha256sum format.
+
+    def __init__(self, path=None, fast=False, sidecars=False):
+        self.path = path or os.path.join(user_data_dir(), "manifest.sqlite3")
+        self.fast = fast
+        self.sidecars = sidecars
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime REAL NOT NULL,"
+            " sha256 TEXT NOT NULL,"
+            " fast_hash TEXT,"
+            " streamed INTEGER NOT NULL DEFAULT 0,"
+            " url TEXT,"
+            " title TEXT,"
+            " archive_id TEXT,"
+            " format_spec TEXT,"
+            " added REAL NOT NULL,"
+            " verified REAL,"
+            " status TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)")
+        self._db.commit()
+
+    def record_file(self, path, hasher=None, url=None, title=None, archive_id=None, format_spec=None):
+        # Uses the digest computed while downloading when it still matches the file, else reads it once
+        path = os.path.abspath(path)
+        digest = hasher.digest(path) if hasher is not None else None
+        if digest is None:
+            # A second pass over the file: plain MP4 merges, fixups and conversions rewrite it after download
+            logger.info("Reading %s back to hash it", path)
+            digest = hash_file(path, self.fast)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime, sha256, fast_hash, streamed, url, title, archive_id,"
+                " format_spec, added) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, digest.size, os.path.getmtime(path), digest.sha256, digest.fast_hash, int(digest.streamed),
+                 url, title, archive_id, format_spec, time.time()))
+            self._db.commit()
+        if self.sidecars:
+            with open(path + SIDECAR_SUFFIX, "w", encoding="utf-8") as fh:
+                fh.write(f"{digest.sha256}  {os.path.basename(path)}\n")
+        return digest
+
+    def get(self, path):
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM files WHERE path = ?",
+                                   (os.path.abspath(path),)).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def entries(self, paths=None):
+        # Every recorded file, or those at or below the given files/folders
+        with self._lock:
+            rows = [dict(zip(_COLUMNS, row))
+                    for row in self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM files ORDER BY path")]
+        if not paths:
+            return rows
+        prefixes = [os.path.abspath(p) for p in paths]
+        return [row for row in rows
+                if any(row["path"] == p or row["path"].startswith(p.rstrip(os.sep) + os.sep) for p in prefixes)]
+
+    def mark_verified(self, path, status):
+        with self._lock:
+            self._db.execute("UPDATE files SET verified = ?, status = ? WHERE path = ?", (time.time(), status, path))
+            self._db.commit()
+
+    def forget(self, path):
+        with self._lock:
+            self._db.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(path),))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def check_file(row, fast=False):
+    path = row["path"]
+    if not os.path.isfile(path):
+        return MISSING
+    if os.path.getsize(path) != row["size"]:
+        return CHANGED
+    if fast and row["fast_hash"]:
+        actual = fast_hash_file(path, row["fast_hash"].split(":", 1)[0])
+        if actual is not None:
+            return OK if actual == row["fast_hash"] else MISMATCH
+    return OK if hash_file(path).sha256 == row["sha256"] else MISMATCH
+
+
+def verify(manifest, paths=None, workers=None, fast=False):
+    # Yields (row, status) as files are re-hashed. hashlib and zlib release the GIL on large blocks, so
+    # a thread per core keeps every core (or the disk) busy.
+    rows = manifest.entries(paths)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1, thread_name_prefix="ytdl-verify") as pool:
+        for row, status in zip(rows, pool.map(lambda r: check_file(r, fast), rows)):
+            manifest.mark_verified(row["path"], status)
+            yield row, status
+
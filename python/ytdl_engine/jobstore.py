@@ -0,0 +1,250 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from .bandwidth import NORMAL
+from .paths import user_data_dir
+
+# A claimed job belongs to its worker until this long after the last heartbeat
+LEASE_SECONDS = 60.0
+# Claims a job gets before a worker that keeps dying on it gives up
+MAX_ATTEMPTS = 3
+# Seconds a connection waits for another process's write transaction
+BUSY_TIMEOUT = 30.0
+
+QUEUED = "queued"
+RUNNING = "running"
+OPEN_STATES = (QUEUED, RUNNING)
+
+_COLUMNS = ("id", "url", "format_spec", "policy", "save_path", "turbo", "priority", "state", "phase", "attempts",
+            "max_attempts", "worker", "lease_until", "cancel_requested", "output", "downloaded_bytes",
+            "total_bytes", "error", "created", "started", "updated", "audio_only", "audio_format", "audio_quality")
+# Columns stores created by older versions lack
+_ADDED_COLUMNS = (
+    ("audio_only", "INTEGER NOT NULL DEFAULT 0"),
+    ("audio_format", "TEXT"),
+    ("audio_quality", "TEXT"),
+)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobStore:
+    # A download queue shared by worker processes, on one machine or several. Workers claim jobs under a
+    # lease they renew with heartbeats; a job whose lease runs out (its worker died or hung) goes back to
+    # the queue for another worker, up to max_attempts claims. Every method is one short transaction, so
+    # any number of processes can use the same file.
+    #
+    # WAL lets readers and the writer proceed at once but needs shared memory, so it only works where all
+    # processes run on the same machine. shared=True uses the rollback journal instead, which relies on
+    # file locks only and so works on a network volume whose locks are reliable. Leases compare the clocks
+    # of different hosts there; keep them in sync (NTP), LEASE_SECONDS leaves a wide margin.
+
+    def __init__(self, path=None, shared=False, lease=LEASE_SECONDS):
+        self.path = path or os.path.join(user_data_dir(), "jobstore.sqlite3")
+        self.lease = lease
+        self._lock = threading.Lock()
+        # Transactions are opened explicitly: claims need BEGIN IMMEDIATE to take the write lock up front
+        self._db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._db.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " url TEXT NOT NULL,"
+                " format_spec TEXT,"
+                " policy TEXT,"
+                " save_path TEXT,"
+                " turbo INTEGER NOT NULL DEFAULT 0,"
+                " priority INTEGER NOT NULL,"
+                " state TEXT NOT NULL,"
+                " phase TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " max_attempts INTEGER NOT NULL,"
+                " worker TEXT,"
+                " lease_until REAL,"
+                " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+                " output TEXT,"
+                " downloaded_bytes INTEGER NOT NULL DEFAULT 0,"
+                " total_bytes INTEGER,"
+                " error TEXT,"
+                " created REAL NOT NULL,"
+                " started REAL,"
+                " updated REAL NOT NULL)")
+            existing = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            for name, definition in _ADDED_COLUMNS:
+                if name not in existing:
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (state, priority, created)")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def enqueue(self, url, format_spec=None, policy=None, save_path=".", turbo=False, priority=NORMAL,
+                max_attempts=MAX_ATTEMPTS, audio_only=False, audio_format=None, audio_quality=None):
+        # `policy` is a FormatPolicy; save_path should be absolute and valid on every worker's machine.
+        # audio_format/audio_quality left None use the worker's.
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction():
+            self._db.execute(
+                "INSERT INTO jobs (id, url, format_spec, policy, save_path, turbo, priority, state, max_attempts,"
+                " created, updated, audio_only, audio_format, audio_quality)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, url, format_spec, json.dumps(policy.to_dict()) if policy is not None else None,
+                 save_path, int(bool(turbo)), priority, QUEUED, max_attempts, now, now, int(bool(audio_only)),
+                 audio_format, audio_quality))
+        return job_id
+
+    def claim(self, worker, limit=1):
+        # Up to `limit` queued jobs, highest priority and oldest first, now leased to `worker`
+        now = time.time()
+        with self._lock:
+            # Idle workers poll; only take the write lock when there may be something to claim
+            ready = self._db.execute(
+                "SELECT 1 FROM jobs WHERE state = ? OR (state = ? AND lease_until < ?) LIMIT 1",
+                (QUEUED, RUNNING, now)).fetchone()
+        if ready is None:
+            return []
+        with self._transaction():
+            self._expire(now)
+            rows = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE state = ? ORDER BY priority DESC, created LIMIT ?",
+                (QUEUED, limit)).fetchall()
+            for row in rows:
+                self._db.execute(
+                    "UPDATE jobs SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1, started = ?,"
+                    " updated = ? WHERE id = ?",
+                    (RUNNING, worker, now + self.lease, now, now, row[0]))
+        claimed = []
+        for row in rows:
+            job = dict(zip(_COLUMNS, row))
+            job.update(state=RUNNING, worker=worker, attempts=job["attempts"] + 1)
+            job["policy"] = json.loads(job["policy"]) if job["policy"] else None
+            claimed.append(job)
+        return claimed
+
+    def heartbeat(self, worker, progress):
+        # Renews the leases of `worker`'s jobs ({id: (phase, downloaded_bytes, total_bytes)}). Returns the
+        # ids it has to stop: cancelled, or no longer its own because the lease had already run out.
+        now = time.time()
+        drop = set()
+        with self._transaction():
+            for job_id, (phase, downloaded, total) in progress.items():
+                cursor = self._db.execute(
+                    "UPDATE jobs SET lease_until = ?, phase = ?, downloaded_bytes = ?, total_bytes = ?, updated = ?"
+                    " WHERE id = ? AND worker = ? AND state = ?",
+                    (now + self.lease, phase, downloaded, total, now, job_id, worker, RUNNING))
+                if cursor.rowcount == 0:
+                    drop.add(job_id)
+            drop.update(row[0] for row in self._db.execute(
+                "SELECT id FROM jobs WHERE worker = ? AND state = ? AND cancel_requested = 1", (worker, RUNNING)))
+        return drop
+
+    def complete(self, job_id, worker, state, error=None, output=None, downloaded=None):
+        # False when the job was no longer `worker`'s to finish
+        with self._transaction():
+            cursor = self._db.execute(
+                "UPDATE jobs SET state = ?, phase = ?, error = ?, output = ?,"
+                " downloaded_bytes = COALESCE(?, downloaded_bytes), lease_until = NULL, updated = ?"
+                " WHERE id = ? AND worker = ? AND state = ?",
+                (state, state, str(error) if error else None, output, downloaded, time.time(), job_id, worker,
+                 RUNNING))
+            return cursor.rowcount == 1
+
+    def release(self, job_id, worker):
+        # A worker shutting down hands the job back; the claim doesn't count as an attempt
+        with self._transaction():
+            self._db.execute(
+                "UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, attempts = MAX(0, attempts - 1),"
+                " updated = ? WHERE id = ? AND worker = ? AND state = ?",
+                (QUEUED, time.time(), job_id, worker, RUNNING))
+
+    def cancel(self, job_id):
+        # Queued jobs end at once; a running one is stopped by its worker at the next heartbeat
+        now = time.time()
+        with self._transaction():
+            self._db.execute("UPDATE jobs SET state = 'cancelled', phase = 'cancelled', updated = ?"
+                             " WHERE id = ? AND state = ?", (now, job_id, QUEUED))
+            self._db.execute("UPDATE jobs SET cancel_requested = 1, updated = ? WHERE id = ? AND state = ?",
+                             (now, job_id, RUNNING))
+
+    def retry(self, job_id):
+        # Queues a failed or cancelled job again with fresh attempts
+        with self._transaction():
+            cursor = self._db.execute(
+                "UPDATE jobs SET state = ?, phase = NULL, attempts = 0, worker = NULL, cancel_requested = 0,"
+                " error = NULL, updated = ? WHERE id = ? AND state NOT IN (?, ?)",
+                (QUEUED, time.time(), job_id, QUEUED, RUNNING))
+            return cursor.rowcount == 1
+
+    def requeue_expired(self):
+        with self._transaction():
+            return self._expire(time.time())
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def jobs(self, state=None, limit=None):
+        query = f"SELECT {', '.join(_COLUMNS)} FROM jobs"
+        args = ()
+        if state is not None:
+            query += " WHERE state = ?"
+            args = (state,)
+        query += " ORDER BY created"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        with self._lock:
+            return [dict(zip(_COLUMNS, row)) for row in self._db.execute(query, args)]
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def workers(self):
+        # Workers holding a live lease, with how many jobs each is running
+        with self._lock:
+            return dict(self._db.execute(
+                "SELECT worker, COUNT(*) FROM jobs WHERE state = ? AND lease_until >= ? GROUP BY worker",
+                (RUNNING, time.time())).fetchall())
+
+    def pending(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)", OPEN_STATES).fetchone()[0]
+
+    def prune(self, older_than=30 * 24 * 3600):
+        with self._transaction():
+            self._db.execute("DELETE FROM jobs WHERE state NOT IN (?, ?) AND updated < ?",
+                             OPEN_STATES + (time.time() - older_than,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _expire(self, now):
+        # Jobs whose worker stopped renewing: back to the queue, or failed once out of attempts
+        cursor = self._db.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE ? END,"
+            " phase = NULL, error = CASE WHEN attempts >= max_attempts THEN 'Worker lost ' || attempts || ' times'"
+            " ELSE error END, worker = NULL, lease_until = NULL, updated = ?"
+            " WHERE state = ? AND lease_until < ?",
+            (QUEUED, now, RUNNING, now))
+        return cursor.rowcount
@@ -0,0 +1,201 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from .bandwidth import NORMAL
+from .jobstore import worker_name
+from .paths import user_data_dir
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between byte-progress writes for one job
+PROGRESS_INTERVAL = 2.0
+# Unfinished jobs belong to the process that journaled them until this long after its last heartbeat
+LEASE_SECONDS = 60.0
+
+_COLUMNS = ("id", "url", "format_id", "format_spec", "save_path", "ffmpeg_path", "turbo", "state", "phase",
+            "filename", "tmpfilename", "downloaded_bytes", "total_bytes", "error", "created", "updated",
+            "audio_only", "policy", "audio_format", "audio_quality", "priority", "owner", "heartbeat")
+# Added after the first release; journals written before them gain the columns when opened
+_ADDED_COLUMNS = (
+    ("audio_only", "INTEGER NOT NULL DEFAULT 0"),
+    ("policy", "TEXT"),
+    ("audio_format", "TEXT"),
+    ("audio_quality", "TEXT"),
+    ("priority", f"INTEGER NOT NULL DEFAULT {NORMAL}"),
+    ("owner", "TEXT"),
+    ("heartbeat", "REAL"),
+)
+_UNFINISHED = "state IN ('queued', 'running')"
+
+
+class JobJournal:
+    # Durable record of every submitted job so unfinished ones can be resumed after a crash. The GUIs, the
+    # CLI and the daemon share one journal, so each row names the process that owns it ("host:pid:token"),
+    # which keeps a heartbeat on its unfinished rows; claim_unfinished() only takes over rows whose owner
+    # has exited or stopped beating.
+
+    def __init__(self, path=None, lease=LEASE_SECONDS):
+        self.path = path or os.path.join(user_data_dir(), "journal.sqlite3")
+        self.lease = lease
+        self.owner = f"{worker_name()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " url TEXT NOT NULL,"
+            " format_id TEXT,"
+            " format_spec TEXT,"
+            " save_path TEXT,"
+            " ffmpeg_path TEXT,"
+            " turbo INTEGER NOT NULL DEFAULT 0,"
+            " state TEXT NOT NULL,"
+            " phase TEXT,"
+            " filename TEXT,"
+            " tmpfilename TEXT,"
+            " downloaded_bytes INTEGER NOT NULL DEFAULT 0,"
+            " total_bytes INTEGER,"
+            " error TEXT,"
+            " created REAL NOT NULL,"
+            " updated REAL NOT NULL)")
+        existing = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for name, definition in _ADDED_COLUMNS:
+            if name not in existing:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        self._db.commit()
+        self._closed = threading.Event()
+        threading.Thread(target=self._beat, name="ytdl-journal-heartbeat", daemon=True).start()
+
+    def record(self, job):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, url, format_id, format_spec, save_path, ffmpeg_path, turbo, state, phase,"
+                " filename, tmpfilename, downloaded_bytes, total_bytes, created, updated, audio_only, policy,"
+                " audio_format, audio_quality, priority, owner, heartbeat)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(id) DO UPDATE SET state = excluded.state, updated = excluded.updated,"
+                " owner = excluded.owner, heartbeat = excluded.heartbeat",
+                (job.journal_id, job.url, job.format_id, job.format_spec, job.save_path, job.ffmpeg_path,
+                 int(bool(job.turbo)), job.state, job.phase, job.filename, job.tmpfilename,
+                 job.downloaded_bytes, job.total_bytes, now, now, int(bool(job.audio_only)),
+                 json.dumps(job.policy.to_dict()) if job.policy is not None else None, job.audio_format,
+                 None if job.audio_quality is None else str(job.audio_quality), job.priority, self.owner, now))
+            self._db.commit()
+        job.journal_updated = now
+
+    def update_state(self, job):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, phase = ?, format_spec = ?, filename = ?, tmpfilename = ?,"
+                " downloaded_bytes = ?, total_bytes = ?, error = ?, updated = ? WHERE id = ?",
+                (job.state, job.phase, job.format_spec, job.filename, job.tmpfilename, job.downloaded_bytes,
+                 job.total_bytes, str(job.error) if job.error else None, time.time(), job.journal_id))
+            self._db.commit()
+
+    def update_progress(self, job, force=False):
+        now = time.time()
+        if not force and now - job.journal_updated < PROGRESS_INTERVAL:
+            return
+        job.journal_updated = now
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET phase = ?, filename = ?, tmpfilename = ?, downloaded_bytes = ?, total_bytes = ?,"
+                " updated = ? WHERE id = ?",
+                (job.phase, job.filename, job.tmpfilename, job.downloaded_bytes, job.total_bytes, now,
+                 job.journal_id))
+            self._db.commit()
+
+    def unfinished(self):
+        # Every queued/running row, whoever owns it
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE {_UNFINISHED} ORDER BY created"
+            ).fetchall()
+        return [_row(row) for row in rows]
+
+    def claim_unfinished(self):
+        # The unfinished rows no live process owns, now owned by this journal: written before rows had owners,
+        # by a process on this machine that has exited, or by one whose heartbeat is older than the lease
+        with self._lock:
+            owners = self._db.execute(
+                f"SELECT DISTINCT owner FROM jobs WHERE {_UNFINISHED} AND owner IS NOT NULL AND owner != ?",
+                (self.owner,)).fetchall()
+            exited = [owner for owner, in owners if _owner_exited(owner)]
+            now = time.time()
+            rows = self._db.execute(
+                f"UPDATE jobs SET owner = ?, heartbeat = ? WHERE {_UNFINISHED} AND (owner IS NULL"
+                f" OR (owner != ? AND COALESCE(heartbeat, 0) < ?) OR owner IN ({', '.join('?' * len(exited))}))"
+                f" RETURNING {', '.join(_COLUMNS)}",
+                (self.owner, now, self.owner, now - self.lease, *exited)).fetchall()
+            self._db.commit()
+        return sorted((_row(row) for row in rows), key=lambda row: row["created"])
+
+    def heartbeat(self):
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET heartbeat = ? WHERE owner = ? AND {_UNFINISHED}",
+                             (time.time(), self.owner))
+            self._db.commit()
+
+    def get(self, journal_id):
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (journal_id,)).fetchone()
+        return _row(row) if row else None
+
+    def forget(self, journal_id):
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (journal_id,))
+            self._db.commit()
+
+    def prune(self, older_than=30 * 24 * 3600):
+        # Drops finished jobs that have not been touched for a while
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE state NOT IN ('queued', 'running') AND updated < ?",
+                             (time.time() - older_than,))
+            self._db.commit()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            self._db.close()
+
+    def _beat(self):
+        while not self._closed.wait(max(0.5, self.lease / 3)):
+            try:
+                self.heartbeat()
+            except sqlite3.Error:
+                if not self._closed.is_set():
+                    logger.exception("Could not renew the journal heartbeat")
+
+
+def _row(values):
+    row = dict(zip(_COLUMNS, values))
+    # The policy is stored as the JSON of FormatPolicy.to_dict()
+    if row["policy"]:
+        row["policy"] = json.loads(row["policy"])
+    return row
+
+
+def _owner_exited(owner):
+    # Only processes on this machine can be looked up; elsewhere the lease has to run out
+    host, pid, _ = owner.rsplit(":", 2)
+    # os.kill(pid, 0) sends CTRL_C_EVENT on Windows rather than probing
+    if host != socket.gethostname() or sys.platform == "win32" or not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return False
+    return False
@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .progress import aggregate
+
+logger = logging.getLogger(__name__)
+
+PHASES = ("queue", "extract", "format_selection", "thumbnail", "download", "merge_wait", "merge", "finalize")
+DEFAULT_PORT = 9464
+# yt-dlp's RetryManager phrases every retry this way, for extractors and downloaders alike
+RETRY_MARKER = ". Retrying"
+
+
+class JobLogger:
+    # yt-dlp 'logger' for one job: counts retries and passes warnings/errors on to this module's logger
+
+    def __init__(self, job, on_retry=None):
+        self.job = job
+        self.on_retry = on_retry
+
+    def debug(self, msg):
+        # Downloaders report their retries through to_screen, which lands here rather than in warning()
+        if RETRY_MARKER in msg:
+            self.job.retries += 1
+            if self.on_retry is not None:
+                self.on_retry(msg)
+
+    info = debug
+
+    def warning(self, msg):
+        self.debug(msg)
+        logger.warning("%s: %s", self.job.url, msg)
+
+    def error(self, msg):
+        # yt-dlp's messages start with "ERROR:" already
+        logger.error("%s", msg)
+
+
+def error_class(error):
+    if error is None:
+        return None
+    # yt-dlp wraps the real failure in DownloadError/PostProcessingError
+    exc_info = getattr(error, "exc_info", None)
+    if exc_info and exc_info[1] is not None:
+        error = exc_info[1]
+    return type(error).__name__
+
+
+def job_record(job):
+    return {
+        "type": "job",
+        "ts": time.time(),
+        "id": job.id,
+        "journal_id": job.journal_id,
+        "url": job.url,
+        "state": job.state,
+        "error_class": error_class(job.error),
+        "error": str(job.error) if job.error else None,
+        "turbo": job.turbo,
+        "bytes": job.bytes_done,
+        "retries": job.retries,
+        "phases": {p: round(job.timings[p], 6) for p in PHASES if p in job.timings},
+        "postprocessors": {name: round(s, 6) for name, s in job.pp_seconds.items()},
+    }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRecorder:
+    # Aggregates finished jobs into counters and reads live gauges from the engine. Jobs are picked up
+    # through the engine's listener hook, so nothing extra runs per downloaded chunk.
+
+    def __init__(self, engine, jsonl_path=None, interval=None):
+        self.engine = engine
+        self.started_at = time.time()
+        self.jobs = {}
+        self.errors = {}
+        self.bytes_finished = 0
+        self.retries = 0
+        self.phase_sum = dict.fromkeys(PHASES, 0.0)
+        self.phase_count = dict.fromkeys(PHASES, 0)
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._jsonl = open(jsonl_path, "a", encoding="utf-8") if jsonl_path else None
+        self._stop = threading.Event()
+        self._thread = None
+        engine.add_listener(self.on_job_event)
+        if self._jsonl is not None and interval:
+            # Periodic gauge lines so a JSON lines consumer sees throughput between job completions
+            self._thread = threading.Thread(target=self._write_gauges, args=(interval,),
+                                            name="ytdl-metrics", daemon=True)
+            self._thread.start()
+
+    def on_job_event(self, job):
+        if not job.finished:
+            return
+        with self._lock:
+            if job.id in self._seen:
+                return
+            self._seen.add(job.id)
+            self.jobs[job.state] = self.jobs.get(job.state, 0) + 1
+            name = error_class(job.error)
+            if name and job.state != "cancelled":
+                self.errors[name] = self.errors.get(name, 0) + 1
+            self.bytes_finished += job.bytes_done
+            self.retries += job.retries
+            for phase in PHASES:
+                if phase in job.timings:
+                    self.phase_sum[phase] += job.timings[phase]
+                    self.phase_count[phase] += 1
+        self._write(job_record(job))
+
+    def gauges(self):
+        active = self.engine.active_jobs()
+        sample = aggregate(self.engine.progress.latest().values())
+        merge = self.engine.postprocessor.stats()
+        return {
+            "active_jobs": len(active),
+            "queue_depth": self.engine.queue_depth(),
+            "merge_queue_depth": merge["queued"],
+            "merge_busy": merge["busy"],
+            "bytes_per_second": (sample.speed or 0.0) if sample is not None else 0.0,
+        }
+
+    def snapshot(self):
+        gauges = self.gauges()
+        with self._lock:
+            # Jobs not yet booked by on_job_event count live, so the counters never step backwards
+            live = [job for job in list(self.engine.jobs) if job.id not in self._seen]
+            return {
+                "type": "process",
+                "ts": time.time(),
+                "uptime": time.time() - self.started_at,
+                "jobs": dict(self.jobs),
+                "errors": dict(self.errors),
+                "bytes_total": self.bytes_finished + sum(job.bytes_done for job in live),
+                "retries_total": self.retries + sum(job.retries for job in live),
+                "phase_seconds": {p: {"sum": self.phase_sum[p], "count": self.phase_count[p]} for p in PHASES},
+                "gauges": gauges,
+                "network": self.engine.network.stats(),
+            }
+
+    def prometheus(self):
+        snap = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        metric("ytdl_jobs_total", "counter", "Jobs that reached a final state.",
+               [({"state": state}, count) for state, count in sorted(snap["jobs"].items())])
+        metric("ytdl_job_errors_total", "counter", "Failed jobs by exception class.",
+               [({"class": name}, count) for name, count in sorted(snap["errors"].items())])
+        metric("ytdl_downloaded_bytes_total", "counter", "Bytes downloaded by all jobs.", [({}, snap["bytes_total"])])
+        metric("ytdl_retries_total", "counter", "Network retries reported by yt-dlp.", [({}, snap["retries_total"])])
+        phases = snap["phase_seconds"]
+        lines.append("# HELP ytdl_job_phase_seconds Time finished jobs spent in each phase.")
+        lines.append("# TYPE ytdl_job_phase_seconds summary")
+        for p in PHASES:
+            lines.append(f'ytdl_job_phase_seconds_sum{{phase="{p}"}} {phases[p]["sum"]}')
+            lines.append(f'ytdl_job_phase_seconds_count{{phase="{p}"}} {phases[p]["count"]}')
+        gauges = snap["gauges"]
+        metric("ytdl_active_jobs", "gauge", "Jobs queued or running.", [({}, gauges["active_jobs"])])
+        metric("ytdl_queue_depth", "gauge", "Jobs waiting for a download worker.", [({}, gauges["queue_depth"])])
+        metric("ytdl_merge_queue_depth", "gauge", "Jobs waiting for a merge worker.",
+               [({}, gauges["merge_queue_depth"])])
+        metric("ytdl_merge_busy", "gauge", "Merge workers currently running ffmpeg.", [({}, gauges["merge_busy"])])
+        metric("ytdl_download_bytes_per_second", "gauge", "Combined speed of running downloads.",
+               [({}, gauges["bytes_per_second"])])
+        network = snap["network"]
+        metric("ytdl_http_requests_total", "counter", "HTTP requests made by extractions, downloads and thumbnails.",
+               [({}, network["requests"])])
+        metric("ytdl_http_connections_total", "counter", "New TCP connections (and TLS handshakes) opened.",
+               [({}, network["connections"])])
+        metric("ytdl_dns_lookups_total", "counter", "Host name lookups, answered by the cache or resolved.",
+               [({"result": "cached"}, network["dns_cache_hits"]), ({"result": "resolved"}, network["dns_lookups"])])
+        metric("ytdl_uptime_seconds", "gauge", "Seconds since metrics collection started.", [({}, snap["uptime"])])
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        self._stop.set()
+        self.engine.remove_listener(self.on_job_event)
+        if self._thread is not None:
+            self._thread.join()
+        if self._jsonl is not None:
+            self._write(self.snapshot())
+            with self._lock:
+                self._jsonl.close()
+                self._jsonl = None
+
+    def _write(self, record):
+        with self._lock:
+            if self._jsonl is None:
+                return
+            self._jsonl.write(json.dumps(record) + "\n")
+            self._jsonl.flush()
+
+    def _write_gauges(self, interval):
+        while not self._stop.wait(interval):
+            self._write(self.snapshot())
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    recorder = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = self.recorder.prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body = json.dumps(self.recorder.snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer:
+    # Serves /metrics (Prometheus text format) and /metrics.json on localhost only
+
+    def __init__(self, recorder, port=DEFAULT_PORT, host="127.0.0.1"):
+        handler = type("MetricsHandler", (_MetricsHandler,), {"recorder": recorder})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="ytdl-metrics-http", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def metrics_from_env(engine):
+    # Opt-in for the GUIs: YTDL_METRICS_PORT serves /metrics, YTDL_METRICS_JSONL appends job records
+    port = os.environ.get("YTDL_METRICS_PORT")
+    path = os.environ.get("YTDL_METRICS_JSONL")
+    if not port and not path:
+        return None, None
+    recorder = MetricsRecorder(engine, jsonl_path=path or None, interval=10 if path else None)
+    server = None
+    if port:
+        try:
+            server = MetricsServer(recorder, int(port))
+        except (OSError, ValueError) as e:
+            logger.warning("Metrics endpoint disabled: %s", e)
+    return recorder, server
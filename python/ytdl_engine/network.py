@@ -0,0 +1,251 @@
+import json
+import logging
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds a resolved address is reused; CDN hostnames are stable far longer than a batch takes
+DNS_TTL = 300.0
+# Connections kept alive per host; the engine sizes it to its workers x connections per job
+DEFAULT_POOL_SIZE = 16
+# YoutubeDL params that shape its HTTP stack; instances that agree on them share one opener
+NETWORK_PARAMS = ("proxy", "source_address", "socket_timeout", "nocheckcertificate", "legacyserverconnect",
+                  "http_headers", "cookiefile", "cookiesfrombrowser", "impersonate", "client_certificate",
+                  "client_certificate_key", "client_certificate_password", "compat_opts", "enable_file_urls")
+
+
+class DnsCache:
+    # Caches the lookups of the connections SharedNetwork opens itself: its pools are built with the
+    # connection classes from pool_classes(), and nothing else in the process resolves through here. Only
+    # successful answers are kept. Every new connection resolves its host once, which makes the lookups a
+    # count of connections opened.
+
+    def __init__(self, ttl=DNS_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.lookups = 0
+        self.hits = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._pool_classes = None
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self._lock:
+            if type == socket.SOCK_STREAM:
+                self.connections += 1
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return list(entry[1])
+            self.lookups += 1
+        result = socket.getaddrinfo(host, port, family, type, proto, flags)
+        if self.ttl > 0:
+            with self._lock:
+                self.entries[key] = (now + self.ttl, tuple(result))
+        return result
+
+    def connect(self, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None, socket_options=None):
+        # socket.create_connection(), resolving through the cache
+        host, port = address
+        err = None
+        for family, type, proto, _, sockaddr in self.getaddrinfo(host.strip("[]"), port, 0, socket.SOCK_STREAM):
+            sock = None
+            try:
+                sock = socket.socket(family, type, proto)
+                for option in socket_options or ():
+                    sock.setsockopt(*option)
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except OSError as e:
+                err = e
+                if sock is not None:
+                    sock.close()
+        raise err if err is not None else OSError("getaddrinfo returns an empty list")
+
+    def pool_classes(self):
+        # urllib3 pool classes by scheme whose connections resolve through this cache, for a PoolManager's
+        # pool_classes_by_scheme
+        with self._lock:
+            if self._pool_classes is None:
+                self._pool_classes = _cached_pool_classes(self)
+            return self._pool_classes
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"dns_lookups": self.lookups, "dns_cache_hits": self.hits, "connections": self.connections,
+                    "dns_entries": len(self.entries)}
+
+
+def network_key(params):
+    return json.dumps({name: params.get(name) for name in NETWORK_PARAMS}, sort_keys=True, default=str)
+
+
+class SharedNetwork:
+    # One long-lived HTTP stack per process, instead of the fresh YoutubeDL (and so fresh DNS, TCP and TLS
+    # handshakes) every extraction and download used to build. Passed to yt-dlp as the 'shared_network'
+    # param (not a yt-dlp option): SharedNetworkMixin then sends its requests through the urlopen() and
+    # cookie jar of a YoutubeDL kept here per set of networking params, whose keep-alive pools are sized to
+    # the engine's concurrency and resolve through the DNS cache. Counts requests against the connections
+    # they needed, so reuse shows in the metrics.
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, dns_ttl=DNS_TTL):
+        self.pool_size = max(1, int(pool_size))
+        self.dns = DnsCache(dns_ttl)
+        self.requests = 0
+        self._owners = {}
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def opener(self, params):
+        # The YoutubeDL whose connections and cookie jar serve these networking params
+        key = network_key(params)
+        with self._lock:
+            owner = self._owners.get(key)
+            if owner is None:
+                opts = {name: params[name] for name in NETWORK_PARAMS if params.get(name) is not None}
+                owner = self._owners[key] = _network_ydl(self, dict(opts, quiet=True, no_warnings=True))
+            return owner
+
+    def urlopen(self, owner, request):
+        # owner.urlopen() on behalf of a SharedNetworkMixin instance
+        self.count_request()
+        return owner.urlopen(request)
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def http_session(self, pool_size=None):
+        # A requests session for plain fetches (thumbnails) that reports into the same counters
+        from .thumbnails import make_session
+
+        pool_size = pool_size or self.pool_size
+        session = make_session(pool_size)
+        adapter = _network_adapter(self, pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        with self._lock:
+            self._sessions.append(session)
+        return session
+
+    def stats(self):
+        stats = self.dns.stats()
+        with self._lock:
+            stats["requests"] = self.requests
+            stats["openers"] = len(self._owners)
+        # A request that fails over to a second address opens two sockets; clamp so reuse never goes negative
+        stats["reused"] = max(0, stats["requests"] - stats["connections"])
+        stats["reuse_ratio"] = stats["reused"] / stats["requests"] if stats["requests"] else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            owners, self._owners = list(self._owners.values()), {}
+            sessions, self._sessions = self._sessions, []
+        for owner in owners:
+            owner.close()
+        for session in sessions:
+            session.close()
+
+    def handler_class(self, rh):
+        # The request handler class the owners use in place of `rh`: yt-dlp's requests handler keeps
+        # urllib3's default of 10 connections per host and discards the rest, which turbo jobs exceed, and
+        # resolves through the process-wide socket.getaddrinfo. yt-dlp has no option for either, so the
+        # owners' request director gets a subclass that sizes the pools of each session it creates and
+        # builds them with the DNS cache's connection classes. A handler without the session hook it
+        # relies on is used as it is.
+        if rh.RH_KEY != "Requests" or not callable(getattr(rh, "_create_instance", None)):
+            return rh
+        network = self
+
+        class RequestsRH(rh):
+            def _create_instance(self, *args, **kwargs):
+                session = super()._create_instance(*args, **kwargs)
+                try:
+                    for adapter in set(session.adapters.values()):
+                        network.configure_adapter(adapter)
+                except Exception:
+                    logger.warning("Could not set up yt-dlp's connection pools; keeping its defaults",
+                                   exc_info=True)
+                return session
+
+        return RequestsRH
+
+    def configure_adapter(self, adapter, pool_size=None):
+        # Sizes a requests HTTPAdapter's pools and has their connections resolve through the DNS cache
+        pool_size = pool_size or self.pool_size
+        adapter.init_poolmanager(pool_size, pool_size)
+        adapter.poolmanager.pool_classes_by_scheme = self.dns.pool_classes()
+
+
+def _network_ydl(network, params):
+    # A YoutubeDL whose request director is built with the network's handler classes
+    import yt_dlp
+
+    class NetworkYoutubeDL(yt_dlp.YoutubeDL):
+        def build_request_director(self, handlers, preferences=None):
+            return super().build_request_director([network.handler_class(rh) for rh in handlers], preferences)
+
+    return NetworkYoutubeDL(params)
+
+
+def _cached_pool_classes(dns):
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.exceptions import ConnectTimeoutError, NameResolutionError, NewConnectionError
+
+    class CachedConnectionMixin:
+        # urllib3's _new_conn(), with the lookup answered by the DNS cache
+        def _new_conn(self):
+            try:
+                return dns.connect((self._dns_host, self.port), self.timeout, self.source_address,
+                                   self.socket_options)
+            except socket.gaierror as e:
+                raise NameResolutionError(self.host, self, e) from e
+            except socket.timeout as e:
+                raise ConnectTimeoutError(
+                    self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})") from e
+            except OSError as e:
+                raise NewConnectionError(self, f"Failed to establish a new connection: {e}") from e
+
+    class CachedHTTPConnection(CachedConnectionMixin, HTTPConnection):
+        pass
+
+    class CachedHTTPSConnection(CachedConnectionMixin, HTTPSConnection):
+        pass
+
+    class CachedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = CachedHTTPConnection
+
+    class CachedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = CachedHTTPSConnection
+
+    return {"http": CachedHTTPConnectionPool, "https": CachedHTTPSConnectionPool}
+
+
+def _network_adapter(network, pool_size):
+    from requests.adapters import HTTPAdapter
+
+    class NetworkAdapter(HTTPAdapter):
+        # Counts each request and resolves through the network's DNS cache, for the sessions it is mounted on
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = network.dns.pool_classes()
+
+        def send(self, request, **kwargs):
+            network.count_request()
+            return super().send(request, **kwargs)
+
+    return NetworkAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
@@ -0,0 +1,196 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import shutil
+import sys
+import threading
+
+from .formats import Format, parse_size
+
+# Hidden folder inside the save folder: same filesystem, so finished files move out with a rename
+STAGING_DIR = ".ytdl-staging"
+# Free space every admission leaves untouched, for the rest of the system
+DEFAULT_MIN_FREE = 512 * 1024 * 1024
+# Size estimates (filesize_approx, bitrate x duration) are rough; admit with this much headroom
+SIZE_MARGIN = 0.10
+# A job waiting for others to release space re-checks this often
+ADMIT_POLL = 1.0
+_FALLOC_FL_KEEP_SIZE = 1
+
+_fallocate = None
+
+
+class InsufficientSpace(OSError):
+    def __init__(self, path, needed, free):
+        super().__init__(errno.ENOSPC, f"Not enough free space in {path}: about {needed / 1024 ** 2:.0f} MiB "
+                                       f"needed, {free / 1024 ** 2:.0f} MiB available")
+        self.needed = needed
+        self.free = free
+
+
+def estimate_size(info):
+    # Bytes the download will write, from the chosen formats; None when any part's size is unknown.
+    # A merge holds the separate streams and the merged copy at once.
+    formats = info.get("__mux_streams") or info.get("requested_formats") or [info]
+    duration = info.get("duration")
+    total = 0
+    for f in formats:
+        size = Format.from_dict(dict(f, format_id=f.get("format_id") or "", ext=f.get("ext")), duration).filesize
+        if size is None:
+            return None
+        total += size
+    if info.get("requested_formats") and len(formats) > 1:
+        total *= 2
+    return int(total * (1 + SIZE_MARGIN))
+
+
+def reserve_blocks(path, size):
+    # Allocates the file's blocks up front without changing its size (Linux), so a downloader appending
+    # to it writes into contiguous extents and a full disk shows up now rather than at 95%. Returns False
+    # where the filesystem or platform can't.
+    global _fallocate
+    if not sys.platform.startswith("linux") or size <= 0:
+        return False
+    if _fallocate is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        _fallocate = libc.fallocate
+        _fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        if _fallocate(fd, _FALLOC_FL_KEEP_SIZE, 0, size) == 0:
+            return True
+        err = ctypes.get_errno()
+        if err == errno.ENOSPC:
+            raise OSError(err, os.strerror(err), path)
+        return False
+    finally:
+        os.close(fd)
+
+
+class _Reservation:
+    def __init__(self, job, device, size):
+        self.job = job
+        self.device = device
+        self.size = size
+        # Bytes already taken on disk by preallocation, which free space reflects
+        self.allocated = 0
+
+    @property
+    def outstanding(self):
+        # What the job will still take from free space
+        return max(0, self.size - max(self.job.bytes_done, self.allocated))
+
+
+class OutputManager:
+    # Where and how jobs write. Each job downloads into its own staging folder under the save folder and
+    # yt-dlp moves the finished files out (a rename, being on the same filesystem), so the save folder only
+    # ever holds complete files and a cancel removes everything by deleting one folder. Before a download
+    # starts its estimated size is admitted against free space minus what running jobs on the same
+    # filesystem still have to write: it waits while those hold the space, and fails at once if the file
+    # can't fit at all. Buffer and HTTP chunk sizes are passed on to the downloaders.
+
+    def __init__(self, staging=True, min_free=DEFAULT_MIN_FREE, preallocate=True, buffer_size=None,
+                 http_chunk_size=None):
+        self.staging = staging
+        self.min_free = parse_size(min_free) or 0
+        self.preallocate = preallocate
+        self.buffer_size = parse_size(buffer_size)
+        self.http_chunk_size = parse_size(http_chunk_size)
+        self.reservations = {}
+        self._cond = threading.Condition()
+
+    def staging_dir(self, job):
+        if not self.staging:
+            return None
+        return os.path.join(os.path.abspath(job.save_path), STAGING_DIR, job.journal_id)
+
+    def ydl_opts(self, job):
+        opts = {}
+        staging = self.staging_dir(job)
+        if staging is not None:
+            # A relative template lets yt-dlp put the download in "temp" and move the result to "home"
+            opts.update({"paths": {"home": job.save_path, "temp": staging}, "outtmpl": "%(title)s.%(ext)s"})
+        if self.buffer_size:
+            opts.update({"buffersize": self.buffer_size, "noresizebuffer": True})
+        if self.http_chunk_size:
+            opts["http_chunk_size"] = self.http_chunk_size
+        return opts
+
+    def final_path(self, job, path):
+        # Where a file written in the job's staging folder ends up
+        staging = self.staging_dir(job)
+        if not path or staging is None or not os.path.abspath(path).startswith(staging + os.sep):
+            return path
+        return os.path.join(job.save_path, os.path.relpath(os.path.abspath(path), staging))
+
+    def admit(self, job, size, on_wait=None):
+        # Blocks until `size` bytes fit beside what other jobs still have to write; raises
+        # InsufficientSpace when they never would. on_wait() is called once if the job has to wait.
+        if not size:
+            return
+        os.makedirs(job.save_path, exist_ok=True)
+        device = os.stat(job.save_path).st_dev
+        waiting = False
+        with self._cond:
+            while not job.cancel_event.is_set():
+                free = shutil.disk_usage(job.save_path).free - self.min_free
+                if size > free:
+                    raise InsufficientSpace(job.save_path, size, max(0, free))
+                others = sum(r.outstanding for r in self.reservations.values()
+                             if r.device == device and r.job is not job)
+                if size <= free - others:
+                    self.reservations[job.id] = _Reservation(job, device, size)
+                    return
+                if not waiting:
+                    waiting = True
+                    job.phase = "waiting for disk space"
+                    if on_wait is not None:
+                        on_wait()
+                self._cond.wait(ADMIT_POLL)
+
+    def allocate(self, job, path, size):
+        # Called once per file with its exact size as the download starts. A job admitted without a size
+        # estimate is checked here instead, but can't wait: its connection is already open.
+        folder = os.path.dirname(path)
+        with self._cond:
+            admitted = job.id in self.reservations
+        if not admitted:
+            free = shutil.disk_usage(folder).free - self.min_free
+            # Less what the file already holds, e.g. preallocated by the segmented downloader
+            needed = size - getattr(os.stat(path), "st_blocks", 0) * 512
+            if needed > free:
+                raise InsufficientSpace(job.save_path, needed, max(0, free))
+        if not self.preallocate:
+            return
+        try:
+            allocated = reserve_blocks(path, size)
+        except OSError as e:
+            raise InsufficientSpace(job.save_path, size, shutil.disk_usage(folder).free) from e
+        if allocated:
+            with self._cond:
+                reservation = self.reservations.get(job.id)
+                if reservation is not None:
+                    reservation.allocated += size
+
+    def release(self, job):
+        with self._cond:
+            if self.reservations.pop(job.id, None) is not None:
+                self._cond.notify_all()
+
+    def discard(self, job):
+        # Everything the job wrote that isn't a finished file
+        staging = self.staging_dir(job)
+        if staging is not None:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def finish(self, job):
+        # The finished files have moved out; drop the empty staging folders
+        staging = self.staging_dir(job)
+        if staging is None:
+            return
+        for path in (staging, os.path.dirname(staging)):
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
@@ -0,0 +1,26 @@
+import os
+import sys
+
+APP_NAME = "ytdl-video-downloader"
+
+
+def _base_dir(env_var, fallback):
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches" if env_var == "XDG_CACHE_HOME" else "~/Library/Application Support")
+    else:
+        base = os.environ.get(env_var) or os.path.expanduser(fallback)
+    return base
+
+
+def user_cache_dir(*parts):
+    path = os.path.join(_base_dir("XDG_CACHE_HOME", "~/.cache"), APP_NAME, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def user_data_dir(*parts):
+    path = os.path.join(_base_dir("XDG_DATA_HOME", "~/.local/share"), APP_NAME, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,106 @@
+import os
+import threading
+
+from .bandwidth import BACKGROUND
+
+MAX_DEPTH = 3
+
+
+class Playlist:
+    # A playlist/channel being expanded into jobs; entries are queued as soon as they are discovered
+
+    def __init__(self, url):
+        self.url = url
+        self.title = None
+        self.jobs = []
+        # Entries left out because the download archive already has them
+        self.skipped = 0
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+
+    def __repr__(self):
+        return f"<Playlist {self.title or self.url} ({len(self.jobs)} jobs)>"
+
+    @property
+    def expanded(self):
+        return self.done_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+        for job in list(self.jobs):
+            job.cancel()
+
+    def wait(self, timeout=None):
+        # Waits for the expansion and every job queued from it
+        if not self.done_event.wait(timeout):
+            return False
+        return all(job.wait(timeout) for job in list(self.jobs))
+
+
+def _entry_url(entry):
+    return entry.get("url") or entry.get("webpage_url") or entry.get("original_url")
+
+
+def iter_entries(url, opts=None, on_title=None):
+    # Yields entry dicts lazily (flat, no per-entry extraction) so callers can act on the first
+    # entries while later pages of the playlist are still being fetched
+    from .downloaders import SharedYoutubeDL
+
+    ydl_opts = {'quiet': True, 'skip_download': True, 'extract_flat': 'in_playlist', 'lazy_playlist': True}
+    ydl_opts.update(opts or {})
+    with SharedYoutubeDL(ydl_opts) as ydl:
+        yield from _walk(ydl, url, on_title, 0)
+
+
+def _walk(ydl, url, on_title, depth):
+    info = ydl.extract_info(url, download=False, process=False)
+    if info is None:
+        return
+    kind = info.get("_type", "video")
+    if kind in ("url", "url_transparent") and depth < MAX_DEPTH:
+        yield from _walk(ydl, _entry_url(info), on_title, depth + 1)
+        return
+    if kind not in ("playlist", "multi_video"):
+        yield info
+        return
+
+    if on_title is not None and depth == 0:
+        on_title(info.get("title"))
+    for entry in info.get("entries") or []:
+        if not entry:
+            continue
+        if entry.get("_type") == "playlist" and depth < MAX_DEPTH:
+            # Channel tabs and nested playlists
+            yield from _walk(ydl, _entry_url(entry), None, depth + 1)
+        elif _entry_url(entry):
+            yield entry
+
+
+def expand_playlist(engine, playlist, format_spec=None, save_path=".", ffmpeg_path=None,
+                    subfolder=True, limit=None, policy=None, priority=BACKGROUND):
+    from yt_dlp.utils import sanitize_filename
+
+    def set_title(title):
+        playlist.title = title
+
+    try:
+        for entry in iter_entries(playlist.url, engine.ydl_opts, set_title):
+            if playlist.cancel_event.is_set():
+                break
+            if engine.archive is not None and engine.archive.has_info(entry):
+                playlist.skipped += 1
+                continue
+            path = save_path
+            if subfolder and playlist.title:
+                path = os.path.join(save_path, sanitize_filename(playlist.title))
+            job = engine.submit(_entry_url(entry), save_path=path, ffmpeg_path=ffmpeg_path,
+                                format_spec=format_spec, policy=policy, priority=priority)
+            playlist.jobs.append(job)
+            if limit is not None and len(playlist.jobs) >= limit:
+                break
+    except Exception as e:
+        playlist.error = e
+    finally:
+        playlist.done_event.set()
+    return playlist
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def default_workers():
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def default_conversion_workers():
+    # ffmpeg's audio encoders use one core each
+    return max(1, os.cpu_count() or 1)
+
+
+# Codecs audio-only downloads can end as ("best": the downloaded one)
+AUDIO_FORMATS = ("best", "mp3", "m4a", "aac", "opus", "vorbis", "flac", "alac", "wav")
+# Target codec -> the acodec prefixes FFmpegExtractAudio copies instead of re-encoding
+COPY_CODECS = {"m4a": ("mp4a", "aac"), "aac": ("mp4a", "aac"), "mp3": ("mp3",), "opus": ("opus",),
+               "vorbis": ("vorbis",), "flac": ("flac",), "alac": ("alac",)}
+
+
+def audio_transcodes(info, codec):
+    # Whether extracting `codec` from this download re-encodes the audio rather than copying it
+    if codec == "best":
+        return False
+    return not (info.get("acodec") or "").lower().startswith(COPY_CODECS.get(codec, (codec,)))
+
+
+class DeferredPostprocessMixin:
+    # Records the post_process() call yt-dlp makes right after a download (merge, fixups, moves)
+    # instead of running it, so the download worker can move on while ffmpeg runs elsewhere.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.deferred = []
+
+    def post_process(self, filename, info, files_to_move=None):
+        if not info.get('__postprocessors'):
+            return super().post_process(filename, info, files_to_move)
+        info['filepath'] = filename
+        self.deferred.append((filename, dict(info), dict(files_to_move or {})))
+        return info
+
+
+def run_deferred(params, deferred):
+    # Returns the path of the last finished file, which conversions may have renamed
+    import yt_dlp
+
+    output = None
+    with yt_dlp.YoutubeDL(params) as ydl:
+        for filename, info, files_to_move in deferred:
+            for pp in info.get('__postprocessors') or []:
+                pp.set_downloader(ydl)
+            output = ydl.post_process(filename, info, files_to_move).get('filepath')
+    return output
+
+
+class PostprocessPool:
+    # Bounded pool for the merge/fixup stage, with its own queue depth and utilization figures
+
+    def __init__(self, workers=None, name="ytdl-merge"):
+        self.workers = workers or default_workers()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self.queued = 0
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+    def submit(self, job, params, deferred, callback):
+        # callback(job, error) runs on the pool thread once post-processing finished
+        with self._lock:
+            self.queued += 1
+        job.timings["merge_queued_at"] = time.time()
+        return self._pool.submit(self._run, job, params, deferred, callback)
+
+    def _run(self, job, params, deferred, callback):
+        began = time.time()
+        with self._lock:
+            self.queued -= 1
+            self.busy += 1
+        job.timings["merge_wait"] = began - job.timings.pop("merge_queued_at", began)
+        error = None
+        try:
+            output = run_deferred(params, deferred)
+            if output:
+                job.output = output
+        except Exception as e:
+            error = e
+        elapsed = time.time() - began
+        job.timings["postprocess"] = elapsed
+        with self._lock:
+            self.busy -= 1
+            self.busy_seconds += elapsed
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+        callback(job, error)
+
+    def stats(self):
+        with self._lock:
+            wall = max(time.time() - self._started_at, 1e-6)
+            busy_seconds = self.busy_seconds
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "busy": self.busy,
+                "completed": self.completed,
+                "failed": self.failed,
+                "merge_seconds": busy_seconds,
+                "utilization": min(1.0, busy_seconds / (wall * self.workers)),
+            }
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,231 @@
+import logging
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from .errors import rate_limit_delay
+from .session import open_session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 16
+# Extractions in flight per host; sites rate limit per client, so more threads only earn more 429s
+DEFAULT_PER_HOST = 3
+DEFAULT_RETRIES = 4
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 120.0
+
+
+def host_key(url):
+    host = (urlsplit(url).hostname or "").lower()
+    # youtube.com, m.youtube.com and www.youtube.com share one rate limit
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    return host
+
+
+class PrefetchResult:
+    def __init__(self, url, session=None, error=None, attempts=0, seconds=0.0):
+        self.url = url
+        self.session = session
+        self.error = error
+        self.attempts = attempts
+        self.seconds = seconds
+
+    def __repr__(self):
+        state = "ok" if self.session is not None else f"error: {self.error}"
+        return f"<PrefetchResult {self.url} {state}>"
+
+    @property
+    def ok(self):
+        return self.session is not None
+
+
+class PrefetchBatch:
+    # Results of one prefetch() call. Iterating yields PrefetchResults in completion order, not input order.
+
+    def __init__(self, urls, callback=None, prefetcher=None):
+        self.urls = list(OrderedDict.fromkeys(urls))
+        self.prefetcher = prefetcher
+        self.results = {}
+        self.callback = callback
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        if not self.urls:
+            self.done_event.set()
+
+    def __repr__(self):
+        return f"<PrefetchBatch {len(self.results)}/{len(self.urls)} done>"
+
+    def __iter__(self):
+        for _ in self.urls:
+            result = self._queue.get()
+            if result is None:
+                return
+            yield result
+
+    @property
+    def pending(self):
+        return len(self.urls) - len(self.results)
+
+    def cancel(self):
+        # Extractions already running still finish and are delivered
+        self.cancel_event.set()
+        if self.prefetcher is not None:
+            self.prefetcher._drop(self)
+
+    def wait(self, timeout=None):
+        return self.done_event.wait(timeout)
+
+    def _deliver(self, result):
+        with self._lock:
+            self.results[result.url] = result
+            finished = len(self.results) == len(self.urls)
+        self._queue.put(result)
+        if self.callback is not None:
+            try:
+                self.callback(result)
+            except Exception:
+                logger.exception("Prefetch callback error for %s", result.url)
+        if finished:
+            self.done_event.set()
+
+    def _abandon(self):
+        # Cancelled: unblock iterators; URLs that never started simply have no result
+        self._queue.put(None)
+        self.done_event.set()
+
+
+class _Task:
+    __slots__ = ("batch", "url", "force_refresh", "attempts", "began")
+
+    def __init__(self, batch, url, force_refresh):
+        self.batch = batch
+        self.url = url
+        self.force_refresh = force_refresh
+        self.attempts = 0
+        self.began = time.time()
+
+
+class BatchPrefetcher:
+    # Runs extractions for many URLs at once on a bounded pool, with at most `per_host` in flight per host.
+    # Tasks wait in per-host queues and only take a pool thread once their host has a free slot, so 200
+    # links to one site don't park every worker on a semaphore. An HTTP 429 pauses that host (honouring
+    # Retry-After, else exponential backoff with jitter) and the URL is requeued at the front.
+
+    def __init__(self, opts=None, cache=None, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST,
+                 retries=DEFAULT_RETRIES):
+        self.opts = dict(opts or {})
+        self.cache = cache
+        self.workers = max(1, int(workers))
+        self.per_host = max(1, int(per_host))
+        self.retries = retries
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ytdl-prefetch")
+        self._cond = threading.Condition()
+        self._waiting = OrderedDict()
+        self._active = {}
+        self._cooldown = {}
+        self._strikes = {}
+        self._running = 0
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch, name="ytdl-prefetch-dispatch", daemon=True)
+        self._dispatcher.start()
+
+    def prefetch(self, urls, callback=None, force_refresh=False):
+        # callback(PrefetchResult) runs on a prefetch thread as each URL resolves or gives up
+        batch = PrefetchBatch(urls, callback, self)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Prefetcher has been shut down.")
+            for url in batch.urls:
+                self._waiting.setdefault(host_key(url), deque()).append(_Task(batch, url, force_refresh))
+            self._cond.notify()
+        return batch
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "waiting": sum(len(q) for q in self._waiting.values()),
+                "running": self._running,
+                "hosts_cooling_down": sorted(h for h, until in self._cooldown.items() if until > now),
+            }
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._closed = True
+            batches = {task.batch for tasks in self._waiting.values() for task in tasks}
+            self._waiting.clear()
+            self._cond.notify()
+        for batch in batches:
+            batch._abandon()
+        self._pool.shutdown(wait=wait)
+
+    def _drop(self, batch):
+        with self._cond:
+            for host in list(self._waiting):
+                tasks = deque(t for t in self._waiting[host] if t.batch is not batch)
+                if tasks:
+                    self._waiting[host] = tasks
+                else:
+                    del self._waiting[host]
+        batch._abandon()
+
+    def _dispatch(self):
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+                wake = None
+                # Round-robin over hosts so one long list can't starve the others
+                for host in list(self._waiting):
+                    if self._running >= self.workers:
+                        break
+                    tasks = self._waiting[host]
+                    until = self._cooldown.get(host, 0)
+                    if until > now:
+                        wake = until if wake is None else min(wake, until)
+                        continue
+                    while tasks and self._active.get(host, 0) < self.per_host and self._running < self.workers:
+                        task = tasks.popleft()
+                        self._active[host] = self._active.get(host, 0) + 1
+                        self._running += 1
+                        self._pool.submit(self._extract, host, task)
+                    if not tasks:
+                        del self._waiting[host]
+                    else:
+                        # Move the host behind the others for the next pass
+                        self._waiting.move_to_end(host)
+                self._cond.wait(None if wake is None else max(0.0, wake - now))
+
+    def _extract(self, host, task):
+        task.attempts += 1
+        session = None
+        error = None
+        try:
+            session = open_session(task.url, self.opts, self.cache, task.force_refresh)
+        except Exception as e:
+            error = e
+        delay = rate_limit_delay(error) if error is not None else None
+        with self._cond:
+            self._active[host] -= 1
+            self._running -= 1
+            if delay is not None and task.attempts <= self.retries and not self._closed:
+                strikes = self._strikes.get(host, 0) + 1
+                self._strikes[host] = strikes
+                backoff = min(BACKOFF_MAX, BACKOFF_BASE ** strikes) * random.uniform(0.75, 1.25)
+                until = time.monotonic() + max(delay, backoff)
+                self._cooldown[host] = max(self._cooldown.get(host, 0), until)
+                self._waiting.setdefault(host, deque()).appendleft(task)
+                self._cond.notify()
+                return
+            if error is None:
+                self._strikes.pop(host, None)
+            self._cond.notify()
+        task.batch._deliver(PrefetchResult(task.url, session, error, task.attempts, time.time() - task.began))
@@ -0,0 +1,119 @@
+import queue
+from collections import namedtuple
+
+DEFAULT_HZ = 10
+
+
+class ProgressSample(namedtuple("ProgressSample", "status downloaded_bytes total_bytes speed eta target_rate",
+                                defaults=(None,))):
+    # target_rate: bytes/s the bandwidth scheduler currently allows the job; None when unlimited
+    __slots__ = ()
+
+    @property
+    def percent(self):
+        if not self.total_bytes:
+            return 0.0
+        return min(100.0, self.downloaded_bytes * 100.0 / self.total_bytes)
+
+
+class ProgressBus:
+    # One latest-value slot per job. Download threads overwrite their slot (a single dict store,
+    # atomic under the GIL) and the UI reads a snapshot at its own pace, so no locks are taken per chunk.
+
+    def __init__(self):
+        self._slots = {}
+
+    def publish(self, job_id, sample):
+        self._slots[job_id] = sample
+
+    def discard(self, job_id):
+        self._slots.pop(job_id, None)
+
+    def latest(self):
+        return dict(self._slots)
+
+
+def aggregate(samples):
+    samples = list(samples)
+    if not samples:
+        return None
+    downloaded = sum(s.downloaded_bytes for s in samples)
+    total = sum(s.total_bytes or 0 for s in samples) if all(s.total_bytes for s in samples) else None
+    speed = sum(s.speed or 0 for s in samples)
+    eta = max((s.eta for s in samples if s.eta is not None), default=None)
+    status = "downloading" if any(s.status == "downloading" for s in samples) else "finished"
+    limited = [s.target_rate for s in samples if s.status == "downloading"]
+    target = sum(limited) if limited and None not in limited else None
+    return ProgressSample(status, downloaded, total, speed, eta, target)
+
+
+def format_bytes(n):
+    if n is None:
+        return "?"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(n) < 1024:
+            return f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}TiB"
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "??"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+def format_sample(sample):
+    if sample.status == "finished":
+        return "Finalizing..."
+    rate = f"{format_bytes(sample.speed)}/s"
+    if sample.target_rate is not None:
+        rate += f" of {format_bytes(sample.target_rate)}/s"
+    return f"{sample.percent:.1f}% at {rate} | ETA: {format_eta(sample.eta)}"
+
+
+class TkProgressTicker:
+    # Polls a ProgressBus from the Tk event loop at a fixed rate.
+    # Job state changes queued by worker threads are delivered on the same tick.
+
+    def __init__(self, widget, bus, render, on_event=None, hz=DEFAULT_HZ):
+        self.widget = widget
+        self.bus = bus
+        self.render = render
+        self.on_event = on_event
+        self.events = queue.SimpleQueue()
+        self.interval = max(1, int(1000 / hz))
+        self._last = None
+        self._job = None
+
+    def post(self, item):
+        # Safe to call from any thread
+        self.events.put(item)
+
+    def start(self):
+        if self._job is None:
+            self._job = self.widget.after(self.interval, self._tick)
+
+    def stop(self):
+        if self._job is not None:
+            self.widget.after_cancel(self._job)
+            self._job = None
+
+    def _tick(self):
+        self._job = None
+        try:
+            snapshot = self.bus.latest()
+            if snapshot != self._last:
+                self._last = snapshot
+                self.render(snapshot)
+            while self.on_event is not None:
+                try:
+                    item = self.events.get_nowait()
+                except queue.Empty:
+                    break
+                self.on_event(item)
+        finally:
+            self.start()
@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+from collections import deque
+
+DEFAULT_CONNECTIONS = 4
+DEFAULT_FRAGMENTS = 4
+MIN_SEGMENTED_SIZE = 4 * 1024 * 1024
+MIN_RANGE = 256 * 1024
+MAX_RANGE = 8 * 1024 * 1024
+# Each range request should take roughly this long on the measured link
+TARGET_RANGE_SECONDS = 2.0
+READ_BLOCK = 256 * 1024
+REPORT_INTERVAL = 0.25
+# Sidecar next to the .part file listing the byte ranges already written and synced
+SEGMENTS_SUFFIX = ".segments"
+
+
+def preallocate(path, size):
+    with open(path, "wb") as fh:
+        if size <= 0:
+            return
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fh.fileno(), 0, size)
+                return
+            except OSError:
+                pass
+        fh.truncate(size)
+
+
+def load_segments(path, total):
+    try:
+        with open(path, encoding="utf-8") as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if data.get("total") != total:
+        return None
+    return [tuple(r) for r in data.get("done", [])]
+
+
+def save_segments(path, total, done):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump({"total": total, "done": merge_ranges(done)}, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class RangeScheduler:
+    # Hands out byte ranges to connection threads from the gaps not yet downloaded. Failed ranges go
+    # back to the front of the queue, and each connection's next range is sized from its own throughput.
+
+    def __init__(self, total, done=(), initial_range=1024 * 1024):
+        self.total = total
+        self.initial_range = initial_range
+        self._gaps = deque()
+        pos = 0
+        for start, end in merge_ranges(done):
+            if start > pos:
+                self._gaps.append((pos, start - 1))
+            pos = max(pos, end + 1)
+        if pos < total:
+            self._gaps.append((pos, total - 1))
+        self._lock = threading.Lock()
+
+    def claim(self, rate=None):
+        with self._lock:
+            if not self._gaps:
+                return None
+            gap_start, gap_end = self._gaps.popleft()
+            size = self.initial_range if not rate else int(rate * TARGET_RANGE_SECONDS)
+            size = max(MIN_RANGE, min(MAX_RANGE, size))
+            end = min(gap_end, gap_start + size - 1)
+            if end < gap_end:
+                self._gaps.appendleft((end + 1, gap_end))
+            return gap_start, end
+
+    def give_back(self, start, end):
+        with self._lock:
+            self._gaps.appendleft((start, end))
+
+
+def turbo_opts(fragments=DEFAULT_FRAGMENTS):
+    # DASH/HLS: let yt-dlp fetch this many fragments at once
+    return {"concurrent_fragment_downloads": max(1, fragments)}
@@ -0,0 +1,79 @@
+import time
+
+from .formats import parse_formats, select_formats
+
+
+def extract_info(url, opts=None):
+    from .downloaders import SharedYoutubeDL
+
+    ydl_opts = {'quiet': True, 'skip_download': True}
+    ydl_opts.update(opts or {})
+    with SharedYoutubeDL(ydl_opts) as ydl:
+        return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+
+def describe_formats(info):
+    # Returns (label, format_id) pairs in the order yt-dlp listed them
+    return [(f.label, f.format_id) for f in parse_formats(info)]
+
+
+class VideoSession:
+    # Holds the extract_info result for one URL so the download stage can skip re-extraction
+
+    def __init__(self, url, info, fresh=True):
+        self.url = url
+        self.info = info
+        # False when the info came from an expired cache entry whose stream URLs can no longer be used
+        self.fresh = fresh
+        # Time open_session() spent extracting (or reading the cache)
+        self.extract_seconds = None
+        # Parsed once; the labels, the format map and automatic selection all work from these
+        self.format_records = parse_formats(info)
+        self.format_map = {f.label: f.format_id for f in self.format_records}
+
+    def __repr__(self):
+        return f"<VideoSession {self.url} ({len(self.format_map)} formats)>"
+
+    @property
+    def title(self):
+        return self.info.get("title", "")
+
+    @property
+    def key(self):
+        video_id = self.info.get("id")
+        if not video_id:
+            return None
+        return f"{self.info.get('extractor_key', 'generic')}-{video_id}"
+
+    @property
+    def thumbnail(self):
+        return self.info.get("thumbnail")
+
+    @property
+    def formats(self):
+        return self.info.get("formats") or []
+
+    @property
+    def labels(self):
+        return list(self.format_map)
+
+    def select(self, policy=None):
+        # The Selection a FormatPolicy makes from this video's formats (None if it has none)
+        return select_formats(self.format_records, policy)
+
+
+def open_session(url, opts=None, cache=None, force_refresh=False):
+    began = time.time()
+    if cache is not None and not force_refresh:
+        hit = cache.get(url)
+        if hit is not None:
+            info, fresh = hit
+            session = VideoSession(url, info, fresh)
+            session.extract_seconds = time.time() - began
+            return session
+    info = extract_info(url, opts)
+    if cache is not None:
+        cache.put(url, info)
+    session = VideoSession(url, info)
+    session.extract_seconds = time.time() - began
+    return session
@@ -0,0 +1,71 @@
+import os
+import tkinter as tk
+
+DEFAULT_DELAY = 100
+
+
+def gif_delays(path):
+    # Per-frame delays in ms, read from the GIF's graphic control blocks (Tk's gif reader doesn't expose them)
+    with open(path, "rb") as fh:
+        data = fh.read()
+    if data[:3] != b"GIF":
+        raise ValueError(f"{path} is not a GIF file")
+    pos = 13
+    if data[10] & 0x80:
+        pos += 3 << ((data[10] & 7) + 1)
+    delays = []
+    delay = None
+    while pos < len(data):
+        block = data[pos]
+        if block == 0x21:
+            if data[pos + 1] == 0xF9:
+                delay = int.from_bytes(data[pos + 4:pos + 6], "little") * 10
+            pos += 2
+        elif block == 0x2C:
+            packed = data[pos + 9]
+            pos += 10
+            if packed & 0x80:
+                pos += 3 << ((packed & 7) + 1)
+            pos += 1
+            delays.append(delay or DEFAULT_DELAY)
+            delay = None
+        else:
+            break
+        # Skip the data sub-blocks of the extension or image
+        while pos < len(data) and data[pos]:
+            pos += data[pos] + 1
+        pos += 1
+    return delays
+
+
+def bake_spinner(source, target, size=(32, 32), background="#1e1e1e"):
+    # Writes the frames of `source` resized to `size` and flattened onto the widget background, so the
+    # GUI can load them with Tk alone instead of decoding and resampling every frame with PIL at startup
+    from PIL import Image, ImageSequence
+
+    frames = []
+    durations = []
+    with Image.open(source) as img:
+        for frame in ImageSequence.Iterator(img):
+            durations.append(frame.info.get("duration", DEFAULT_DELAY))
+            rgba = frame.convert("RGBA").resize(size, Image.LANCZOS)
+            flat = Image.new("RGBA", size, background)
+            flat.alpha_composite(rgba)
+            frames.append(flat.convert("RGB"))
+    # One shared palette keeps the file small and saves Tk a colour table per frame
+    strip = Image.new("RGB", (size[0] * len(frames), size[1]))
+    for i, frame in enumerate(frames):
+        strip.paste(frame, (i * size[0], 0))
+    palette = strip.quantize(256)
+    frames = [frame.quantize(palette=palette) for frame in frames]
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    frames[0].save(target, "GIF", save_all=True, append_images=frames[1:], duration=durations,
+                   loop=0, disposal=1)
+    return target
+
+
+def load_frames(master, path):
+    # Returns [(PhotoImage, delay_ms)] for an already sized GIF
+    delays = gif_delays(path)
+    return [(tk.PhotoImage(master=master, file=path, format=f"gif -index {i}"), delay)
+            for i, delay in enumerate(delays)]
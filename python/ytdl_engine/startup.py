@@ -0,0 +1,31 @@
+import json
+import os
+import sys
+import time
+
+MEASURE_FLAG = "--measure-startup"
+
+
+def measure_requested(argv=None):
+    argv = sys.argv if argv is None else argv
+    return MEASURE_FLAG in argv or bool(os.environ.get("YTDL_MEASURE_STARTUP"))
+
+
+class StartupTimer:
+    # Milestones since `started` (a time.perf_counter() value taken on the script's first line)
+
+    def __init__(self, started, enabled=None):
+        self.started = started
+        self.enabled = measure_requested() if enabled is None else enabled
+        self.marks = {}
+
+    def mark(self, name, at=None):
+        at = time.perf_counter() if at is None else at
+        self.marks.setdefault(name, round((at - self.started) * 1000, 1))
+        return self.marks[name]
+
+    def report(self, stream=None):
+        stream = stream or sys.stdout
+        json.dump({"startup_ms": self.marks, "modules": len(sys.modules)}, stream)
+        stream.write("\n")
+        stream.flush()
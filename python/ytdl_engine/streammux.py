@@ -0,0 +1,61 @@
+import os
+
+# Protocol given to a merged format that StreamMuxFD downloads; yt-dlp itself has no downloader for it
+STREAM_MUX_PROTOCOL = "stream_mux"
+# Containers ffmpeg can demux as the bytes arrive through a pipe. Plain progressive MP4 may keep its
+# index at the end of the file, so it still goes through download-then-merge.
+PIPE_CONTAINERS = ("mp4_dash", "m4a_dash", "webm_dash")
+PIPE_EXTS = ("webm",)
+MUXERS = {"mp4": "mp4", "mov": "mov", "mkv": "matroska", "webm": "webm"}
+# Fragmented MP4 needs no index at the end, so even a file cut short plays up to that point
+FRAGMENTED_MOVFLAGS = "+frag_keyframe+empty_moov+default_base_moof"
+# Linux pipes hold 64 KiB by default; a bigger buffer rides out ffmpeg reading one input in bursts
+PIPE_BUFFER = 1024 * 1024
+
+
+def can_stream_mux(info, params):
+    # True for a video+audio pair that one ffmpeg process can mux while both are still downloading
+    formats = info.get("requested_formats")
+    if os.name != "posix" or not params.get("stream_mux") or not formats or len(formats) != 2:
+        return False
+    if info.get("ext") not in MUXERS or params.get("allow_unplayable_formats") or info.get("is_live"):
+        return False
+    if info.get("section_start") or info.get("section_end"):
+        return False
+    return all(_pipeable(f) for f in formats)
+
+
+def _pipeable(f):
+    if f.get("has_drm") or f.get("is_live") or f.get("impersonate"):
+        return False
+    if f.get("container") not in PIPE_CONTAINERS and f.get("ext") not in PIPE_EXTS:
+        return False
+    protocol = f.get("protocol")
+    if protocol in ("http", "https"):
+        return bool(f.get("url"))
+    return protocol == "http_dash_segments" and bool(f.get("fragments"))
+
+
+def mux_command(ffmpeg, fds, formats, ext, output, fragmented=False):
+    # Stream-copies every input read from `fds` (one per format, same order) into `output`
+    cmd = [ffmpeg, "-y", "-nostdin", "-hide_banner", "-loglevel", "error"]
+    for fd in fds:
+        cmd += ["-i", f"pipe:{fd}"]
+    for i, f in enumerate(formats):
+        # Same mapping as yt-dlp's merger; "?" because an unknown codec may mean there is no such track
+        if f.get("vcodec") != "none":
+            cmd += ["-map", f"{i}:v:0?"]
+        if f.get("acodec") != "none":
+            cmd += ["-map", f"{i}:a:0?"]
+    cmd += ["-c", "copy"]
+    if fragmented and MUXERS[ext] in ("mp4", "mov"):
+        cmd += ["-movflags", FRAGMENTED_MOVFLAGS]
+    return cmd + ["-f", MUXERS[ext], output]
+
+
+def widen_pipe(fd):
+    try:
+        import fcntl
+        fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, PIPE_BUFFER)
+    except (ImportError, AttributeError, OSError):
+        pass
@@ -0,0 +1,166 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+
+from .paths import user_cache_dir
+
+DEFAULT_TIMEOUT = (5, 15)
+MAX_DOWNLOAD_BYTES = 8 * 1024 * 1024
+
+_UNSAFE_CHARS = re.compile(r'[^0-9A-Za-z_.-]')
+
+
+def make_session(pool_size=8):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class ThumbnailService:
+    # Fetches, downsizes and caches thumbnails off the UI thread.
+    # Only resized images are kept, in a small LRU in memory and as JPEGs on disk.
+
+    def __init__(self, size=(360, 202), cache_dir=None, workers=4, max_memory_items=64,
+                 max_disk_files=2000, session=None, timeout=DEFAULT_TIMEOUT, network=None):
+        self.size = tuple(size)
+        self.cache_dir = cache_dir or user_cache_dir("thumbnails")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_memory_items = max_memory_items
+        self.max_disk_files = max_disk_files
+        self.timeout = timeout
+        self.workers = workers
+        # requests and PIL are only imported on the worker threads, once the first thumbnail is needed
+        self._session = session
+        # A SharedNetwork (usually the engine's) to fetch through, for its DNS cache and counters
+        self.network = network
+        self._memory = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ytdl-thumb")
+        self._pool.submit(self._prune_disk)
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                if self.network is not None:
+                    self._session = self.network.http_session(self.workers)
+                else:
+                    self._session = make_session(self.workers)
+            return self._session
+
+    def fetch(self, url, key=None):
+        # Returns a Future resolving to a resized PIL image, or None when unavailable
+        key = self._cache_key(url, key)
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                done = Future()
+                done.set_result(image)
+                return done
+            pending = self._pending.get(key)
+            if pending is not None:
+                return pending
+            future = self._pool.submit(self._load, url, key)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._forget(key))
+        return future
+
+    def get(self, url, key=None):
+        return self.fetch(url, key).result()
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        if self._session is not None:
+            self._session.close()
+
+    def _forget(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def _cache_key(self, url, key):
+        key = key or url or ""
+        return _UNSAFE_CHARS.sub("_", f"{key}-{self.size[0]}x{self.size[1]}")[-150:]
+
+    def _load(self, url, key):
+        import requests
+        from PIL import Image
+
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                return image
+
+        path = os.path.join(self.cache_dir, key + ".jpg")
+        image = None
+        if os.path.exists(path):
+            try:
+                with Image.open(path) as cached:
+                    image = cached.convert("RGB")
+            except (OSError, SyntaxError, Image.DecompressionBombError):
+                image = None
+
+        if image is None:
+            if not url:
+                return None
+            try:
+                image = self._decode(self._download(url))
+            except (requests.RequestException, OSError, ValueError, SyntaxError, Image.DecompressionBombError):
+                # PIL raises SyntaxError for some malformed files and DecompressionBombError for huge ones
+                return None
+            try:
+                image.save(path, "JPEG", quality=85)
+            except OSError:
+                pass
+
+        with self._lock:
+            self._memory[key] = image
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+        return image
+
+    def _download(self, url):
+        buf = BytesIO()
+        with self.session.get(url, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(64 * 1024):
+                buf.write(chunk)
+                if buf.tell() > MAX_DOWNLOAD_BYTES:
+                    raise ValueError("Thumbnail too large")
+        buf.seek(0)
+        return buf
+
+    def _decode(self, data):
+        from PIL import Image
+
+        with Image.open(data) as source:
+            # JPEG: let libjpeg decode straight at a reduced scale instead of full size
+            source.draft("RGB", self.size)
+            image = source.convert("RGB")
+        image.thumbnail(self.size, Image.LANCZOS, reducing_gap=2.0)
+        return image
+
+    def _prune_disk(self):
+        try:
+            entries = [e for e in os.scandir(self.cache_dir) if e.name.endswith(".jpg")]
+        except OSError:
+            return
+        if len(entries) <= self.max_disk_files:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_disk_files]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
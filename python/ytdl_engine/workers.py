@@ -0,0 +1,256 @@
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+from .archive import DownloadArchive
+from .engine import DownloadEngine
+from .formats import FormatPolicy
+from .integrity import Manifest
+from .jobstore import LEASE_SECONDS, JobStore, worker_name
+from .postprocess import AUDIO_FORMATS
+
+# Idle workers look for new jobs this often
+POLL_INTERVAL = 1.0
+# Leases are renewed well before they run out, so one slow write doesn't lose a job
+HEARTBEAT_INTERVAL = LEASE_SECONDS / 4
+# A worker process that crashed is started again after this long
+RESTART_DELAY = 5.0
+
+
+class StoreWorker:
+    # Feeds a DownloadEngine from a JobStore: claims as many jobs as the engine has workers, renews their
+    # leases while they run and writes the outcome back. One per process; the engine's threads do the I/O
+    # and extraction runs in this process's own interpreter, so N processes use N cores.
+
+    def __init__(self, store, engine, slots=None, name=None):
+        self.store = store
+        self.engine = engine
+        self.slots = slots or engine.workers
+        self.name = name or worker_name()
+        self.running = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        engine.add_listener(self._on_job)
+
+    def run(self, exit_when_idle=False):
+        beat = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                with self._lock:
+                    free = self.slots - len(self.running)
+                claimed = self.store.claim(self.name, free) if free > 0 else []
+                for row in claimed:
+                    self._start(row)
+                if time.monotonic() - beat >= HEARTBEAT_INTERVAL:
+                    beat = time.monotonic()
+                    self._heartbeat()
+                if exit_when_idle and not claimed and not self.running and not self.store.pending():
+                    return
+                if not claimed:
+                    self._stop.wait(POLL_INTERVAL)
+        finally:
+            self._hand_back()
+
+    def stop(self):
+        self._stop.set()
+
+    def _start(self, row):
+        policy = FormatPolicy.from_dict(row["policy"]) if row["policy"] else None
+        job = self.engine.submit(row["url"], save_path=row["save_path"], format_spec=row["format_spec"],
+                                 turbo=bool(row["turbo"]), journal_id=row["id"], policy=policy,
+                                 priority=row["priority"], audio_only=bool(row["audio_only"]),
+                                 audio_format=row["audio_format"], audio_quality=row["audio_quality"])
+        with self._lock:
+            self.running[row["id"]] = job
+        # The job may have ended before it was registered
+        if job.finished:
+            self._on_job(job)
+
+    def _heartbeat(self):
+        with self._lock:
+            progress = {job_id: (job.phase, job.downloaded_bytes, job.total_bytes)
+                        for job_id, job in self.running.items()}
+        if not progress:
+            return
+        for job_id in self.store.heartbeat(self.name, progress):
+            with self._lock:
+                job = self.running.get(job_id)
+            if job is None:
+                continue
+            row = self.store.get(job_id)
+            if row is None or row["worker"] == self.name:
+                # Cancelled (or removed) through the store; the listener records it
+                self.engine.cancel(job)
+            else:
+                # The lease ran out and another worker may already be resuming the same .part files
+                with self._lock:
+                    self.running.pop(job_id, None)
+                self.engine.cancel(job, keep_partial=True)
+
+    def _on_job(self, job):
+        if not job.finished:
+            return
+        with self._lock:
+            if self.running.get(job.journal_id) is not job:
+                return
+            del self.running[job.journal_id]
+        self.store.complete(job.journal_id, self.name, job.state, job.error, job.output, job.bytes_done)
+
+    def _hand_back(self):
+        # Unfinished jobs go straight back to the queue instead of waiting for their lease to run out;
+        # their .part files stay for whichever worker picks them up
+        with self._lock:
+            running, self.running = self.running, {}
+        for job_id, job in running.items():
+            self.store.release(job_id, self.name)
+            job.cancel(keep_partial=True)
+
+
+def run_worker(store_path, shared, slots, options, exit_when_idle):
+    # Entry point of one worker process. The 'archive' and 'manifest' options are the arguments of the
+    # DownloadArchive and Manifest each process opens for itself.
+    store = JobStore(store_path, shared)
+    options = dict(options)
+    archive = options.pop("archive", None)
+    manifest = options.pop("manifest", None)
+    archive = DownloadArchive(**archive) if archive is not None else None
+    manifest = Manifest(**manifest) if manifest is not None else None
+    engine = DownloadEngine(workers=slots, archive=archive, manifest=manifest, **options)
+    worker = StoreWorker(store, engine, slots)
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    try:
+        worker.run(exit_when_idle)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.shutdown(wait=False)
+        store.close()
+        for db in (archive, manifest):
+            if db is not None:
+                db.close()
+
+
+def run_pool(store_path, processes, slots, options=None, shared=False, exit_when_idle=False):
+    # Starts `processes` worker processes and restarts any that crash; returns when they all exited
+    ctx = multiprocessing.get_context("spawn")
+    args = (store_path, shared, slots, options or {}, exit_when_idle)
+    procs = {}
+    stopping = threading.Event()
+
+    def start(i):
+        proc = ctx.Process(target=run_worker, args=args, name=f"ytdl-store-worker-{i + 1}")
+        proc.start()
+        procs[i] = proc
+
+    def terminate(*_):
+        # Each worker hands its jobs back on SIGTERM
+        stopping.set()
+        for proc in list(procs.values()):
+            proc.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    for i in range(processes):
+        start(i)
+    try:
+        while procs:
+            for i, proc in list(procs.items()):
+                proc.join(POLL_INTERVAL / len(procs))
+                if proc.is_alive():
+                    continue
+                del procs[i]
+                if proc.exitcode and not stopping.is_set():
+                    print(f"Worker {proc.pid} exited with code {proc.exitcode}, restarting", file=sys.stderr)
+                    time.sleep(RESTART_DELAY)
+                    start(i)
+    except KeyboardInterrupt:
+        # The terminal sent SIGINT to the workers too; they hand their jobs back and exit
+        stopping.set()
+        for proc in procs.values():
+            proc.join()
+
+
+def print_status(store):
+    counts = store.counts()
+    print(", ".join(f"{n} {state}" for state, n in sorted(counts.items())) or "No jobs.")
+    for name, n in sorted(store.workers().items()):
+        print(f"  {name}: {n} running")
+    for row in store.jobs("running"):
+        total = f"/{row['total_bytes']}" if row["total_bytes"] else ""
+        print(f"  {row['id'][:8]} {row['phase'] or 'running'} {row['downloaded_bytes']}{total} {row['url']}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ytdl_engine.workers",
+                                     description="Run download workers that take jobs from a shared job store "
+                                                 "(queue jobs with: python -m ytdl_engine URL_FILE --store PATH).")
+    parser.add_argument("--store", default=None, help="job store database (default: the one in the user data folder)")
+    parser.add_argument("--shared", action="store_true",
+                        help="the store is on a network volume used by several machines (no WAL)")
+    parser.add_argument("-p", "--processes", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: CPU cores)")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="concurrent downloads per process (default: 2)")
+    parser.add_argument("--exit-when-idle", action="store_true", help="exit once the store has no open jobs")
+    parser.add_argument("--ffmpeg", default=None, help="path to ffmpeg binary or its folder")
+    parser.add_argument("--stream-mux", nargs="?", const="mp4", choices=("mp4", "fmp4"), default=None,
+                        help="mux DASH video and audio through ffmpeg while they download (POSIX only)")
+    parser.add_argument("--audio-format", choices=AUDIO_FORMATS, default="best",
+                        help="codec of audio-only jobs queued without one; 'best' keeps the downloaded one")
+    parser.add_argument("--archive", nargs="?", const="", default=None, metavar="PATH",
+                        help="skip videos already in the download archive and add new ones to it "
+                             "(default archive in the user data folder)")
+    parser.add_argument("--archive-hash", action="store_true",
+                        help="store a SHA-256 of every file added to the archive")
+    parser.add_argument("--manifest", nargs="?", const="", default=None, metavar="PATH",
+                        help="record the SHA-256 and size of every finished file, hashed while it downloads "
+                             "(default manifest in the user data folder)")
+    parser.add_argument("--fast-hash", action="store_true",
+                        help="also record a fast non-cryptographic hash for quick verification")
+    parser.add_argument("--sidecar", action="store_true",
+                        help="with --manifest, also write a sha256sum-style .sha256 file next to each download")
+    parser.add_argument("--status", action="store_true", help="print the store's jobs and live workers, then exit")
+    parser.add_argument("--cancel", nargs="+", default=None, metavar="ID", help="cancel jobs, then exit")
+    parser.add_argument("--retry", nargs="+", default=None, metavar="ID",
+                        help="queue failed or cancelled jobs again, then exit")
+    return parser
+
+
+def _full_id(store, prefix):
+    matches = [row["id"] for row in store.jobs() if row["id"].startswith(prefix)]
+    return matches[0] if len(matches) == 1 else None
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    store = JobStore(args.store, args.shared)
+    if args.status or args.cancel or args.retry:
+        for prefix in args.cancel or ():
+            job_id = _full_id(store, prefix)
+            if job_id is None:
+                print(f"No single job matches {prefix!r}")
+            else:
+                store.cancel(job_id)
+        for prefix in args.retry or ():
+            job_id = _full_id(store, prefix)
+            if job_id is None or not store.retry(job_id):
+                print(f"Cannot retry {prefix!r}")
+        print_status(store)
+        store.close()
+        return 0
+    path = store.path
+    store.close()
+    print(f"Starting {args.processes} worker process(es) x {args.jobs} job(s) on {path}", flush=True)
+    options = {"ffmpeg_path": args.ffmpeg, "stream_mux": args.stream_mux, "audio_format": args.audio_format}
+    if args.archive is not None:
+        options["archive"] = {"path": args.archive or None, "hash_files": args.archive_hash}
+    if args.manifest is not None:
+        options["manifest"] = {"path": args.manifest or None, "fast": args.fast_hash, "sidecars": args.sidecar}
+    run_pool(path, max(1, args.processes), max(1, args.jobs), options, args.shared, args.exit_when_idle)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())